@@ -0,0 +1,139 @@
+"""benchmarks/bench_artifacts.py.
+
+Time collecting and querying a large number of backup artifacts, before and
+after names were parsed into an `ArtifactTable` and `find` queries became
+binary searches. The 'before' side is a copy of the old implementation: a regex
+compiled per basename plus `strptime()` to parse every name, and linear scans
+to select artifacts. The queries are timed on the artifacts as `find` gets
+them, collected from a catalog whose artifacts all have metadata. Run it from
+the top of the source tree with:
+
+    PYTHONPATH=src python benchmarks/bench_artifacts.py [COUNT]
+"""
+
+import argparse
+import dataclasses
+import json
+import random
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import yaesm.backup as bckp
+import yaesm.catalog as catalog
+from yaesm.subcommand.findsubcommand import FindQuery
+
+QUERIES = [
+    ["newest"],
+    ["after", "2020-06-01"],
+    ["before", "2020-06-01"],
+    ["between", "2020-03-01", "2020-03-02"],
+    ["closest", "2020-04-01T12:34"],
+]
+
+
+def _legacy_basename_re(backup_name: str) -> re.Pattern[str]:
+    return re.compile(
+        f"^yaesm-({backup_name})-(.+)"
+        + "\\.([0-9]{4})_([0-9]{2})_([0-9]{2})_([0-9]{2}):([0-9]{2})$"
+    )
+
+
+def _legacy_collect(
+    backup: bckp.Backup, dst_path: Path, basenames: list[str]
+) -> list[bckp.BackupArtifact]:
+    artifacts = []
+    for basename in basenames:
+        if not _legacy_basename_re(backup.name).match(basename):
+            continue
+        match = _legacy_basename_re(backup.name).match(basename)
+        assert match is not None
+        year, month, day, hour, minute = match.group(3, 4, 5, 6, 7)
+        created_at = datetime.strptime(f"{year}_{month}_{day}_{hour}:{minute}", "%Y_%m_%d_%H:%M")
+        path = dst_path.joinpath(basename)
+        artifacts.append(bckp.BackupArtifact(basename, match.group(2), created_at, str(path)))
+    return sorted(artifacts, key=lambda artifact: artifact.created_at, reverse=True)
+
+
+def _legacy_select(query: FindQuery, artifacts: list[bckp.BackupArtifact]) -> int:
+    target, start, end = query.target, query.start, query.end
+    match query.type:
+        case FindQuery.Type.NEWEST:
+            return len(artifacts[:1])
+        case FindQuery.Type.AFTER:
+            assert target is not None
+            return sum(1 for artifact in artifacts if artifact.created_at > target)
+        case FindQuery.Type.BEFORE:
+            assert target is not None
+            return sum(1 for artifact in artifacts if artifact.created_at < target)
+        case FindQuery.Type.BETWEEN:
+            assert start is not None and end is not None
+            return sum(1 for artifact in artifacts if start <= artifact.created_at <= end)
+        case _:
+            assert target is not None
+            min(artifacts, key=lambda artifact: abs(artifact.created_at - target))
+            return 1
+
+
+def _basenames(count: int) -> list[str]:
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+    timeframes = ["5minute", "hourly", "daily", "weekly"]
+    basenames = [
+        (start + timedelta(minutes=5 * i)).strftime(
+            f"yaesm-home-{rng.choice(timeframes)}.%Y_%m_%d_%H:%M"
+        )
+        for i in range(count)
+    ]
+    rng.shuffle(basenames)
+    return basenames
+
+
+def _write_catalog(backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+    records = [{"op": "reconciled", "at": time.time()}]
+    records += [
+        catalog._artifact_record(
+            dataclasses.replace(artifact, metadata={"btrfs_src_transid": index})
+        )
+        for index, artifact in enumerate(artifacts)
+    ]
+    catalog.Catalog(backup).path.write_text(
+        "".join(json.dumps(record) + "\n" for record in records)
+    )
+
+
+def _timed(label: str, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(f"{label:<40} {(time.perf_counter() - start) * 1000:10.2f} ms")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("count", nargs="?", type=int, default=100_000)
+    count = parser.parse_args().count
+    basenames = _basenames(count)
+    queries = [FindQuery(query) for query in QUERIES]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dst_path = Path(tmpdir)
+        backup = bckp.Backup("home", None, dst_path, dst_path, [])
+        print(f"{count} artifacts")
+        artifacts = _timed("parse (before)", _legacy_collect, backup, dst_path, basenames)
+        parsed = _timed("parse (after)", bckp.path_artifacts_from_listing, backup, basenames)
+        assert parsed == artifacts
+        _write_catalog(backup, artifacts)
+        collected = _timed("collect from catalog", catalog.Catalog(backup).collect)
+        assert [artifact.name for artifact in collected] == [a.name for a in artifacts]
+        for query in queries:
+            label = " ".join(query.query)
+            expected = _timed(f"{label} (before)", _legacy_select, query, collected)
+            rows = _timed(f"{label} (after)", query.select_rows, collected)
+            assert len(rows) == expected
+
+
+if __name__ == "__main__":
+    main()
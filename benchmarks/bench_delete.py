@@ -0,0 +1,71 @@
+"""benchmarks/bench_delete.py.
+
+Time deleting copies of a directory tree shaped like an rsync backup, a hardlink
+farm of many small directories, with `shutil.rmtree()` and with
+`yaesm.backend.treedelete.delete_tree()` at several worker counts. The trees
+are made in DIR, which should be on the filesystem of interest. Run it from the
+top of the source tree with:
+
+    PYTHONPATH=src python benchmarks/bench_delete.py DIR [DIRS] [FILES]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import yaesm.backend.treedelete as treedelete
+
+WORKERS = [1, 2, 4, 8, 16]
+
+
+def _make_tree(root: Path, sources: list[Path], dirs: int) -> None:
+    """Make `dirs` directories two levels deep under `root`, each with a
+    hardlink to every one of `sources`.
+    """
+    for i in range(dirs):
+        directory = root.joinpath(f"{i % 64:02}", f"{i}")
+        directory.mkdir(parents=True)
+        for source in sources:
+            os.link(source, directory.joinpath(source.name))
+
+
+def _timed(label: str, delete, root: Path) -> float:
+    start = time.perf_counter()
+    delete(root)
+    elapsed = time.perf_counter() - start
+    assert not root.exists()
+    print(f"{label:<30} {elapsed * 1000:10.2f} ms")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("dir", type=Path)
+    parser.add_argument("dirs", nargs="?", type=int, default=2000)
+    parser.add_argument("files", nargs="?", type=int, default=50)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        top = Path(tmp)
+        sources = [top.joinpath(f"f{j}") for j in range(args.files)]
+        for source in sources:
+            source.write_text("data")
+        print(f"{args.dirs} directories of {args.files} files")
+        runs = [("rmtree", shutil.rmtree)] + [
+            (
+                f"delete_tree ({workers} workers)",
+                lambda root, workers=workers: treedelete.delete_tree(root, workers),
+            )
+            for workers in WORKERS
+        ]
+        for label, delete in runs:
+            root = top.joinpath("tree")
+            _make_tree(root, sources, args.dirs)
+            os.sync()
+            _timed(label, delete, root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""src/yaesm/agent.py.
+
+The yaesm agent answers requests from another yaesm process over a single
+stream, usually one SSH session to the machine the agent runs on (see the
+'agent' subcommand and `SSHTarget.agent_session()`). This saves starting a new
+SSH session for every remote probe and action.
+
+The protocol is line based. Every request line is a JSON object with an 'op'
+key naming the operation and the operations arguments as other keys, or a JSON
+array of such objects, which forms a batch. Every request line is answered
+with one response line: a JSON object for a single request, or an array of
+objects in request order for a batch. A response is either
+{"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+"""
+
+import contextlib
+import fnmatch
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import yaesm.ty as ty
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 2
+REQUEST_TIMEOUT = 2 * 60
+
+
+class AgentError(Exception): ...
+
+
+class AgentRequestError(AgentError):
+    """The agent performed a request, and reported that it failed."""
+
+
+def _op_hello() -> dict:
+    return {"version": PROTOCOL_VERSION}
+
+
+def _op_stat(paths: list[str]) -> list[dict | None]:
+    now = time.time()
+    results: list[dict | None] = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            results.append(None)
+            continue
+        results.append(
+            {
+                "is_dir": os.path.isdir(path),
+                "is_file": os.path.isfile(path),
+                "age": now - st.st_mtime,
+            }
+        )
+    return results
+
+
+def _op_listdir(path: str, dirs_only: bool = False, globs: list[str] | None = None) -> list:
+    """List the names in `path`, only those matching one of `globs` if given."""
+    results = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if dirs_only and not entry.is_dir(follow_symlinks=False):
+                continue
+            if globs is not None and not any(fnmatch.fnmatchcase(entry.name, g) for g in globs):
+                continue
+            results.append(entry.name)
+    return results
+
+
+def _op_which(tools: list[str]) -> list[bool]:
+    return [shutil.which(tool) is not None for tool in tools]
+
+
+def _op_rename(src: str, dst: str) -> None:
+    os.rename(src, dst)
+
+
+def _op_run(argv: list[str], input: str | None = None) -> dict:
+    try:
+        p = subprocess.run(
+            argv,
+            input=input,
+            stdin=subprocess.DEVNULL if input is None else None,
+            capture_output=True,
+            encoding="utf-8",
+            errors="surrogateescape",
+            check=False,
+        )
+    except OSError as exc:
+        # Like a shell, 127 for a command that is not found and 126 otherwise.
+        return {
+            "returncode": 127 if isinstance(exc, FileNotFoundError) else 126,
+            "stdout": "",
+            "stderr": f"{argv[0]}: {exc.strerror}\n",
+        }
+    return {
+        "returncode": p.returncode,
+        "stdout": p.stdout.encode("utf-8", "surrogateescape").decode("utf-8", "replace"),
+        "stderr": p.stderr.encode("utf-8", "surrogateescape").decode("utf-8", "replace"),
+    }
+
+
+_OPS: dict[str, ty.Callable[..., ty.Any]] = {
+    "hello": _op_hello,
+    "stat": _op_stat,
+    "listdir": _op_listdir,
+    "which": _op_which,
+    "rename": _op_rename,
+    "run": _op_run,
+}
+
+
+def handle_request(request: ty.Any) -> dict:
+    """Perform the single agent `request` and return its response."""
+    if not isinstance(request, dict) or request.get("op") not in _OPS:
+        return {"ok": False, "error": f"invalid request: {request!r}"}
+    args = {key: value for key, value in request.items() if key != "op"}
+    try:
+        return {"ok": True, "result": _OPS[request["op"]](**args)}
+    except (OSError, TypeError, ValueError) as exc:
+        return {"ok": False, "error": str(exc)}
+
+
+def serve(instream: ty.Any, outstream: ty.Any) -> None:
+    """Answer every request line read from the text stream `instream` on
+    `outstream`, until `instream` is exhausted.
+    """
+    for line in instream:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as exc:
+            response: ty.Any = {"ok": False, "error": f"invalid request: {exc}"}
+        else:
+            if isinstance(request, list):
+                response = [handle_request(r) for r in request]
+            else:
+                response = handle_request(request)
+        outstream.write(json.dumps(response) + "\n")
+        outstream.flush()
+
+
+class AgentSession:
+    """A running agent, started with the exec list `cmd`, for example an SSH
+    command running 'yaesm agent' on a remote server. Requests are serialized,
+    so a session may be shared by threads. Raises `AgentError` if the agent
+    cannot be started or does not speak our protocol version.
+
+    If the agent does not answer a request within `timeout` seconds, then it
+    is stopped and `AgentError` is raised, so that callers can fall back to
+    plain SSH. Requests with a 'run' operation wait for the command to finish,
+    like it would without the agent.
+    """
+
+    def __init__(
+        self, cmd: ty.Sequence[str | Path], timeout: float | None = REQUEST_TIMEOUT
+    ) -> None:
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        try:
+            self._proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+            )
+        except OSError as exc:
+            raise AgentError(f"cannot start agent: {exc}") from exc
+        # Responses are read by a thread, so that waiting for one can time out.
+        self._responses: queue.Queue[str] = queue.Queue()
+        threading.Thread(target=self._read_responses, daemon=True).start()
+        try:
+            version = self.request("hello").get("version")
+        except AgentError:
+            self.close()
+            raise
+        if version != PROTOCOL_VERSION:
+            self.close()
+            raise AgentError(f"unsupported agent protocol version: {version}")
+
+    def _read_responses(self) -> None:
+        stdout = self._proc.stdout
+        assert stdout is not None
+        with contextlib.suppress(OSError, ValueError):
+            for line in stdout:
+                self._responses.put(line)
+        self._responses.put("")
+
+    def _exchange(self, request: ty.Any, timeout: float | None) -> ty.Any:
+        stdin = self._proc.stdin
+        assert stdin is not None
+        with self._lock:
+            try:
+                stdin.write(json.dumps(request) + "\n")
+                stdin.flush()
+            except (OSError, ValueError) as exc:
+                raise AgentError(f"agent connection failed: {exc}") from exc
+            try:
+                line = self._responses.get(timeout=timeout)
+            except queue.Empty:
+                # A late response would be taken as the answer to the next
+                # request, so the agent cannot be used anymore.
+                self._proc.kill()
+                self._proc.wait()
+                raise AgentError(f"agent did not respond within {timeout} seconds") from None
+        if not line:
+            raise AgentError("agent connection closed")
+        try:
+            return json.loads(line)
+        except ValueError as exc:
+            raise AgentError(f"invalid agent response: {exc}") from exc
+
+    @staticmethod
+    def _result(response: ty.Any) -> ty.Any:
+        if not isinstance(response, dict) or not response.get("ok"):
+            error = response.get("error") if isinstance(response, dict) else response
+            raise AgentRequestError(f"agent request failed: {error}")
+        return response.get("result")
+
+    def request(self, op: str, **args: ty.Any) -> ty.Any:
+        """Perform the operation `op` with `args` and return its result."""
+        timeout = None if op == "run" else self.timeout
+        return self._result(self._exchange({"op": op, **args}, timeout))
+
+    def batch(self, requests: list[dict]) -> list[ty.Any]:
+        """Perform all of `requests`, each a dict like {"op": ..., ...}, in a
+        single round trip and return their results in order. Raises `AgentError`
+        if any of them failed.
+        """
+        timeout = None if any(r.get("op") == "run" for r in requests) else self.timeout
+        responses = self._exchange(requests, timeout)
+        if not isinstance(responses, list) or len(responses) != len(requests):
+            raise AgentError("invalid agent batch response")
+        return [self._result(response) for response in responses]
+
+    def alive(self) -> bool:
+        return self._proc.poll() is None
+
+    def close(self) -> None:
+        """Stop the agent."""
+        if self._proc.stdin is not None:
+            with contextlib.suppress(OSError):
+                self._proc.stdin.close()
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
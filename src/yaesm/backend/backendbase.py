@@ -14,9 +14,12 @@ from pathlib import Path
 import voluptuous as vlp
 
 import yaesm.backup as bckp
+import yaesm.prunequeue as prunequeue
+import yaesm.retention as retention
 import yaesm.ty as ty
 from yaesm import config
-from yaesm.sshtarget import SSHTarget
+from yaesm.catalog import Catalog
+from yaesm.sshtarget import Probe, SSHTarget, SSHTargetException
 from yaesm.timeframe import Timeframe
 
 logger = logging.getLogger(__name__)
@@ -39,27 +42,103 @@ class BackendBase(abc.ABC):
 
     Backend implementations are expected to implement `check()`, `create()`,
     `collect()`, and `delete()`.
+
+    With the 'prune_deferred' setting, the artifacts a backup no longer keeps
+    are queued for deletion instead of being deleted by `do_backup()`, and are
+    deleted in the background at no more than 'prune_rate' artifacts per second,
+    see the yaesm.prunequeue module. Backends that cannot queue deletions
+    delete the artifacts right away.
+
+    Before a backup in a timeframe whose `unchanged` policy is not 'backup',
+    `source_unchanged()` is asked whether the source changed since the newest
+    artifact. If it did not, then the backup is skipped, or recorded as an alias
+    of the newest artifact with `alias()`, by the policy.
     """
 
     def __init__(self, extra_opts: list[str] | None = None) -> None:
         self.extra_opts = extra_opts
+        self.prune_deferred = False
+        self.prune_rate: float | None = None
 
     @ty.final
     def do_backup(self, backup: bckp.Backup, timeframe: Timeframe) -> None:
         """Perform a `backup` for a given `timeframe`.
 
-        Note that this function also cleans up old backups.
+        Note that this function also cleans up old backups of every timeframe
+        of `backup`, see `prune()`.
         """
         backup_basename = bckp.backup_basename_now(backup, timeframe)
-        backups = self.collect(backup, timeframes=[timeframe])
-        if any(artifact.name == backup_basename for artifact in backups):
+        backups = self.collect(backup)
+        if any(
+            artifact.timeframe == timeframe.name and artifact.name == backup_basename
+            for artifact in backups
+        ):
             logger.error(f"backup already exists: {backup_basename}")
             raise bckp.BackupError(f"backup already exists: {backup_basename}")
-        backups.append(self.create(backup, timeframe, backup_basename))
-        backups.sort(key=lambda artifact: artifact.created_at, reverse=True)
-        to_delete = backups[timeframe.keep :]
-        if to_delete:
-            self.delete(backup, to_delete)
+        newest = backups[:1] if timeframe.unchanged != "backup" else []
+        if newest and self.source_unchanged(backup, newest[0]):
+            if timeframe.unchanged == "skip":
+                logger.info(
+                    f"skipping backup {backup_basename}, as the src_dir of backup"
+                    f" '{backup.name}' did not change since {newest[0].name}"
+                )
+                return
+            logger.info(f"recording backup {backup_basename} as an alias of {newest[0].name}")
+            self.alias(backup, timeframe, backup_basename, newest[0])
+        else:
+            self.create(backup, timeframe, backup_basename)
+        others = [other for other in backup.timeframes if other.name != timeframe.name]
+        self.prune(backup, [*others, timeframe])
+
+    @ty.final
+    def prune(
+        self,
+        backup: bckp.Backup,
+        timeframes: list[Timeframe] | None = None,
+        dry_run: bool = False,
+        defer: bool | None = None,
+    ) -> retention.RetentionPlan:
+        """Delete the artifacts of `backup` that its `timeframes` (by default
+        `backup.timeframes`) no longer keep. The deletions of all the timeframes
+        are planned together and performed with a single `delete()` call, or
+        queued with `defer_delete()` if `defer` is True (by default the
+        'prune_deferred' setting). If `dry_run` is True, then nothing is deleted.
+        Returns the plan.
+        """
+        timeframes = backup.timeframes if timeframes is None else timeframes
+        defer = self.prune_deferred if defer is None else defer
+        with retention.backup_lock(backup):
+            plan = retention.plan(self.collect(backup), timeframes)
+            if plan.delete and not dry_run:
+                if defer:
+                    logger.info(
+                        f"queueing {len(plan.delete)} artifacts of backup '{backup.name}'"
+                        " for pruning"
+                    )
+                    self.defer_delete(backup, plan.delete)
+                else:
+                    logger.info(f"pruning {len(plan.delete)} artifacts of backup '{backup.name}'")
+                    self.delete(backup, plan.delete)
+        if plan.delete and not dry_run and defer:
+            prunequeue.notify(backup)
+        return plan
+
+    def defer_delete(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+        """Queue the stored backup `artifacts` for deletion. They are no longer
+        collected, and are returned by `pending_deletions()` until deleted.
+        """
+        self.delete(backup, artifacts)
+
+    def pending_deletions(self, backup: bckp.Backup) -> list[bckp.BackupArtifact]:
+        """Return the artifacts of `backup` queued for deletion, oldest first."""
+        return []
+
+    def commit_deletions(self, backup: bckp.Backup) -> None:
+        """Wait until the deletions of artifacts of `backup` so far are durable
+        and their space is being reclaimed. Backends whose deletions are durable
+        once `delete()` returns do not need to override this.
+        """
+        return None
 
     @classmethod
     @ty.final
@@ -102,11 +181,32 @@ class BackendBase(abc.ABC):
     def create(self, backup: bckp.Backup, timeframe: Timeframe, name: str) -> bckp.BackupArtifact:
         """Create and return a stored backup artifact."""
 
+    def source_unchanged(self, backup: bckp.Backup, artifact: bckp.BackupArtifact) -> bool:
+        """Return True only if the src_dir of `backup` certainly did not change
+        since `artifact` was created. Backends that cannot tell return False.
+        """
+        return False
+
+    def alias(
+        self,
+        backup: bckp.Backup,
+        timeframe: Timeframe,
+        name: str,
+        artifact: bckp.BackupArtifact,
+    ) -> bckp.BackupArtifact:
+        """Record and return an artifact named `name` in `timeframe` with the
+        same contents as `artifact`, without copying them if possible. Backends
+        that cannot alias artifacts create a new one.
+        """
+        return self.create(backup, timeframe, name)
+
     @abc.abstractmethod
     def collect(
-        self, backup: bckp.Backup, timeframes: list[Timeframe] | None = None
+        self, backup: bckp.Backup, timeframes: list[Timeframe] | None = None, rescan: bool = False
     ) -> list[bckp.BackupArtifact]:
-        """Collect stored backup artifacts from newest to oldest."""
+        """Collect stored backup artifacts from newest to oldest. If `rescan` is
+        True, then do not trust any record of the stored artifacts.
+        """
 
     @abc.abstractmethod
     def delete(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
@@ -137,7 +237,15 @@ class BackendBase(abc.ABC):
 class PathBackendBase(BackendBase):
     """Base class for backends with Path or SSHTarget sources and destinations.
 
-    The destination is expected to be an existing directory.
+    The destination is expected to be an existing directory. The artifacts in
+    the destination are recorded in a `yaesm.catalog.Catalog`, so backend
+    implementations implement `create_artifact()` and `delete_artifacts()`,
+    which are wrapped by `create()` and `delete()` to keep the catalog up to date.
+
+    An alias is only a catalog record, whose locator is that of the artifact it
+    aliases. `delete()` only deletes a locator along with the last artifact that
+    has it, so that artifacts outlive their deletion for as long as aliases of
+    them are kept.
     """
 
     @ty.final
@@ -155,21 +263,24 @@ class PathBackendBase(BackendBase):
         sshtarget = src_dir if isinstance(src_dir, SSHTarget) else None
         if isinstance(dst_dir, SSHTarget):
             sshtarget = dst_dir
-        ssh_connected = True
+        # Every remote check is one probe, so they all take a single round trip.
+        probes: dict[Probe, bool | float | None] = {}
         if sshtarget is not None:
-            ssh_connected = add_result(
-                f"SSH connection to {sshtarget.host}", check_ssh_connectivity(sshtarget)
-            ).passed
+            probes = probe_remote(sshtarget, self.name())
+            add_result(
+                f"SSH connection to {sshtarget.host}",
+                [] if probes else [f"cannot establish SSH connection to {sshtarget.host}"],
+            )
 
         if isinstance(src_dir, SSHTarget):
-            if ssh_connected:
+            if probes:
                 add_result(
                     f"src_dir exists on remote {src_dir.host}: {src_dir.path}",
-                    check_dir_exists_remote(src_dir, "src_dir"),
+                    check_dir_exists_remote(src_dir, "src_dir", probes),
                 )
                 add_result(
                     f"src_dir is readable on remote {src_dir.host}: {src_dir.path}",
-                    check_dir_readable_remote(src_dir, "src_dir"),
+                    check_dir_readable_remote(src_dir, "src_dir", probes),
                 )
         else:
             add_result(
@@ -178,14 +289,14 @@ class PathBackendBase(BackendBase):
             )
 
         if isinstance(dst_dir, SSHTarget):
-            if ssh_connected:
+            if probes:
                 add_result(
                     f"dst_dir exists on remote {dst_dir.host}: {dst_dir.path}",
-                    check_dir_exists_remote(dst_dir, "dst_dir"),
+                    check_dir_exists_remote(dst_dir, "dst_dir", probes),
                 )
                 add_result(
                     f"dst_dir is writable on remote {dst_dir.host}: {dst_dir.path}",
-                    check_dir_writable_remote(dst_dir, "dst_dir"),
+                    check_dir_writable_remote(dst_dir, "dst_dir", probes),
                 )
         else:
             add_result(
@@ -197,19 +308,83 @@ class PathBackendBase(BackendBase):
             f"{self.name()} is installed locally",
             check_tool_local(self.name()),
         )
-        if sshtarget is not None and ssh_connected:
+        if sshtarget is not None and probes:
             add_result(
                 f"{self.name()} is installed on remote {sshtarget.host}",
-                check_tool_remote(sshtarget, self.name()),
+                check_tool_remote(sshtarget, self.name(), probes),
             )
         results += self.check_extra(backup)
         return results
 
     def collect(
-        self, backup: bckp.Backup, timeframes: list[Timeframe] | None = None
+        self, backup: bckp.Backup, timeframes: list[Timeframe] | None = None, rescan: bool = False
     ) -> list[bckp.BackupArtifact]:
         """Collect directory-backed artifacts from newest to oldest."""
-        return bckp.path_artifacts_collect(backup, timeframes=timeframes)
+        return Catalog(backup).collect(timeframes=timeframes, rescan=rescan)
+
+    @ty.final
+    def create(self, backup: bckp.Backup, timeframe: Timeframe, name: str) -> bckp.BackupArtifact:
+        artifact = self.create_artifact(backup, timeframe, name)
+        Catalog(backup).add(artifact)
+        return artifact
+
+    @ty.final
+    def alias(
+        self,
+        backup: bckp.Backup,
+        timeframe: Timeframe,
+        name: str,
+        artifact: bckp.BackupArtifact,
+    ) -> bckp.BackupArtifact:
+        alias = bckp.BackupArtifact(
+            name,
+            timeframe.name,
+            bckp.backup_to_datetime(name),
+            artifact.locator,
+            size=artifact.size,
+            metadata={**artifact.metadata, "alias_of": Path(artifact.locator).name},
+        )
+        Catalog(backup).add(alias)
+        return alias
+
+    @ty.final
+    def defer_delete(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+        Catalog(backup).queue_removal(artifacts)
+
+    @ty.final
+    def pending_deletions(self, backup: bckp.Backup) -> list[bckp.BackupArtifact]:
+        return Catalog(backup).pending()
+
+    @ty.final
+    def delete(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+        catalog = Catalog(backup)
+        names = {artifact.name for artifact in artifacts}
+        shared = {
+            artifact.locator
+            for artifact in [*catalog.collect(), *catalog.pending()]
+            if artifact.name not in names
+        }
+        unshared = {
+            artifact.locator: artifact for artifact in artifacts if artifact.locator not in shared
+        }
+        try:
+            if unshared:
+                self.delete_artifacts(backup, list(unshared.values()))
+        except BaseException:
+            # Some of the artifacts may be gone, the next collect finds out which.
+            catalog.invalidate()
+            raise
+        catalog.remove(artifacts)
+
+    @abc.abstractmethod
+    def create_artifact(
+        self, backup: bckp.Backup, timeframe: Timeframe, name: str
+    ) -> bckp.BackupArtifact:
+        """Create and return a stored backup artifact named `name` in the dst_dir."""
+
+    @abc.abstractmethod
+    def delete_artifacts(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+        """Delete the stored backup `artifacts` from the dst_dir."""
 
     def check_extra(self, backup: bckp.Backup) -> list[CheckResult]:
         """Perform backend-specific path checks."""
@@ -222,8 +397,30 @@ def check_dir_exists_local(path: Path, label: str) -> list[str]:
     return []
 
 
-def check_dir_exists_remote(sshtarget: SSHTarget, label: str) -> list[str]:
-    if not sshtarget.is_dir():
+def probe_remote(sshtarget: SSHTarget, tool: str) -> dict[Probe, bool | float | None]:
+    """Probe everything `PathBackendBase.check()` needs to know about the remote
+    `sshtarget` in a single round trip: that `sshtarget.path` is a readable and
+    writable directory, and that `tool` is installed. Returns an empty dict if
+    the SSH connection failed.
+    """
+    try:
+        return sshtarget.probe(
+            [
+                Probe("is_dir", sshtarget.path),
+                Probe("readable", sshtarget.path),
+                Probe("writable", sshtarget.path),
+                Probe("which", tool),
+            ]
+        )
+    except (subprocess.CalledProcessError, SSHTargetException) as exc:
+        logger.debug(f"probing {sshtarget.host} failed: {exc}")
+        return {}
+
+
+def check_dir_exists_remote(
+    sshtarget: SSHTarget, label: str, probes: dict[Probe, bool | float | None] | None = None
+) -> list[str]:
+    if not _probed(sshtarget, Probe("is_dir", sshtarget.path), probes):
         return [f"{label} does not exist on remote {sshtarget.host}: {sshtarget.path}"]
     return []
 
@@ -240,34 +437,39 @@ def check_tool_local(tool: str) -> list[str]:
     return []
 
 
-def check_tool_remote(sshtarget: SSHTarget, tool: str) -> list[str]:
-    p = subprocess.run(
-        sshtarget.openssh_cmd(["command", "-v", tool]),
-        check=False,
-        capture_output=True,
-    )
-    if p.returncode != 0:
+def check_tool_remote(
+    sshtarget: SSHTarget, tool: str, probes: dict[Probe, bool | float | None] | None = None
+) -> list[str]:
+    if not _probed(sshtarget, Probe("which", tool), probes):
         return [f"required tool not found on remote {sshtarget.host}: {tool}"]
     return []
 
 
-def check_dir_readable_remote(sshtarget: SSHTarget, label: str) -> list[str]:
-    p = subprocess.run(
-        sshtarget.openssh_cmd(["test", "-r", sshtarget.path]),
-        check=False,
-        capture_output=True,
-    )
-    if p.returncode != 0:
+def check_dir_readable_remote(
+    sshtarget: SSHTarget, label: str, probes: dict[Probe, bool | float | None] | None = None
+) -> list[str]:
+    if not _probed(sshtarget, Probe("readable", sshtarget.path), probes):
         return [f"{label} is not readable on remote {sshtarget.host}: {sshtarget.path}"]
     return []
 
 
-def check_dir_writable_remote(sshtarget: SSHTarget, label: str) -> list[str]:
-    p = subprocess.run(
-        sshtarget.openssh_cmd(["test", "-w", sshtarget.path]),
-        check=False,
-        capture_output=True,
-    )
-    if p.returncode != 0:
+def check_dir_writable_remote(
+    sshtarget: SSHTarget, label: str, probes: dict[Probe, bool | float | None] | None = None
+) -> list[str]:
+    if not _probed(sshtarget, Probe("writable", sshtarget.path), probes):
         return [f"{label} is not writable on remote {sshtarget.host}: {sshtarget.path}"]
     return []
+
+
+def _probed(
+    sshtarget: SSHTarget, probe: Probe, probes: dict[Probe, bool | float | None] | None
+) -> bool | float | None:
+    """Return the result of `probe` from the already performed `probes`, or
+    perform it now if it is not among them.
+    """
+    if probes is not None and probe in probes:
+        return probes[probe]
+    try:
+        return sshtarget.probe([probe])[probe]
+    except (subprocess.CalledProcessError, SSHTargetException):
+        return False
@@ -1,21 +1,57 @@
 """src/yaesm/backend/btrfsbackend.py."""
 
+import ctypes
+import dataclasses
+import errno
 import logging
-import shlex
+import os
+import re
 import subprocess
+import threading
 import time
 import uuid
 from pathlib import Path
 
 import voluptuous as vlp
 
+import yaesm.backend.btrfsioctl as btrfsioctl
+import yaesm.backend.btrfsspool as btrfsspool
 import yaesm.backup as bckp
-from yaesm.backend.backendbase import CheckResult, PathBackendBase
-from yaesm.sshtarget import SSHTarget
-from yaesm.timeframe import Timeframe
+import yaesm.transport as transport
+import yaesm.ty as ty
+from yaesm.backend.backendbase import (
+    CheckResult,
+    PathBackendBase,
+    check_tool_local,
+    check_tool_remote,
+)
+from yaesm.backend.pipeline import PipelineResult, pipefail_sh, run_pipeline
+from yaesm.catalog import Catalog
+from yaesm.sshtarget import Probe, SSHTarget
+from yaesm.timeframe import Timeframe, tframe_types
 
 logger = logging.getLogger(__name__)
 
+_AT_FDCWD = -100
+
+_SEND_V2_OPTS = ["--proto", "2", "--compressed-data"]
+_SEND_FEATURES_CACHE_SECONDS = 24 * 60 * 60
+_SEND_FEATURES_SCRIPT = (
+    "v=$(cat /sys/fs/btrfs/features/send_stream_version 2>/dev/null); "
+    '[ "${v:-1}" -ge 2 ] 2>/dev/null && btrfs send --help 2>&1 | grep -q -e --compressed-data'
+    " && echo send; "
+    "btrfs receive --help 2>&1 | grep -q -e --force-decompress && echo receive; exit 0"
+)
+# Run with the argument SUBVOLUME to commit its filesystem and show it.
+_SRC_GENERATION_SCRIPT = 'btrfs filesystem sync "$1" >/dev/null && btrfs subvolume show "$1"'
+
+_send_features_cache: dict[tuple, tuple[float, frozenset[str]]] = {}
+_send_features_cache_lock = threading.Lock()
+# The jobs of the timeframes of a backup run concurrently, and one must not
+# rotate away the parent snapshot that another one is about to send against.
+_backup_locks: dict[str, threading.Lock] = {}
+_backup_locks_lock = threading.Lock()
+
 
 class BtrfsBackend(PathBackendBase):
     """The btrfs backup execution backend. See `BackendBase` for more details on
@@ -30,26 +66,81 @@ class BtrfsBackend(PathBackendBase):
     performed, then the remote SSH user must have sufficient privileges to run
     'btrfs subvolume snapshot', 'btrfs subvolume delete', 'btrfs send', and
     'btrfs receive'.
+
+    With the 'btrfs_spool' setting, local-to-remote and remote-to-local send
+    streams are first spooled to the destination in chunks, so that a transfer
+    interrupted halfway is resumed by the next backup rather than restarted.
+    This needs free space on the destination for the whole stream. See the
+    yaesm.backend.btrfsspool module for details.
+
+    With the 'btrfs_clone_sources' setting, snapshots yaesm keeps on the source
+    side, in src_dir and in the listed directories (such as the src_dir of other
+    backups on the same filesystem), are passed to 'btrfs send' as clone sources
+    with '-c' if they have been received on the destination filesystem. Data
+    shared with them is then sent as clone operations rather than in full.
+
+    With the 'btrfs_send_compressed_data' setting, extents compressed on the
+    source are sent as they are with 'btrfs send --proto 2 --compressed-data'
+    and written as they are by 'btrfs receive', instead of being decompressed
+    and recompressed. This is only done when btrfs-progs and the kernel support
+    it on both sides, otherwise the version 1 send stream is used.
+
+    The src_dir did not change since a backup, see `source_unchanged()`, if its
+    generation, the last transaction that changed it, is no later than the
+    transaction of the source side snapshot the backup was taken from, which is
+    recorded in the metadata of the backup.
     """
 
-    def __init__(self, extra_opts=None, bootstrap_refresh_days=None):
+    def __init__(
+        self,
+        extra_opts=None,
+        bootstrap_refresh_days=None,
+        spool=False,
+        spool_chunk_size=None,
+        clone_sources=None,
+        send_compressed_data=False,
+    ):
         super().__init__(extra_opts)
         self.bootstrap_refresh_days = bootstrap_refresh_days
+        self.spool = spool
+        self.spool_chunk_size = spool_chunk_size or btrfsspool.DEFAULT_CHUNK_SIZE_MIB
+        self.clone_sources = clone_sources
+        self.send_compressed_data = send_compressed_data
 
     @staticmethod
     def config_settings() -> set[str]:
-        return {"btrfs_bootstrap_refresh"}
+        return {
+            "btrfs_bootstrap_refresh",
+            "btrfs_spool",
+            "btrfs_spool_chunk_size",
+            "btrfs_clone_sources",
+            "btrfs_send_compressed_data",
+        }
 
     @staticmethod
     def config_schema() -> vlp.Schema:
         def _apply_to_backend(d: dict) -> dict:
             if "btrfs_bootstrap_refresh" in d:
                 d["backend"].bootstrap_refresh_days = d.pop("btrfs_bootstrap_refresh")
+            if "btrfs_spool" in d:
+                d["backend"].spool = d.pop("btrfs_spool")
+            if "btrfs_spool_chunk_size" in d:
+                d["backend"].spool_chunk_size = d.pop("btrfs_spool_chunk_size")
+            if "btrfs_clone_sources" in d:
+                d["backend"].clone_sources = [Path(p) for p in d.pop("btrfs_clone_sources")]
+            if "btrfs_send_compressed_data" in d:
+                d["backend"].send_compressed_data = d.pop("btrfs_send_compressed_data")
             return d
 
         return vlp.Schema(
             vlp.All(
-                {vlp.Optional("btrfs_bootstrap_refresh"): vlp.All(int, vlp.Range(min=1))},
+                {
+                    vlp.Optional("btrfs_bootstrap_refresh"): vlp.All(int, vlp.Range(min=1)),
+                    vlp.Optional("btrfs_spool"): bool,
+                    vlp.Optional("btrfs_spool_chunk_size"): vlp.All(int, vlp.Range(min=1)),
+                    vlp.Optional("btrfs_clone_sources"): [str],
+                    vlp.Optional("btrfs_send_compressed_data"): bool,
+                },
                 _apply_to_backend,
             ),
             extra=vlp.ALLOW_EXTRA,
@@ -87,17 +178,65 @@ class BtrfsBackend(PathBackendBase):
                     tuple(check_btrfs_filesystem_local(dst_dir, "dst_dir")),
                 )
             )
+        if self.clone_sources and isinstance(src_dir, Path) and src_dir.is_dir():
+            for clone_dir in self.clone_sources:
+                results.append(
+                    CheckResult(
+                        f"clone source dir is on the same filesystem as src_dir: {clone_dir}",
+                        tuple(check_btrfs_same_filesystem_local(clone_dir, src_dir)),
+                    )
+                )
+        elif self.clone_sources and isinstance(src_dir, SSHTarget):
+            for clone_dir, errors in check_btrfs_same_filesystem_remote(
+                src_dir, self.clone_sources
+            ).items():
+                results.append(
+                    CheckResult(
+                        f"clone source dir is on the same filesystem as src_dir on remote"
+                        f" {src_dir.host}: {clone_dir}",
+                        tuple(errors),
+                    )
+                )
+        sshtarget = src_dir if isinstance(src_dir, SSHTarget) else dst_dir
+        if isinstance(sshtarget, SSHTarget) and sshtarget.compression in transport.DEFAULT_LEVELS:
+            tool = sshtarget.compression
+            results.append(
+                CheckResult(f"{tool} is installed locally", tuple(check_tool_local(tool)))
+            )
+            results.append(
+                CheckResult(
+                    f"{tool} is installed on remote {sshtarget.host}",
+                    tuple(check_tool_remote(sshtarget, tool)),
+                )
+            )
         return results
 
-    def create(self, backup: bckp.Backup, timeframe: Timeframe, name: str) -> bckp.BackupArtifact:
-        if backup.backup_type == "local_to_local":
-            locator = self._exec_backup_local_to_local(backup, name, timeframe)
-        elif backup.backup_type == "local_to_remote":
-            locator = self._exec_backup_local_to_remote(backup, name, timeframe)
-        else:
-            locator = self._exec_backup_remote_to_local(backup, name, timeframe)
+    def create_artifact(
+        self, backup: bckp.Backup, timeframe: Timeframe, name: str
+    ) -> bckp.BackupArtifact:
+        with _btrfs_backup_lock(backup):
+            if backup.backup_type == "local_to_local":
+                locator = self._exec_backup_local_to_local(backup, name, timeframe)
+            elif backup.backup_type == "local_to_remote":
+                locator = self._exec_backup_local_to_remote(backup, name, timeframe)
+            else:
+                locator = self._exec_backup_remote_to_local(backup, name, timeframe)
         path = locator.path if isinstance(locator, SSHTarget) else locator
-        return bckp.BackupArtifact(name, timeframe.name, bckp.backup_to_datetime(name), str(path))
+        metadata = {}
+        if any(other.unchanged != "backup" for other in backup.timeframes):
+            transid = _btrfs_snapshot_transid(_btrfs_source_snapshot(backup, path))
+            if transid is not None:
+                metadata["btrfs_src_transid"] = transid
+        return bckp.BackupArtifact(
+            name, timeframe.name, bckp.backup_to_datetime(name), str(path), metadata=metadata
+        )
+
+    def source_unchanged(self, backup: bckp.Backup, artifact: bckp.BackupArtifact) -> bool:
+        transid = artifact.metadata.get("btrfs_src_transid")
+        if transid is None:
+            return False
+        generation = _btrfs_src_generation(backup.src_dir)
+        return generation is not None and generation <= transid
 
     def _exec_backup_local_to_local(
         self, backup: bckp.Backup, backup_basename: str, timeframe: Timeframe
@@ -108,24 +247,44 @@ class BtrfsBackend(PathBackendBase):
             _btrfs_maybe_refresh_bootstrap(backup, self.bootstrap_refresh_days)
         src_dir = backup.src_dir
         backup_path = backup.dst_dir.joinpath(backup_basename)
-        returncode, _ = _btrfs_take_snapshot_local(src_dir, backup_path, check=False)
-        if returncode != 0:
+        try:
+            direct = btrfsioctl.same_filesystem(src_dir, backup.dst_dir)
+        except OSError:
+            returncode, _ = _btrfs_take_snapshot_local(src_dir, backup_path, check=False)
+            direct = returncode == 0
+        else:
+            if direct:
+                _btrfs_take_snapshot_local(src_dir, backup_path)
+        if not direct:
             staging_basename = _btrfs_staging_snapshot_basename()
             tmp_snapshot = src_dir.joinpath(staging_basename)
             received_snapshot = backup_path.parent.joinpath(staging_basename)
-            bootstrap_snapshot = _btrfs_bootstrap_local_to_local(
+            parent_snapshot = _btrfs_incremental_parent_local_to_local(
                 src_dir, backup_path.parent, backup
             )
+            clone_sources = []
+            if self.clone_sources is not None:
+                clone_sources = _btrfs_clone_sources_local(
+                    [src_dir, *self.clone_sources],
+                    _btrfs_received_uuids_local(backup_path.parent),
+                    exclude=[parent_snapshot],
+                )
             try:
                 _btrfs_take_snapshot_local(src_dir, tmp_snapshot)
                 _btrfs_send_receive_local_to_local(
-                    tmp_snapshot, backup_path.parent, parent=bootstrap_snapshot
+                    tmp_snapshot,
+                    backup_path.parent,
+                    parent=parent_snapshot,
+                    clone_sources=clone_sources,
+                    send_opts=_btrfs_send_opts(backup),
                 )
                 received_snapshot.rename(backup_path)
             except Exception:
                 if received_snapshot.is_dir():
                     _btrfs_delete_subvolumes_local(received_snapshot)
                 raise
+            else:
+                _btrfs_rotate_parent_snapshot_local(tmp_snapshot, backup, backup_basename)
             finally:
                 if tmp_snapshot.is_dir():
                     _btrfs_delete_subvolumes_local(tmp_snapshot)
@@ -138,6 +297,8 @@ class BtrfsBackend(PathBackendBase):
         assert isinstance(backup.dst_dir, SSHTarget)
         if self.bootstrap_refresh_days is not None:
             _btrfs_maybe_refresh_bootstrap(backup, self.bootstrap_refresh_days)
+        if self.spool:
+            return self._exec_backup_local_to_remote_spool(backup, backup_basename, timeframe)
         src_dir = backup.src_dir
         backup_path = backup.dst_dir.with_path(backup.dst_dir.path.joinpath(backup_basename))
         staging_basename = _btrfs_staging_snapshot_basename()
@@ -145,21 +306,32 @@ class BtrfsBackend(PathBackendBase):
         received_snapshot = backup_path.with_path(
             backup_path.path.parent.joinpath(staging_basename)
         )
-        bootstrap_snapshot = _btrfs_bootstrap_local_to_remote(
+        parent_snapshot = _btrfs_incremental_parent_local_to_remote(
             src_dir, backup_path.with_path(backup_path.path.parent), backup
         )
+        clone_sources = []
+        if self.clone_sources is not None:
+            clone_sources = _btrfs_clone_sources_local(
+                [src_dir, *self.clone_sources],
+                _btrfs_received_uuids_remote(backup_path.with_path(backup_path.path.parent)),
+                exclude=[parent_snapshot],
+            )
         try:
             _btrfs_take_snapshot_local(src_dir, tmp_snapshot)
             _btrfs_send_receive_local_to_remote(
                 tmp_snapshot,
                 backup_path.with_path(backup_path.path.parent),
-                parent=bootstrap_snapshot,
+                parent=parent_snapshot,
+                clone_sources=clone_sources,
+                send_opts=_btrfs_send_opts(backup),
             )
             _btrfs_rename_subvolume_remote(received_snapshot, backup_path)
         except Exception:
             if received_snapshot.is_dir():
                 _btrfs_delete_subvolumes_remote(received_snapshot)
             raise
+        else:
+            _btrfs_rotate_parent_snapshot_local(tmp_snapshot, backup, backup_basename)
         finally:
             if tmp_snapshot.is_dir():
                 _btrfs_delete_subvolumes_local(tmp_snapshot)
@@ -172,28 +344,217 @@ class BtrfsBackend(PathBackendBase):
         assert isinstance(backup.dst_dir, Path)
         if self.bootstrap_refresh_days is not None:
             _btrfs_maybe_refresh_bootstrap(backup, self.bootstrap_refresh_days)
+        if self.spool:
+            return self._exec_backup_remote_to_local_spool(backup, backup_basename, timeframe)
         src_dir = backup.src_dir
         backup_path = backup.dst_dir.joinpath(backup_basename)
         staging_basename = _btrfs_staging_snapshot_basename()
         tmp_snapshot = src_dir.with_path(src_dir.path.joinpath(staging_basename))
         received_snapshot = backup_path.parent.joinpath(staging_basename)
-        bootstrap_snapshot = _btrfs_bootstrap_remote_to_local(src_dir, backup_path.parent, backup)
+        parent_snapshot = _btrfs_incremental_parent_remote_to_local(
+            src_dir, backup_path.parent, backup
+        )
+        clone_sources = []
+        if self.clone_sources is not None:
+            clone_sources = _btrfs_clone_sources_remote(
+                [src_dir, *(src_dir.with_path(d) for d in self.clone_sources)],
+                _btrfs_received_uuids_local(backup_path.parent),
+                exclude=[parent_snapshot],
+            )
         try:
             _btrfs_take_snapshot_remote(src_dir, tmp_snapshot)
             _btrfs_send_receive_remote_to_local(
-                tmp_snapshot, backup_path.parent, parent=bootstrap_snapshot
+                tmp_snapshot,
+                backup_path.parent,
+                parent=parent_snapshot,
+                clone_sources=clone_sources,
+                send_opts=_btrfs_send_opts(backup),
             )
             received_snapshot.rename(backup_path)
         except Exception:
             if received_snapshot.is_dir():
                 _btrfs_delete_subvolumes_local(received_snapshot)
             raise
+        else:
+            _btrfs_rotate_parent_snapshot_remote(tmp_snapshot, backup, backup_basename)
         finally:
             if tmp_snapshot.is_dir():
                 _btrfs_delete_subvolumes_remote(tmp_snapshot)
         return backup_path
 
-    def delete(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+    def _exec_backup_local_to_remote_spool(
+        self, backup: bckp.Backup, backup_basename: str, timeframe: Timeframe
+    ) -> SSHTarget:
+        """Like `_exec_backup_local_to_remote()`, but the send stream is spooled
+        to the destination before it is received. An interrupted spool is resumed
+        by the next backup of the same timeframe, by regenerating the stream from
+        the kept src snapshot and checking it against the spooled checksums. See
+        `_btrfs_record_resumed()` for how the resumed backup is named.
+        """
+        assert isinstance(backup.src_dir, Path)
+        assert isinstance(backup.dst_dir, SSHTarget)
+        src_dir = backup.src_dir
+        dst_dir = backup.dst_dir
+        snapshot_basename = btrfsspool.spool_snapshot_basename(backup.name, timeframe.name)
+        snapshot = src_dir.joinpath(snapshot_basename)
+        spool = btrfsspool.RemoteSpool(
+            dst_dir.with_path(
+                dst_dir.path.joinpath(btrfsspool.spool_dir_basename(backup.name, timeframe.name))
+            )
+        )
+        src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+        src_uuids = _btrfs_subvolume_uuids_local(src_dir, [*src_patterns, snapshot_basename])
+        dst_uuids = _btrfs_subvolume_uuids_remote(dst_dir, dst_patterns)
+        send_opts = _btrfs_send_opts(backup)
+        state = spool.state()
+        manifest = state.manifest
+        if manifest is None or not _btrfs_spool_resumable(
+            manifest,
+            self.spool_chunk_size * (1 << 20),
+            send_opts,
+            snapshot_basename,
+            src_uuids,
+            dst_uuids,
+        ):
+            if snapshot.is_dir():
+                _btrfs_delete_subvolumes_local(snapshot)
+            parent = _btrfs_find_common_parent(backup, src_uuids, dst_uuids)
+            _btrfs_take_snapshot_local(src_dir, snapshot)
+            manifest = btrfsspool.SpoolManifest(
+                backup_basename,
+                _btrfs_subvolume_uuids_local(src_dir, [snapshot_basename])[snapshot_basename].uuid,
+                parent,
+                None if parent is None else src_uuids[parent].uuid,
+                self.spool_chunk_size * (1 << 20),
+                tuple(send_opts),
+            )
+            spool.start(manifest)
+            state = btrfsspool.SpoolState(manifest, [], False)
+        else:
+            logger.info(
+                f"resuming spooled send of '{manifest.backup_basename}'"
+                f" after {len(state.checksums)} chunks"
+            )
+        if not state.complete:
+            send_cmd: list[str | Path] = ["btrfs", "send", *manifest.send_opts]
+            if manifest.parent is not None:
+                send_cmd += ["-p", src_dir.joinpath(manifest.parent)]
+            send_cmd.append(snapshot)
+            btrfsspool.fill_spool(send_cmd, spool, manifest.chunk_size, expected=state.checksums)
+        received_snapshot = dst_dir.with_path(dst_dir.path.joinpath(snapshot_basename))
+        backup_path = dst_dir.with_path(dst_dir.path.joinpath(manifest.backup_basename))
+        try:
+            if received_snapshot.is_dir():
+                _btrfs_delete_subvolumes_remote(received_snapshot)
+            btrfsspool.receive_spool(spool, dst_dir.path)
+            _btrfs_rename_subvolume_remote(received_snapshot, backup_path)
+        except Exception:
+            if received_snapshot.is_dir():
+                _btrfs_delete_subvolumes_remote(received_snapshot)
+            spool.remove()
+            _btrfs_delete_subvolumes_local(snapshot)
+            raise
+        _btrfs_rotate_parent_snapshot_local(snapshot, backup, manifest.backup_basename)
+        spool.remove()
+        if manifest.backup_basename != backup_basename:
+            _btrfs_record_resumed(backup, timeframe, backup_path.path, backup_basename)
+            return self._exec_backup_local_to_remote_spool(backup, backup_basename, timeframe)
+        return backup_path
+
+    def _exec_backup_remote_to_local_spool(
+        self, backup: bckp.Backup, backup_basename: str, timeframe: Timeframe
+    ) -> Path:
+        """Like `_exec_backup_remote_to_local()`, but the send stream is spooled
+        to the destination before it is received. An interrupted spool is resumed
+        by the next backup of the same timeframe, by regenerating the stream from
+        the kept src snapshot and only transferring it from the first missing
+        chunk on. See `_btrfs_record_resumed()` for how the resumed backup is
+        named.
+        """
+        assert isinstance(backup.src_dir, SSHTarget)
+        assert isinstance(backup.dst_dir, Path)
+        src_dir = backup.src_dir
+        dst_dir = backup.dst_dir
+        snapshot_basename = btrfsspool.spool_snapshot_basename(backup.name, timeframe.name)
+        snapshot = src_dir.with_path(src_dir.path.joinpath(snapshot_basename))
+        spool = btrfsspool.LocalSpool(
+            dst_dir.joinpath(btrfsspool.spool_dir_basename(backup.name, timeframe.name))
+        )
+        src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+        src_uuids = _btrfs_subvolume_uuids_remote(src_dir, [*src_patterns, snapshot_basename])
+        dst_uuids = _btrfs_subvolume_uuids_local(dst_dir, dst_patterns)
+        send_opts = _btrfs_send_opts(backup)
+        state = spool.state()
+        manifest = state.manifest
+        if manifest is None or not _btrfs_spool_resumable(
+            manifest,
+            self.spool_chunk_size * (1 << 20),
+            send_opts,
+            snapshot_basename,
+            src_uuids,
+            dst_uuids,
+        ):
+            if snapshot_basename in src_uuids:
+                _btrfs_delete_subvolumes_remote(snapshot)
+            parent = _btrfs_find_common_parent(backup, src_uuids, dst_uuids)
+            _btrfs_take_snapshot_remote(src_dir, snapshot)
+            manifest = btrfsspool.SpoolManifest(
+                backup_basename,
+                _btrfs_subvolume_uuids_remote(src_dir, [snapshot_basename])[snapshot_basename].uuid,
+                parent,
+                None if parent is None else src_uuids[parent].uuid,
+                self.spool_chunk_size * (1 << 20),
+                tuple(send_opts),
+            )
+            spool.start(manifest)
+            state = btrfsspool.SpoolState(manifest, [], False)
+        else:
+            # Only the chunks after the spooled ones are transferred, so those
+            # have to be intact.
+            intact = spool.verify(state, manifest.chunk_size)
+            if intact < len(state.checksums):
+                logger.warning(f"spooled chunk {intact} is damaged, discarding the rest")
+                spool.truncate(intact)
+                state = btrfsspool.SpoolState(manifest, state.checksums[:intact], False)
+            logger.info(
+                f"resuming spooled send of '{manifest.backup_basename}'"
+                f" after {len(state.checksums)} chunks"
+            )
+        if not state.complete:
+            send_cmd: list[str | Path] = ["btrfs", "send", *manifest.send_opts]
+            if manifest.parent is not None:
+                send_cmd += ["-p", src_dir.path.joinpath(manifest.parent)]
+            send_cmd.append(snapshot.path)
+            offset = len(state.checksums) * manifest.chunk_size
+            if offset:
+                send_cmd = pipefail_sh(send_cmd, ["tail", "-c", f"+{offset + 1}"])
+            btrfsspool.fill_spool(
+                src_dir.openssh_cmd(send_cmd),
+                spool,
+                manifest.chunk_size,
+                start_index=len(state.checksums),
+            )
+        received_snapshot = dst_dir.joinpath(snapshot_basename)
+        backup_path = dst_dir.joinpath(manifest.backup_basename)
+        try:
+            if received_snapshot.is_dir():
+                _btrfs_delete_subvolumes_local(received_snapshot)
+            btrfsspool.receive_spool(spool, dst_dir)
+            received_snapshot.rename(backup_path)
+        except Exception:
+            if received_snapshot.is_dir():
+                _btrfs_delete_subvolumes_local(received_snapshot)
+            spool.remove()
+            _btrfs_delete_subvolumes_remote(snapshot)
+            raise
+        _btrfs_rotate_parent_snapshot_remote(snapshot, backup, manifest.backup_basename)
+        spool.remove()
+        if manifest.backup_basename != backup_basename:
+            _btrfs_record_resumed(backup, timeframe, backup_path, backup_basename)
+            return self._exec_backup_remote_to_local_spool(backup, backup_basename, timeframe)
+        return backup_path
+
+    def delete_artifacts(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
         if isinstance(backup.dst_dir, SSHTarget):
             _btrfs_delete_subvolumes_remote(
                 *(backup.dst_dir.with_path(Path(artifact.locator)) for artifact in artifacts)
@@ -201,16 +562,114 @@ class BtrfsBackend(PathBackendBase):
         else:
             _btrfs_delete_subvolumes_local(*(Path(artifact.locator) for artifact in artifacts))
 
+    def commit_deletions(self, backup: bckp.Backup) -> None:
+        if isinstance(backup.dst_dir, SSHTarget):
+            _btrfs_commit_remote(backup.dst_dir)
+        else:
+            _btrfs_commit_local(backup.dst_dir)
+
+
+def _btrfs_record_resumed(
+    backup: bckp.Backup, timeframe: Timeframe, backup_path: Path, backup_basename: str
+) -> None:
+    """Record the backup `backup_path` received from a resumed spool in the
+    catalog of `backup`. The resumed stream holds the src_dir as it was when the
+    spool was started, so the backup keeps the name it was started with, and the
+    backup `backup_basename` is then sent on top of it.
+    """
+    name = backup_path.name
+    logger.info(f"received resumed backup {name}, sending {backup_basename} on top of it")
+    Catalog(backup).add(
+        bckp.BackupArtifact(name, timeframe.name, bckp.backup_to_datetime(name), str(backup_path))
+    )
+
+
+def _btrfs_backup_lock(backup: bckp.Backup) -> threading.Lock:
+    """Return the lock to hold while selecting the parent snapshot of, sending,
+    and rotating the parent snapshots of `backup`.
+    """
+    with _backup_locks_lock:
+        return _backup_locks.setdefault(backup.name, threading.Lock())
+
+
+def _btrfs_source_snapshot(backup: bckp.Backup, backup_path: Path) -> Path | SSHTarget:
+    """Return the source side snapshot that the backup `backup_path` of `backup`
+    was taken from, which is its rolling parent snapshot, or for a local backup
+    to the same filesystem the backup itself.
+    """
+    basename = _btrfs_parent_snapshot_basename(backup_path.name)
+    if isinstance(backup.src_dir, SSHTarget):
+        return backup.src_dir.with_path(backup.src_dir.path.joinpath(basename))
+    snapshot = backup.src_dir.joinpath(basename)
+    if backup.backup_type == "local_to_local" and not snapshot.is_dir():
+        return backup_path
+    return snapshot
+
+
+def _btrfs_parse_generation(output: str, field: str) -> int | None:
+    """Parse the generation `field` out of the output of 'btrfs subvolume show'."""
+    match = re.search(rf"^\s*{field}:\s*(\d+)", output, re.MULTILINE)
+    return None if match is None else int(match.group(1))
+
+
+def _btrfs_snapshot_transid(snapshot: Path | SSHTarget) -> int | None:
+    """Return the transaction `snapshot` was created in, or None if it cannot
+    be told.
+    """
+    if isinstance(snapshot, Path):
+        try:
+            return btrfsioctl.subvolume_info(snapshot).otransid
+        except OSError as exc:
+            logger.debug(f"btrfs subvolume info ioctl failed, falling back to btrfs-progs: {exc}")
+            p = subprocess.run(
+                ["btrfs", "subvolume", "show", snapshot],
+                check=False,
+                capture_output=True,
+                encoding="utf-8",
+            )
+    else:
+        p = snapshot.run(
+            ["btrfs", "subvolume", "show", snapshot.path],
+            check=False,
+            capture_output=True,
+            encoding="utf-8",
+        )
+    return _btrfs_parse_generation(p.stdout, "Gen at creation") if p.returncode == 0 else None
+
+
+def _btrfs_src_generation(src_dir: Path | SSHTarget) -> int | None:
+    """Commit the filesystem of the subvolume `src_dir`, so that every change
+    made to it so far counts, and then return its generation, or None if it
+    cannot be told.
+    """
+    if isinstance(src_dir, Path):
+        try:
+            btrfsioctl.commit(src_dir)
+            return btrfsioctl.subvolume_info(src_dir).generation
+        except OSError as exc:
+            logger.debug(f"btrfs ioctls failed, falling back to btrfs-progs: {exc}")
+        p = subprocess.run(
+            ["sh", "-c", _SRC_GENERATION_SCRIPT, "sh", src_dir],
+            check=False,
+            capture_output=True,
+            encoding="utf-8",
+        )
+    else:
+        p = src_dir.run(
+            ["sh", "-c", _SRC_GENERATION_SCRIPT, "sh", src_dir.path],
+            check=False,
+            capture_output=True,
+            encoding="utf-8",
+        )
+    return _btrfs_parse_generation(p.stdout, "Generation") if p.returncode == 0 else None
+
 
 def _btrfs_staging_snapshot_basename() -> str:
     return f".yaesm-btrfs-incomplete-{uuid.uuid4().hex}"
 
 
 def _btrfs_rename_subvolume_remote(snapshot: SSHTarget, destination: SSHTarget) -> None:
-    subprocess.run(
-        snapshot.openssh_cmd(["mv", "--", snapshot.path, destination.path]),
-        check=True,
-    )
+    snapshot.rename(snapshot.path, destination.path)
 
 
 def _btrfs_take_snapshot_local(
@@ -221,7 +680,16 @@ def _btrfs_take_snapshot_local(
     Passes `check` along to `subprocess.run()`. Returns a pair containing the
     btrfs subvolume snapshot command returncode, and the name of the created (or
     attempted to create) snapshot.
+
+    The snapshot is taken with an ioctl when possible. If that fails for any
+    reason, then 'btrfs subvolume snapshot' is run instead, so that failures are
+    reported the same way regardless.
     """
+    try:
+        btrfsioctl.snapshot(src_dir, snapshot)
+        return 0, snapshot
+    except OSError as exc:
+        logger.debug(f"btrfs snapshot ioctl failed, falling back to btrfs-progs: {exc}")
     p = subprocess.run(["btrfs", "subvolume", "snapshot", "-r", src_dir, snapshot], check=check)
     return p.returncode, snapshot
 
@@ -238,9 +706,8 @@ def _btrfs_take_snapshot_remote(
     Note that it is assumed that `src_dir` and `snapshot` refer to the same SSH
     server.
     """
-    p = subprocess.run(
-        src_dir.openssh_cmd(["btrfs", "subvolume", "snapshot", "-r", src_dir.path, snapshot.path]),
-        check=check,
+    p = src_dir.run(
+        ["btrfs", "subvolume", "snapshot", "-r", src_dir.path, snapshot.path], check=check
     )
     return p.returncode, snapshot
 
@@ -250,8 +717,20 @@ def _btrfs_delete_subvolumes_local(*subvolumes: Path, check: bool = True) -> tup
     The `check arg is passed along to `subprocess.run()`. Returns a pair
     containing the 'btrfs subvolume delete' commands returncode, and a list of all
     the deleted subvolumes (a list of Paths).
+
+    Subvolumes are deleted with an ioctl when possible, and any that fail are
+    handed to 'btrfs subvolume delete' in a single command.
     """
-    p = subprocess.run(["btrfs", "subvolume", "delete", *subvolumes], check=check)
+    remaining = []
+    for subvolume in subvolumes:
+        try:
+            btrfsioctl.delete_subvolume(subvolume)
+        except OSError as exc:
+            logger.debug(f"btrfs delete ioctl failed, falling back to btrfs-progs: {exc}")
+            remaining.append(subvolume)
+    if not remaining:
+        return 0, list(subvolumes)
+    p = subprocess.run(["btrfs", "subvolume", "delete", *remaining], check=check)
     return p.returncode, list(subvolumes)
 
 
@@ -266,105 +745,248 @@ def _btrfs_delete_subvolumes_remote(
     Note that it is assumed that all the SSHTargets in `subvolumes` refer to
     the same SSH server.
     """
-    p = subprocess.run(
-        subvolumes[0].openssh_cmd(
-            ["btrfs", "subvolume", "delete", *(subvolume.path for subvolume in subvolumes)]
-        ),
+    p = subvolumes[0].run(
+        ["btrfs", "subvolume", "delete", *(subvolume.path for subvolume in subvolumes)],
         check=check,
     )
     return p.returncode, list(subvolumes)
 
 
+def _btrfs_commit_local(path: Path) -> None:
+    """Commit the btrfs filesystem that `path` is on, so that the subvolumes
+    deleted on it so far are committed, like 'btrfs subvolume delete --commit-after'.
+    Uses an ioctl when possible, and 'btrfs filesystem sync' otherwise.
+    """
+    try:
+        btrfsioctl.commit(path)
+        return
+    except OSError as exc:
+        logger.debug(f"btrfs sync ioctl failed, falling back to btrfs-progs: {exc}")
+    subprocess.run(["btrfs", "filesystem", "sync", path], check=True)
+
+
+def _btrfs_commit_remote(sshtarget: SSHTarget) -> None:
+    """Like `_btrfs_commit_local()`, for the filesystem of the remote `sshtarget`."""
+    sshtarget.run(["btrfs", "filesystem", "sync", sshtarget.path], check=True)
+
+
 def _btrfs_send_receive_local_to_local(
-    snapshot: Path, dst_dir: Path, parent: Path | None = None, check: bool = True
+    snapshot: Path,
+    dst_dir: Path,
+    parent: Path | None = None,
+    clone_sources: ty.Sequence[Path] = (),
+    send_opts: ty.Sequence[str] = (),
+    check: bool = True,
 ) -> tuple[int, Path]:
     """Perform a btrfs send/receive sending the local snapshot `snapshot` to the
     directory `dst_dir`. If supplied a `parent` arg, then uses btrfs to send
-    '-p parent' for an incremental backup. Passes along `check` to `subprocess.run()`.
+    '-p parent' for an incremental backup. Each of `clone_sources` is passed to
+    btrfs send with '-c', and `send_opts` are passed to btrfs send as they are
+    (see `_btrfs_send_opts()`). Passes along `check` to `run_pipeline()`.
     """
-    parent_opt = "" if parent is None else f"-p {shlex.quote(str(parent))}"
-    p = subprocess.run(
-        f"btrfs send {parent_opt} {shlex.quote(str(snapshot))}"
-        f" | btrfs receive {shlex.quote(str(dst_dir))}",
-        shell=True,
-        check=check,
-    )
-    return p.returncode, dst_dir.joinpath(snapshot.name)
+    send_cmd: list[str | Path] = ["btrfs", "send", *send_opts]
+    if parent is not None:
+        send_cmd += ["-p", parent]
+    for clone_source in clone_sources:
+        send_cmd += ["-c", clone_source]
+    send_cmd.append(snapshot)
+    result = run_pipeline(send_cmd, ["btrfs", "receive", dst_dir], check=check)
+    _btrfs_log_transfer(snapshot.name, result)
+    return result.returncode, dst_dir.joinpath(snapshot.name)
 
 
 def _btrfs_send_receive_local_to_remote(
-    snapshot: Path, dst_dir: SSHTarget, parent: Path | None = None, check: bool = True
+    snapshot: Path,
+    dst_dir: SSHTarget,
+    parent: Path | None = None,
+    clone_sources: ty.Sequence[Path] = (),
+    send_opts: ty.Sequence[str] = (),
+    check: bool = True,
 ) -> tuple[int, SSHTarget]:
     """Perform a btrfs send/receive sending the local snapshot `snapshot` to the
     remote SSHTarger `dst_dir`. If supplied a 'parent' arg, then uses btrfs send
-    '-p parent' for an incremental backup. Passes along `check` to `subprocess.run()`.
+    '-p parent' for an incremental backup. Each of `clone_sources` is passed to
+    btrfs send with '-c', and `send_opts` are passed to btrfs send as they are.
+    Passes along `check` to `run_pipeline()`. The stream is compressed according
+    to the transport settings of `dst_dir`.
     """
-    parent_opt = "" if parent is None else f"-p {shlex.quote(str(parent))}"
-    cmd_local = f"btrfs send {parent_opt} {shlex.quote(str(snapshot))}"
-    cmd_remote = dst_dir.openssh_cmd(["btrfs", "receive", dst_dir.path], string=True)
-    p = subprocess.run(
-        cmd_local + " | " + cmd_remote,
-        shell=True,
-        check=check,
-    )
-    return p.returncode, dst_dir.with_path(dst_dir.path.joinpath(snapshot.name))
+    send_cmd: list[str | Path] = ["btrfs", "send", *send_opts]
+    if parent is not None:
+        send_cmd += ["-p", parent]
+    for clone_source in clone_sources:
+        send_cmd += ["-c", clone_source]
+    send_cmd.append(snapshot)
+    receive_cmd: list[str | Path] = ["btrfs", "receive", dst_dir.path]
+    target, compressor = transport.transfer_settings(dst_dir, local_dir=snapshot)
+    if compressor is None:
+        result = run_pipeline(send_cmd, target.openssh_cmd(receive_cmd), check=check)
+    else:
+        result = run_pipeline(
+            send_cmd,
+            compressor.compress_cmd(),
+            target.openssh_cmd(pipefail_sh(compressor.decompress_cmd(), receive_cmd)),
+            check=check,
+        )
+    _btrfs_log_transfer(snapshot.name, result)
+    return result.returncode, dst_dir.with_path(dst_dir.path.joinpath(snapshot.name))
 
 
 def _btrfs_send_receive_remote_to_local(
-    snapshot: SSHTarget, dst_dir: Path, parent: SSHTarget | None = None, check: bool = True
+    snapshot: SSHTarget,
+    dst_dir: Path,
+    parent: SSHTarget | None = None,
+    clone_sources: ty.Sequence[SSHTarget] = (),
+    send_opts: ty.Sequence[str] = (),
+    check: bool = True,
 ) -> tuple[int, Path]:
     """Perform a btrfs send/receive sending the remote snapshot `snapshot` to the
     local dir `dst_dir`. If supplied a `parent` arg, then uses btrfs send
-    '-p parent' for an incremental backup. Passes along `check` to `subprocess.run()`.
+    '-p parent' for an incremental backup. Each of `clone_sources` is passed to
+    btrfs send with '-c', and `send_opts` are passed to btrfs send as they are.
+    Passes along `check` to `run_pipeline()`.
 
-    Note that if `parent` is supplied, then it is assumed to be an SSHTarget
-    refering to the same SSH server as `snapshot`.
+    Note that if `parent` or `clone_sources` are supplied, then they are assumed
+    to be SSHTargets refering to the same SSH server as `snapshot`. The stream is
+    compressed according to the transport settings of `snapshot`.
     """
-    send_cmd: list[str | Path] = ["btrfs", "send"]
+    send_cmd: list[str | Path] = ["btrfs", "send", *send_opts]
     if parent is not None:
         send_cmd += ["-p", parent.path]
+    for clone_source in clone_sources:
+        send_cmd += ["-c", clone_source.path]
     send_cmd.append(snapshot.path)
-    cmd_remote = snapshot.openssh_cmd(send_cmd, string=True)
-    p = subprocess.run(
-        cmd_remote + " | " + f"btrfs receive {shlex.quote(str(dst_dir))}",
-        shell=True,
-        check=check,
-    )
-    return p.returncode, dst_dir.joinpath(snapshot.path.name)
+    receive_cmd: list[str | Path] = ["btrfs", "receive", dst_dir]
+    target, compressor = transport.transfer_settings(snapshot)
+    if compressor is None:
+        result = run_pipeline(target.openssh_cmd(send_cmd), receive_cmd, check=check)
+    else:
+        result = run_pipeline(
+            target.openssh_cmd(pipefail_sh(send_cmd, compressor.compress_cmd())),
+            compressor.decompress_cmd(),
+            receive_cmd,
+            check=check,
+        )
+    _btrfs_log_transfer(snapshot.path.name, result)
+    return result.returncode, dst_dir.joinpath(snapshot.path.name)
+
+
+def _btrfs_send_features(sshtarget: SSHTarget | None = None) -> frozenset[str]:
+    """Return which of 'send' and 'receive' support send stream version 2 with
+    compressed data on the local host, or on the host of `sshtarget`. Sending
+    needs a kernel with send stream version 2 and a 'btrfs send' that knows
+    '--compressed-data', receiving needs a 'btrfs receive' that knows version 2
+    streams (btrfs-progs 6.0). Results are cached per host for a day.
+    """
+    key = () if sshtarget is None else (sshtarget.user, sshtarget.host, sshtarget.port)
+    with _send_features_cache_lock:
+        cached = _send_features_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < _SEND_FEATURES_CACHE_SECONDS:
+            return cached[1]
+        cmd: list[str | Path] = ["sh", "-c", _SEND_FEATURES_SCRIPT]
+        if sshtarget is not None:
+            cmd = sshtarget.openssh_cmd(cmd)
+        p = subprocess.run(cmd, check=False, capture_output=True, encoding="utf-8")
+        features = frozenset(p.stdout.split()) if p.returncode == 0 else frozenset()
+        _send_features_cache[key] = (time.monotonic(), features)
+    return features
+
+
+def _btrfs_send_opts(backup: bckp.Backup) -> list[str]:
+    """Return the extra options to pass to btrfs send for `backup`. If the backup
+    has the 'btrfs_send_compressed_data' setting, and both the sending and the
+    receiving side support it, then these select send stream version 2 with
+    compressed data passed through. Otherwise no extra options are needed.
+    """
+    if not getattr(backup.backend, "send_compressed_data", False):
+        return []
+    src_dir = backup.src_dir
+    dst_dir = backup.dst_dir
+    sender = _btrfs_send_features(src_dir if isinstance(src_dir, SSHTarget) else None)
+    receiver = _btrfs_send_features(dst_dir if isinstance(dst_dir, SSHTarget) else None)
+    if "send" in sender and "receive" in receiver:
+        return list(_SEND_V2_OPTS)
+    logger.info(f"btrfs send stream version 2 is unsupported for backup '{backup.name}'")
+    return []
+
+
+def _btrfs_log_transfer(name: str, result: PipelineResult) -> None:
+    if result.returncode == 0:
+        logger.info(f"btrfs sent '{name}': {result.describe()}")
+    else:
+        stage = result.stages[result.failed_stage or 0]
+        logger.error(f"btrfs send/receive of '{name}' failed in '{' '.join(map(str, stage.cmd))}'")
 
 
 def _btrfs_maybe_refresh_bootstrap(backup: bckp.Backup, refresh_days: int) -> None:
-    """Delete stale bootstrap snapshots so they get recreated fresh.
+    """Refresh stale bootstrap snapshots.
 
     Checks if the src bootstrap snapshot is older than `refresh_days` days.
-    If so, deletes both src and dst bootstrap snapshots. The existing
-    _btrfs_bootstrap_* functions handle the "neither exists" case by
-    recreating both.
+    If so, a new bootstrap snapshot is taken and sent incrementally on top of
+    the newest snapshot common to both sides. The new pair is swapped in place
+    of the old pair, and only then is the old pair deleted, so a refresh costs a
+    single delta.
+
+    If there is no common snapshot to send on top of, then both the src and dst
+    bootstrap snapshots are deleted, along with the src rolling parent
+    snapshots. The existing _btrfs_bootstrap_* functions handle the "neither
+    exists" case by recreating both.
     """
     basename = _btrfs_bootstrap_snapshot_basename(backup.name)
     src_dir = backup.src_dir
-    dst_dir = backup.dst_dir
     if isinstance(src_dir, SSHTarget):
-        src_bootstrap_path = src_dir.path.joinpath(basename)
-        src_bootstrap_target = src_dir.with_path(src_bootstrap_path)
-        if not src_bootstrap_target.is_dir():
+        # A single probe tells both whether the snapshot exists and its age.
+        age_probe = Probe("age", src_dir.path.joinpath(basename))
+        age = src_dir.probe([age_probe])[age_probe]
+        if age is None:
             return
-        stale = src_bootstrap_target.is_older_than(refresh_days)
     else:
         src_bootstrap_path = src_dir.joinpath(basename)
         if not src_bootstrap_path.is_dir():
             return
-        stale = time.time() - src_bootstrap_path.stat().st_mtime > refresh_days * 86400
+        age = time.time() - src_bootstrap_path.stat().st_mtime
+    stale = age > refresh_days * 86400
     if not stale:
         return
     logger.info(f"refreshing btrfs bootstrap snapshot for backup '{backup.name}'")
+    if backup.backup_type == "local_to_local":
+        refreshed = _btrfs_refresh_bootstrap_local_to_local(backup)
+    elif backup.backup_type == "local_to_remote":
+        refreshed = _btrfs_refresh_bootstrap_local_to_remote(backup)
+    else:
+        refreshed = _btrfs_refresh_bootstrap_remote_to_local(backup)
+    if not refreshed:
+        logger.info(f"no common snapshot for backup '{backup.name}', bootstrapping from scratch")
+        _btrfs_delete_bootstrap(backup)
+
+
+def _btrfs_delete_bootstrap(backup: bckp.Backup) -> None:
+    """Delete the src and dst bootstrap snapshots of `backup`, along with the src
+    rolling parent snapshots so that the next send cannot chain off of them.
+    """
+    basename = _btrfs_bootstrap_snapshot_basename(backup.name)
+    parent_pattern = _btrfs_parent_snapshot_prefix(backup.name) + "*"
+    src_dir = backup.src_dir
+    dst_dir = backup.dst_dir
     if isinstance(src_dir, SSHTarget):
-        _btrfs_delete_subvolumes_remote(src_bootstrap_target)
+        src_subvolumes = [
+            src_dir.with_path(src_dir.path.joinpath(name))
+            for name in _btrfs_subvolume_uuids_remote(src_dir, [basename, parent_pattern])
+            if name == basename or _btrfs_is_parent_snapshot(backup, name)
+        ]
+        if src_subvolumes:
+            _btrfs_delete_subvolumes_remote(*src_subvolumes)
     else:
-        _btrfs_delete_subvolumes_local(src_bootstrap_path)
+        src_subvolumes = [
+            path
+            for pattern in [basename, parent_pattern]
+            for path in src_dir.glob(pattern)
+            if path.name == basename or _btrfs_is_parent_snapshot(backup, path.name)
+        ]
+        if src_subvolumes:
+            _btrfs_delete_subvolumes_local(*src_subvolumes)
     if isinstance(dst_dir, SSHTarget):
         dst_bootstrap_target = dst_dir.with_path(dst_dir.path.joinpath(basename))
-        if dst_bootstrap_target.is_dir():
+        if _btrfs_remote_is_dir(dst_bootstrap_target):
             _btrfs_delete_subvolumes_remote(dst_bootstrap_target)
     else:
         dst_bootstrap_path = dst_dir.joinpath(basename)
@@ -372,6 +994,173 @@ def _btrfs_maybe_refresh_bootstrap(backup: bckp.Backup, refresh_days: int) -> No
             _btrfs_delete_subvolumes_local(dst_bootstrap_path)
 
 
+def _btrfs_refresh_bootstrap_local_to_local(backup: bckp.Backup) -> bool:
+    """Incrementally refresh the bootstrap snapshots of the local-to-local `backup`.
+    Returns False if there is no common snapshot to send the new bootstrap
+    snapshot on top of, otherwise returns True.
+    """
+    assert isinstance(backup.src_dir, Path)
+    assert isinstance(backup.dst_dir, Path)
+    src_dir = backup.src_dir
+    dst_dir = backup.dst_dir
+    src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+    parent = _btrfs_find_common_parent(
+        backup,
+        _btrfs_subvolume_uuids_local(src_dir, src_patterns),
+        _btrfs_subvolume_uuids_local(dst_dir, dst_patterns),
+    )
+    if parent is None:
+        return False
+    basename = _btrfs_bootstrap_snapshot_basename(backup.name)
+    staging_basename = _btrfs_staging_snapshot_basename()
+    src_staging = src_dir.joinpath(staging_basename)
+    dst_staging = dst_dir.joinpath(staging_basename)
+    try:
+        _btrfs_take_snapshot_local(src_dir, src_staging)
+        _btrfs_send_receive_local_to_local(
+            src_staging,
+            dst_dir,
+            parent=src_dir.joinpath(parent),
+            send_opts=_btrfs_send_opts(backup),
+        )
+    except Exception:
+        for staging in [src_staging, dst_staging]:
+            if staging.is_dir():
+                _btrfs_delete_subvolumes_local(staging)
+        raise
+    _btrfs_swap_subvolume_local(dst_staging, dst_dir.joinpath(basename))
+    _btrfs_swap_subvolume_local(src_staging, src_dir.joinpath(basename))
+    old_pair = [staging for staging in [src_staging, dst_staging] if staging.is_dir()]
+    if old_pair:
+        _btrfs_delete_subvolumes_local(*old_pair, check=False)
+    return True
+
+
+def _btrfs_refresh_bootstrap_local_to_remote(backup: bckp.Backup) -> bool:
+    """Incrementally refresh the bootstrap snapshots of the local-to-remote `backup`.
+    See `_btrfs_refresh_bootstrap_local_to_local()` for more details.
+    """
+    assert isinstance(backup.src_dir, Path)
+    assert isinstance(backup.dst_dir, SSHTarget)
+    src_dir = backup.src_dir
+    dst_dir = backup.dst_dir
+    src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+    parent = _btrfs_find_common_parent(
+        backup,
+        _btrfs_subvolume_uuids_local(src_dir, src_patterns),
+        _btrfs_subvolume_uuids_remote(dst_dir, dst_patterns),
+    )
+    if parent is None:
+        return False
+    basename = _btrfs_bootstrap_snapshot_basename(backup.name)
+    staging_basename = _btrfs_staging_snapshot_basename()
+    src_staging = src_dir.joinpath(staging_basename)
+    dst_staging = dst_dir.with_path(dst_dir.path.joinpath(staging_basename))
+    try:
+        _btrfs_take_snapshot_local(src_dir, src_staging)
+        _btrfs_send_receive_local_to_remote(
+            src_staging,
+            dst_dir,
+            parent=src_dir.joinpath(parent),
+            send_opts=_btrfs_send_opts(backup),
+        )
+    except Exception:
+        if src_staging.is_dir():
+            _btrfs_delete_subvolumes_local(src_staging)
+        if dst_staging.is_dir():
+            _btrfs_delete_subvolumes_remote(dst_staging)
+        raise
+    _btrfs_swap_subvolume_remote(dst_staging, dst_dir.with_path(dst_dir.path.joinpath(basename)))
+    _btrfs_swap_subvolume_local(src_staging, src_dir.joinpath(basename))
+    if src_staging.is_dir():
+        _btrfs_delete_subvolumes_local(src_staging, check=False)
+    if dst_staging.is_dir():
+        _btrfs_delete_subvolumes_remote(dst_staging, check=False)
+    return True
+
+
+def _btrfs_refresh_bootstrap_remote_to_local(backup: bckp.Backup) -> bool:
+    """Incrementally refresh the bootstrap snapshots of the remote-to-local `backup`.
+    See `_btrfs_refresh_bootstrap_local_to_local()` for more details.
+    """
+    assert isinstance(backup.src_dir, SSHTarget)
+    assert isinstance(backup.dst_dir, Path)
+    src_dir = backup.src_dir
+    dst_dir = backup.dst_dir
+    src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+    parent = _btrfs_find_common_parent(
+        backup,
+        _btrfs_subvolume_uuids_remote(src_dir, src_patterns),
+        _btrfs_subvolume_uuids_local(dst_dir, dst_patterns),
+    )
+    if parent is None:
+        return False
+    basename = _btrfs_bootstrap_snapshot_basename(backup.name)
+    staging_basename = _btrfs_staging_snapshot_basename()
+    src_staging = src_dir.with_path(src_dir.path.joinpath(staging_basename))
+    dst_staging = dst_dir.joinpath(staging_basename)
+    try:
+        _btrfs_take_snapshot_remote(src_dir, src_staging)
+        _btrfs_send_receive_remote_to_local(
+            src_staging,
+            dst_dir,
+            parent=src_dir.with_path(src_dir.path.joinpath(parent)),
+            send_opts=_btrfs_send_opts(backup),
+        )
+    except Exception:
+        if src_staging.is_dir():
+            _btrfs_delete_subvolumes_remote(src_staging)
+        if dst_staging.is_dir():
+            _btrfs_delete_subvolumes_local(dst_staging)
+        raise
+    _btrfs_swap_subvolume_local(dst_staging, dst_dir.joinpath(basename))
+    _btrfs_swap_subvolume_remote(src_staging, src_dir.with_path(src_dir.path.joinpath(basename)))
+    if src_staging.is_dir():
+        _btrfs_delete_subvolumes_remote(src_staging, check=False)
+    if dst_staging.is_dir():
+        _btrfs_delete_subvolumes_local(dst_staging, check=False)
+    return True
+
+
+def _btrfs_swap_subvolume_local(subvolume: Path, target: Path) -> None:
+    """Move the local `subvolume` to `target`. If `target` already exists, then
+    the two are atomically exchanged with renameat2(2), so that afterwards
+    `subvolume` refers to what used to be `target`. If renameat2(2) is not
+    available, then the exchange is emulated with three renames.
+    """
+    if not target.exists():
+        subvolume.rename(target)
+        return
+    renameat2 = getattr(ctypes.CDLL(None, use_errno=True), "renameat2", None)
+    if renameat2 is not None:
+        if renameat2(_AT_FDCWD, os.fsencode(subvolume), _AT_FDCWD, os.fsencode(target), 2) == 0:
+            return
+        logger.debug(f"renameat2 failed: {os.strerror(ctypes.get_errno())}")
+    tmp = subvolume.with_name(_btrfs_staging_snapshot_basename())
+    target.rename(tmp)
+    subvolume.rename(target)
+    tmp.rename(subvolume)
+
+
+def _btrfs_swap_subvolume_remote(subvolume: SSHTarget, target: SSHTarget) -> None:
+    """Like `_btrfs_swap_subvolume_local()` but for a remote `subvolume` and
+    `target` on the same SSH server. Uses 'mv --exchange' where available.
+    """
+    tmp = target.path.with_name(_btrfs_staging_snapshot_basename())
+    script = (
+        'if [ -e "$2" ]; then mv --exchange -- "$1" "$2" 2>/dev/null'
+        ' || { mv -- "$2" "$3" && mv -- "$1" "$2" && mv -- "$3" "$1"; };'
+        ' else mv -- "$1" "$2"; fi'
+    )
+    subvolume.run(["sh", "-c", script, "sh", subvolume.path, target.path, tmp], check=True)
+
+
+def _btrfs_remote_is_dir(target: SSHTarget) -> bool:
+    """Return True if `target.path` is a directory, probing it with `SSHTarget.probe()`."""
+    probe = Probe("is_dir", target.path)
+    return bool(target.probe([probe])[probe])
+
+
 def _btrfs_bootstrap_snapshot_basename(backup_name: str) -> str:
     """Return the basename of a btrfs bootstrap snapshot."""
     return f".yaesm-btrfs-bootstrap-snapshot-{backup_name}"
@@ -388,14 +1177,20 @@ def _btrfs_bootstrap_local_to_local(src_dir: Path, dst_dir: Path, backup: bckp.B
     dst_bootstrap_exists = dst_bootstrap.is_dir()
     if not src_bootstrap_exists and not dst_bootstrap_exists:
         _btrfs_take_snapshot_local(src_dir, src_bootstrap)
-        _btrfs_send_receive_local_to_local(src_bootstrap, dst_dir)
+        _btrfs_send_receive_local_to_local(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     elif src_bootstrap_exists and not dst_bootstrap_exists:
-        _btrfs_send_receive_local_to_local(src_bootstrap, dst_dir)
+        _btrfs_send_receive_local_to_local(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     elif not src_bootstrap_exists and dst_bootstrap_exists:
         # TODO: should log here, something weird is going on
         _btrfs_delete_subvolumes_local(dst_bootstrap)
         _btrfs_take_snapshot_local(src_dir, src_bootstrap)
-        _btrfs_send_receive_local_to_local(src_bootstrap, dst_dir)
+        _btrfs_send_receive_local_to_local(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     else:
         pass  # already bootstrapped
     return src_bootstrap
@@ -413,17 +1208,23 @@ def _btrfs_bootstrap_local_to_remote(
         dst_dir.path.joinpath(_btrfs_bootstrap_snapshot_basename(backup.name))
     )
     src_bootstrap_exists = src_bootstrap.is_dir()
-    dst_bootstrap_exists = dst_bootstrap.is_dir()
+    dst_bootstrap_exists = _btrfs_remote_is_dir(dst_bootstrap)
     if not src_bootstrap_exists and not dst_bootstrap_exists:
         _btrfs_take_snapshot_local(src_dir, src_bootstrap)
-        _btrfs_send_receive_local_to_remote(src_bootstrap, dst_dir)
+        _btrfs_send_receive_local_to_remote(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     elif src_bootstrap_exists and not dst_bootstrap_exists:
-        _btrfs_send_receive_local_to_remote(src_bootstrap, dst_dir)
+        _btrfs_send_receive_local_to_remote(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     elif not src_bootstrap_exists and dst_bootstrap_exists:
         # TODO: should log here, something weird is going on
         _btrfs_delete_subvolumes_remote(dst_bootstrap)
         _btrfs_take_snapshot_local(src_dir, src_bootstrap)
-        _btrfs_send_receive_local_to_remote(src_bootstrap, dst_dir)
+        _btrfs_send_receive_local_to_remote(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     else:
         pass  # already bootstrapped
     return src_bootstrap
@@ -440,26 +1241,518 @@ def _btrfs_bootstrap_remote_to_local(
         src_dir.path.joinpath(_btrfs_bootstrap_snapshot_basename(backup.name))
     )
     dst_bootstrap = dst_dir.joinpath(_btrfs_bootstrap_snapshot_basename(backup.name))
-    src_bootstrap_exists = src_bootstrap.is_dir()
+    src_bootstrap_exists = _btrfs_remote_is_dir(src_bootstrap)
     dst_bootstrap_exists = dst_bootstrap.is_dir()
     if not src_bootstrap_exists and not dst_bootstrap_exists:
         _btrfs_take_snapshot_remote(src_dir, src_bootstrap)
-        _btrfs_send_receive_remote_to_local(src_bootstrap, dst_dir)
+        _btrfs_send_receive_remote_to_local(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     elif src_bootstrap_exists and not dst_bootstrap_exists:
-        _btrfs_send_receive_remote_to_local(src_bootstrap, dst_dir)
+        _btrfs_send_receive_remote_to_local(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     elif not src_bootstrap_exists and dst_bootstrap_exists:
         # TODO: should log here, something weird is going on
         _btrfs_delete_subvolumes_local(dst_bootstrap)
         _btrfs_take_snapshot_remote(src_dir, src_bootstrap)
-        _btrfs_send_receive_remote_to_local(src_bootstrap, dst_dir)
+        _btrfs_send_receive_remote_to_local(
+            src_bootstrap, dst_dir, send_opts=_btrfs_send_opts(backup)
+        )
     else:
         pass  # already bootstrapped
     return src_bootstrap
 
 
+@dataclasses.dataclass(frozen=True)
+class _BtrfsSubvolumeUUIDs:
+    """The UUID and received UUID of a btrfs subvolume. A received UUID of None
+    means the subvolume was not created by 'btrfs receive'.
+    """
+
+    uuid: str
+    received_uuid: str | None
+
+
+def _btrfs_spool_resumable(
+    manifest: btrfsspool.SpoolManifest,
+    chunk_size: int,
+    send_opts: ty.Sequence[str],
+    snapshot_basename: str,
+    src_uuids: dict[str, _BtrfsSubvolumeUUIDs],
+    dst_uuids: dict[str, _BtrfsSubvolumeUUIDs],
+) -> bool:
+    """Return True if the spool described by `manifest` can be resumed. That is
+    the case if its src snapshot and parent still exist, its parent still has a
+    received copy on the destination, and the chunk size and send options are
+    still `chunk_size` and `send_opts`.
+    """
+    if manifest.chunk_size != chunk_size or list(manifest.send_opts) != list(send_opts):
+        return False
+    snapshot = src_uuids.get(snapshot_basename)
+    if snapshot is None or snapshot.uuid != manifest.snapshot_uuid:
+        return False
+    if manifest.parent is None:
+        return True
+    parent = src_uuids.get(manifest.parent)
+    return (
+        parent is not None
+        and parent.uuid == manifest.parent_uuid
+        and any(dst.received_uuid == parent.uuid for dst in dst_uuids.values())
+    )
+
+
+def _btrfs_parent_snapshot_prefix(backup_name: str) -> str:
+    """Return the basename prefix of the source side rolling parent snapshots
+    for the backup named `backup_name`.
+    """
+    return f".yaesm-btrfs-parent-snapshot-yaesm-{backup_name}-"
+
+
+def _btrfs_parent_snapshot_basename(backup_basename: str) -> str:
+    """Return the basename of the source side rolling parent snapshot that
+    corresponds to the backup `backup_basename` on the destination.
+    """
+    return f".yaesm-btrfs-parent-snapshot-{backup_basename}"
+
+
+def _btrfs_is_parent_snapshot(backup: bckp.Backup, name: str) -> bool:
+    """Return True if `name` is the basename of a source side rolling parent
+    snapshot of `backup`.
+    """
+    # the timeframe is checked too, or the parent snapshots of a backup named
+    # '<name>-x' would match as well
+    match = bckp.backup_basename_re(backup=backup).match(
+        name.removeprefix(".yaesm-btrfs-parent-snapshot-")
+    )
+    return (
+        name.startswith(_btrfs_parent_snapshot_prefix(backup.name))
+        and match is not None
+        and match.group(2) in tframe_types(names=True)
+    )
+
+
+def _btrfs_parse_subvolume_show(output: str) -> _BtrfsSubvolumeUUIDs | None:
+    """Parse the output of 'btrfs subvolume show' into a `_BtrfsSubvolumeUUIDs`."""
+    uuid_match = re.search(r"^\s*UUID:\s*(\S+)", output, re.MULTILINE)
+    if uuid_match is None:
+        return None
+    received_match = re.search(r"^\s*Received UUID:\s*(\S+)", output, re.MULTILINE)
+    received_uuid = None if received_match is None else received_match.group(1)
+    return _BtrfsSubvolumeUUIDs(
+        uuid_match.group(1), None if received_uuid == "-" else received_uuid
+    )
+
+
+def _btrfs_parse_subvolume_list(output: str) -> dict[int, _BtrfsSubvolumeUUIDs]:
+    """Parse the output of 'btrfs subvolume list -u -R' into a dict mapping the
+    ids of the subvolumes it lists to their `_BtrfsSubvolumeUUIDs`.
+    """
+    subvolumes = {}
+    for line in output.splitlines():
+        id_match = re.match(r"ID\s+(\d+)\b", line)
+        uuid_match = re.search(r"\buuid\s+([0-9a-f-]{36})\b", line)
+        if id_match is None or uuid_match is None:
+            continue
+        received_match = re.search(r"\breceived_uuid\s+([0-9a-f-]{36})\b", line)
+        received_uuid = None if received_match is None else received_match.group(1)
+        if received_uuid == "00000000-0000-0000-0000-000000000000":
+            received_uuid = None
+        subvolumes[int(id_match.group(1))] = _BtrfsSubvolumeUUIDs(
+            uuid_match.group(1), received_uuid
+        )
+    return subvolumes
+
+
+def _btrfs_subvolume_uuids_local(
+    directory: Path, patterns: list[str]
+) -> dict[str, _BtrfsSubvolumeUUIDs]:
+    """Return a dict mapping the basenames of the subvolumes in `directory` that
+    match any of the glob `patterns` to their `_BtrfsSubvolumeUUIDs`.
+
+    The subvolumes are inspected with the GET_SUBVOL_INFO ioctl. On kernels
+    without it, a single 'btrfs subvolume list -u -R' lists the subvolumes,
+    which are matched up by their subvolume ids.
+    """
+    uuids = {}
+    ids: dict[int, str] = {}
+    for pattern in patterns:
+        for path in directory.glob(pattern):
+            if path.name in uuids or path.name in ids.values() or not path.is_dir():
+                continue
+            try:
+                info = btrfsioctl.subvolume_info(path)
+                uuids[path.name] = _BtrfsSubvolumeUUIDs(info.uuid, info.received_uuid)
+                continue
+            except OSError as exc:
+                if exc.errno == errno.EINVAL:
+                    continue  # not a subvolume
+            try:
+                ids[btrfsioctl.subvolume_id(path)] = path.name
+            except OSError:
+                continue
+    if ids:
+        p = subprocess.run(
+            ["btrfs", "subvolume", "list", "-o", "-u", "-R", directory],
+            check=False,
+            capture_output=True,
+            encoding="utf-8",
+        )
+        if p.returncode == 0:
+            for subvolume_id, subvolume in _btrfs_parse_subvolume_list(p.stdout).items():
+                if subvolume_id in ids:
+                    uuids[ids[subvolume_id]] = subvolume
+    return uuids
+
+
+def _btrfs_subvolume_uuids_remote(
+    directory: SSHTarget, patterns: list[str]
+) -> dict[str, _BtrfsSubvolumeUUIDs]:
+    """Like `_btrfs_subvolume_uuids_local()` but for the remote directory
+    `directory`. All the subvolumes are inspected with a single SSH command.
+    """
+    script = (
+        'cd "$1" || exit 1; shift; for pattern in "$@"; do for d in $pattern; do '
+        '[ -d "$d" ] || continue; printf "\\0%s\\n" "$d"; '
+        'btrfs subvolume show -- "$d" 2>/dev/null; done; done'
+    )
+    p = directory.run(
+        ["sh", "-c", script, "sh", directory.path, *patterns],
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    )
+    uuids = {}
+    for record in p.stdout.split("\0")[1:]:
+        name, _, output = record.partition("\n")
+        if subvolume := _btrfs_parse_subvolume_show(output):
+            uuids.setdefault(name, subvolume)
+    return uuids
+
+
+def _btrfs_parent_candidates(
+    backup: bckp.Backup, src_subvolumes: dict[str, _BtrfsSubvolumeUUIDs]
+) -> list[str]:
+    """Return the basenames of the source side snapshots in `src_subvolumes` that
+    may serve as the parent of an incremental send for `backup`, ordered from
+    most to least preferred. Rolling parent snapshots come newest first, followed
+    by the bootstrap snapshot.
+    """
+    parents = [name for name in src_subvolumes if _btrfs_is_parent_snapshot(backup, name)]
+    parents.sort(
+        key=lambda name: bckp.backup_to_datetime(
+            name.removeprefix(".yaesm-btrfs-parent-snapshot-")
+        ),
+        reverse=True,
+    )
+    bootstrap = _btrfs_bootstrap_snapshot_basename(backup.name)
+    if bootstrap in src_subvolumes:
+        parents.append(bootstrap)
+    return parents
+
+
+def _btrfs_find_common_parent(
+    backup: bckp.Backup,
+    src_subvolumes: dict[str, _BtrfsSubvolumeUUIDs],
+    dst_subvolumes: dict[str, _BtrfsSubvolumeUUIDs],
+) -> str | None:
+    """Return the basename of the newest source side snapshot in `src_subvolumes`
+    that has been received on the destination, meaning some subvolume in
+    `dst_subvolumes` has a received UUID equal to its UUID. Returns None if there
+    is no such snapshot.
+    """
+    received = {
+        subvolume.received_uuid
+        for subvolume in dst_subvolumes.values()
+        if subvolume.received_uuid is not None
+    }
+    for name in _btrfs_parent_candidates(backup, src_subvolumes):
+        if src_subvolumes[name].uuid in received:
+            return name
+    return None
+
+
+def _btrfs_parent_patterns(backup: bckp.Backup) -> tuple[list[str], list[str]]:
+    """Return a pair containing the glob patterns matching the source side and
+    destination side subvolumes that take part in parent selection for `backup`.
+    """
+    bootstrap = _btrfs_bootstrap_snapshot_basename(backup.name)
+    src_patterns = [bootstrap, _btrfs_parent_snapshot_prefix(backup.name) + "*"]
+    dst_patterns = [bootstrap, f"yaesm-{backup.name}-*"]
+    return src_patterns, dst_patterns
+
+
+def _btrfs_incremental_parent_local_to_local(
+    src_dir: Path, dst_dir: Path, backup: bckp.Backup
+) -> Path:
+    """Return the parent snapshot to use for an incremental local-to-local send.
+
+    This is the newest source side snapshot that also exists on the destination.
+    If there is no such snapshot, then we fall back to bootstrapping.
+    """
+    src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+    parent = _btrfs_find_common_parent(
+        backup,
+        _btrfs_subvolume_uuids_local(src_dir, src_patterns),
+        _btrfs_subvolume_uuids_local(dst_dir, dst_patterns),
+    )
+    if parent is None:
+        return _btrfs_bootstrap_local_to_local(src_dir, dst_dir, backup)
+    logger.debug(f"using parent snapshot '{parent}' for backup '{backup.name}'")
+    return src_dir.joinpath(parent)
+
+
+def _btrfs_incremental_parent_local_to_remote(
+    src_dir: Path, dst_dir: SSHTarget, backup: bckp.Backup
+) -> Path:
+    """Return the parent snapshot to use for an incremental local-to-remote send.
+
+    See `_btrfs_incremental_parent_local_to_local()` for more details.
+    """
+    src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+    parent = _btrfs_find_common_parent(
+        backup,
+        _btrfs_subvolume_uuids_local(src_dir, src_patterns),
+        _btrfs_subvolume_uuids_remote(dst_dir, dst_patterns),
+    )
+    if parent is None:
+        return _btrfs_bootstrap_local_to_remote(src_dir, dst_dir, backup)
+    logger.debug(f"using parent snapshot '{parent}' for backup '{backup.name}'")
+    return src_dir.joinpath(parent)
+
+
+def _btrfs_incremental_parent_remote_to_local(
+    src_dir: SSHTarget, dst_dir: Path, backup: bckp.Backup
+) -> SSHTarget:
+    """Return the parent snapshot to use for an incremental remote-to-local send.
+
+    See `_btrfs_incremental_parent_local_to_local()` for more details.
+    """
+    src_patterns, dst_patterns = _btrfs_parent_patterns(backup)
+    parent = _btrfs_find_common_parent(
+        backup,
+        _btrfs_subvolume_uuids_remote(src_dir, src_patterns),
+        _btrfs_subvolume_uuids_local(dst_dir, dst_patterns),
+    )
+    if parent is None:
+        return _btrfs_bootstrap_remote_to_local(src_dir, dst_dir, backup)
+    logger.debug(f"using parent snapshot '{parent}' for backup '{backup.name}'")
+    return src_dir.with_path(src_dir.path.joinpath(parent))
+
+
+def _btrfs_clone_source_patterns() -> list[str]:
+    """Return the glob patterns matching the source side snapshots of any backup
+    that may serve as clone sources.
+    """
+    return [
+        _btrfs_bootstrap_snapshot_basename("*"),
+        _btrfs_parent_snapshot_basename("yaesm-*"),
+    ]
+
+
+def _btrfs_parse_received_uuids(output: str) -> set[str]:
+    """Parse the output of 'btrfs subvolume list -R' into the set of received
+    UUIDs of the subvolumes it lists.
+    """
+    return {
+        match.group(1)
+        for match in re.finditer(r"\breceived_uuid\s+([0-9a-f-]{36})\b", output)
+        if match.group(1) != "00000000-0000-0000-0000-000000000000"
+    }
+
+
+def _btrfs_received_uuids_local(directory: Path) -> set[str]:
+    """Return the received UUIDs of every subvolume on the btrfs filesystem
+    containing `directory`. These are the UUIDs of the source subvolumes that
+    'btrfs receive' into any directory on the filesystem can use as clone sources.
+    """
+    p = subprocess.run(
+        ["btrfs", "subvolume", "list", "-R", directory],
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    )
+    return _btrfs_parse_received_uuids(p.stdout)
+
+
+def _btrfs_received_uuids_remote(directory: SSHTarget) -> set[str]:
+    """Like `_btrfs_received_uuids_local()` but for the remote directory `directory`."""
+    p = directory.run(
+        ["btrfs", "subvolume", "list", "-R", directory.path],
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    )
+    return _btrfs_parse_received_uuids(p.stdout)
+
+
+def _btrfs_select_clone_sources(
+    subvolumes: dict[str, _BtrfsSubvolumeUUIDs], received_uuids: set[str], exclude: set[str]
+) -> list[str]:
+    """Return the basenames in `subvolumes` that are not in `exclude` and whose
+    UUID is in `received_uuids`, that is that are usable as clone sources.
+    """
+    return sorted(
+        name
+        for name, subvolume in subvolumes.items()
+        if name not in exclude and subvolume.uuid in received_uuids
+    )
+
+
+def _btrfs_clone_sources_local(
+    directories: list[Path], received_uuids: set[str], exclude: ty.Sequence[Path] = ()
+) -> list[Path]:
+    """Return the local source side snapshots in `directories` that have been
+    received on the destination, as identified by `received_uuids`, and so can
+    be passed to btrfs send as clone sources. Snapshots in `exclude` are left
+    out, and so are directories that are not on the same filesystem as the
+    first one, as btrfs send only accepts clone sources from the filesystem the
+    sent snapshot is on.
+    """
+    clone_sources: list[Path] = []
+    for directory in dict.fromkeys(directories):
+        try:
+            if not btrfsioctl.same_filesystem(directories[0], directory):
+                logger.warning(f"ignoring clone source dir on another filesystem: {directory}")
+                continue
+        except OSError as exc:
+            logger.warning(f"ignoring clone source dir {directory}: {exc}")
+            continue
+        subvolumes = _btrfs_subvolume_uuids_local(directory, _btrfs_clone_source_patterns())
+        names = _btrfs_select_clone_sources(
+            subvolumes, received_uuids, {p.name for p in exclude if p.parent == directory}
+        )
+        clone_sources += [directory.joinpath(name) for name in names]
+    logger.debug(f"using {len(clone_sources)} btrfs clone sources")
+    return clone_sources
+
+
+def _btrfs_filesystem_uuids_remote(
+    sshtarget: SSHTarget, paths: ty.Sequence[Path]
+) -> dict[Path, str | None]:
+    """Return a dict mapping each of the `paths` on the SSH server of `sshtarget`
+    to the fsid of the btrfs filesystem it is on, or None if it is missing or
+    not on btrfs. All the paths are inspected with a single SSH command.
+    """
+    script = (
+        'for d in "$@"; do printf "\\0%s\\n" "$d"; '
+        'findmnt -n -o FSTYPE,UUID --target "$d" 2>/dev/null; done; exit 0'
+    )
+    p = sshtarget.run(
+        ["sh", "-c", script, "sh", *paths], check=True, capture_output=True, encoding="utf-8"
+    )
+    fsids: dict[Path, str | None] = dict.fromkeys(paths)
+    for record in p.stdout.split("\0")[1:]:
+        path, _, output = record.partition("\n")
+        fields = output.split()
+        if len(fields) == 2 and fields[0] == "btrfs":
+            fsids[Path(path)] = fields[1]
+    return fsids
+
+
+def _btrfs_clone_sources_remote(
+    directories: list[SSHTarget], received_uuids: set[str], exclude: ty.Sequence[SSHTarget] = ()
+) -> list[SSHTarget]:
+    """Like `_btrfs_clone_sources_local()` but for the remote source side
+    `directories`, which must all refer to the same SSH server.
+    """
+    clone_sources: list[SSHTarget] = []
+    paths = list(dict.fromkeys(directory.path for directory in directories))
+    try:
+        fsids = _btrfs_filesystem_uuids_remote(directories[0], paths)
+    except subprocess.CalledProcessError as exc:
+        logger.warning(f"ignoring clone source dirs on remote {directories[0].host}: {exc}")
+        return []
+    for path in paths:
+        directory = directories[0].with_path(path)
+        if fsids[path] is None or fsids[path] != fsids[paths[0]]:
+            logger.warning(
+                f"ignoring clone source dir on another filesystem on remote {directory.host}:"
+                f" {path}"
+            )
+            continue
+        try:
+            subvolumes = _btrfs_subvolume_uuids_remote(directory, _btrfs_clone_source_patterns())
+        except subprocess.CalledProcessError:
+            logger.warning(f"ignoring missing clone source dir on remote {directory.host}: {path}")
+            continue
+        names = _btrfs_select_clone_sources(
+            subvolumes, received_uuids, {s.path.name for s in exclude if s.path.parent == path}
+        )
+        clone_sources += [directory.with_path(path.joinpath(name)) for name in names]
+    logger.debug(f"using {len(clone_sources)} btrfs clone sources")
+    return clone_sources
+
+
+def _btrfs_rotate_parent_snapshot_local(
+    snapshot: Path, backup: bckp.Backup, backup_basename: str
+) -> Path | None:
+    """Keep the local source side `snapshot`, which was just received on the
+    destination as `backup_basename`, as the rolling parent for the next
+    incremental send of `backup`. Older rolling parent snapshots are deleted.
+    Returns the Path of the kept parent snapshot.
+
+    As the backup is already in place, failures are only logged, and None is
+    returned if `snapshot` could not be kept. The next backup then falls back to
+    an older common parent, or to the bootstrap snapshot.
+    """
+    try:
+        parent = snapshot.rename(
+            snapshot.with_name(_btrfs_parent_snapshot_basename(backup_basename))
+        )
+        stale = [
+            path
+            for path in parent.parent.glob(_btrfs_parent_snapshot_prefix(backup.name) + "*")
+            if path != parent and _btrfs_is_parent_snapshot(backup, path.name)
+        ]
+    except OSError as exc:
+        logger.warning(f"failed to keep parent snapshot for backup '{backup.name}': {exc}")
+        return None
+    if stale:
+        returncode, _ = _btrfs_delete_subvolumes_local(*stale, check=False)
+        if returncode != 0:
+            logger.warning(f"failed to delete stale parent snapshots for backup '{backup.name}'")
+    return parent
+
+
+def _btrfs_rotate_parent_snapshot_remote(
+    snapshot: SSHTarget, backup: bckp.Backup, backup_basename: str
+) -> SSHTarget | None:
+    """Like `_btrfs_rotate_parent_snapshot_local()` but for the remote source
+    side `snapshot`.
+    """
+    parent = snapshot.with_path(
+        snapshot.path.with_name(_btrfs_parent_snapshot_basename(backup_basename))
+    )
+    prefix = _btrfs_parent_snapshot_prefix(backup.name)
+    try:
+        _btrfs_rename_subvolume_remote(snapshot, parent)
+        stale = [
+            parent.with_path(parent.path.with_name(name))
+            for name in _btrfs_subvolume_uuids_remote(
+                parent.with_path(parent.path.parent), [prefix + "*"]
+            )
+            if name != parent.path.name and _btrfs_is_parent_snapshot(backup, name)
+        ]
+    except (OSError, subprocess.CalledProcessError) as exc:
+        logger.warning(f"failed to keep parent snapshot for backup '{backup.name}': {exc}")
+        return None
+    if stale:
+        returncode, _ = _btrfs_delete_subvolumes_remote(*stale, check=False)
+        if returncode != 0:
+            logger.warning(f"failed to delete stale parent snapshots for backup '{backup.name}'")
+    return parent
+
+
 def check_btrfs_filesystem_local(path: Path, label: str) -> list[str]:
     if not path.is_dir():
         return []
+    try:
+        if btrfsioctl.is_btrfs(path):
+            return []
+        return [f"{label} is not on a btrfs filesystem: {path}"]
+    except OSError:
+        pass
     p = subprocess.run(
         ["btrfs", "filesystem", "show", path],
         check=False,
@@ -470,6 +1763,36 @@ def check_btrfs_filesystem_local(path: Path, label: str) -> list[str]:
     return []
 
 
+def check_btrfs_same_filesystem_local(path: Path, other: Path) -> list[str]:
+    try:
+        if btrfsioctl.same_filesystem(path, other):
+            return []
+    except OSError as exc:
+        return [f"cannot check the filesystem of {path}: {exc.strerror}"]
+    return [f"{path} is not on the same btrfs filesystem as {other}"]
+
+
+def check_btrfs_same_filesystem_remote(
+    sshtarget: SSHTarget, paths: ty.Sequence[Path]
+) -> dict[Path, list[str]]:
+    """Like `check_btrfs_same_filesystem_local()` but checks each of the remote
+    `paths` against `sshtarget.path`, with a single SSH command.
+    """
+    try:
+        fsids = _btrfs_filesystem_uuids_remote(sshtarget, [sshtarget.path, *paths])
+    except subprocess.CalledProcessError:
+        return {path: [f"cannot check the filesystem on remote {sshtarget.host}"] for path in paths}
+    errors: dict[Path, list[str]] = {}
+    for path in paths:
+        errors[path] = []
+        if fsids[path] is None or fsids[path] != fsids[sshtarget.path]:
+            errors[path].append(
+                f"{path} is not on the same btrfs filesystem as {sshtarget.path}"
+                f" on remote {sshtarget.host}"
+            )
+    return errors
+
+
 def check_btrfs_filesystem_remote(sshtarget: SSHTarget, label: str) -> list[str]:
     p = subprocess.run(
         sshtarget.openssh_cmd(["btrfs", "filesystem", "show", sshtarget.path]),
@@ -0,0 +1,261 @@
+"""src/yaesm/backend/btrfsioctl.py."""
+
+import ctypes
+import dataclasses
+import errno
+import fcntl
+import os
+import struct
+import uuid
+from pathlib import Path
+
+BTRFS_SUPER_MAGIC = 0x9123683E
+BTRFS_FIRST_FREE_OBJECTID = 256
+BTRFS_SUBVOL_RDONLY = 1 << 1
+
+_BTRFS_IOCTL_MAGIC = 0x94
+_BTRFS_VOL_ARGS_SIZE = 4096
+_BTRFS_SUBVOL_NAME_MAX = 4039
+_BTRFS_PATH_NAME_MAX = 4087
+_BTRFS_FS_INFO_ARGS_SIZE = 1024
+_BTRFS_INO_LOOKUP_ARGS_SIZE = 4096
+
+# struct btrfs_ioctl_get_subvol_info_args, see linux/btrfs.h
+_BTRFS_SUBVOL_INFO = struct.Struct("=Q256sQQQQ16s16s16sQQQQ" + "QI4x" * 4 + "64x")
+
+
+def _ioc(direction: int, nr: int, size: int) -> int:
+    return (direction << 30) | (size << 16) | (_BTRFS_IOCTL_MAGIC << 8) | nr
+
+
+BTRFS_IOC_SNAP_DESTROY = _ioc(1, 15, _BTRFS_VOL_ARGS_SIZE)
+BTRFS_IOC_INO_LOOKUP = _ioc(3, 18, _BTRFS_INO_LOOKUP_ARGS_SIZE)
+BTRFS_IOC_WAIT_SYNC = _ioc(1, 22, 8)
+BTRFS_IOC_SNAP_CREATE_V2 = _ioc(1, 23, _BTRFS_VOL_ARGS_SIZE)
+BTRFS_IOC_START_SYNC = _ioc(2, 24, 8)
+BTRFS_IOC_FS_INFO = _ioc(2, 31, _BTRFS_FS_INFO_ARGS_SIZE)
+BTRFS_IOC_GET_SUBVOL_INFO = _ioc(2, 60, _BTRFS_SUBVOL_INFO.size)
+BTRFS_IOC_SNAP_DESTROY_V2 = _ioc(1, 63, _BTRFS_VOL_ARGS_SIZE)
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+@dataclasses.dataclass(frozen=True)
+class SubvolumeInfo:
+    """The subset of a btrfs subvolumes metadata that yaesm cares about, as
+    returned by `subvolume_info()`. The uuids are formatted like 'btrfs subvolume
+    show' formats them, and are None where btrfs-progs would print '-'.
+    """
+
+    treeid: int
+    name: str
+    parent_id: int
+    generation: int
+    flags: int
+    uuid: str
+    parent_uuid: str | None
+    received_uuid: str | None
+    ctransid: int
+    otransid: int
+    ctime: float
+    otime: float
+
+    @property
+    def readonly(self) -> bool:
+        return bool(self.flags & BTRFS_SUBVOL_RDONLY)
+
+
+def _format_uuid(raw: bytes) -> str | None:
+    return None if raw == bytes(16) else str(uuid.UUID(bytes=raw))
+
+
+def _parse_subvolume_info(buf: bytes) -> SubvolumeInfo:
+    (
+        treeid,
+        name,
+        parent_id,
+        _dirid,
+        generation,
+        flags,
+        subvol_uuid,
+        parent_uuid,
+        received_uuid,
+        ctransid,
+        otransid,
+        _stransid,
+        _rtransid,
+        ctime_sec,
+        ctime_nsec,
+        otime_sec,
+        otime_nsec,
+        *_,
+    ) = _BTRFS_SUBVOL_INFO.unpack(buf)
+    return SubvolumeInfo(
+        treeid=treeid,
+        name=os.fsdecode(name.split(b"\0", 1)[0]),
+        parent_id=parent_id,
+        generation=generation,
+        flags=flags,
+        uuid=str(uuid.UUID(bytes=subvol_uuid)),
+        parent_uuid=_format_uuid(parent_uuid),
+        received_uuid=_format_uuid(received_uuid),
+        ctransid=ctransid,
+        otransid=otransid,
+        ctime=ctime_sec + ctime_nsec / 1e9,
+        otime=otime_sec + otime_nsec / 1e9,
+    )
+
+
+def _vol_args_v2(name: str, fd: int = 0, flags: int = 0) -> bytearray:
+    """Return a struct btrfs_ioctl_vol_args_v2 buffer. Raises OSError(ENAMETOOLONG)
+    if `name` does not fit.
+    """
+    encoded = os.fsencode(name)
+    if len(encoded) > _BTRFS_SUBVOL_NAME_MAX:
+        raise OSError(errno.ENAMETOOLONG, os.strerror(errno.ENAMETOOLONG), name)
+    buf = bytearray(_BTRFS_VOL_ARGS_SIZE)
+    struct.pack_into("=qQQ", buf, 0, fd, 0, flags)
+    buf[56 : 56 + len(encoded)] = encoded
+    return buf
+
+
+def _vol_args(name: str) -> bytearray:
+    """Return a struct btrfs_ioctl_vol_args buffer. Raises OSError(ENAMETOOLONG)
+    if `name` does not fit.
+    """
+    encoded = os.fsencode(name)
+    if len(encoded) > _BTRFS_PATH_NAME_MAX:
+        raise OSError(errno.ENAMETOOLONG, os.strerror(errno.ENAMETOOLONG), name)
+    buf = bytearray(_BTRFS_VOL_ARGS_SIZE)
+    buf[8 : 8 + len(encoded)] = encoded
+    return buf
+
+
+def _open_dir(path: Path) -> int:
+    return os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+
+
+def filesystem_type(path: Path) -> int:
+    """Return the statfs(2) f_type magic number of the filesystem `path` is on.
+    Raises OSError on failure, including when statfs(2) is not available.
+    """
+    statfs = getattr(_libc, "statfs", None)
+    if statfs is None:
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS), str(path))
+    buf = ctypes.create_string_buffer(256)
+    if statfs(os.fsencode(path), buf) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), str(path))
+    return ctypes.c_long.from_buffer(buf).value & 0xFFFFFFFF
+
+
+def is_btrfs(path: Path) -> bool:
+    """Return True if `path` is on a btrfs filesystem. Raises OSError if this
+    cannot be determined.
+    """
+    return filesystem_type(path) == BTRFS_SUPER_MAGIC
+
+
+def filesystem_uuid(path: Path) -> str:
+    """Return the fsid of the btrfs filesystem that `path` is on."""
+    buf = bytearray(_BTRFS_FS_INFO_ARGS_SIZE)
+    fd = _open_dir(path)
+    try:
+        fcntl.ioctl(fd, BTRFS_IOC_FS_INFO, buf)
+    finally:
+        os.close(fd)
+    return str(uuid.UUID(bytes=bytes(buf[16:32])))
+
+
+def same_filesystem(a: Path, b: Path) -> bool:
+    """Return True if `a` and `b` are both on the same btrfs filesystem, meaning
+    that a snapshot of one can be placed directly in the other. Subvolumes of the
+    same filesystem have distinct st_dev values, so on mismatch the filesystem
+    uuids are compared. Raises OSError if this cannot be determined.
+    """
+    if not (is_btrfs(a) and is_btrfs(b)):
+        return False
+    if os.stat(a).st_dev == os.stat(b).st_dev:
+        return True
+    return filesystem_uuid(a) == filesystem_uuid(b)
+
+
+def subvolume_info(path: Path) -> SubvolumeInfo:
+    """Return the `SubvolumeInfo` for the btrfs subvolume `path`. Raises OSError
+    with EINVAL if `path` is not the root of a subvolume.
+    """
+    fd = _open_dir(path)
+    try:
+        if os.fstat(fd).st_ino != BTRFS_FIRST_FREE_OBJECTID:
+            raise OSError(errno.EINVAL, "not a btrfs subvolume", str(path))
+        buf = bytearray(_BTRFS_SUBVOL_INFO.size)
+        fcntl.ioctl(fd, BTRFS_IOC_GET_SUBVOL_INFO, buf)
+    finally:
+        os.close(fd)
+    return _parse_subvolume_info(bytes(buf))
+
+
+def subvolume_id(path: Path) -> int:
+    """Return the id of the btrfs subvolume `path`, as listed by 'btrfs subvolume
+    list'. Unlike `subvolume_info()` this works on kernels older than 4.18.
+    Raises OSError with EINVAL if `path` is not the root of a subvolume.
+    """
+    fd = _open_dir(path)
+    try:
+        if os.fstat(fd).st_ino != BTRFS_FIRST_FREE_OBJECTID:
+            raise OSError(errno.EINVAL, "not a btrfs subvolume", str(path))
+        buf = bytearray(_BTRFS_INO_LOOKUP_ARGS_SIZE)
+        # treeid 0 looks up the subvolume of fd itself
+        struct.pack_into("=QQ", buf, 0, 0, BTRFS_FIRST_FREE_OBJECTID)
+        fcntl.ioctl(fd, BTRFS_IOC_INO_LOOKUP, buf)
+    finally:
+        os.close(fd)
+    return struct.unpack_from("=Q", buf)[0]
+
+
+def snapshot(src: Path, dst: Path, readonly: bool = True) -> None:
+    """Snapshot the btrfs subvolume `src` to the new subvolume `dst`, like
+    'btrfs subvolume snapshot [-r] src dst'. Raises OSError on failure, for
+    example with EXDEV if `src` and `dst` are on different filesystems.
+    """
+    src_fd = _open_dir(src)
+    try:
+        dst_parent_fd = _open_dir(dst.parent)
+        try:
+            args = _vol_args_v2(dst.name, src_fd, BTRFS_SUBVOL_RDONLY if readonly else 0)
+            fcntl.ioctl(dst_parent_fd, BTRFS_IOC_SNAP_CREATE_V2, args)
+        finally:
+            os.close(dst_parent_fd)
+    finally:
+        os.close(src_fd)
+
+
+def delete_subvolume(path: Path) -> None:
+    """Delete the btrfs subvolume `path`, like 'btrfs subvolume delete path'.
+    Uses BTRFS_IOC_SNAP_DESTROY_V2, and falls back to BTRFS_IOC_SNAP_DESTROY on
+    kernels older than 5.7. Raises OSError on failure.
+    """
+    parent_fd = _open_dir(path.parent)
+    try:
+        try:
+            fcntl.ioctl(parent_fd, BTRFS_IOC_SNAP_DESTROY_V2, _vol_args_v2(path.name))
+        except OSError as exc:
+            if exc.errno not in (errno.ENOTTY, errno.EOPNOTSUPP):
+                raise
+            fcntl.ioctl(parent_fd, BTRFS_IOC_SNAP_DESTROY, _vol_args(path.name))
+    finally:
+        os.close(parent_fd)
+
+
+def commit(path: Path) -> None:
+    """Commit the current transaction of the btrfs filesystem that `path` is on
+    and wait for it, like the '--commit-after' option of 'btrfs subvolume delete'
+    does. Raises OSError on failure.
+    """
+    fd = _open_dir(path)
+    try:
+        transid = bytearray(8)
+        fcntl.ioctl(fd, BTRFS_IOC_START_SYNC, transid)
+        fcntl.ioctl(fd, BTRFS_IOC_WAIT_SYNC, transid)
+    finally:
+        os.close(fd)
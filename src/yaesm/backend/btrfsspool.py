@@ -0,0 +1,328 @@
+"""src/yaesm/backend/btrfsspool.py."""
+
+from __future__ import annotations
+
+import abc
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+import yaesm.ty as ty
+from yaesm.backend.pipeline import pipefail_sh, run_pipeline
+from yaesm.sshtarget import SSHTarget
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE_MIB = 64
+
+_CHUNK_RE = re.compile("^([0-9]{8})-([0-9a-f]{64})$")
+_MANIFEST = "manifest"
+_COMPLETE = "complete"
+_TMP_CHUNK = ".chunk.tmp"
+
+
+def spool_snapshot_basename(backup_name: str, timeframe_name: str) -> str:
+    """The basename of the src snapshot that is kept while its send stream is
+    being spooled, and of the subvolume it is received as.
+    """
+    return f".yaesm-btrfs-spool-{backup_name}-{timeframe_name}"
+
+
+def spool_dir_basename(backup_name: str, timeframe_name: str) -> str:
+    """The basename of the destination directory holding the spooled chunks."""
+    return spool_snapshot_basename(backup_name, timeframe_name) + ".chunks"
+
+
+def _chunk_name(index: int, checksum: str) -> str:
+    return f"{index:08d}-{checksum}"
+
+
+@dataclasses.dataclass(frozen=True)
+class SpoolManifest:
+    """Identifies the send stream a spool holds. A spool can only be resumed by
+    regenerating the same stream, that is sending the same src snapshot with the
+    same parent and the same extra `send_opts`, cut into chunks of the same
+    size. `backup_basename` is the name of the backup the spool was started for,
+    the backup is named after the backup that receives it.
+    """
+
+    backup_basename: str
+    snapshot_uuid: str
+    parent: str | None
+    parent_uuid: str | None
+    chunk_size: int
+    send_opts: tuple[str, ...] = ()
+
+    def dumps(self) -> str:
+        return json.dumps(dataclasses.asdict(self), sort_keys=True)
+
+    @staticmethod
+    def loads(s: str) -> SpoolManifest | None:
+        try:
+            d = json.loads(s)
+            d["send_opts"] = tuple(d.get("send_opts", ()))
+            return SpoolManifest(**d)
+        except (ValueError, TypeError, AttributeError):
+            return None
+
+
+@dataclasses.dataclass(frozen=True)
+class SpoolState:
+    """What a spool currently holds. `checksums` are the sha256 sums of the
+    complete chunks, in stream order, up to the first missing chunk.
+    """
+
+    manifest: SpoolManifest | None
+    checksums: list[str]
+    complete: bool
+
+
+class Spool(abc.ABC):
+    """A directory of numbered, checksummed chunks of a btrfs send stream. A
+    chunk is only ever visible under its final name once it is fully written and
+    its checksum verified, so a spool can always be resumed after the last
+    chunk it holds.
+    """
+
+    @abc.abstractmethod
+    def state(self) -> SpoolState:
+        """Return the current `SpoolState` of the spool."""
+
+    @abc.abstractmethod
+    def start(self, manifest: SpoolManifest) -> None:
+        """Discard anything in the spool, and begin a new one for `manifest`."""
+
+    @abc.abstractmethod
+    def truncate(self, count: int) -> None:
+        """Discard every chunk from index `count` onwards."""
+
+    @abc.abstractmethod
+    def write_chunk(self, index: int, data: bytes, checksum: str) -> None:
+        """Atomically add the chunk `data` at `index`, verifying `checksum`."""
+
+    @abc.abstractmethod
+    def mark_complete(self) -> None:
+        """Record that the spool holds the entire stream."""
+
+    @abc.abstractmethod
+    def receive_cmd(self, dst_dir: Path) -> list[str | Path]:
+        """Return an exec list that feeds the spooled stream to 'btrfs receive dst_dir'."""
+
+    @abc.abstractmethod
+    def remove(self) -> None:
+        """Delete the spool directory."""
+
+
+def _receive_cmd(spool_dir: Path, dst_dir: Path) -> list[str | Path]:
+    """Return an exec list that feeds the chunks in `spool_dir` to 'btrfs
+    receive dst_dir', and fails if reading the chunks fails.
+    """
+    return pipefail_sh(
+        ["sh", "-c", 'cd "$1" && cat -- [0-9]*', "sh", spool_dir],
+        ["btrfs", "receive", dst_dir],
+    )
+
+
+def _parse_listing(names: list[str], manifest: str | None) -> SpoolState:
+    chunks = {}
+    for name in names:
+        if match := _CHUNK_RE.match(name):
+            chunks[int(match.group(1))] = match.group(2)
+    checksums = []
+    while len(checksums) in chunks:
+        checksums.append(chunks[len(checksums)])
+    return SpoolState(
+        None if manifest is None else SpoolManifest.loads(manifest),
+        checksums,
+        _COMPLETE in names and len(checksums) == len(chunks),
+    )
+
+
+class LocalSpool(Spool):
+    """A `Spool` in the local directory `path`."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def state(self) -> SpoolState:
+        if not self.path.is_dir():
+            return SpoolState(None, [], False)
+        manifest_path = self.path.joinpath(_MANIFEST)
+        manifest = manifest_path.read_text() if manifest_path.is_file() else None
+        return _parse_listing(os.listdir(self.path), manifest)
+
+    def start(self, manifest: SpoolManifest) -> None:
+        self.remove()
+        self.path.mkdir()
+        self.path.joinpath(_MANIFEST).write_text(manifest.dumps())
+
+    def truncate(self, count: int) -> None:
+        for name in os.listdir(self.path):
+            match = _CHUNK_RE.match(name)
+            if name == _COMPLETE or (match and int(match.group(1)) >= count):
+                self.path.joinpath(name).unlink()
+
+    def write_chunk(self, index: int, data: bytes, checksum: str) -> None:
+        tmp = self.path.joinpath(_TMP_CHUNK)
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.rename(self.path.joinpath(_chunk_name(index, checksum)))
+
+    def mark_complete(self) -> None:
+        self.path.joinpath(_COMPLETE).touch()
+
+    def receive_cmd(self, dst_dir: Path) -> list[str | Path]:
+        return _receive_cmd(self.path, dst_dir)
+
+    def verify(self, state: SpoolState, chunk_size: int) -> int:
+        """Return how many of the chunks of `state`, from the first one on, are
+        intact. A chunk is intact if it has its checksum and `chunk_size` bytes,
+        or fewer if it is the final chunk of a complete spool.
+        """
+        for index, checksum in enumerate(state.checksums):
+            try:
+                data = self.path.joinpath(_chunk_name(index, checksum)).read_bytes()
+            except OSError:
+                return index
+            final = state.complete and index == len(state.checksums) - 1
+            if len(data) > chunk_size or (len(data) < chunk_size and not final):
+                return index
+            if hashlib.sha256(data).hexdigest() != checksum:
+                return index
+        return len(state.checksums)
+
+    def remove(self) -> None:
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
+
+
+class RemoteSpool(Spool):
+    """A `Spool` in the directory `sshtarget.path` on a remote SSH server."""
+
+    def __init__(self, sshtarget: SSHTarget) -> None:
+        self.sshtarget = sshtarget
+
+    def _run(self, script: str, *args: str | Path, **kwargs: ty.Any) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            self.sshtarget.openssh_cmd(["sh", "-c", script, "sh", self.sshtarget.path, *args]),
+            **kwargs,
+        )
+
+    def state(self) -> SpoolState:
+        p = self._run(
+            '[ -d "$1" ] || exit 0; cat -- "$1/manifest" 2>/dev/null; echo; ls -1 -- "$1"',
+            check=True,
+            capture_output=True,
+            encoding="utf-8",
+        )
+        if not p.stdout:
+            return SpoolState(None, [], False)
+        manifest, _, listing = p.stdout.partition("\n")
+        return _parse_listing(listing.splitlines(), manifest or None)
+
+    def start(self, manifest: SpoolManifest) -> None:
+        self._run(
+            'rm -rf -- "$1" && mkdir -- "$1" && printf "%s" "$2" > "$1/manifest"',
+            manifest.dumps(),
+            check=True,
+        )
+
+    def truncate(self, count: int) -> None:
+        self._run(
+            'cd "$1" || exit 1; rm -f complete; for f in [0-9]*; do'
+            ' [ -e "$f" ] || continue; n=${f%%-*}; while [ "${n#0}" != "$n" ]; do n=${n#0}; done;'
+            ' [ "${n:-0}" -ge "$2" ] && rm -f -- "$f"; done; exit 0',
+            str(count),
+            check=True,
+        )
+
+    def write_chunk(self, index: int, data: bytes, checksum: str) -> None:
+        self._run(
+            'cat > "$1/.chunk.tmp" && sum=$(sha256sum < "$1/.chunk.tmp") &&'
+            ' [ "${sum%% *}" = "$2" ] && mv -- "$1/.chunk.tmp" "$1/$3"',
+            checksum,
+            _chunk_name(index, checksum),
+            input=data,
+            check=True,
+        )
+
+    def mark_complete(self) -> None:
+        self._run('touch -- "$1/complete"', check=True)
+
+    def receive_cmd(self, dst_dir: Path) -> list[str | Path]:
+        return self.sshtarget.openssh_cmd(_receive_cmd(self.sshtarget.path, dst_dir))
+
+    def remove(self) -> None:
+        self._run('rm -rf -- "$1"', check=True)
+
+
+def fill_spool(
+    send_cmd: list[str | Path],
+    spool: Spool,
+    chunk_size: int,
+    start_index: int = 0,
+    expected: list[str] | None = None,
+) -> None:
+    """Run `send_cmd` and write its output to `spool` in chunks of `chunk_size`
+    bytes, numbered from `start_index`. The output of `send_cmd` must begin at
+    the first byte of chunk `start_index`.
+
+    If `expected` is given, then it holds the checksums of the chunks already in
+    the spool. Those chunks are regenerated from the stream and only checked
+    against their checksums, and from the first mismatch on the spool is
+    truncated and rewritten. Raises `subprocess.CalledProcessError` if
+    `send_cmd` fails, leaving every complete chunk in the spool.
+    """
+    verify = list(expected or [])
+    proc = subprocess.Popen(send_cmd, stdout=subprocess.PIPE)
+    assert proc.stdout is not None
+    index = start_index
+
+    def _add_chunk(data: bytes) -> None:
+        nonlocal verify
+        checksum = hashlib.sha256(data).hexdigest()
+        if index < len(verify):
+            if verify[index] == checksum:
+                return
+            logger.warning(f"spooled chunk {index} does not match, discarding the rest")
+            spool.truncate(index)
+            verify = []
+        spool.write_chunk(index, data, checksum)
+
+    try:
+        while True:
+            data = proc.stdout.read(chunk_size)
+            if len(data) < chunk_size:
+                # The short final chunk only counts if the stream ended cleanly.
+                if proc.wait() != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, send_cmd)
+                if data:
+                    _add_chunk(data)
+                    index += 1
+                break
+            _add_chunk(data)
+            index += 1
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        proc.stdout.close()
+    if index < len(verify):
+        logger.warning("spooled stream is longer than the regenerated stream, discarding the rest")
+        spool.truncate(index)
+    spool.mark_complete()
+    logger.info(f"spooled {index} chunks")
+
+
+def receive_spool(spool: Spool, dst_dir: Path, check: bool = True) -> int:
+    """Feed the complete `spool` to 'btrfs receive dst_dir'. Returns the returncode."""
+    return run_pipeline(spool.receive_cmd(dst_dir), check=check).returncode
@@ -0,0 +1,378 @@
+"""src/yaesm/backend/changejournal.py.
+
+Every rsync backup has rsync stat the whole source tree and the --link-dest
+tree, even if only a few files changed since the previous backup. With the
+'rsync_change_source' setting set to 'inotify', the 'run' subcommand keeps a
+`ChangeJournal` for the src_dir of the backup, which watches the tree with
+inotify(7) and records the directories in which something changed. The next
+backup then hardlinks the unchanged directories from the previous backup with
+`prefill()`, and has rsync transfer only the entries of the changed directories
+and the new directory trees.
+
+The journal records the changes in segments between checkpoints. A backup takes
+a checkpoint before it starts, and records it in its metadata, so that the next
+backup asks for the changes since then. Whenever the journal may have missed a
+change, because it was not watching yet, the kernel's event queue overflowed, or
+a directory could not be watched, it has no changes since the checkpoints taken
+before, and the backup falls back to a full walk.
+
+btrfs' 'subvolume find-new' is no change source, for it only reports files with
+new data, and not unlinks, renames, or changes of metadata.
+"""
+
+import contextlib
+import ctypes
+import ctypes.util
+import dataclasses
+import errno
+import logging
+import os
+import select
+import shutil
+import struct
+import threading
+import uuid
+from pathlib import Path
+
+import yaesm.backup as bckp
+import yaesm.ty as ty
+
+logger = logging.getLogger(__name__)
+
+CHANGE_SOURCES = ["walk", "inotify"]
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_DONT_FOLLOW = 0x2000000
+_IN_EXCL_UNLINK = 0x4000000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = os.O_CLOEXEC
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_ONLYDIR
+    | _IN_DONT_FOLLOW
+    | _IN_EXCL_UNLINK
+)
+_EVENT = struct.Struct("iIII")
+
+_journals: dict[str, "ChangeJournal"] = {}
+_journals_lock = threading.Lock()
+
+
+@dataclasses.dataclass
+class ChangeSet:
+    """The changes to a tree, as paths relative to its top ('.' for the top).
+    `dirty` are the directories in which entries were created, deleted, renamed,
+    or modified, or whose own metadata changed. `new_dirs` are the directories
+    that were created or moved into the tree, whose contents are unknown.
+    """
+
+    dirty: set[str] = dataclasses.field(default_factory=set)
+    new_dirs: set[str] = dataclasses.field(default_factory=set)
+
+    def update(self, other: "ChangeSet") -> None:
+        self.dirty |= other.dirty
+        self.new_dirs |= other.new_dirs
+
+
+class _Libc:
+    """The inotify(7) functions of the C library."""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+    def _check(self, result: int) -> int:
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+    def inotify_init(self) -> int:
+        return self._check(self._libc.inotify_init1(_IN_CLOEXEC))
+
+    def inotify_add_watch(self, fd: int, path: Path) -> int:
+        return self._check(self._libc.inotify_add_watch(fd, os.fsencode(path), _WATCH_MASK))
+
+
+class ChangeJournal(threading.Thread):
+    """A daemon thread that records the changes to the tree `root`."""
+
+    def __init__(self, root: Path) -> None:
+        super().__init__(name="yaesm-journal", daemon=True)
+        self.root = root
+        self.session = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._checkpoint = 0
+        self._segments: dict[int, ChangeSet] = {0: ChangeSet()}
+        # The first checkpoint since which no change was missed, if any.
+        self._floor: int | None = None
+        # The checkpoints before this one were released, and are unknown.
+        self._released = 0
+        self._paths: dict[int, str] = {}
+        self._fd = -1
+        self._libc = _Libc()
+        self._stop_r, self._stop_w = os.pipe()
+
+    def checkpoint(self) -> int:
+        """Start a new segment of changes, and return its checkpoint."""
+        with self._lock:
+            self._checkpoint += 1
+            self._segments[self._checkpoint] = ChangeSet()
+            return self._checkpoint
+
+    def changes(self, session: str, since: int, until: int | None = None) -> ChangeSet | None:
+        """Return the changes made between the checkpoints `since` and `until`
+        (by default up to now) of the journal `session`, or None if some may
+        have been missed or were released.
+        """
+        with self._lock:
+            if (
+                session != self.session
+                or self._floor is None
+                or since < max(self._floor, self._released)
+                or since not in self._segments
+            ):
+                return None
+            merged = ChangeSet()
+            for checkpoint, segment in self._segments.items():
+                if since <= checkpoint and (until is None or checkpoint < until):
+                    merged.update(segment)
+            return merged
+
+    def release(self, checkpoint: int) -> None:
+        """Forget the changes made before `checkpoint`, which are not needed
+        by any backup anymore. Asking for changes since a released checkpoint
+        returns None.
+        """
+        with self._lock:
+            self._released = max(self._released, checkpoint)
+            for old in [old for old in self._segments if old < checkpoint]:
+                del self._segments[old]
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Wait up to `timeout` seconds for the whole tree to be watched."""
+        return self._ready.wait(timeout)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stop watching, and wait up to `timeout` seconds for the thread."""
+        if self._stop_w < 0:
+            return
+        os.write(self._stop_w, b"x")
+        if self.is_alive():
+            self.join(timeout)
+        if not self.is_alive():
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+            self._stop_r = self._stop_w = -1
+
+    def run(self) -> None:
+        try:
+            self._fd = self._libc.inotify_init()
+            self._rewatch()
+            self._ready.set()
+            while True:
+                readable, _, _ = select.select([self._fd, self._stop_r], [], [])
+                if self._stop_r in readable:
+                    return
+                self._handle(os.read(self._fd, 1 << 16))
+        except Exception:
+            logger.error(f"watching {self.root} for changes failed", exc_info=True)
+            self._gap(None)
+        finally:
+            self._ready.set()
+            if self._fd >= 0:
+                os.close(self._fd)
+
+    def _gap(self, floor: int | None) -> None:
+        """Record that changes may have been missed, so that only the
+        checkpoints from `floor` on have all of their changes.
+        """
+        with self._lock:
+            self._floor = floor
+            for old in [old for old in self._segments if floor is None or old < floor]:
+                self._segments[old] = ChangeSet()
+
+    def _rewatch(self) -> None:
+        """Watch the whole tree, and record that changes were complete only
+        from the checkpoint after it is all watched on.
+        """
+        if self._watch_tree("."):
+            with self._lock:
+                floor = self._checkpoint + 1
+            self._gap(floor)
+        else:
+            self._gap(None)
+
+    def _watch_tree(self, top: str) -> bool:
+        """Watch the directory `top` and every directory under it. Returns
+        False if one that exists could not be watched.
+        """
+        stack = [top]
+        while stack:
+            rel = stack.pop()
+            path = self.root.joinpath(rel)
+            try:
+                wd = self._libc.inotify_add_watch(self._fd, path)
+            except OSError as exc:
+                if exc.errno in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                logger.warning(f"cannot watch {path} for changes, falling back to walks: {exc}")
+                return False
+            self._paths[wd] = rel
+            try:
+                with os.scandir(path) as entries:
+                    stack += [
+                        _join(rel, entry.name)
+                        for entry in entries
+                        if entry.is_dir(follow_symlinks=False)
+                    ]
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return True
+
+    def _handle(self, data: bytes) -> None:
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                logger.warning(f"missed changes to {self.root}, the next backup walks it all")
+                self._rewatch()
+                continue
+            if mask & _IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            rel = self._paths.get(wd)
+            if rel is None:
+                continue
+            path = _join(rel, name) if name else rel
+            new_dir = bool(mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO))
+            with self._lock:
+                segment = self._segments[self._checkpoint]
+                segment.dirty.add(rel)
+                if mask & _IN_ISDIR and mask & _IN_ATTRIB:
+                    segment.dirty.add(path)
+                if new_dir:
+                    segment.new_dirs.add(path)
+            if new_dir and not self._watch_tree(path):
+                self._gap(None)
+
+
+def _join(rel: str, name: str) -> str:
+    return name if rel == "." else f"{rel}/{name}"
+
+
+def start_journals(backups: ty.Iterable[bckp.Backup]) -> None:
+    """Start a `ChangeJournal` for the src_dir of every one of `backups` that
+    has the 'inotify' change source and a local src_dir.
+    """
+    for backup in backups:
+        if getattr(backup.backend, "change_source", "walk") != "inotify":
+            continue
+        if not isinstance(backup.src_dir, Path):
+            logger.warning(f"not watching the remote src_dir of backup '{backup.name}'")
+            continue
+        with _journals_lock:
+            if backup.name in _journals:
+                continue
+            journal = _journals[backup.name] = ChangeJournal(backup.src_dir)
+        journal.start()
+
+
+def stop_journals(timeout: float | None = None) -> None:
+    """Stop every `ChangeJournal` started by `start_journals()`."""
+    with _journals_lock:
+        journals = list(_journals.values())
+        _journals.clear()
+    for journal in journals:
+        journal.stop(timeout)
+
+
+def journal(backup: bckp.Backup) -> ChangeJournal | None:
+    """Return the running `ChangeJournal` for `backup`, if any."""
+    with _journals_lock:
+        return _journals.get(backup.name)
+
+
+def prefill(src: Path, base: Path, staging: Path, changes: ChangeSet) -> list[str]:
+    """Fill the empty directory `staging` with hardlinks to the files of the
+    backup `base` of `src` that did not change according to `changes`. Returns
+    the paths relative to `src` that rsync has to transfer to complete it: the
+    entries of the changed directories that are no directories, and the new
+    directories, which are to be transferred recursively.
+    """
+    transfer = []
+    clean_dirs = []
+    stack = ["."]
+    while stack:
+        rel = stack.pop()
+        if rel in changes.new_dirs:
+            transfer.append(rel)
+            continue
+        if rel != ".":
+            staging.joinpath(rel).mkdir()
+        if rel in changes.dirty:
+            # A directory removed meanwhile is left empty, and the change is
+            # recorded for the next backup.
+            with contextlib.suppress(FileNotFoundError), os.scandir(src.joinpath(rel)) as entries:
+                for entry in entries:
+                    path = _join(rel, entry.name)
+                    if not entry.is_dir(follow_symlinks=False):
+                        transfer.append(path)
+                    elif path not in changes.new_dirs and base.joinpath(path).is_dir():
+                        stack.append(path)
+                    else:
+                        transfer.append(path)
+            continue
+        clean_dirs.append(rel)
+        with os.scandir(base.joinpath(rel)) as entries:
+            for entry in entries:
+                path = _join(rel, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                else:
+                    _link(base.joinpath(path), staging.joinpath(path))
+    # Directory times are copied last, as filling a directory changes them.
+    for rel in reversed(clean_dirs):
+        _copy_dir_attrs(base.joinpath(rel), staging.joinpath(rel))
+    return sorted(transfer)
+
+
+def copy_dir_attrs(src: Path, staging: Path, rels: ty.Iterable[str]) -> None:
+    """Copy the metadata of the directories `rels` of `src` that still exist
+    to those of `staging`.
+    """
+    for rel in sorted(rels, key=lambda rel: rel.count("/"), reverse=True):
+        if src.joinpath(rel).is_dir() and staging.joinpath(rel).is_dir():
+            _copy_dir_attrs(src.joinpath(rel), staging.joinpath(rel))
+
+
+def _copy_dir_attrs(src: Path, dst: Path) -> None:
+    st = os.stat(src, follow_symlinks=False)
+    with contextlib.suppress(PermissionError):
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+    shutil.copystat(src, dst, follow_symlinks=False)
+
+
+def _link(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except OSError as exc:
+        if exc.errno != errno.EMLINK:
+            raise
+        shutil.copy2(src, dst, follow_symlinks=False)
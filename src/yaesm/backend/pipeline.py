@@ -0,0 +1,201 @@
+"""src/yaesm/backend/pipeline.py."""
+
+import dataclasses
+import errno
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1 << 20
+
+
+@dataclasses.dataclass(frozen=True)
+class StageResult:
+    """The outcome of one stage of a pipeline run by `run_pipeline()`.
+    `bytes_out` is the number of bytes the stage wrote to the next stage, and
+    is None for the last stage, whose stdout is not relayed.
+    """
+
+    cmd: tuple[str | Path, ...]
+    returncode: int
+    bytes_out: int | None
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second written to the next stage."""
+        if not self.bytes_out or self.seconds <= 0:
+            return 0.0
+        return self.bytes_out / self.seconds
+
+
+@dataclasses.dataclass(frozen=True)
+class PipelineResult:
+    """The outcome of a pipeline run by `run_pipeline()`. `failed_stage` is the
+    index of the stage that failed first, if any. The other stages may have been
+    terminated because of it.
+    """
+
+    stages: tuple[StageResult, ...]
+    seconds: float
+    failed_stage: int | None = None
+
+    @property
+    def returncode(self) -> int:
+        """The returncode of the stage that failed first, or 0."""
+        if self.failed_stage is None:
+            return 0
+        return self.stages[self.failed_stage].returncode or 1
+
+    @property
+    def bytes_transferred(self) -> int:
+        """The number of bytes the first stage produced."""
+        return self.stages[0].bytes_out or 0
+
+    def describe(self) -> str:
+        mib = self.bytes_transferred / (1 << 20)
+        rate = mib / self.seconds if self.seconds > 0 else 0.0
+        return f"{mib:.1f} MiB in {self.seconds:.1f}s ({rate:.1f} MiB/s)"
+
+
+def _relay(src: int, dst: int) -> int:
+    """Copy everything from the pipe `src` to the pipe `dst`, returning the
+    number of bytes copied. Uses zero-copy splice(2) when possible, otherwise
+    read/write. Stops early if the reader of `dst` goes away.
+    """
+    total = 0
+    splice = getattr(os, "splice", None)
+    try:
+        while splice is not None:
+            try:
+                n = splice(src, dst, _CHUNK_SIZE)
+            except OSError as exc:
+                if exc.errno in (errno.EINVAL, errno.ENOSYS) and total == 0:
+                    splice = None
+                    break
+                raise
+            if n == 0:
+                return total
+            total += n
+        while data := os.read(src, _CHUNK_SIZE):
+            view = memoryview(data)
+            while view:
+                n = os.write(dst, view)
+                view = view[n:]
+            total += len(data)
+    except BrokenPipeError:
+        pass
+    return total
+
+
+def run_pipeline(*cmds: list[str | Path], check: bool = True) -> PipelineResult:
+    """Run `cmds` as a pipeline like 'cmd1 | cmd2 | ...', but without a shell.
+
+    The stdout of each stage is relayed to the stdin of the next in-process, so
+    the bytes each stage produces and its throughput are known. As soon as any
+    stage fails, all other stages are terminated. If `check` is True and a stage
+    failed, then raises `subprocess.CalledProcessError` for the stage that failed
+    first, otherwise returns a `PipelineResult` describing every stage.
+    """
+    start = time.monotonic()
+    procs: list[subprocess.Popen] = []
+    try:
+        for i, cmd in enumerate(cmds):
+            procs.append(
+                subprocess.Popen(
+                    cmd,
+                    stdin=None if i == 0 else subprocess.PIPE,
+                    stdout=None if i == len(cmds) - 1 else subprocess.PIPE,
+                )
+            )
+    except Exception:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        raise
+
+    lock = threading.Lock()
+    failed_stage: list[int] = []
+    bytes_out: list[int | None] = [None] * len(procs)
+    seconds = [0.0] * len(procs)
+
+    def _terminate_all(culprit: int) -> None:
+        with lock:
+            if failed_stage:
+                return
+            failed_stage.append(culprit)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+
+    def _relay_stage(i: int) -> None:
+        src = procs[i].stdout
+        dst = procs[i + 1].stdin
+        assert src is not None and dst is not None
+        try:
+            bytes_out[i] = _relay(src.fileno(), dst.fileno())
+        except OSError as exc:
+            logger.error(f"pipeline relay after '{cmds[i][0]}' failed: {exc}")
+            bytes_out[i] = 0
+            _terminate_all(i + 1)
+        finally:
+            seconds[i] = time.monotonic() - start
+            src.close()
+            dst.close()
+
+    def _wait_stage(i: int) -> None:
+        # A stage killed by SIGPIPE is a consequence of a later stage exiting
+        # early, so it is only blamed if nothing else failed.
+        if procs[i].wait() not in (0, -signal.SIGPIPE):
+            _terminate_all(i)
+
+    threads = [threading.Thread(target=_relay_stage, args=(i,)) for i in range(len(procs) - 1)]
+    threads += [threading.Thread(target=_wait_stage, args=(i,)) for i in range(len(procs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds[-1] = time.monotonic() - start
+    if not failed_stage:
+        failed_stage += [i for i, proc in enumerate(procs) if proc.returncode != 0][:1]
+
+    result = PipelineResult(
+        tuple(
+            StageResult(tuple(cmd), proc.returncode, bytes_out[i], seconds[i])
+            for i, (cmd, proc) in enumerate(zip(cmds, procs, strict=True))
+        ),
+        time.monotonic() - start,
+        failed_stage[0] if failed_stage else None,
+    )
+    for stage in result.stages:
+        logger.debug(
+            f"pipeline stage '{stage.cmd[0]}' exited {stage.returncode}"
+            + (f" after writing {stage.bytes_out} bytes" if stage.bytes_out is not None else "")
+        )
+    if check and result.failed_stage is not None:
+        stage = result.stages[result.failed_stage]
+        raise subprocess.CalledProcessError(result.returncode, list(stage.cmd))
+    return result
+
+
+def pipefail_sh(first: list[str | Path], second: list[str | Path]) -> list[str | Path]:
+    """Return an exec list that runs 'first | second' with any POSIX sh, exiting
+    with the status of `first` if it failed and with the status of `second`
+    otherwise, like 'set -o pipefail' (which not every sh supports). Intended
+    for pipelines that must run on a remote server via `SSHTarget.openssh_cmd()`.
+    """
+    script = (
+        "{ status=$( { { "
+        + shlex.join(str(arg) for arg in first)
+        + "; echo $? >&3; } | { "
+        + shlex.join(str(arg) for arg in second)
+        + '; } >&4; } 3>&1 ); rc=$?; } 4>&1; [ "$status" = 0 ] || exit "${status:-1}"; exit "$rc"'
+    )
+    return ["sh", "-c", script]
@@ -1,23 +1,269 @@
 """src/yaesm/backend/rsyncbackend.py."""
 
+import dataclasses
+import logging
+import os
+import re
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from shutil import rmtree
 
 import voluptuous as vlp
 
+import yaesm.backend.changejournal as changejournal
+import yaesm.backend.rsyncshard as rsyncshard
+import yaesm.backend.treedelete as treedelete
 import yaesm.backup as bckp
+import yaesm.transport as transport
+import yaesm.ty as ty
 from yaesm.backend.backendbase import PathBackendBase
 from yaesm.sshtarget import SSHTarget
-from yaesm.timeframe import Timeframe
+from yaesm.timeframe import Timeframe, tframe_types
+
+logger = logging.getLogger(__name__)
+
+DELETE_STRATEGIES = ["rm", "rsync"]
+LINK_DEST_POLICIES = ["newest", "per_timeframe", "same_timeframe_first"]
+MAX_LINK_DESTS = 20  # rsync accepts at most 20 --link-dest directories
+STAGING_PREFIX = ".yaesm-rsync-incomplete-"
+# Filesystems take ctimes from a coarse clock, which may lag behind time.time().
+_CTIME_SLACK_NS = 1_000_000_000
+EXIT_ACTIONS = ["accept", "warn", "fail"]
+# rsync exits with 24 when files vanished while it ran, which is routine on a
+# live filesystem.
+DEFAULT_EXIT_POLICY = {24: "warn"}
+
+# The staging directories that backups in progress transfer into, by backup,
+# which the backups of other timeframes running meanwhile must not resume from.
+# They are guarded by the lock of their backup in `_staging_locks`.
+_live_stagings: dict[str, set[str]] = {}
+_staging_locks: dict[str, threading.Lock] = {}
+_staging_locks_lock = threading.Lock()
+
+_STATS_RE = re.compile(
+    r"^(Number of [a-z ]+|Total [a-z ]+|Literal data|Matched data|File list size):"
+    r" ([0-9,]+)(?: bytes)?(?: \((.*)\))?$"
+)
+_STATS_DETAIL_RE = re.compile(r"([a-z]+): ([0-9,]+)")
+# The first line of the --stats output. It and all lines after it are parsed
+# rather than passed on.
+_STATS_HEADER_RE = re.compile(r"^Number of files: [0-9,]+")
+
+# Run with the arguments STRATEGY WORKERS TRASH SUFFIX PREFIX PATH... to move
+# every PATH into the TRASH directory, and then delete them along with the
+# backups of the backup NAME with one of the space separated TIMEFRAMES left in
+# TRASH, WORKERS at a time. Prints 'ok N' or 'failed N MESSAGE' for the Nth
+# PATH, and for anything else deleted with N = 0.
+_DELETE_REMOTE_SCRIPT = r"""
+strategy=$1 workers=$2 trash=$3 suffix=$4 name=$5 timeframes=$6
+shift 6
+mkdir -p -- "$trash" || exit 1
+exec 3>&1
+{
+    i=0
+    for path in "$@"; do
+        i=$((i + 1))
+        if err=$(mv -- "$path" "$trash/${path##*/}.$suffix" 2>&1); then
+            printf '%s\0%s\0' "$i" "$trash/${path##*/}.$suffix"
+        else
+            printf 'failed %s %s\n' "$i" "$(printf %s "$err" | tr '\n' ' ')" >&3
+        fi
+    done
+    for left in "$trash/yaesm-$name-"*; do
+        case $left in *".$suffix") continue ;; esac
+        for timeframe in $timeframes; do
+            case ${left##*/} in
+                "yaesm-$name-$timeframe".[0-9][0-9][0-9][0-9]_[0-9][0-9]_[0-9][0-9]_[0-9][0-9]:[0-9][0-9].*)
+                    printf '0\0%s\0' "$left"
+                    break
+                    ;;
+            esac
+        done
+    done
+} | xargs -0 -r -n 2 -P "$workers" sh -c '
+    [ -n "$3" ] || exit 0
+    if [ "$1" = rsync ]; then
+        err=$( {
+            empty=$(mktemp -d) && rsync -r --delete -- "$empty/" "$3/" && rmdir -- "$3"
+            status=$?
+            [ -z "$empty" ] || rmdir -- "$empty"
+            exit $status
+        } 2>&1 )
+    else
+        err=$(rm -r -f -- "$3" 2>&1)
+    fi
+    if [ $? -eq 0 ]; then
+        printf "ok %s\n" "$2"
+    else
+        printf "failed %s %s\n" "$2" "$(printf %s "$err" | tr "\n" " ")"
+    fi
+' sh "$strategy"
+"""
+
+
+class RsyncError(subprocess.CalledProcessError):
+    """rsync exited with a non-zero exit code. `counters` are the statistics it
+    reported anyway, see `_rsync_parse_stats()`, for a partial transfer.
+    """
+
+    def __init__(self, returncode: int, cmd: list[str], counters: dict[str, int]) -> None:
+        super().__init__(returncode, cmd)
+        self.counters = counters
+
+
+@dataclasses.dataclass(frozen=True)
+class RsyncStats:
+    """The statistics of the rsync transfer of a backup. `hardlinked_files` is
+    the number of regular files that were unchanged since a --link-dest backup,
+    and so were hardlinked to it rather than transferred, or None if that is
+    not known.
+    """
+
+    files: int
+    files_transferred: int
+    hardlinked_files: int | None
+    literal_bytes: int
+    matched_bytes: int
+    sent_bytes: int
+    received_bytes: int
+    seconds: float
+
+    @classmethod
+    def from_counters(
+        cls, counters: dict[str, int], seconds: float, link_dest: bool, exact: bool = True
+    ) -> "RsyncStats":
+        """Make the `RsyncStats` of a transfer that took `seconds`, from the
+        `counters` parsed by `_rsync_parse_stats()`. Files can only have been
+        hardlinked if the transfer had a --link-dest. The files rsync did not
+        transfer are only the hardlinked ones if it transferred the whole
+        backup into an empty staging directory, which is what `exact` tells.
+        Otherwise some of them were already in place, as in a resumed staging
+        directory, or rsync only saw part of the backup, as with --files-from.
+        """
+        # rsync before 3.1 counts all files, not only the regular ones.
+        files = counters.get("number_of_files_reg", counters.get("number_of_files", 0))
+        transferred = counters.get("number_of_regular_files_transferred", 0)
+        return cls(
+            files=files,
+            files_transferred=transferred,
+            hardlinked_files=(max(files - transferred, 0) if link_dest else 0) if exact else None,
+            literal_bytes=counters.get("literal_data", 0),
+            matched_bytes=counters.get("matched_data", 0),
+            sent_bytes=counters.get("total_bytes_sent", 0),
+            received_bytes=counters.get("total_bytes_received", 0),
+            seconds=seconds,
+        )
+
+    @property
+    def rate(self) -> float:
+        """Bytes per second sent and received by rsync."""
+        if self.seconds <= 0:
+            return 0.0
+        return (self.sent_bytes + self.received_bytes) / self.seconds
+
+    def describe(self) -> str:
+        hardlinked = (
+            "" if self.hardlinked_files is None else f" {self.hardlinked_files} hardlinked,"
+        )
+        return (
+            f"{self.files_transferred} of {self.files} files transferred,{hardlinked}"
+            f" {self.literal_bytes / (1 << 20):.1f} MiB literal and"
+            f" {self.matched_bytes / (1 << 20):.1f} MiB matched, in"
+            f" {self.seconds:.1f}s ({self.rate / (1 << 20):.1f} MiB/s)"
+        )
 
 
 class RsyncBackend(PathBackendBase):
-    """The rsync backup execution backend."""
+    """The rsync backup execution backend.
+
+    Backups are deleted by first moving them into the trash directory of the
+    dst_dir, and then deleting them 'rsync_delete_workers' at a time. Local
+    backups are deleted with threads, see the yaesm.backend.treedelete module.
+    Remote backups are all deleted with a single remote command, with 'rm -r'
+    or, with the 'rsync_delete_strategy' setting set to 'rsync', by syncing an
+    empty directory into them with 'rsync --delete', which is faster for huge
+    trees on some filesystems. Backups left in the trash by an interrupted
+    deletion are deleted along with the next ones.
+
+    Files unchanged since an earlier backup are hardlinked to it with rsync's
+    --link-dest option. The earlier backups to pass are chosen by the
+    'rsync_link_dest_policy' setting, see `_rsync_link_dests()`, up to
+    'rsync_link_dest_count' of them.
+
+    rsync runs with --stats but not --verbose, which can be passed with the
+    'rsync_extra_opts' setting for a list of the transferred files. The
+    statistics are parsed into an `RsyncStats` that is logged, and recorded in
+    the metadata of the backup.
+
+    A backup is transferred into a staging directory in the dst_dir, which is
+    renamed to the backup only once rsync succeeded. The staging directory of a
+    failed backup is kept, and the next backup resumes from it with --partial,
+    so that what was transferred already is not transferred again.
+
+    With the 'rsync_shards' setting, a backup is split into shards that are
+    transferred by concurrent rsyncs, 'rsync_shard_workers' at a time, see the
+    yaesm.backend.rsyncshard module.
+
+    The 'rsync_exit_policy' setting maps rsync exit codes to one of
+    `EXIT_ACTIONS`, on top of `DEFAULT_EXIT_POLICY`, and exit codes it does not
+    map 'fail'. A backup whose rsync exited with an exit code that is accepted,
+    or accepted with a warning, is kept but marked partial in its metadata,
+    rather than failed over a file that could not be transferred.
+
+    With the 'rsync_change_source' setting set to 'inotify', the 'run'
+    subcommand watches the src_dir of a local-to-local backup for changes, see
+    the yaesm.backend.changejournal module. A backup then hardlinks what did not
+    change since the newest backup, and has rsync transfer only the changed
+    paths, listed with --files-from, rather than walk both trees. A backup walks
+    the trees as usual, unsharded or in shards, whenever the changes since the
+    newest backup are not all known.
+
+    The src_dir did not change since a backup, see `source_unchanged()`, if its
+    change journal recorded no change since, or else if nothing in a local
+    src_dir has a ctime later than the time the backup started, which is
+    recorded in its metadata.
+    """
+
+    def __init__(
+        self,
+        extra_opts: list[str] | None = None,
+        delete_workers: int | None = None,
+        delete_strategy: str = "rm",
+        link_dest_policy: str = "newest",
+        link_dest_count: int | None = None,
+        shards: str = "none",
+        shard_workers: int = rsyncshard.DEFAULT_WORKERS,
+        exit_policy: dict[int, str] | None = None,
+        change_source: str = "walk",
+    ) -> None:
+        super().__init__(extra_opts)
+        self.delete_workers = delete_workers or treedelete.DEFAULT_WORKERS
+        self.delete_strategy = delete_strategy
+        self.link_dest_policy = link_dest_policy
+        self.link_dest_count = link_dest_count
+        self.shards = shards
+        self.shard_workers = shard_workers
+        self.exit_policy = {**DEFAULT_EXIT_POLICY, **(exit_policy or {})}
+        self.change_source = change_source
 
     @staticmethod
     def config_settings() -> set[str]:
-        return {"rsync_extra_opts"}
+        return {
+            "rsync_extra_opts",
+            "rsync_delete_workers",
+            "rsync_delete_strategy",
+            "rsync_link_dest_policy",
+            "rsync_link_dest_count",
+            "rsync_shards",
+            "rsync_shard_workers",
+            "rsync_exit_policy",
+            "rsync_change_source",
+        }
 
     @staticmethod
     def config_schema() -> vlp.Schema:
@@ -26,6 +272,17 @@ class RsyncBackend(PathBackendBase):
         containing the options, or a list of strings containing the options. In
         either case the value is promoted to a list of string split on whitespace.
         The 'rsync_extra_opts' key is renamed to 'extra_opts' in the outputted dict.
+
+        The 'rsync_delete_workers' setting is a positive number of backups to
+        delete at once, and the 'rsync_delete_strategy' setting is one of
+        `DELETE_STRATEGIES`. The 'rsync_link_dest_policy' setting is one of
+        `LINK_DEST_POLICIES`, and the 'rsync_link_dest_count' setting is at most
+        `MAX_LINK_DESTS`. The 'rsync_shards' setting is one of
+        `rsyncshard.SHARD_MODES`, and the 'rsync_shard_workers' setting is the
+        number of shards to transfer at once. The 'rsync_exit_policy' setting
+        maps rsync exit codes to one of `EXIT_ACTIONS`, and the
+        'rsync_change_source' setting is one of `changejournal.CHANGE_SOURCES`.
+        They are applied to the backend instance.
         """
 
         def _promote_options_to_list_of_strings(d: dict) -> dict:
@@ -43,72 +300,658 @@ class RsyncBackend(PathBackendBase):
                 del d["rsync_extra_opts"]
             return d
 
+        def _apply_to_backend(d: dict) -> dict:
+            if "rsync_delete_workers" in d:
+                d["backend"].delete_workers = d.pop("rsync_delete_workers")
+            if "rsync_delete_strategy" in d:
+                d["backend"].delete_strategy = d.pop("rsync_delete_strategy")
+            if "rsync_link_dest_policy" in d:
+                d["backend"].link_dest_policy = d.pop("rsync_link_dest_policy")
+            if "rsync_link_dest_count" in d:
+                d["backend"].link_dest_count = d.pop("rsync_link_dest_count")
+            if "rsync_shards" in d:
+                d["backend"].shards = d.pop("rsync_shards")
+            if "rsync_shard_workers" in d:
+                d["backend"].shard_workers = d.pop("rsync_shard_workers")
+            if "rsync_exit_policy" in d:
+                d["backend"].exit_policy = {
+                    **DEFAULT_EXIT_POLICY,
+                    **d.pop("rsync_exit_policy"),
+                }
+            if "rsync_change_source" in d:
+                d["backend"].change_source = d.pop("rsync_change_source")
+            return d
+
         return vlp.Schema(
             vlp.All(
-                {vlp.Optional("rsync_extra_opts"): vlp.Any(str, [str])},
+                {
+                    vlp.Optional("rsync_extra_opts"): vlp.Any(str, [str]),
+                    vlp.Optional("rsync_delete_workers"): vlp.All(int, vlp.Range(min=1)),
+                    vlp.Optional("rsync_delete_strategy"): vlp.In(DELETE_STRATEGIES),
+                    vlp.Optional("rsync_link_dest_policy"): vlp.In(LINK_DEST_POLICIES),
+                    vlp.Optional("rsync_link_dest_count"): vlp.All(
+                        int, vlp.Range(min=1, max=MAX_LINK_DESTS)
+                    ),
+                    vlp.Optional("rsync_shards"): vlp.In(rsyncshard.SHARD_MODES),
+                    vlp.Optional("rsync_shard_workers"): vlp.All(int, vlp.Range(min=1)),
+                    vlp.Optional("rsync_exit_policy"): vlp.Schema(
+                        {vlp.All(vlp.Coerce(int), vlp.Range(min=1, max=255)): vlp.In(EXIT_ACTIONS)},
+                        extra=vlp.PREVENT_EXTRA,
+                    ),
+                    vlp.Optional("rsync_change_source"): vlp.In(changejournal.CHANGE_SOURCES),
+                },
                 _promote_options_to_list_of_strings,
                 _rename_key_extra_opts,
+                _apply_to_backend,
             ),
             extra=vlp.ALLOW_EXTRA,
         )
 
-    def create(self, backup: bckp.Backup, timeframe: Timeframe, name: str) -> bckp.BackupArtifact:
-        locator = self._exec_backup(backup, name, timeframe)
+    def create_artifact(
+        self, backup: bckp.Backup, timeframe: Timeframe, name: str
+    ) -> bckp.BackupArtifact:
+        try:
+            locator, metadata = self._exec_backup(backup, name, timeframe)
+        finally:
+            _release_stagings(backup, [f"{STAGING_PREFIX}{name}"])
         path = locator.path if isinstance(locator, SSHTarget) else locator
-        return bckp.BackupArtifact(name, timeframe.name, bckp.backup_to_datetime(name), str(path))
+        return bckp.BackupArtifact(
+            name, timeframe.name, bckp.backup_to_datetime(name), str(path), metadata=metadata
+        )
 
-    def delete(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+    def delete_artifacts(self, backup: bckp.Backup, artifacts: list[bckp.BackupArtifact]) -> None:
+        """Delete `artifacts`, all of them even if some cannot be deleted. The
+        failure for every one that could not be deleted is logged, and then a
+        `BackupError` is raised.
+        """
         if isinstance(backup.dst_dir, SSHTarget):
-            for artifact in artifacts:
-                path = Path(artifact.locator)
-                subprocess.run(
-                    backup.dst_dir.openssh_cmd(["rm", "-r", "-f", "--", path]), check=True
-                )
+            failures = _rsync_delete_remote(
+                backup.dst_dir,
+                [Path(artifact.locator) for artifact in artifacts],
+                backup.name,
+                self.delete_workers,
+                self.delete_strategy,
+            )
         else:
-            for artifact in artifacts:
-                rmtree(artifact.locator)
+            failures = _rsync_delete_local(backup, artifacts, self.delete_workers)
+        for index, error in sorted(failures.items()):
+            logger.error(f"cannot delete backup {artifacts[index].locator}: {error}")
+        if failures:
+            raise bckp.BackupError(
+                f"cannot delete {len(failures)} of {len(artifacts)} backups of '{backup.name}'"
+            )
 
     def _exec_backup(
         self, backup: bckp.Backup, backup_basename: str, timeframe: Timeframe
-    ) -> Path | SSHTarget:
+    ) -> tuple[Path | SSHTarget, dict[str, ty.Any]]:
         """Execute a single backup for `backup` in the timeframe `timeframe`. This
         function automatically deals with if the backup is local-to-local,
         local-to-remote, or remote-to-local. If existing backups for this backup
-        already exist, then the latest one is used with rsync's --link-dest
-        option, which allows for incremental backups.
+        already exist, then some of them are used with rsync's --link-dest
+        option, which allows for incremental backups. Returns the backup and
+        its metadata.
+
+        rsync transfers into a staging directory in the dst_dir, see
+        `_staging()`, which is renamed to `backup_basename` once rsync
+        succeeded. If rsync fails then the staging directory is kept, for the
+        next backup to resume from. If the changes since the newest backup are
+        known, then only they are transferred, see `_journal_changes()`.
         """
-        rsync_cmd = ["rsync", "--verbose", "--archive", "--numeric-ids", "--delete"]
+        rsync_cmd = ["rsync", "--stats", "--archive", "--numeric-ids", "--delete", "--partial"]
         if self.extra_opts:
             rsync_cmd += self.extra_opts
 
         backups = self.collect(backup)  # note that we dont pass timeframe here
-        if backups:
-            rsync_cmd += [f"--link-dest={backups[0].locator}"]
+        link_dests = _rsync_link_dests(
+            backups, timeframe, self.link_dest_policy, self.link_dest_count
+        )
+        rsync_cmd += [f"--link-dest={link_dest.locator}" for link_dest in link_dests]
 
         if isinstance(backup.dst_dir, SSHTarget):
-            rsync_cmd += ["-e", "ssh " + backup.dst_dir.openssh_opts(string=True)]
-            dst_dir = Path(_rsync_translate_sshtarget(backup.dst_dir)).joinpath(backup_basename)
-        else:
-            dst_dir = backup.dst_dir.joinpath(backup_basename)
+            assert isinstance(backup.src_dir, Path)
+            target, compressor = transport.transfer_settings(
+                backup.dst_dir, local_dir=backup.src_dir
+            )
+            rsync_cmd += ["-e", "ssh " + target.openssh_opts(string=True)]
+            if compressor is not None:
+                rsync_cmd += compressor.rsync_opts()
 
         if isinstance(backup.src_dir, SSHTarget):
-            rsync_cmd += ["-e", "ssh " + backup.src_dir.openssh_opts(string=True)]
+            target, compressor = transport.transfer_settings(backup.src_dir)
+            rsync_cmd += ["-e", "ssh " + target.openssh_opts(string=True)]
+            if compressor is not None:
+                rsync_cmd += compressor.rsync_opts()
             src_dir: str | Path = _rsync_translate_sshtarget(backup.src_dir)
         else:
             src_dir = backup.src_dir
 
-        rsync_cmd += [f"{src_dir}/", f"{dst_dir}/"]
+        staging, resumed = self._staging(backup, backup_basename)
+        if isinstance(staging, SSHTarget):
+            staging_dst: str | Path = _rsync_translate_sshtarget(staging)
+        else:
+            staging_dst = staging
 
+        metadata: dict[str, ty.Any] = {"link_dests": [link_dest.name for link_dest in link_dests]}
+        if isinstance(backup.src_dir, Path):
+            metadata["src_watermark"] = time.time_ns()
+        journal = changejournal.journal(backup) if self.change_source == "inotify" else None
+        checkpoint = None
+        if journal is not None:
+            checkpoint = journal.checkpoint()
+            metadata["rsync_journal"] = {"session": journal.session, "checkpoint": checkpoint}
+        changes = self._journal_changes(backup, backups, staging, journal, checkpoint)
+        start = time.monotonic()
         try:
-            subprocess.run(rsync_cmd, check=True)
+            if changes is not None:
+                assert isinstance(backup.src_dir, Path) and isinstance(staging, Path)
+                counters, exit_code = self._exec_journaled(
+                    rsync_cmd, backup.src_dir, Path(backups[0].locator), staging, changes
+                )
+                exit_codes = [exit_code] if exit_code else []
+                metadata["rsync_journal"]["changed_dirs"] = len(changes.dirty | changes.new_dirs)
+            elif self.shards != "none":
+                counters, exit_codes = self._exec_sharded(
+                    backup, rsync_cmd, src_dir, staging_dst, backups, metadata
+                )
+            else:
+                counters, exit_code = _rsync_run_tolerant(
+                    [*rsync_cmd, f"{src_dir}/", f"{staging_dst}/"], self._exit_tolerated
+                )
+                exit_codes = [exit_code] if exit_code else []
         except subprocess.CalledProcessError:
-            if not isinstance(backup.dst_dir, SSHTarget) and dst_dir.exists():
-                rmtree(dst_dir)
+            logger.warning(f"backup {backup_basename} failed, keeping {staging} to resume from")
             raise
 
-        if isinstance(backup.dst_dir, SSHTarget):
-            return backup.dst_dir.with_path(backup.dst_dir.path.joinpath(backup_basename))
-        return dst_dir
+        if exit_codes:
+            metadata["partial"] = True
+            metadata["rsync_exit_codes"] = sorted(set(exit_codes))
+            for exit_code in metadata["rsync_exit_codes"]:
+                message = f"backup {backup_basename} is partial, rsync exited with {exit_code}"
+                if self.exit_policy[exit_code] == "warn":
+                    logger.warning(message)
+                else:
+                    logger.info(message)
+
+        if isinstance(staging, SSHTarget):
+            locator: Path | SSHTarget = staging.with_path(staging.path.with_name(backup_basename))
+            staging.rename(staging.path, locator.path)
+        else:
+            locator = staging.with_name(backup_basename)
+            os.rename(staging, locator)
+        if journal is not None and checkpoint is not None:
+            journal.release(checkpoint)
+
+        stats = RsyncStats.from_counters(
+            counters,
+            time.monotonic() - start,
+            bool(link_dests),
+            exact=changes is None and not resumed,
+        )
+        metadata["rsync_stats"] = {**dataclasses.asdict(stats), "rate": stats.rate}
+        if link_dests and stats.files and stats.hardlinked_files is not None:
+            metadata["link_dest_hit_rate"] = stats.hardlinked_files / stats.files
+        logger.info(f"backup {backup_basename}: {stats.describe()}")
+        return locator, metadata
+
+    def source_unchanged(self, backup: bckp.Backup, artifact: bckp.BackupArtifact) -> bool:
+        if artifact.metadata.get("partial"):
+            return False
+        journal = changejournal.journal(backup) if self.change_source == "inotify" else None
+        recorded = artifact.metadata.get("rsync_journal")
+        if journal is not None and recorded is not None:
+            changes = journal.changes(recorded["session"], recorded["checkpoint"])
+            if changes is not None:
+                return not changes.dirty and not changes.new_dirs
+        watermark = artifact.metadata.get("src_watermark")
+        if watermark is None or not isinstance(backup.src_dir, Path):
+            return False
+        return not _rsync_changed_since(backup.src_dir, watermark - _CTIME_SLACK_NS)
+
+    def _exit_tolerated(self, exit_code: int) -> bool:
+        """Return True if the rsync exit code `exit_code` does not fail a backup."""
+        return self.exit_policy.get(exit_code, "fail") != "fail"
+
+    def _journal_changes(
+        self,
+        backup: bckp.Backup,
+        backups: list[bckp.BackupArtifact],
+        staging: Path | SSHTarget,
+        journal: changejournal.ChangeJournal | None,
+        checkpoint: int | None,
+    ) -> changejournal.ChangeSet | None:
+        """Return the changes to the src_dir of `backup` that `journal`
+        recorded between the checkpoint of the newest of `backups` and
+        `checkpoint`, or None if the new backup has to walk the src_dir. It has
+        to if the backups are not local-to-local, if the newest backup is
+        partial or was not taken with `journal`, if `staging` was resumed from a
+        failed backup, or if the journal may have missed changes.
+        """
+        if journal is None or checkpoint is None:
+            return None
+        reason = None
+        if backup.backup_type != "local_to_local":
+            reason = "it is not local-to-local"
+        elif not backups:
+            reason = "there is no earlier backup"
+        elif backups[0].metadata.get("partial"):
+            reason = f"backup {backups[0].name} is partial"
+        elif "rsync_journal" not in backups[0].metadata:
+            reason = f"backup {backups[0].name} has no change journal checkpoint"
+        elif isinstance(staging, Path) and any(staging.iterdir()):
+            reason = "it resumes a failed backup"
+        else:
+            base = backups[0].metadata["rsync_journal"]
+            changes = journal.changes(base["session"], base["checkpoint"], checkpoint)
+            if changes is not None:
+                return changes
+            reason = f"changes since backup {backups[0].name} may have been missed"
+        logger.info(f"walking {backup.src_dir} for backup '{backup.name}', as {reason}")
+        return None
+
+    def _exec_journaled(
+        self,
+        rsync_cmd: list[str],
+        src_dir: Path,
+        base: Path,
+        staging: Path,
+        changes: changejournal.ChangeSet,
+    ) -> tuple[dict[str, int], int]:
+        """Fill `staging` with hardlinks into the backup `base` for what did
+        not change in `src_dir` according to `changes`, and transfer the rest
+        with `rsync_cmd` and --files-from. Returns the rsync statistics and its
+        exit code, as `_rsync_run_tolerant()`.
+        """
+        paths = changejournal.prefill(src_dir, base, staging, changes)
+        counters: dict[str, int] = {}
+        exit_code = 0
+        if paths:
+            with tempfile.NamedTemporaryFile(prefix="yaesm-rsync-files-") as files_from:
+                files_from.write(b"".join(os.fsencode(path) + b"\0" for path in paths))
+                files_from.flush()
+                counters, exit_code = _rsync_run_tolerant(
+                    [
+                        *rsync_cmd,
+                        "--recursive",
+                        "--from0",
+                        f"--files-from={files_from.name}",
+                        f"{src_dir}/",
+                        f"{staging}/",
+                    ],
+                    self._exit_tolerated,
+                )
+        changejournal.copy_dir_attrs(src_dir, staging, changes.dirty)
+        return counters, exit_code
+
+    def _staging(self, backup: bckp.Backup, backup_basename: str) -> tuple[Path | SSHTarget, bool]:
+        """Return the staging directory of the backup `backup_basename` of
+        `backup` in its dst_dir, creating it if needed, and whether it was
+        resumed. If earlier backups of `backup` failed and left their staging
+        directories behind, then the newest one is renamed to be this one, so
+        that rsync resumes from what it transferred already, and the others are
+        deleted.
+
+        The staging directory is claimed until `create_artifact()` returns,
+        and the staging directories claimed by backups of other timeframes of
+        `backup` running meanwhile are neither resumed from nor deleted.
+        """
+        dst_dir = backup.dst_dir
+        pattern = bckp.backup_basename_re(backup)
+        staging_name = f"{STAGING_PREFIX}{backup_basename}"
+        with _staging_lock(backup):
+            live = _live_stagings.setdefault(backup.name, set())
+            live.add(staging_name)
+            leftovers = sorted(
+                (
+                    name
+                    for name in bckp.dst_dir_listing(
+                        dst_dir,
+                        [
+                            STAGING_PREFIX + glob
+                            for glob in bckp.backup_basename_globs(backup, backup.timeframes)
+                        ],
+                    )
+                    if pattern.match(name.removeprefix(STAGING_PREFIX))
+                    and (name == staging_name or name not in live)
+                ),
+                key=lambda name: bckp.backup_to_datetime(name.removeprefix(STAGING_PREFIX)),
+                reverse=True,
+            )
+            live.update(leftovers)
+        if leftovers and leftovers[0] != staging_name:
+            logger.info(f"resuming backup {backup_basename} from {leftovers[0]}")
+        try:
+            return self._claim_staging(backup, staging_name, leftovers), bool(leftovers)
+        finally:
+            _release_stagings(backup, [name for name in leftovers if name != staging_name])
+
+    def _claim_staging(
+        self, backup: bckp.Backup, staging_name: str, leftovers: list[str]
+    ) -> Path | SSHTarget:
+        """Make `staging_name` the staging directory of `backup`, out of the
+        newest of the claimed `leftovers` if any, and delete the others.
+        """
+        dst_dir = backup.dst_dir
+        if isinstance(dst_dir, SSHTarget):
+            staging = dst_dir.with_path(dst_dir.path.joinpath(staging_name))
+            if leftovers:
+                if leftovers[0] != staging_name:
+                    dst_dir.rename(dst_dir.path.joinpath(leftovers[0]), staging.path)
+                if leftovers[1:]:
+                    paths = [dst_dir.path.joinpath(name) for name in leftovers[1:]]
+                    dst_dir.run(["rm", "-r", "-f", "--", *paths], check=True)
+            else:
+                staging.mkdir(check=True)
+            return staging
+        staging_path = dst_dir.joinpath(staging_name)
+        if leftovers:
+            if leftovers[0] != staging_name:
+                os.rename(dst_dir.joinpath(leftovers[0]), staging_path)
+            for name in leftovers[1:]:
+                treedelete.delete_tree(dst_dir.joinpath(name), self.delete_workers)
+        else:
+            staging_path.mkdir()
+        return staging_path
+
+    def _exec_sharded(
+        self,
+        backup: bckp.Backup,
+        rsync_cmd: list[str],
+        src_dir: str | Path,
+        staging_dst: str | Path,
+        backups: list[bckp.BackupArtifact],
+        metadata: dict[str, ty.Any],
+    ) -> tuple[dict[str, int], list[int]]:
+        """Transfer `src_dir` of `backup` into `staging_dst` in shards, each with
+        `rsync_cmd`, see the yaesm.backend.rsyncshard module. The estimates of
+        the 'balanced' shard mode are taken from the newest of `backups` that
+        has them. Returns the summed rsync statistics of the shards and the
+        tolerated exit codes of those that were partial, and records the shards
+        in `metadata`. Raises `subprocess.CalledProcessError` if a shard failed.
+        """
+        names = rsyncshard.top_level_dirs(backup.src_dir)
+        if self.shards == "balanced":
+            cached = next(
+                (
+                    artifact.metadata["rsync_shard_estimate"]
+                    for artifact in backups
+                    if "rsync_shard_estimate" in artifact.metadata
+                ),
+                {},
+            )
+            estimate = {name: cached[name] for name in names if name in cached}
+            estimate |= rsyncshard.measure(
+                backup.src_dir, [name for name in names if name not in cached]
+            )
+        else:
+            estimate = dict.fromkeys(names, 1)
+        shards = rsyncshard.plan(estimate, self.shards, self.shard_workers)
+
+        with tempfile.TemporaryDirectory(prefix="yaesm-rsync-") as tmp:
+            # The rsync of what is in no shard runs first, as it holds the top
+            # level files, which the shards cannot be balanced against.
+            rsync_cmds = []
+            for i, shard in enumerate([None, *shards]):
+                rules = Path(tmp).joinpath(f"shard{i}")
+                rules.write_text(
+                    "".join(f"{rule}\n" for rule in rsyncshard.filter_rules(shard, shards)),
+                    encoding="utf-8",
+                    errors="surrogateescape",
+                )
+                rsync_cmds.append(
+                    [*rsync_cmd, f"--filter=merge {rules}", f"{src_dir}/", f"{staging_dst}/"]
+                )
+            results = _rsync_run_all(rsync_cmds, self.shard_workers, self._exit_tolerated)
+
+        shard_stats = [stats for stats, _ in results]
+        metadata["rsync_shards"] = len(shard_stats)
+        if self.shards == "balanced":
+            # Every shard counts its top directory, which is no directory of it.
+            counts = [max(stats.get("number_of_files", 1) - 1, 0) for stats in shard_stats[1:]]
+            metadata["rsync_shard_estimate"] = rsyncshard.refine_estimate(estimate, shards, counts)
+        keys = {key for stats in shard_stats for key in stats}
+        counters = {key: sum(stats.get(key, 0) for stats in shard_stats) for key in sorted(keys)}
+        return counters, [exit_code for _, exit_code in results if exit_code]
+
+
+def _staging_lock(backup: bckp.Backup) -> threading.Lock:
+    """Return the lock to hold while listing and claiming the staging
+    directories of `backup`.
+    """
+    with _staging_locks_lock:
+        return _staging_locks.setdefault(backup.name, threading.Lock())
+
+
+def _release_stagings(backup: bckp.Backup, names: list[str]) -> None:
+    """Release the claims of `backup` on the staging directories `names`."""
+    with _staging_lock(backup):
+        _live_stagings.get(backup.name, set()).difference_update(names)
+
+
+def _rsync_link_dests(
+    backups: list[bckp.BackupArtifact], timeframe: Timeframe, policy: str, count: int | None
+) -> list[bckp.BackupArtifact]:
+    """Return the backups among `backups` (ordered from newest to oldest) to
+    pass to rsync with --link-dest for a new backup in `timeframe`, in the order
+    rsync should try them, which depend on the `policy`.
+
+    - 'newest': the newest `count` (by default 1) backups.
+    - 'per_timeframe': the newest backup of every timeframe, newest first.
+    - 'same_timeframe_first': the backups of `timeframe` and then the others,
+      both newest first.
+
+    There are at most `count` (by default `MAX_LINK_DESTS`) of them.
+    """
+    if policy == "per_timeframe":
+        newest: dict[str, bckp.BackupArtifact] = {}
+        for artifact in backups:
+            newest.setdefault(artifact.timeframe, artifact)
+        candidates = list(newest.values())
+    elif policy == "same_timeframe_first":
+        candidates = [artifact for artifact in backups if artifact.timeframe == timeframe.name]
+        candidates += [artifact for artifact in backups if artifact.timeframe != timeframe.name]
+    else:
+        candidates = backups[: count or 1]
+    # Aliases share the locator of the backup they alias.
+    unique: dict[str, bckp.BackupArtifact] = {}
+    for artifact in candidates:
+        unique.setdefault(artifact.locator, artifact)
+    return list(unique.values())[: min(count or MAX_LINK_DESTS, MAX_LINK_DESTS)]
+
+
+def _rsync_changed_since(src_dir: Path, ctime_ns: int) -> bool:
+    """Return True if `src_dir` or anything under it has a ctime of at least
+    `ctime_ns`, or cannot be inspected. Creating, deleting or renaming an entry
+    changes the ctime of its directory, so the directories are checked first,
+    which only stats the directories, and the other files are only statted if
+    none of the directories changed. Either pass returns on the first change.
+    """
+    try:
+        if os.lstat(src_dir).st_ctime_ns >= ctime_ns:
+            return True
+        dirs = [src_dir]
+        for directory in dirs:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.stat(follow_symlinks=False).st_ctime_ns >= ctime_ns:
+                            return True
+                        dirs.append(Path(entry.path))
+        for directory in dirs:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if (
+                        not entry.is_dir(follow_symlinks=False)
+                        and entry.stat(follow_symlinks=False).st_ctime_ns >= ctime_ns
+                    ):
+                        return True
+    except OSError:
+        return True
+    return False
+
+
+def _rsync_run(rsync_cmd: list[str]) -> dict[str, int]:
+    """Run `rsync_cmd`, which should include --stats, passing its output but
+    the statistics on to stdout. Returns the statistics rsync reported, see
+    `_rsync_parse_stats()`. Raises `RsyncError` if rsync fails.
+    """
+    stats_lines = []
+    with subprocess.Popen(
+        rsync_cmd, stdout=subprocess.PIPE, encoding="utf-8", errors="replace"
+    ) as proc:
+        assert proc.stdout is not None
+        # rsync prints a blank line before the statistics, so blank lines are
+        # only passed on once it is clear they are not that one.
+        blank = ""
+        for line in proc.stdout:
+            if stats_lines or _STATS_HEADER_RE.match(line):
+                stats_lines.append(line)
+                blank = ""
+                continue
+            sys.stdout.write(blank)
+            blank = ""
+            if line.strip():
+                sys.stdout.write(line)
+            else:
+                blank = line
+        sys.stdout.write(blank)
+    if proc.returncode != 0:
+        raise RsyncError(proc.returncode, rsync_cmd, _rsync_parse_stats(stats_lines))
+    return _rsync_parse_stats(stats_lines)
+
+
+def _rsync_run_tolerant(
+    rsync_cmd: list[str], tolerated: ty.Callable[[int], bool]
+) -> tuple[dict[str, int], int]:
+    """Like `_rsync_run()`, but return the statistics along with the exit code
+    of rsync, which may be non-zero if `tolerated` returns True for it.
+    """
+    try:
+        return _rsync_run(rsync_cmd), 0
+    except subprocess.CalledProcessError as exc:
+        if not tolerated(exc.returncode):
+            raise
+        return getattr(exc, "counters", {}), exc.returncode
+
+
+def _rsync_run_all(
+    rsync_cmds: list[list[str]], workers: int, tolerated: ty.Callable[[int], bool]
+) -> list[tuple[dict[str, int], int]]:
+    """Run every one of `rsync_cmds` with `_rsync_run_tolerant()`, `workers` at
+    a time, and return their statistics and exit codes in order. Once one fails
+    no more are started, and the first failure is raised once those running
+    finished.
+    """
+    failed = threading.Event()
+
+    def run(rsync_cmd: list[str]) -> tuple[dict[str, int], int]:
+        if failed.is_set():
+            return {}, 0
+        try:
+            return _rsync_run_tolerant(rsync_cmd, tolerated)
+        except subprocess.CalledProcessError:
+            failed.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, rsync_cmd) for rsync_cmd in rsync_cmds]
+    for future in futures:
+        error = future.exception()
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
+
+
+def _rsync_parse_stats(lines: ty.Iterable[str]) -> dict[str, int]:
+    """Parse the counters in the --stats output `lines` of rsync, such as
+    'Number of files: 1,234 (reg: 1,000, dir: 234)', into a dict such as
+    {'number_of_files': 1234, 'number_of_files_reg': 1000, 'number_of_files_dir': 234}.
+    Other lines are ignored.
+    """
+    stats = {}
+    for line in lines:
+        match = _STATS_RE.match(line.strip())
+        if match is None:
+            continue
+        key = match.group(1).lower().replace(" ", "_")
+        stats[key] = int(match.group(2).replace(",", ""))
+        for detail, value in _STATS_DETAIL_RE.findall(match.group(3) or ""):
+            stats[f"{key}_{detail}"] = int(value.replace(",", ""))
+    return stats
+
+
+def _rsync_delete_local(
+    backup: bckp.Backup, artifacts: list[bckp.BackupArtifact], workers: int
+) -> dict[int, str]:
+    """Move the local `artifacts` into the trash and delete them, along with
+    the leftovers of `backup` in the trash, with `workers` threads. Returns the
+    error for every artifact that could not be deleted, by its index.
+    """
+    assert isinstance(backup.dst_dir, Path)
+    failures: dict[int, str] = {}
+    trashed: dict[int, Path] = {}
+    for index, artifact in enumerate(artifacts):
+        try:
+            trashed[index] = treedelete.move_to_trash(Path(artifact.locator))
+        except OSError as exc:
+            failures[index] = str(exc)
+    timeframes = tframe_types(names=True)
+    basename_re = bckp.backup_basename_re(backup)
+
+    def is_leftover(name: str) -> bool:
+        # the timeframe is checked too, or the backups of a backup named
+        # '<name>-x' would match as well
+        match = basename_re.match(name)
+        return match is not None and match.group(2) in timeframes
+
+    for path in treedelete.trash_contents(backup.dst_dir, is_leftover):
+        if path in trashed.values():
+            continue
+        try:
+            treedelete.delete_tree(path, workers)
+        except OSError as exc:
+            logger.warning(f"cannot delete {path}: {exc}")
+    for index, path in trashed.items():
+        try:
+            treedelete.delete_tree(path, workers)
+        except OSError as exc:
+            failures[index] = str(exc)
+    return failures
+
+
+def _rsync_delete_remote(
+    dst_dir: SSHTarget, paths: list[Path], backup_name: str, workers: int, strategy: str
+) -> dict[int, str]:
+    """Move the `paths` on the server of `dst_dir` into the trash of `dst_dir`
+    and delete them, along with the backups of `backup_name` left in the trash,
+    `workers` at a time with `strategy` (see `DELETE_STRATEGIES`). This is all
+    done with a single remote command. Returns the error for every path that
+    could not be deleted, by its index. Raises `subprocess.CalledProcessError`
+    if the remote command failed as a whole.
+    """
+    trash = dst_dir.path.joinpath(treedelete.TRASH_BASENAME)
+    p = dst_dir.run(
+        ["sh", "-c", _DELETE_REMOTE_SCRIPT, "sh", strategy, str(workers), trash]
+        + [uuid.uuid4().hex, backup_name, " ".join(tframe_types(names=True)), *paths],
+        capture_output=True,
+        encoding="utf-8",
+    )
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, p.args, p.stdout, p.stderr)
+    failures = dict.fromkeys(range(len(paths)), "no result from the server")
+    for line in p.stdout.splitlines():
+        status, _, rest = line.partition(" ")
+        number, _, error = rest.partition(" ")
+        if not number.isdigit():
+            continue
+        index = int(number) - 1
+        if index < 0:
+            if status == "failed":
+                logger.warning(f"cannot delete leftover in {trash} on {dst_dir.host}: {error}")
+        elif status == "ok":
+            failures.pop(index, None)
+        elif status == "failed":
+            failures[index] = error.strip()
+    return failures
 
 
 def _rsync_translate_sshtarget(sshtarget: SSHTarget) -> str:
@@ -0,0 +1,136 @@
+"""src/yaesm/backend/rsyncshard.py.
+
+A single rsync walks and transfers a whole source tree serially, so on trees of
+many small files over a high latency link it is bound by round trips and by one
+core. RsyncBackend can instead split the source into shards, and run one rsync
+per shard concurrently into the same backup. A shard is a set of directories at
+the top of the source, selected with the rsync filter rules of
+`filter_rules()`. Everything that is in no shard, such as the files at the top
+of the source and directories created meanwhile, is transferred by one more
+rsync that excludes the directories of every shard, so that nothing is left out.
+
+In the 'top_level' mode every top level directory is a shard. In the 'balanced'
+mode the directories are packed into shards by their estimated file counts, see
+`plan()`. Estimates are measured with `measure()` once per directory, cached in
+the metadata of the backups, and rescaled after every backup to the file counts
+rsync reported with `refine_estimate()`.
+"""
+
+import os
+import re
+from pathlib import Path
+
+from yaesm.sshtarget import SSHTarget
+
+SHARD_MODES = ["none", "top_level", "balanced"]
+DEFAULT_WORKERS = 4
+
+# Run with the arguments DIR NAME... to print a NUL-delimited name and file
+# count record for every directory NAME in DIR.
+_MEASURE_SCRIPT = r"""
+cd -- "$1" || exit 1
+shift
+for name in "$@"; do
+    printf '%s\0%s\0' "$name" "$(find "./$name" 2>/dev/null | wc -l)"
+done
+"""
+
+
+def top_level_dirs(src_dir: Path | SSHTarget) -> list[str]:
+    """Return the sorted names of the directories directly in `src_dir`,
+    without following symlinks. Names with a newline cannot be written in a
+    filter rule, so they are left out, to be transferred with the files.
+    """
+    if isinstance(src_dir, SSHTarget):
+        names = src_dir.list_dirs()
+    else:
+        with os.scandir(src_dir) as entries:
+            names = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)]
+    return sorted(name for name in names if "\n" not in name)
+
+
+def measure(src_dir: Path | SSHTarget, names: list[str]) -> dict[str, int]:
+    """Return the number of files in each of the directories `names` of
+    `src_dir`, counting the directory itself. Raises
+    `subprocess.CalledProcessError` if a remote `src_dir` cannot be measured.
+    """
+    if not names:
+        return {}
+    if isinstance(src_dir, SSHTarget):
+        p = src_dir.run(
+            ["sh", "-c", _MEASURE_SCRIPT, "sh", src_dir.path, *names],
+            check=True,
+            capture_output=True,
+            encoding="utf-8",
+        )
+        fields = p.stdout.split("\0")
+        return {fields[i]: int(fields[i + 1]) for i in range(0, len(fields) - 1, 2)}
+    return {name: _count_files(src_dir.joinpath(name)) for name in names}
+
+
+def _count_files(path: Path) -> int:
+    count = 1
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    count += 1
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+        except OSError:
+            continue
+    return count
+
+
+def plan(estimate: dict[str, int], mode: str, workers: int) -> list[list[str]]:
+    """Return the shards for the directories in `estimate`, which maps their
+    names to their estimated file counts, in the shard `mode`. In the 'balanced'
+    mode they are packed into at most `workers` shards, every directory from the
+    largest to the smallest onto the shard with the fewest files so far.
+    """
+    names = sorted(estimate)
+    if mode == "top_level":
+        return [[name] for name in names]
+    shards: list[list[str]] = [[] for _ in range(min(workers, len(names)))]
+    loads = [0] * len(shards)
+    for name in sorted(names, key=lambda name: (-estimate[name], name)):
+        i = loads.index(min(loads))
+        shards[i].append(name)
+        loads[i] += max(estimate[name], 1)
+    return [sorted(shard) for shard in shards]
+
+
+def filter_rules(shard: list[str] | None, shards: list[list[str]]) -> list[str]:
+    """Return the rsync filter rules that select the directories of `shard`
+    at the top of the source. If `shard` is None, then return the rules that
+    select everything but the directories of all of `shards`.
+    """
+    if shard is None:
+        return [f"- /{_escape(name)}/" for other in shards for name in other]
+    return [*(f"+ /{_escape(name)}/" for name in shard), "- /*"]
+
+
+def _escape(name: str) -> str:
+    """Escape `name` for a filter rule. Backslashes are only special in rules
+    with wildcards, so only names with wildcard characters are escaped.
+    """
+    if any(c in name for c in "*?["):
+        return re.sub(r"([*?[\\])", r"\\\1", name)
+    return name
+
+
+def refine_estimate(
+    estimate: dict[str, int], shards: list[list[str]], counts: list[int]
+) -> dict[str, int]:
+    """Return `estimate` with the estimates of the directories of every one of
+    `shards` rescaled so that they add up to the file count of the shard in
+    `counts`.
+    """
+    refined = dict(estimate)
+    for shard, count in zip(shards, counts, strict=True):
+        total = sum(estimate[name] for name in shard)
+        if total:
+            for name in shard:
+                refined[name] = max(1, round(estimate[name] * count / total))
+    return refined
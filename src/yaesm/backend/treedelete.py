@@ -0,0 +1,151 @@
+"""src/yaesm/backend/treedelete.py.
+
+Deleting a directory tree is dominated by metadata system calls, one per file
+and directory, which `shutil.rmtree()` makes one at a time. `delete_tree()`
+instead deletes a tree with several threads: every directory is scanned by one
+thread, which unlinks its files and hands its subdirectories to the others.
+Directories are opened relative to their parent's directory file descriptor and
+their entries are unlinked relative to their own, so that paths are not resolved
+again for every entry, and so that a directory replaced by a symlink halfway is
+never followed.
+
+A tree is first renamed into the `TRASH_BASENAME` directory next to it with
+`move_to_trash()`, which is atomic, so that it is gone from its directory at
+once however long deleting it takes. Trees left in the trash by an interrupted
+deletion are found again with `trash_contents()`.
+"""
+
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import yaesm.ty as ty
+
+TRASH_BASENAME = ".yaesm-trash"
+DEFAULT_WORKERS = min(8, 2 * (os.cpu_count() or 1))
+
+_OPEN_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+
+
+class _Dir:
+    """A directory being deleted. `pending` counts the scan of the directory
+    and those of its subdirectories that are not yet deleted, and the directory
+    itself is removed once it drops to zero. `fd` is open from the scan until
+    then, for the subdirectories to be opened and removed relative to.
+    """
+
+    __slots__ = ("parent", "name", "fd", "pending")
+
+    def __init__(self, parent: "_Dir | None", name: str) -> None:
+        self.parent = parent
+        self.name = name
+        self.fd: int | None = None
+        self.pending = 1
+
+
+class _TreeDeleter:
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self._cond = threading.Condition()
+        # Scanned last in first out, so that the directories open at once are
+        # about those on the paths being worked on rather than a whole level.
+        self._stack: list[_Dir] = []
+        self._done = False
+        self._errors: list[OSError] = []
+
+    def run(self, path: Path) -> None:
+        self._stack.append(_Dir(None, str(path)))
+        threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stack and not self._done:
+                    self._cond.wait()
+                if self._done:
+                    return
+                directory = self._stack.pop()
+            self._scan(directory)
+
+    def _scan(self, directory: _Dir) -> None:
+        """Unlink the files in `directory`, and queue its subdirectories."""
+        parent_fd = None if directory.parent is None else directory.parent.fd
+        subdirs = []
+        try:
+            directory.fd = os.open(directory.name, _OPEN_FLAGS, dir_fd=parent_fd)
+            with os.scandir(directory.fd) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(_Dir(directory, entry.name))
+                    else:
+                        os.unlink(entry.name, dir_fd=directory.fd)
+        except OSError as exc:
+            self._errors.append(exc)
+        with self._cond:
+            directory.pending += len(subdirs)
+            self._stack += subdirs
+            self._cond.notify(len(subdirs))
+        self._release(directory)
+
+    def _release(self, directory: _Dir | None) -> None:
+        """Count one of the pending tasks of `directory` as finished, and
+        remove it, and then its parents in turn, once they have none left.
+        """
+        while directory is not None:
+            with self._cond:
+                directory.pending -= 1
+                if directory.pending:
+                    return
+            if directory.fd is not None:
+                os.close(directory.fd)
+            parent_fd = None if directory.parent is None else directory.parent.fd
+            try:
+                os.rmdir(directory.name, dir_fd=parent_fd)
+            except OSError as exc:
+                self._errors.append(exc)
+            if directory.parent is None:
+                with self._cond:
+                    self._done = True
+                    self._cond.notify_all()
+            directory = directory.parent
+
+
+def delete_tree(path: Path, workers: int = DEFAULT_WORKERS) -> None:
+    """Delete the directory `path` and everything under it, like
+    `shutil.rmtree()`, with `workers` threads. Symlinks are deleted, not
+    followed. Raises the first OSError encountered, after deleting everything
+    else that could be deleted.
+    """
+    _TreeDeleter(max(1, workers)).run(path)
+
+
+def move_to_trash(path: Path) -> Path:
+    """Atomically move the directory `path` into the `TRASH_BASENAME` directory
+    of its parent directory, which is created if needed. The moved directory is
+    named after `path` with a unique suffix. Returns its new path.
+    """
+    trash = path.parent.joinpath(TRASH_BASENAME)
+    trash.mkdir(exist_ok=True)
+    trashed = trash.joinpath(f"{path.name}.{uuid.uuid4().hex}")
+    os.rename(path, trashed)
+    return trashed
+
+
+def trash_contents(directory: Path, match: ty.Callable[[str], bool]) -> list[Path]:
+    """Return the paths in the `TRASH_BASENAME` directory of `directory` that
+    were moved there from a path whose basename satisfies `match`.
+    """
+    try:
+        with os.scandir(directory.joinpath(TRASH_BASENAME)) as entries:
+            names = [entry.name for entry in entries]
+    except FileNotFoundError:
+        return []
+    trash = directory.joinpath(TRASH_BASENAME)
+    return [trash.joinpath(name) for name in sorted(names) if match(name.rpartition(".")[0])]
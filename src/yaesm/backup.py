@@ -1,28 +1,42 @@
 """src/yaesm/backup.py."""
 
+import bisect
 import dataclasses
+import fnmatch
+import functools
+import operator
 import os
 import re
-import subprocess
-from datetime import datetime
+from array import array
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import yaesm.ty as ty
 from yaesm.sshtarget import SSHTarget
 from yaesm.timeframe import Timeframe
 
+_EPOCH = datetime(1970, 1, 1)
+_MINUTE = timedelta(minutes=1)
+
 
 class BackupError(Exception): ...
 
 
 @dataclasses.dataclass(frozen=True)
 class BackupArtifact:
-    """Backend-neutral backup metadata with a backend-defined locator."""
+    """Backend-neutral backup metadata with a backend-defined locator.
+
+    `size` is the size of the artifact in bytes if the backend knows it, and
+    `metadata` holds any other backend-defined details. Neither takes part in
+    comparing or hashing artifacts.
+    """
 
     name: str
     timeframe: str
     created_at: datetime
     locator: str
+    size: int | None = dataclasses.field(default=None, compare=False)
+    metadata: dict[str, ty.Any] = dataclasses.field(default_factory=dict, compare=False)
 
 
 @dataclasses.dataclass
@@ -65,14 +79,28 @@ def backup_basename_re(
     is given, then only match a basename for `backup`. If `timeframe` is given,
     then only match a basename for `timeframe`.
     """
-    backup_name_re_component = ".+" if backup is None else backup.name
-    timeframe_name_re_component = ".+" if timeframe is None else timeframe.name
+    return _basename_re(
+        None if backup is None else backup.name, None if timeframe is None else timeframe.name
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _basename_re(backup_name: str | None, timeframe_name: str | None) -> ty.Pattern[str]:
+    backup_name_re_component = ".+" if backup_name is None else backup_name
+    timeframe_name_re_component = ".+" if timeframe_name is None else timeframe_name
     return re.compile(
         f"^yaesm-({backup_name_re_component})-({timeframe_name_re_component})"
         + "\\.([0-9]{4})_([0-9]{2})_([0-9]{2})_([0-9]{2}):([0-9]{2})$"
     )
 
 
+def _basename(backup_name: str, timeframe_name: str, created_at: datetime) -> str:
+    return (
+        f"yaesm-{backup_name}-{timeframe_name}.{created_at.year:04d}_{created_at.month:02d}"
+        f"_{created_at.day:02d}_{created_at.hour:02d}:{created_at.minute:02d}"
+    )
+
+
 def backup_basename_update_time(backup_basename: str) -> str:
     re_result = backup_basename_re().match(backup_basename)
     assert re_result is not None
@@ -101,9 +129,8 @@ def backup_to_datetime(backup: Path | str | SSHTarget) -> datetime:
         backup_basename = os.path.basename(backup)
     backup_basename_re_match = backup_basename_re().match(backup_basename)
     assert backup_basename_re_match is not None
-    year, month, day, hour, minute = backup_basename_re_match.group(3, 4, 5, 6, 7)
-    dt = datetime.strptime(f"{year}_{month}_{day}_{hour}:{minute}", "%Y_%m_%d_%H:%M")
-    return dt
+    year, month, day, hour, minute = map(int, backup_basename_re_match.group(3, 4, 5, 6, 7))
+    return datetime(year, month, day, hour, minute)
 
 
 def backups_sorted(
@@ -130,46 +157,190 @@ def path_artifacts_collect(
     Remember that all the backups for all the timeframes are
     stored in the same directory.
     """
-    artifacts: list[BackupArtifact] = []
-    backup_basename_res = (
-        [backup_basename_re(backup=backup)]
-        if timeframes is None
-        else [backup_basename_re(backup=backup, timeframe=timeframe) for timeframe in timeframes]
+    listing = dst_dir_listing(backup.dst_dir, backup_basename_globs(backup, timeframes))
+    return path_artifacts_from_listing(backup, listing, timeframes)
+
+
+def backup_basename_globs(backup: Backup, timeframes: list[Timeframe] | None = None) -> list[str]:
+    """Return shell globs matching the basenames of the backups of `backup`, only
+    those in `timeframes` if given. The globs may match more than the backups,
+    but never less.
+    """
+    if timeframes is None:
+        return [f"yaesm-{backup.name}-*"]
+    return [f"yaesm-{backup.name}-{timeframe.name}.*" for timeframe in timeframes]
+
+
+def dst_dir_listing(dst_dir: Path | SSHTarget, globs: list[str] | None = None) -> list[str]:
+    """Return the basenames of all the directories in the local or remote
+    `dst_dir`, only those matching one of the shell `globs` if given. A remote
+    `dst_dir` is filtered on the server.
+    """
+    if isinstance(dst_dir, SSHTarget):
+        return dst_dir.list_dirs(globs=globs)
+    with os.scandir(dst_dir) as entries:
+        return [
+            entry.name
+            for entry in entries
+            if entry.is_dir()
+            and (globs is None or any(fnmatch.fnmatchcase(entry.name, g) for g in globs))
+        ]
+
+
+def path_artifacts_from_listing(
+    backup: Backup, basenames: list[str], timeframes: list[Timeframe] | None = None
+) -> list[BackupArtifact]:
+    """Like `path_artifacts_collect()`, but for the directories in `backup.dst_dir`
+    named `basenames`, as returned by `dst_dir_listing()`.
+    """
+    return list(ArtifactTable.from_listing(backup, basenames, timeframes))
+
+
+def epoch_minutes(dt: datetime) -> int:
+    """Return the number of whole minutes from the epoch to the naive `dt`."""
+    return (dt - _EPOCH) // _MINUTE
+
+
+def _epoch_minutes_ceil(dt: datetime) -> int:
+    return -((_EPOCH - dt) // _MINUTE)
+
+
+def _newer_than(artifacts: ty.Sequence[BackupArtifact], minute: int) -> int:
+    """The number of `artifacts` created after `minute`."""
+    return bisect.bisect_left(
+        artifacts, -minute, key=lambda artifact: -epoch_minutes(artifact.created_at)
     )
-    if isinstance(backup.dst_dir, SSHTarget):
-        sshtarget = backup.dst_dir
-        p = subprocess.run(
-            sshtarget.openssh_cmd(
-                [
-                    "sh",
-                    "-c",
-                    'cd "$1" && find . ! -name . -prune -type d -print',
-                    "sh",
-                    sshtarget.path,
-                ]
-            ),
-            check=True,
-            capture_output=True,
-            encoding="utf-8",
-        )
-        for basename in p.stdout.splitlines():
-            bkp = sshtarget.path.joinpath(Path(basename).name)
-            if any(pattern.match(bkp.name) for pattern in backup_basename_res):
-                artifacts.append(_backup_artifact_from_path(backup, bkp))
-    else:
-        dst_dir = backup.dst_dir
-        for path in dst_dir.iterdir():
-            if path.is_dir() and any(pattern.match(path.name) for pattern in backup_basename_res):
-                artifacts.append(_backup_artifact_from_path(backup, path))
-    return sorted(artifacts, key=lambda artifact: artifact.created_at, reverse=True)
-
-
-def _backup_artifact_from_path(backup: Backup, path: Path) -> BackupArtifact:
-    match = backup_basename_re(backup=backup).match(path.name)
-    assert match is not None
-    return BackupArtifact(
-        name=path.name,
-        timeframe=match.group(2),
-        created_at=backup_to_datetime(path),
-        locator=str(path),
+
+
+def _not_older_than(artifacts: ty.Sequence[BackupArtifact], minute: int) -> int:
+    """The number of `artifacts` created in or after `minute`."""
+    return bisect.bisect_right(
+        artifacts, -minute, key=lambda artifact: -epoch_minutes(artifact.created_at)
     )
+
+
+# The artifacts_*() functions below take artifacts ordered from newest to
+# oldest, like `BackendBase.collect()` returns them, so they are binary searches
+# that return the range of the indices of the matching artifacts. Like yaesm
+# backup names, they only resolve creation times to the minute.
+
+
+def artifacts_after(artifacts: ty.Sequence[BackupArtifact], dt: datetime) -> range:
+    """Artifacts created after `dt`."""
+    return range(_newer_than(artifacts, epoch_minutes(dt)))
+
+
+def artifacts_before(artifacts: ty.Sequence[BackupArtifact], dt: datetime) -> range:
+    """Artifacts created before `dt`."""
+    return range(_not_older_than(artifacts, _epoch_minutes_ceil(dt)), len(artifacts))
+
+
+def artifacts_between(
+    artifacts: ty.Sequence[BackupArtifact], start: datetime, end: datetime
+) -> range:
+    """Artifacts created between `start` and `end`, inclusive."""
+    return range(
+        _newer_than(artifacts, epoch_minutes(end)),
+        _not_older_than(artifacts, _epoch_minutes_ceil(start)),
+    )
+
+
+def artifacts_closest(artifacts: ty.Sequence[BackupArtifact], dt: datetime) -> range:
+    """The artifact created closest to `dt`, preferring the newer of two equally
+    close artifacts, or an empty range if there are no `artifacts`.
+    """
+    older = _newer_than(artifacts, epoch_minutes(dt))
+    if older == 0:
+        return range(min(1, len(artifacts)))
+    newer = _newer_than(artifacts, epoch_minutes(artifacts[older - 1].created_at))
+    if older < len(artifacts) and abs(artifacts[older].created_at - dt) < abs(
+        artifacts[newer].created_at - dt
+    ):
+        return range(older, older + 1)
+    return range(newer, newer + 1)
+
+
+class ArtifactTable(ty.Sequence[BackupArtifact]):
+    """A sequence of the backup artifacts of one backup from newest to oldest,
+    stored in compact columns instead of one `BackupArtifact` per artifact. Every
+    row is a timeframe id and a creation time in minutes since the epoch, both
+    held in `array`s. Names and locators are derived from them, so a
+    `BackupArtifact` is only built when its row is accessed.
+    """
+
+    def __init__(self, backup_name: str, dst_path: Path | str) -> None:
+        self.backup_name = backup_name
+        self.dst_path = str(dst_path)
+        self.timeframes: list[str] = []
+        self._timeframe_ids = array("H")
+        self._minutes = array("q")
+
+    @classmethod
+    def from_listing(
+        cls, backup: Backup, basenames: ty.Iterable[str], timeframes: list[Timeframe] | None = None
+    ) -> "ArtifactTable":
+        """Build the table of the backups of `backup` among the directory
+        `basenames` in `backup.dst_dir`, parsing every basename with a single
+        regex match. If `timeframes` is given, then only for those Timeframes.
+        """
+        pattern = backup_basename_re(backup=backup)
+        wanted = None if timeframes is None else {timeframe.name for timeframe in timeframes}
+        rows = []
+        for basename in basenames:
+            match = pattern.match(basename)
+            if match is None or (wanted is not None and match.group(2) not in wanted):
+                continue
+            year, month, day, hour, minute = map(int, match.group(3, 4, 5, 6, 7))
+            try:
+                created_at = datetime(year, month, day, hour, minute)
+            except ValueError:
+                continue
+            rows.append(((created_at - _EPOCH) // _MINUTE, match.group(2)))
+        table = cls(backup.name, _dst_path(backup))
+        table._fill(rows)
+        return table
+
+    def _fill(self, rows: list[tuple[int, str]]) -> None:
+        # The sort is stable, so artifacts created in the same minute keep
+        # their order, like `sorted(..., reverse=True)` on their datetimes.
+        rows.sort(key=operator.itemgetter(0), reverse=True)
+        ids: dict[str, int] = {}
+        for minute, timeframe in rows:
+            timeframe_id = ids.get(timeframe)
+            if timeframe_id is None:
+                timeframe_id = ids[timeframe] = len(self.timeframes)
+                self.timeframes.append(timeframe)
+            self._timeframe_ids.append(timeframe_id)
+            self._minutes.append(minute)
+
+    def __len__(self) -> int:
+        return len(self._minutes)
+
+    @ty.overload
+    def __getitem__(self, index: int) -> BackupArtifact: ...
+
+    @ty.overload
+    def __getitem__(self, index: slice) -> list[BackupArtifact]: ...
+
+    def __getitem__(self, index: int | slice) -> BackupArtifact | list[BackupArtifact]:
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(len(self))[index]]
+        return self._row(range(len(self))[index])
+
+    def __iter__(self) -> ty.Iterator[BackupArtifact]:
+        for index in range(len(self)):
+            yield self._row(index)
+
+    def _row(self, index: int) -> BackupArtifact:
+        timeframe = self.timeframes[self._timeframe_ids[index]]
+        created_at = self.created_at(index)
+        name = _basename(self.backup_name, timeframe, created_at)
+        return BackupArtifact(name, timeframe, created_at, os.path.join(self.dst_path, name))
+
+    def created_at(self, index: int) -> datetime:
+        """Return the creation time of row `index` without building the row."""
+        return _EPOCH + self._minutes[index] * _MINUTE
+
+
+def _dst_path(backup: Backup) -> Path:
+    return backup.dst_dir.path if isinstance(backup.dst_dir, SSHTarget) else backup.dst_dir
@@ -0,0 +1,529 @@
+"""src/yaesm/catalog.py.
+
+A catalog records the backup artifacts of one backup that are stored in its
+dst_dir, so that collecting them does not require scanning the directory. The
+catalog is an append-only log of JSON lines stored in the dst_dir itself, with
+one record for every artifact created or deleted. It is trusted for reads, and
+is reconciled with the real contents of the dst_dir when it is missing or
+damaged, when a change could not be recorded, once a day, or on demand.
+
+Artifacts can also be queued for removal, which hides them from
+`Catalog.collect()` until they are deleted (see the yaesm.prunequeue module),
+so that the queue survives restarts along with the rest of the catalog.
+
+An alias of an artifact (see `BackendBase.alias()`) exists only in the catalog,
+with the name of the aliased artifact in its 'alias_of' metadata, which is also
+its locator. Reconciliation keeps an alias as long as the aliased artifact is
+still in the dst_dir, even if the aliased artifact itself was deleted.
+
+Within a process, catalogs are cached after they are first read, and the
+directory listings used to reconcile them are cached per local dst_dir, so that
+several backups sharing a dst_dir are served by a single scan. A remote dst_dir
+is instead listed per backup and filtered on the server, so that a dst_dir
+shared with many other backups costs no more than one of its own. Changes made
+through a `Catalog` update the cache directly. A cached local catalog is reread
+if the catalog file changes, and a cached remote catalog or listing is reread
+after `CACHE_SECONDS`, to notice changes made by other yaesm processes.
+
+Compacting or reconciling a catalog rewrites its log from the records read, so
+the records other yaesm processes appended since are copied over to the new
+log. A log is only appended to and rewritten with an exclusive lock on it (on
+a '.lock' file next to a remote log), so that no record can be appended in
+between, and a log rewritten by another process since it was read is not
+rewritten again.
+"""
+
+import contextlib
+import dataclasses
+import fcntl
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import yaesm.backup as bckp
+import yaesm.ty as ty
+from yaesm.sshtarget import SSHTarget
+from yaesm.timeframe import Timeframe
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_SECONDS = 24 * 60 * 60
+CACHE_SECONDS = 60
+
+# Once the log has this many more records than live artifacts it is compacted.
+_COMPACT_SLACK = 64
+
+# Run with the arguments LOG OFFSET FIRST and the new log on stdin to replace
+# LOG with it, followed by what was appended to LOG after its first OFFSET
+# bytes, which is also printed. Exits with status 3 and leaves LOG alone if its
+# first line is no longer FIRST, as another process rewrote it.
+_WRITE_SCRIPT = r"""
+exec 9>> "$1.lock" && flock 9 || exit 1
+[ "$(head -n 1 -- "$1" 2>/dev/null)" = "$3" ] || exit 3
+tmp=$(mktemp -- "$1.XXXXXX") && tail=$(mktemp -- "$1.XXXXXX") || exit 1
+trap 'rm -f -- "$tmp" "$tail"' EXIT
+cat > "$tmp" || exit 1
+if [ -e "$1" ]; then tail -c "+$(($2 + 1))" -- "$1" > "$tail" || exit 1; fi
+cat -- "$tail" >> "$tmp" && mv -- "$tmp" "$1" && cat -- "$tail"
+"""
+_WRITE_REPLACED = 3
+
+# Run with the argument LOG and records on stdin to append them to LOG, and
+# print the size LOG had before.
+_APPEND_SCRIPT = r"""
+exec 9>> "$1.lock" && flock 9 || exit 1
+size=0
+if [ -e "$1" ]; then size=$(wc -c < "$1") || exit 1; fi
+cat >> "$1" && echo "$size"
+"""
+
+
+@dataclasses.dataclass
+class _CacheEntry:
+    """A replayed catalog. `signature` identifies the catalog file it was read
+    from, for a local catalog by its inode, size and mtime (None if there was
+    none), and for a remote catalog by its first line, and `loaded_at` is the
+    `time.monotonic()` it was read at. `pending` holds the artifacts queued for
+    removal, which are not in `artifacts`. `size` is the size in bytes of the
+    log it replays.
+    """
+
+    artifacts: dict[str, bckp.BackupArtifact]
+    reconciled_at: float | None
+    records: int
+    signature: tuple | None
+    loaded_at: float
+    pending: dict[str, bckp.BackupArtifact] = dataclasses.field(default_factory=dict)
+    size: int = 0
+
+
+_cache: dict[tuple, _CacheEntry] = {}
+_listings: dict[tuple, tuple[float, list[str]]] = {}
+_locks: dict[tuple, threading.Lock] = {}
+_cache_lock = threading.Lock()
+
+
+def catalog_basename(backup_name: str) -> str:
+    """Return the basename of the catalog file of the backup named `backup_name`."""
+    return f".yaesm-catalog-{backup_name}"
+
+
+def clear_cache() -> None:
+    """Forget every cached catalog and directory listing."""
+    with _cache_lock:
+        _cache.clear()
+        _listings.clear()
+
+
+def _forget_listings(dst_dir: Path | SSHTarget) -> None:
+    """Forget every cached listing of `dst_dir`. Call with `_cache_lock` held."""
+    key = _destination_key(dst_dir)
+    for listing_key in [k for k in _listings if k[: len(key)] == key]:
+        del _listings[listing_key]
+
+
+def _destination_key(dst_dir: Path | SSHTarget) -> tuple:
+    if isinstance(dst_dir, SSHTarget):
+        return ("ssh", dst_dir.user, dst_dir.host, dst_dir.port, str(dst_dir.path))
+    return ("local", str(dst_dir))
+
+
+class Catalog:
+    """The catalog of the artifacts of `backup`, stored in `backup.dst_dir`.
+    Catalogs are safe to use from several threads at once.
+    """
+
+    def __init__(self, backup: bckp.Backup) -> None:
+        self.backup = backup
+        dst_dir = backup.dst_dir
+        self.remote = isinstance(dst_dir, SSHTarget)
+        self.dst_path = dst_dir.path if isinstance(dst_dir, SSHTarget) else dst_dir
+        self.path = self.dst_path.joinpath(catalog_basename(backup.name))
+        self._key = (*_destination_key(dst_dir), backup.name)
+        with _cache_lock:
+            self._lock = _locks.setdefault(self._key, threading.Lock())
+
+    def collect(
+        self, timeframes: list[Timeframe] | None = None, rescan: bool = False
+    ) -> list[bckp.BackupArtifact]:
+        """Return the artifacts in the catalog from newest to oldest, only those
+        in `timeframes` if given. The catalog is reconciled first if it is due
+        or if `rescan` is True, in which case the dst_dir is scanned even if a
+        cached listing of it exists.
+        """
+        with self._lock:
+            artifacts = list(self._current(rescan).artifacts.values())
+        if timeframes is not None:
+            names = {timeframe.name for timeframe in timeframes}
+            artifacts = [artifact for artifact in artifacts if artifact.timeframe in names]
+        return sorted(artifacts, key=lambda artifact: artifact.created_at, reverse=True)
+
+    def add(self, artifact: bckp.BackupArtifact) -> None:
+        """Record that `artifact` was created."""
+        with self._lock:
+            self._append([_artifact_record(artifact)])
+
+    def remove(self, artifacts: list[bckp.BackupArtifact]) -> None:
+        """Record that `artifacts` were deleted."""
+        with self._lock:
+            self._append([{"op": "remove", "name": artifact.name} for artifact in artifacts])
+
+    def queue_removal(self, artifacts: list[bckp.BackupArtifact]) -> None:
+        """Record that `artifacts` are to be deleted. They are no longer
+        collected, and are returned by `pending()` until they are removed.
+        """
+        with self._lock:
+            self._append([_artifact_record(artifact, "prune") for artifact in artifacts])
+
+    def pending(self) -> list[bckp.BackupArtifact]:
+        """Return the artifacts queued for removal that still exist, from oldest
+        to newest. The catalog is reconciled first if it is due.
+        """
+        with self._lock:
+            artifacts = list(self._current(False).pending.values())
+        return sorted(artifacts, key=lambda artifact: artifact.created_at)
+
+    def invalidate(self) -> None:
+        """Record that the catalog may be wrong, so the next read reconciles it."""
+        with self._lock:
+            self._append([{"op": "stale"}])
+
+    def reconcile(self) -> list[bckp.BackupArtifact]:
+        """Scan the dst_dir and rewrite the catalog to match it. Returns the
+        reconciled artifacts from newest to oldest.
+        """
+        return self.collect(rescan=True)
+
+    def _current(self, rescan: bool) -> _CacheEntry:
+        """Return the catalog, reconciled if it is due or if `rescan` is True,
+        and compacted if it is due. Call with `_lock` held.
+        """
+        entry = self._entry()
+        if (
+            rescan
+            or entry.reconciled_at is None
+            or time.time() - entry.reconciled_at > RECONCILE_SECONDS
+        ):
+            return self._reconcile(entry, rescan)
+        if entry.records > 2 * (len(entry.artifacts) + len(entry.pending)) + _COMPACT_SLACK:
+            return self._write(entry.artifacts, entry.reconciled_at, entry.pending, entry)
+        return entry
+
+    def _entry(self) -> _CacheEntry:
+        """Return the cached catalog if it is still valid, otherwise read it."""
+        with _cache_lock:
+            entry = _cache.get(self._key)
+        if entry is not None:
+            if self.remote:
+                if time.monotonic() - entry.loaded_at < CACHE_SECONDS:
+                    return entry
+            elif entry.signature == self._signature():
+                return entry
+        entry = self._load()
+        with _cache_lock:
+            _cache[self._key] = entry
+        return entry
+
+    def _signature(self) -> tuple | None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _store(
+        self,
+        artifacts: dict[str, bckp.BackupArtifact],
+        reconciled_at: float | None,
+        records: int,
+        pending: dict[str, bckp.BackupArtifact],
+        size: int,
+        first_line: str = "",
+    ) -> _CacheEntry:
+        signature = (first_line,) if self.remote else self._signature()
+        entry = _CacheEntry(
+            artifacts, reconciled_at, records, signature, time.monotonic(), pending, size
+        )
+        with _cache_lock:
+            _cache[self._key] = entry
+        return entry
+
+    def _forget(self) -> None:
+        with _cache_lock:
+            _cache.pop(self._key, None)
+            _forget_listings(self.backup.dst_dir)
+
+    def _listing(self, fresh: bool) -> list[str]:
+        """Return the listing of the dst_dir, from the cache unless `fresh`."""
+        dst_dir = self.backup.dst_dir
+        globs = bckp.backup_basename_globs(self.backup) if isinstance(dst_dir, SSHTarget) else None
+        key = (*_destination_key(dst_dir), *(globs or ()))
+        with _cache_lock:
+            cached = _listings.get(key)
+        if not fresh and cached is not None and time.monotonic() - cached[0] < CACHE_SECONDS:
+            return cached[1]
+        listing = bckp.dst_dir_listing(dst_dir, globs)
+        with _cache_lock:
+            _listings[key] = (time.monotonic(), listing)
+        return listing
+
+    def _reconcile(self, entry: _CacheEntry, fresh: bool) -> _CacheEntry:
+        """Reconcile the catalog `entry` with a listing of the dst_dir, which is
+        scanned anew if `fresh`. The recorded size and metadata of every artifact
+        still present are kept, and so is the queued removal of every artifact
+        still present.
+        """
+        artifacts = entry.artifacts
+        scanned = {
+            artifact.name: artifact
+            for artifact in bckp.path_artifacts_from_listing(self.backup, self._listing(fresh))
+        }
+        aliases = {
+            name: artifact
+            for name, artifact in artifacts.items()
+            if artifact.metadata.get("alias_of") in scanned
+        }
+        pending = {
+            name: artifact
+            for name, artifact in entry.pending.items()
+            if name in scanned or artifact.metadata.get("alias_of") in scanned
+        }
+        # Artifacts deleted while aliases of them were kept are not added again.
+        kept = {
+            artifact.metadata["alias_of"]
+            for artifact in [*aliases.values(), *pending.values()]
+            if "alias_of" in artifact.metadata
+        }
+        for name in (pending.keys() | kept) - artifacts.keys():
+            scanned.pop(name, None)
+        scanned |= aliases
+        missing = artifacts.keys() - scanned.keys()
+        unknown = scanned.keys() - artifacts.keys()
+        if missing or unknown:
+            logger.info(
+                f"catalog of backup '{self.backup.name}' was out of date:"
+                f" {len(unknown)} artifacts added, {len(missing)} removed"
+            )
+        reconciled = {name: artifacts.get(name, artifact) for name, artifact in scanned.items()}
+        return self._write(reconciled, time.time(), pending, entry)
+
+    def _load(self) -> _CacheEntry:
+        """Read and replay the catalog log."""
+        signature = None if self.remote else self._signature()
+        text = self._read()
+        if self.remote:
+            signature = ("" if text is None else text.partition("\n")[0],)
+        artifacts: dict[str, bckp.BackupArtifact] = {}
+        pending: dict[str, bckp.BackupArtifact] = {}
+        reconciled_at: float | None = None
+        lines = [] if text is None else text.splitlines()
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if record["op"] == "reconciled":
+                    reconciled_at = float(record["at"])
+                else:
+                    reconciled_at = self._replay(record, artifacts, pending, reconciled_at)
+            except (ValueError, KeyError, TypeError):
+                # A damaged or truncated record, for example from a crash.
+                logger.warning(f"damaged record in catalog of backup '{self.backup.name}'")
+                reconciled_at = None
+        size = 0 if text is None else len(text.encode("utf-8"))
+        return _CacheEntry(
+            artifacts, reconciled_at, len(lines), signature, time.monotonic(), pending, size
+        )
+
+    def _replay(
+        self,
+        record: dict,
+        artifacts: dict[str, bckp.BackupArtifact],
+        pending: dict[str, bckp.BackupArtifact],
+        reconciled_at: float | None,
+    ) -> float | None:
+        """Apply the change `record` to `artifacts` and `pending`. Returns the new
+        reconciliation time, which is None if `record` marks the catalog stale.
+        """
+        op = record["op"]
+        if op == "add":
+            pending.pop(record["name"], None)
+            artifacts[record["name"]] = self._artifact(record)
+        elif op == "prune":
+            artifacts.pop(record["name"], None)
+            pending[record["name"]] = self._artifact(record)
+        elif op == "remove":
+            artifacts.pop(record["name"], None)
+            pending.pop(record["name"], None)
+        elif op == "stale":
+            return None
+        return reconciled_at
+
+    def _artifact(self, record: dict) -> bckp.BackupArtifact:
+        metadata = dict(record.get("metadata") or {})
+        return bckp.BackupArtifact(
+            name=record["name"],
+            timeframe=record["timeframe"],
+            created_at=datetime.fromisoformat(record["created_at"]),
+            locator=str(self.dst_path.joinpath(metadata.get("alias_of", record["name"]))),
+            size=record.get("size"),
+            metadata=metadata,
+        )
+
+    def _write(
+        self,
+        artifacts: dict[str, bckp.BackupArtifact],
+        reconciled_at: float,
+        pending: dict[str, bckp.BackupArtifact],
+        read: _CacheEntry,
+    ) -> _CacheEntry:
+        """Rewrite the log with the records of `artifacts` and `pending`, which
+        derive from the log as `read`, followed by the records appended to the
+        log since. If the log was rewritten since, then it is read anew instead.
+        """
+        records = [{"op": "reconciled", "at": reconciled_at}]
+        records += [_artifact_record(artifact) for artifact in artifacts.values()]
+        records += [_artifact_record(artifact, "prune") for artifact in pending.values()]
+        text = "".join(json.dumps(record) + "\n" for record in records)
+        data = text.encode("utf-8")
+        dst_dir = self.backup.dst_dir
+        replaced = False
+        try:
+            if isinstance(dst_dir, SSHTarget):
+                first_line = "" if read.signature is None else read.signature[0]
+                p = dst_dir.run(
+                    ["sh", "-c", _WRITE_SCRIPT, "sh", self.path, str(read.size), first_line],
+                    capture_output=True,
+                    encoding="utf-8",
+                    input=text,
+                )
+                replaced = p.returncode == _WRITE_REPLACED
+                if p.returncode not in (0, _WRITE_REPLACED):
+                    raise subprocess.CalledProcessError(p.returncode, p.args, p.stdout, p.stderr)
+                tail = p.stdout
+            else:
+                tmp = self.path.with_name(self.path.name + ".tmp")
+                with _locked_log(self.path) as f:
+                    inode = os.fstat(f.fileno()).st_ino
+                    replaced = read.signature is not None and inode != read.signature[0]
+                    f.seek(read.size)
+                    tail = f.read()
+                    if not replaced:
+                        tmp.write_bytes(data + tail)
+                        os.replace(tmp, self.path)
+        except (OSError, subprocess.CalledProcessError) as exc:
+            logger.warning(f"cannot write catalog of backup '{self.backup.name}': {exc}")
+            return _CacheEntry(artifacts, None, 0, None, time.monotonic(), pending)
+        if replaced or tail:
+            # Other processes changed the catalog meanwhile, so read it anew.
+            self._forget()
+            return self._entry()
+        return self._store(
+            artifacts, reconciled_at, len(records), pending, len(data), json.dumps(records[0])
+        )
+
+    def _append(self, records: list[dict]) -> None:
+        if not records:
+            return
+        text = "".join(json.dumps(record) + "\n" for record in records)
+        data = text.encode("utf-8")
+        dst_dir = self.backup.dst_dir
+        try:
+            entry = self._entry()
+            if isinstance(dst_dir, SSHTarget):
+                p = dst_dir.run(
+                    ["sh", "-c", _APPEND_SCRIPT, "sh", self.path],
+                    check=True,
+                    capture_output=True,
+                    encoding="utf-8",
+                    input=text,
+                )
+                start = int(p.stdout)
+            else:
+                with _locked_log(self.path) as f:
+                    start = f.seek(0, os.SEEK_END)
+                    f.write(data)
+        except (OSError, ValueError, subprocess.CalledProcessError) as exc:
+            # The catalog could not be read or is now out of date, so make sure
+            # it is not trusted.
+            logger.warning(f"cannot update catalog of backup '{self.backup.name}': {exc}")
+            self._remove()
+            self._forget()
+            return
+        if start != entry.size:
+            # Other processes appended to the catalog since it was read.
+            self._forget()
+            return
+        artifacts = dict(entry.artifacts)
+        pending = dict(entry.pending)
+        reconciled_at = entry.reconciled_at
+        for record in records:
+            reconciled_at = self._replay(record, artifacts, pending, reconciled_at)
+        first_line = (
+            entry.signature[0] if entry.size and entry.signature else json.dumps(records[0])
+        )
+        self._store(
+            artifacts,
+            reconciled_at,
+            entry.records + len(records),
+            pending,
+            start + len(data),
+            first_line,
+        )
+        # The dst_dir itself changed, so its cached listing is out of date.
+        with _cache_lock:
+            _forget_listings(dst_dir)
+
+    def _read(self) -> str | None:
+        dst_dir = self.backup.dst_dir
+        if isinstance(dst_dir, SSHTarget):
+            p = dst_dir.run(
+                ["sh", "-c", '[ ! -e "$1" ] || cat -- "$1"', "sh", self.path],
+                capture_output=True,
+                encoding="utf-8",
+            )
+            if p.returncode != 0:
+                raise subprocess.CalledProcessError(p.returncode, p.args, p.stdout, p.stderr)
+            return p.stdout or None
+        try:
+            return self.path.read_text() or None
+        except FileNotFoundError:
+            return None
+
+    def _remove(self) -> None:
+        dst_dir = self.backup.dst_dir
+        try:
+            if isinstance(dst_dir, SSHTarget):
+                dst_dir.run(["rm", "-f", "--", self.path], check=True)
+            else:
+                self.path.unlink(missing_ok=True)
+        except (OSError, subprocess.CalledProcessError) as exc:
+            logger.error(f"cannot remove stale catalog of backup '{self.backup.name}': {exc}")
+
+
+@contextlib.contextmanager
+def _locked_log(path: Path) -> ty.Generator[ty.BinaryIO, None, None]:
+    """Open the local catalog log `path` for appending, creating it if needed,
+    with an exclusive lock on it. If the log was replaced while waiting for the
+    lock, then the new log is opened and locked instead.
+    """
+    while True:
+        with open(path, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                yield f
+                return
+
+
+def _artifact_record(artifact: bckp.BackupArtifact, op: str = "add") -> dict[str, ty.Any]:
+    return {
+        "op": op,
+        "name": artifact.name,
+        "timeframe": artifact.timeframe,
+        "created_at": artifact.created_at.isoformat(),
+        "size": artifact.size,
+        "metadata": artifact.metadata,
+    }
@@ -2,16 +2,18 @@
 
 import dataclasses
 import re
+import subprocess
 from pathlib import Path
 
 import voluptuous as vlp
 import yaml
 
 import yaesm.backup as bckp
+import yaesm.transport as transport
 import yaesm.ty as ty
 from yaesm.backend import backendbase
-from yaesm.sshtarget import SSHTarget
-from yaesm.timeframe import tframe_types_configurable
+from yaesm.sshtarget import Probe, SSHTarget, SSHTargetException
+from yaesm.timeframe import UNCHANGED_POLICIES, tframe_types_configurable
 
 
 @dataclasses.dataclass
@@ -227,15 +229,17 @@ class BackendSchema(Schema):
 
     @staticmethod
     def valid_settings() -> set[str]:
-        return {"backend"}
+        return {"backend", "prune_deferred", "prune_rate"}
 
     @staticmethod
     def schema() -> vlp.Schema:
-        """Schema that accepts a dict with a single key 'backend' with a value
-        that is a string dentoting a valid backend name (like 'btrfs' or 'rsync').
+        """Schema that accepts a dict with a key 'backend' with a value that is
+        a string dentoting a valid backend name (like 'btrfs' or 'rsync'), and
+        the optional pruning settings 'prune_deferred' (a bool) and 'prune_rate'
+        (a positive number of artifacts per second).
 
         This schema Outputs a dict with the backend name promoted to its
-        corresponding backend class.
+        corresponding backend class, with the pruning settings applied to it.
         """
         return vlp.Schema(
             vlp.All(
@@ -243,9 +247,15 @@ class BackendSchema(Schema):
                     vlp.Required("backend"): vlp.In(
                         [cls.name() for cls in backendbase.BackendBase.backend_classes()],
                         msg=BackendSchema.ErrMsg.INVALID_BACKEND_NAME,
-                    )
+                    ),
+                    vlp.Optional("prune_deferred"): bool,
+                    vlp.Optional("prune_rate"): vlp.All(
+                        vlp.Any(int, float),
+                        vlp.Range(min=0, min_included=False),
+                    ),
                 },
                 BackendSchema._dict_promote_backend_name_to_backend_class,
+                BackendSchema._apply_prune_settings,
                 BackendSchema._apply_backend_specific_schema,
             ),
             extra=vlp.ALLOW_EXTRA,
@@ -261,6 +271,15 @@ class BackendSchema(Schema):
                 break
         return d
 
+    @staticmethod
+    def _apply_prune_settings(d: dict) -> dict:
+        """Move the pruning settings onto the backend instance."""
+        if "prune_deferred" in d:
+            d["backend"].prune_deferred = d.pop("prune_deferred")
+        if "prune_rate" in d:
+            d["backend"].prune_rate = float(d.pop("prune_rate"))
+        return d
+
     @staticmethod
     def _apply_backend_specific_schema(d: dict) -> dict:
         """Apply the backend-specific configuration schema to the backup settings dict."""
@@ -296,8 +315,9 @@ class TimeframeSchema(Schema):
     @staticmethod
     def valid_settings() -> set[str]:
         settings = {"timeframes"}
-        for tf_settings in TimeframeSchema.REQUIRED_SETTINGS.values():
+        for tf_type, tf_settings in TimeframeSchema.REQUIRED_SETTINGS.items():
             settings.update(tf_settings)
+            settings.add(f"{tf_type}_unchanged")
         return settings
 
     @staticmethod
@@ -325,6 +345,8 @@ class TimeframeSchema(Schema):
               leap years.
             * 'yearly_days' (if given) contains a valid day within the range 1-365 (TODO: Add
               support for leap years with 366 days.)
+            * all '*_unchanged' settings (if given) are one of `UNCHANGED_POLICIES`, and are
+              applied to their `Timeframe`
         """
         return vlp.Schema(
             vlp.All(
@@ -376,6 +398,10 @@ class TimeframeSchema(Schema):
                     ],
                     "monthly_days": [vlp.All(int, vlp.Range(min=1, max=31))],
                     "yearly_days": [vlp.All(int, vlp.Range(min=1, max=365))],
+                    **{
+                        vlp.Optional(f"{tf_type}_unchanged"): vlp.In(UNCHANGED_POLICIES)
+                        for tf_type in tframe_types_configurable(names=True)
+                    },
                 },
                 TimeframeSchema._promote_timeframes_spec_to_list_of_timeframes,
             ),
@@ -486,6 +512,8 @@ class TimeframeSchema(Schema):
             timeframe_obj = timeframe_dict[timeframe_name](
                 *[spec[s] for s in TimeframeSchema.REQUIRED_SETTINGS[timeframe_name]]
             )
+            if f"{timeframe_name}_unchanged" in spec:
+                timeframe_obj.unchanged = spec[f"{timeframe_name}_unchanged"]
             timeframes.append(timeframe_obj)
         spec["timeframes"] = timeframes  # mutation
         return spec
@@ -507,10 +535,20 @@ class SrcDirDstDirSchema(Schema):
         SSH_CONNECTION_FAILED_TO_ESTABLISH = (
             "Could not establish an SSH connection to the SSHtarget"
         )
+        SSH_COMPRESSION_INVALID = "Not one of 'none', 'zstd', 'lz4', or 'auto'"
 
     @staticmethod
     def valid_settings() -> set[str]:
-        return {"src_dir", "dst_dir", "ssh_key", "ssh_config"}
+        return {
+            "src_dir",
+            "dst_dir",
+            "ssh_key",
+            "ssh_config",
+            "ssh_cipher",
+            "ssh_compression",
+            "ssh_compression_level",
+            "ssh_agent",
+        }
 
     @staticmethod
     def schema() -> vlp.Schema:
@@ -532,6 +570,10 @@ class SrcDirDstDirSchema(Schema):
             * if we are using an SSH target, ensure we were given an 'ssh_key'
               which is an existing local file.
 
+            * 'ssh_compression' (if given) is one of 'none', 'zstd', 'lz4', or
+              'auto', and 'ssh_compression_level' (if given) is an int in the
+              range 1-22.
+
             * Promotes strings denoting file paths to Path objects, and promotes
               SSH target spec strings to SSHTarget objects.
         """
@@ -542,6 +584,13 @@ class SrcDirDstDirSchema(Schema):
                     vlp.Required("dst_dir"): SrcDirDstDirSchema._is_dir_or_sshtarget_spec,
                     vlp.Optional("ssh_key"): Schema.is_file,
                     vlp.Optional("ssh_config"): Schema.is_file,
+                    vlp.Optional("ssh_cipher"): str,
+                    vlp.Optional("ssh_compression"): vlp.In(
+                        transport.COMPRESSION_CHOICES,
+                        msg=SrcDirDstDirSchema.ErrMsg.SSH_COMPRESSION_INVALID,
+                    ),
+                    vlp.Optional("ssh_compression_level"): vlp.All(int, vlp.Range(min=1, max=22)),
+                    vlp.Optional("ssh_agent"): bool,
                 },
                 SrcDirDstDirSchema._dict_max_one_sshtarget_spec,
                 SrcDirDstDirSchema._dict_ssh_key_required_if_ssh_target,
@@ -620,7 +669,15 @@ class SrcDirDstDirSchema(Schema):
         if sshtarget_spec and dir_key:
             ssh_key = d["ssh_key"]
             ssh_config = d.get("ssh_config")
-            sshtarget = SSHTarget(sshtarget_spec, ssh_key, sshconfig=ssh_config)
+            sshtarget = SSHTarget(
+                sshtarget_spec,
+                ssh_key,
+                sshconfig=ssh_config,
+                cipher=d.get("ssh_cipher"),
+                compression=d.get("ssh_compression"),
+                compression_level=d.get("ssh_compression_level"),
+                agent=d.get("ssh_agent", False),
+            )
             d[dir_key] = sshtarget
 
         return d
@@ -644,8 +701,13 @@ class SrcDirDstDirSchema(Schema):
             dir_key = "dst_dir"
 
         if sshtarget and dir_key:
-            if not sshtarget.can_connect():
-                raise vlp.Invalid(SrcDirDstDirSchema.ErrMsg.SSH_CONNECTION_FAILED_TO_ESTABLISH)
-            if not sshtarget.is_dir(d=sshtarget.path):
+            probe = Probe("is_dir", sshtarget.path)
+            try:
+                is_dir = sshtarget.probe([probe])[probe]
+            except (subprocess.CalledProcessError, SSHTargetException) as exc:
+                raise vlp.Invalid(
+                    SrcDirDstDirSchema.ErrMsg.SSH_CONNECTION_FAILED_TO_ESTABLISH
+                ) from exc
+            if not is_dir:
                 raise vlp.Invalid(SrcDirDstDirSchema.ErrMsg.REMOTE_DIR_INVALID)
         return d
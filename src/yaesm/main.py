@@ -75,18 +75,21 @@ def main(argv: list[str] | None = None) -> int:
         else "/dev/log",
     )
 
-    try:
-        backups = yaesm.config.parse_config(parsed_args.config)
-    except yaesm.config.ConfigErrors as exc:
-        for err in exc.errors:
-            backup, err_msg = err
-            logger.error("config error: %s: %s", backup, err_msg)
-        return os.EX_CONFIG
+    subcommand_class = subcommand_name_class_map[parsed_args.subcommand]
+    backups = []
+    if subcommand_class.requires_config:
+        try:
+            backups = yaesm.config.parse_config(parsed_args.config)
+        except yaesm.config.ConfigErrors as exc:
+            for err in exc.errors:
+                backup, err_msg = err
+                logger.error("config error: %s: %s", backup, err_msg)
+            return os.EX_CONFIG
 
     Cleanup.initialize()
 
     try:
-        exit_status = subcommand_name_class_map[parsed_args.subcommand]().main(backups, parsed_args)
+        exit_status = subcommand_class().main(backups, parsed_args)
         return exit_status
     except Exception as exc:
         logger.exception("unexpected error: %s", exc)
@@ -0,0 +1,142 @@
+"""src/yaesm/prunequeue.py.
+
+With the 'prune_deferred' setting, pruning a backup only queues the artifacts
+it no longer keeps for deletion (see `BackendBase.prune()`), so that a backup
+job does not wait for deletions. The queue is kept in the catalog of the backup,
+so it survives restarts. The `PruneWorker` thread started by the 'run'
+subcommand drains the queues in the background, deleting at most 'prune_rate'
+artifacts per second and committing every batch before starting the next, so
+that deletions do not starve backups of I/O. Queues left behind by other yaesm
+processes are drained once the next deferred prune of their backup notifies the
+worker, or by the 'prune' subcommand.
+"""
+
+import logging
+import threading
+import time
+
+import yaesm.backup as bckp
+import yaesm.retention as retention
+import yaesm.ty as ty
+
+logger = logging.getLogger(__name__)
+
+_worker: "PruneWorker | None" = None
+_worker_lock = threading.Lock()
+# Held while draining the queue of a backup, so that its queued artifacts are
+# only deleted by one drain at a time.
+_drain_locks: dict[str, threading.Lock] = {}
+
+
+def drain(backup: bckp.Backup, stop: threading.Event | None = None) -> list[bckp.BackupArtifact]:
+    """Delete the artifacts of `backup` queued for deletion, from oldest to
+    newest, in batches of at most `backup.backend.prune_rate` artifacts per
+    second (all of them at once if there is no rate). Every batch is committed
+    with `commit_deletions()`. Stops early once `stop` is set. Returns the
+    deleted artifacts.
+
+    The retention lock of `backup` is only held to take a batch from the queue
+    and to commit it, not while it is deleted, so that backups of `backup`
+    prune meanwhile without waiting for the deletions.
+    """
+    backend = backup.backend
+    stop = threading.Event() if stop is None else stop
+    rate = backend.prune_rate
+    deleted: list[bckp.BackupArtifact] = []
+    with _worker_lock:
+        drain_lock = _drain_locks.setdefault(backup.name, threading.Lock())
+    with drain_lock:
+        while not stop.is_set():
+            start = time.monotonic()
+            with retention.backup_lock(backup):
+                batch = backend.pending_deletions(backup)
+            if rate is not None:
+                batch = batch[: max(1, int(rate))]
+            if not batch:
+                break
+            logger.info(f"pruning {len(batch)} queued artifacts of backup '{backup.name}'")
+            backend.delete(backup, batch)
+            with retention.backup_lock(backup):
+                backend.commit_deletions(backup)
+            deleted += batch
+            if rate is not None:
+                stop.wait(len(batch) / rate - (time.monotonic() - start))
+    return deleted
+
+
+class PruneWorker(threading.Thread):
+    """A daemon thread that drains the deletion queue of every backup it is
+    notified of with `notify()`, one backup at a time.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="yaesm-prune", daemon=True)
+        self._cond = threading.Condition()
+        self._wanted: dict[str, bckp.Backup] = {}
+        self._stopping = threading.Event()
+
+    def notify(self, backup: bckp.Backup) -> None:
+        """Have the queue of `backup` drained."""
+        with self._cond:
+            self._wanted[backup.name] = backup
+            self._cond.notify()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stop the worker after its current batch, and wait up to `timeout`
+        seconds for it. Undrained queues are left for the next worker.
+        """
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            with self._cond:
+                while not self._wanted and not self._stopping.is_set():
+                    self._cond.wait()
+                wanted = list(self._wanted.values())
+                self._wanted.clear()
+            for backup in wanted:
+                if self._stopping.is_set():
+                    break
+                try:
+                    drain(backup, self._stopping)
+                except Exception:
+                    logger.error(f"pruning queued backups of '{backup.name}' failed", exc_info=True)
+
+
+def start_worker(backups: ty.Iterable[bckp.Backup]) -> PruneWorker:
+    """Start the process wide `PruneWorker`, and have it drain the queues of
+    those of `backups` that prune deferred, which may be left from a previous run.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = PruneWorker()
+            _worker.start()
+        worker = _worker
+    for backup in backups:
+        if backup.backend.prune_deferred:
+            worker.notify(backup)
+    return worker
+
+
+def stop_worker(timeout: float | None = None) -> None:
+    """Stop the process wide `PruneWorker`, if it is running."""
+    global _worker
+    with _worker_lock:
+        worker, _worker = _worker, None
+    if worker is not None:
+        worker.stop(timeout)
+
+
+def notify(backup: bckp.Backup) -> None:
+    """Have the process wide `PruneWorker` drain the queue of `backup`. If no
+    worker is running, then the queue is left as it is.
+    """
+    with _worker_lock:
+        worker = _worker
+    if worker is not None:
+        worker.notify(backup)
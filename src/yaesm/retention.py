@@ -0,0 +1,51 @@
+"""src/yaesm/retention.py.
+
+The retention planner decides which backup artifacts of a backup to delete,
+across all of its timeframes at once, so that a backup is pruned with a single
+batched deletion instead of one per timeframe.
+"""
+
+import dataclasses
+import threading
+
+import yaesm.backup as bckp
+from yaesm.timeframe import Timeframe
+
+_locks: dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class RetentionPlan:
+    """The artifacts of a backup to keep and to delete, both from newest to
+    oldest. Artifacts of timeframes the plan was not made for are always kept.
+    """
+
+    keep: list[bckp.BackupArtifact]
+    delete: list[bckp.BackupArtifact]
+
+
+def plan(artifacts: list[bckp.BackupArtifact], timeframes: list[Timeframe]) -> RetentionPlan:
+    """Plan the retention of `artifacts`, which are ordered from newest to
+    oldest, in a single pass. The newest `timeframe.keep` artifacts of every
+    timeframe in `timeframes` are kept and the rest are deleted.
+    """
+    keep_counts = {timeframe.name: timeframe.keep for timeframe in timeframes}
+    seen = dict.fromkeys(keep_counts, 0)
+    keep, delete = [], []
+    for artifact in artifacts:
+        limit = keep_counts.get(artifact.timeframe)
+        if limit is None:
+            keep.append(artifact)
+            continue
+        seen[artifact.timeframe] += 1
+        (keep if seen[artifact.timeframe] <= limit else delete).append(artifact)
+    return RetentionPlan(keep, delete)
+
+
+def backup_lock(backup: bckp.Backup) -> threading.Lock:
+    """Return the lock to hold while planning and pruning `backup`, so that
+    concurrent jobs of its timeframes do not delete the same artifacts.
+    """
+    with _locks_lock:
+        return _locks.setdefault(backup.name, threading.Lock())
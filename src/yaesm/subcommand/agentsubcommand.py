@@ -0,0 +1,22 @@
+"""src/yaesm/subcommand/agentsubcommand.py."""
+
+import argparse
+import sys
+
+import yaesm.agent
+from yaesm.backup import Backup
+from yaesm.subcommand.subcommandbase import SubcommandBase
+
+
+class AgentSubcommand(SubcommandBase):
+    """Answer requests from a remote yaesm on STDIN (used over SSH, not run by hand)."""
+
+    requires_config = False
+
+    def main(self, backups: list[Backup], parsed_args: argparse.Namespace) -> int:
+        yaesm.agent.serve(sys.stdin, sys.stdout)
+        return 0
+
+    @classmethod
+    def add_argparser_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        pass
@@ -6,7 +6,14 @@ from collections.abc import Sequence
 from datetime import datetime, time, timedelta
 from pathlib import Path
 
-from yaesm.backup import Backup, BackupArtifact
+from yaesm.backup import (
+    Backup,
+    BackupArtifact,
+    artifacts_after,
+    artifacts_before,
+    artifacts_between,
+    artifacts_closest,
+)
 from yaesm.sshtarget import SSHTarget
 from yaesm.subcommand.subcommandbase import SubcommandBase
 from yaesm.timeframe import ImmediateTimeframe, tframe_types
@@ -54,14 +61,15 @@ class FindSubcommand(SubcommandBase):
                     if name in timeframes_by_name
                 ]
 
-            artifacts = backup.backend.collect(backup, timeframes=timeframes)
-            matches = {artifact for query in queries for artifact in query.select(artifacts)}
-            for artifact in artifacts:
-                if artifact in matches:
-                    locator = artifact.locator
-                    if isinstance(backup.dst_dir, SSHTarget):
-                        locator = str(backup.dst_dir.with_path(Path(locator)))
-                    print(locator)
+            artifacts = backup.backend.collect(
+                backup, timeframes=timeframes, rescan=parsed_args.rescan
+            )
+            rows = {row for query in queries for row in query.select_rows(artifacts)}
+            for row in sorted(rows):
+                locator = artifacts[row].locator
+                if isinstance(backup.dst_dir, SSHTarget):
+                    locator = str(backup.dst_dir.with_path(Path(locator)))
+                print(locator)
 
         return 0
 
@@ -98,6 +106,11 @@ class FindSubcommand(SubcommandBase):
             default=[],
             metavar="TIMEFRAME[,TIMEFRAME...]",
         )
+        parser.add_argument(
+            "--rescan",
+            action="store_true",
+            help="rescan the backup destinations instead of trusting their catalogs",
+        )
 
 
 class FindQuery:
@@ -149,40 +162,30 @@ class FindQuery:
 
     def select(self, artifacts: Sequence[BackupArtifact]) -> list[BackupArtifact]:
         """Return backup artifacts matching this query."""
+        return [artifacts[row] for row in self.select_rows(artifacts)]
+
+    def select_rows(self, artifacts: Sequence[BackupArtifact]) -> range:
+        """Return the range of the indices of the `artifacts` matching this query."""
         match self.type:
             case self.Type.ALL:
-                return list(artifacts)
+                return range(len(artifacts))
             case self.Type.NEWEST:
-                return list(artifacts[:1])
+                return range(min(1, len(artifacts)))
             case self.Type.OLDEST:
-                return list(artifacts[-1:])
+                return range(max(len(artifacts) - 1, 0), len(artifacts))
             case self.Type.AFTER:
                 assert self.target is not None
-                return [artifact for artifact in artifacts if artifact.created_at > self.target]
+                return artifacts_after(artifacts, self.target)
             case self.Type.BEFORE:
                 assert self.target is not None
-                return [artifact for artifact in artifacts if artifact.created_at < self.target]
+                return artifacts_before(artifacts, self.target)
             case self.Type.BETWEEN:
                 assert self.start is not None
                 assert self.end is not None
-                return [
-                    artifact
-                    for artifact in artifacts
-                    if self.start <= artifact.created_at <= self.end
-                ]
+                return artifacts_between(artifacts, self.start, self.end)
             case self.Type.CLOSEST:
-                target = self.target
-                assert target is not None
-                return (
-                    [
-                        min(
-                            artifacts,
-                            key=lambda artifact: abs(artifact.created_at - target),
-                        )
-                    ]
-                    if artifacts
-                    else []
-                )
+                assert self.target is not None
+                return artifacts_closest(artifacts, self.target)
             case _:
                 raise AssertionError(f"unknown find query type: {self.type}")
 
@@ -0,0 +1,66 @@
+"""src/yaesm/subcommand/prunesubcommand.py."""
+
+import argparse
+import logging
+from pathlib import Path
+
+import yaesm.prunequeue as prunequeue
+from yaesm.backup import Backup
+from yaesm.sshtarget import SSHTarget
+from yaesm.subcommand.subcommandbase import SubcommandBase
+
+logger = logging.getLogger(__name__)
+
+
+class PruneSubcommand(SubcommandBase):
+    """Delete the backups no longer kept by their timeframes, or queued for deletion."""
+
+    def main(self, backups: list[Backup], parsed_args: argparse.Namespace) -> int:
+        if parsed_args.backup_names is not None:
+            backups_by_name = {backup.name: backup for backup in backups}
+            unknown_names = [
+                name for name in parsed_args.backup_names if name not in backups_by_name
+            ]
+            if not parsed_args.backup_names:
+                logger.error("no backup names specified")
+                return 2
+            if unknown_names:
+                for name in unknown_names:
+                    logger.error(f"no backup named '{name}' in config")
+                return 2
+            backups = [backups_by_name[name] for name in parsed_args.backup_names]
+        pruned = True
+        for backup in backups:
+            try:
+                plan = backup.backend.prune(backup, dry_run=parsed_args.dry_run, defer=False)
+                if parsed_args.dry_run:
+                    queued = backup.backend.pending_deletions(backup)
+                else:
+                    queued = prunequeue.drain(backup)
+            except Exception:
+                logger.error(f"pruning backup '{backup.name}' failed", exc_info=True)
+                pruned = False
+                continue
+            for artifact in [*queued, *plan.delete]:
+                locator = artifact.locator
+                if isinstance(backup.dst_dir, SSHTarget):
+                    locator = str(backup.dst_dir.with_path(Path(locator)))
+                print(locator)
+        return 0 if pruned else 1
+
+    @classmethod
+    def add_argparser_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "backup_names",
+            nargs="?",
+            default=None,
+            metavar="BACKUP[,BACKUP...]",
+            type=lambda value: list(dict.fromkeys(filter(None, map(str.strip, value.split(","))))),
+            help="names of specific backups to prune (default: prune all)",
+        )
+        parser.add_argument(
+            "-n",
+            "--dry-run",
+            action="store_true",
+            help="only print the backups that would be deleted",
+        )
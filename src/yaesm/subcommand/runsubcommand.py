@@ -4,6 +4,8 @@ import logging
 import os
 from pathlib import Path
 
+import yaesm.backend.changejournal
+import yaesm.prunequeue
 import yaesm.scheduler
 from yaesm.backup import Backup
 from yaesm.cleanup import Cleanup
@@ -24,6 +26,10 @@ class RunSubcommand(SubcommandBase):
             logger.error(f"could not acquire scheduler lock: {parsed_args.lockfile}: {e}")
             return 1
 
+        yaesm.prunequeue.start_worker(backups)
+        Cleanup.add_function(lambda: yaesm.prunequeue.stop_worker(timeout=30))
+        yaesm.backend.changejournal.start_journals(backups)
+        Cleanup.add_function(lambda: yaesm.backend.changejournal.stop_journals(timeout=5))
         scheduler = yaesm.scheduler.Scheduler()
         scheduler.add_backups(backups)
         Cleanup.add_function(lambda s=scheduler: s.stop())
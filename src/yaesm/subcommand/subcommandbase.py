@@ -10,9 +10,13 @@ class SubcommandBase(abc.ABC):
     RunSubcommand. An actual subcommand class inherits from SubcommandBase.
 
     Implementers of a Subcommand class must implement the
-    `add_argparser_arguments()` and `main()` abstract methods.
+    `add_argparser_arguments()` and `main()` abstract methods. Subcommands that
+    do not use the configuration file set `requires_config` to False, and are
+    passed an empty list of backups.
     """
 
+    requires_config: ty.ClassVar[bool] = True
+
     @abc.abstractmethod
     def main(self, backups: list[Backup], parsed_args: argparse.Namespace) -> int:
         """The function that actually executes the subcommand.
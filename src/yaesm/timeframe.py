@@ -4,6 +4,8 @@ import dataclasses
 
 import yaesm.ty as ty
 
+UNCHANGED_POLICIES = ["backup", "skip", "alias"]
+
 
 class Timeframe:
     """`Timeframe` is a base class for the different timeframe types. None of the
@@ -12,10 +14,16 @@ class Timeframe:
     See the subclasses of `Timeframe` for more details.
 
     Also see test_timeframe.py for examples of how to use `Timeframe`'s.
+
+    The `unchanged` instance variable is one of `UNCHANGED_POLICIES`, and says
+    what to do when the source did not change since the last backup: take a
+    backup anyway ('backup'), take none ('skip'), or record the last backup
+    again for this timeframe without copying anything ('alias').
     """
 
     name: str
     keep: int
+    unchanged: str = "backup"
 
 
 @ty.overload
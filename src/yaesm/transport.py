@@ -0,0 +1,235 @@
+"""src/yaesm/transport.py."""
+
+import copy
+import dataclasses
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from yaesm.sshtarget import SSHTarget
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_CHOICES = ["none", "zstd", "lz4", "auto"]
+DEFAULT_LEVELS = {"zstd": 3, "lz4": 1}
+
+_BENCHMARK_SAMPLE_SIZE = 8 * (1 << 20)
+_BENCHMARK_MIN_SAMPLE_SIZE = 1 << 20
+_BENCHMARK_CACHE_SECONDS = 24 * 60 * 60
+
+_benchmark_cache: dict[tuple, tuple[float, str | None, "StreamCompressor | None"]] = {}
+_benchmark_locks: dict[tuple, threading.Lock] = {}
+_benchmark_locks_lock = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class StreamCompressor:
+    """A stream compressor ('zstd' or 'lz4') used to compress data before it is
+    sent over SSH, and decompress it on the other side.
+    """
+
+    name: str
+    level: int
+
+    def compress_cmd(self) -> list[str | Path]:
+        cmd: list[str | Path] = [self.name, "-q", "-c", f"-{self.level}"]
+        if self.name == "zstd":
+            cmd.append("-T0")
+            if self.level > 19:
+                cmd.append("--ultra")
+        return cmd
+
+    def decompress_cmd(self) -> list[str | Path]:
+        return [self.name, "-q", "-d", "-c"]
+
+    def rsync_opts(self) -> list[str]:
+        """Options for rsync to use the same compression in its own protocol."""
+        opts = ["--compress", f"--compress-choice={self.name}"]
+        if self.name == "zstd":
+            opts.append(f"--compress-level={self.level}")
+        return opts
+
+
+def transfer_settings(
+    sshtarget: SSHTarget, local_dir: Path | None = None
+) -> tuple[SSHTarget, StreamCompressor | None]:
+    """Return the `SSHTarget` to build the SSH commands of a transfer with
+    `sshtarget` from, and the `StreamCompressor` to use for the transfer, or
+    None if it should not be compressed.
+
+    If `sshtarget.compression` is 'auto' then the choice is made by a short
+    benchmark, see `_benchmark()`. Data is sampled from `local_dir` when sending
+    to `sshtarget`, and from `sshtarget.path` when receiving from it
+    (`local_dir` is None). Results are cached per host for a day. If
+    `sshtarget.cipher` is a list of ciphers, then the benchmark also picks the
+    fastest of them, and the returned `SSHTarget` is a copy of `sshtarget` whose
+    cipher list prefers it. `sshtarget` itself is never changed, as it is shared
+    by the concurrent transfers of a backup.
+    """
+    compression = sshtarget.compression
+    if compression is None or compression == "none":
+        return sshtarget, None
+    if compression != "auto":
+        level = sshtarget.compression_level or DEFAULT_LEVELS[compression]
+        return sshtarget, StreamCompressor(compression, level)
+    ciphers = _ciphers(sshtarget)
+    key = (
+        sshtarget.user,
+        sshtarget.host,
+        sshtarget.port,
+        frozenset(ciphers),
+        sshtarget.compression_level,
+        local_dir is None,
+    )
+    with _benchmark_locks_lock:
+        lock = _benchmark_locks.setdefault(key, threading.Lock())
+    # only transfers with the same host wait for each others benchmark
+    with lock:
+        cached = _benchmark_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < _BENCHMARK_CACHE_SECONDS:
+            _, cipher, compressor = cached
+        else:
+            try:
+                cipher, compressor = _benchmark(sshtarget, local_dir)
+            except (OSError, subprocess.SubprocessError) as exc:
+                logger.warning(f"transport benchmark for {sshtarget.host} failed: {exc}")
+                cipher, compressor = None, None
+            _benchmark_cache[key] = (time.monotonic(), cipher, compressor)
+    if cipher is not None and len(ciphers) > 1 and cipher != ciphers[0]:
+        sshtarget = copy.copy(sshtarget)
+        sshtarget.cipher = ",".join([cipher, *[c for c in ciphers if c != cipher]])
+    return sshtarget, compressor
+
+
+def _ciphers(sshtarget: SSHTarget) -> list[str]:
+    """Return the ciphers in the preference list of `sshtarget`."""
+    if sshtarget.cipher is None:
+        return []
+    return [cipher for cipher in sshtarget.cipher.split(",") if cipher]
+
+
+def _benchmark(
+    sshtarget: SSHTarget, local_dir: Path | None
+) -> tuple[str | None, StreamCompressor | None]:
+    """Measure the throughput of the link to `sshtarget` with a sample of real
+    data, and the speed and ratio of every compressor available on both sides on
+    the same sample. The expected throughput of a compressor is the smaller of
+    its speed and the link throughput times its ratio. If `sshtarget.cipher`
+    lists several ciphers then the link is measured with each of them.
+
+    Returns the cipher (None unless several are listed) and the compressor
+    (None if compression does not help) with the best expected throughput.
+    """
+    ciphers = _ciphers(sshtarget)
+    links: dict[str | None, float] = {}
+    sample = b""
+    for cipher in ciphers if len(ciphers) > 1 else [None]:
+        target = sshtarget
+        if cipher is not None:
+            target = copy.copy(sshtarget)
+            target.cipher = cipher
+        sample, link = _measure_link(target, local_dir, sample)
+        if len(sample) < _BENCHMARK_MIN_SAMPLE_SIZE:
+            logger.debug(f"not enough data to benchmark the link to {sshtarget.host}")
+            return None, None
+        logger.debug(
+            f"link to {sshtarget.host}"
+            f"{'' if cipher is None else f' with {cipher}'}: {link / (1 << 20):.1f} MiB/s"
+        )
+        links[cipher] = link
+    best_cipher = max(links, key=lambda cipher: links[cipher])
+    link = links[best_cipher]
+    best = None
+    best_throughput = link
+    for name in DEFAULT_LEVELS:
+        if shutil.which(name) is None or not sshtarget.which(name):
+            continue
+        compressor = StreamCompressor(name, sshtarget.compression_level or DEFAULT_LEVELS[name])
+        start = time.monotonic()
+        compressed = subprocess.run(
+            compressor.compress_cmd(), input=sample, check=True, capture_output=True
+        ).stdout
+        speed = len(sample) / max(time.monotonic() - start, 1e-3)
+        ratio = len(sample) / max(len(compressed), 1)
+        logger.debug(
+            f"{name} for {sshtarget.host}: {speed / (1 << 20):.1f} MiB/s, ratio {ratio:.2f}"
+        )
+        # with compression the cipher only has to encrypt the compressed data,
+        # so a slower cipher can still win on compressible data
+        for cipher, cipher_link in links.items():
+            throughput = min(speed, cipher_link * ratio)
+            if throughput > best_throughput:
+                best, best_cipher, best_throughput = compressor, cipher, throughput
+    logger.info(
+        f"using {best.name if best else 'no'} stream compression"
+        f"{'' if best_cipher is None else f' and {best_cipher}'} for {sshtarget.host}"
+        f" (~{best_throughput / (1 << 20):.1f} MiB/s)"
+    )
+    return best_cipher, best
+
+
+def _measure_link(
+    sshtarget: SSHTarget, local_dir: Path | None, sample: bytes
+) -> tuple[bytes, float]:
+    """Measure the throughput of the link to `sshtarget` by sending `sample`, or a
+    sample of `local_dir` if `sample` is empty, or by receiving a sample of
+    `sshtarget.path` if `local_dir` is None. Returns the sample and the
+    throughput in bytes per second.
+    """
+    start = time.monotonic()
+    subprocess.run(sshtarget.openssh_cmd(["true"]), check=True, capture_output=True)
+    overhead = time.monotonic() - start
+    if local_dir is not None:
+        sample = sample or _sample_local(local_dir)
+        start = time.monotonic()
+        subprocess.run(
+            sshtarget.openssh_cmd(["sh", "-c", "cat >/dev/null"]),
+            input=sample,
+            check=True,
+            capture_output=True,
+        )
+    else:
+        start = time.monotonic()
+        sample = subprocess.run(
+            sshtarget.openssh_cmd(
+                [
+                    "sh",
+                    "-c",
+                    'find "$1" -xdev -type f -print0 2>/dev/null'
+                    ' | xargs -0 cat 2>/dev/null | head -c "$2"',
+                    "sh",
+                    sshtarget.path,
+                    str(_BENCHMARK_SAMPLE_SIZE),
+                ]
+            ),
+            check=False,
+            capture_output=True,
+        ).stdout
+    elapsed = max(time.monotonic() - start - overhead, 1e-3)
+    return sample, len(sample) / elapsed
+
+
+def _sample_local(directory: Path) -> bytes:
+    """Return up to _BENCHMARK_SAMPLE_SIZE bytes read from the files under `directory`."""
+    chunks = []
+    remaining = _BENCHMARK_SAMPLE_SIZE
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if not stat.S_ISREG(os.lstat(path).st_mode):
+                    continue
+                with open(path, "rb") as f:
+                    chunk = f.read(remaining)
+            except OSError:
+                continue
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            if remaining <= 0:
+                return b"".join(chunks)
+    return b"".join(chunks)
@@ -4,7 +4,7 @@ Always import this module qualified:
     import yaesm.ty as ty
 """
 
-from collections.abc import Callable, Generator, Iterator, Sequence
+from collections.abc import Callable, Generator, Iterable, Iterator, Sequence
 from datetime import datetime, timedelta
 from logging import Logger
 from pathlib import Path
@@ -12,6 +12,7 @@ from re import Match, Pattern
 from subprocess import CompletedProcess
 from typing import (
     Any,
+    BinaryIO,
     ClassVar,
     Final,
     Literal,
@@ -26,12 +27,14 @@ from typing import (
 
 __all__ = [
     "Any",
+    "BinaryIO",
     "Callable",
     "ClassVar",
     "CompletedProcess",
     "datetime",
     "Final",
     "Generator",
+    "Iterable",
     "Iterator",
     "Literal",
     "Logger",
@@ -11,6 +11,8 @@ import pwd
 import random
 import shutil
 import subprocess
+import sys
+from datetime import datetime
 from pathlib import Path
 from string import ascii_lowercase
 
@@ -267,6 +269,19 @@ def random_backend(random_backend_generator):
     return random_backend_generator()
 
 
+@pytest.fixture
+def artifact_generator():
+    """Fixture to provide a function for generating a BackupArtifact of the
+    backup 'foo' in `timeframe`, taken at `hour` of a fixed day.
+    """
+
+    def generator(timeframe, hour):
+        name = f"yaesm-foo-{timeframe}.2026_08_20_{hour:02}:00"
+        return bckp.BackupArtifact(name, timeframe, datetime(2026, 8, 20, hour), f"/dst/{name}")
+
+    return generator
+
+
 @pytest.fixture
 def random_filesystem_modifier(path_generator, random_string_generator):
     """Fixture that provides a function to randomly make changes to a directory.
@@ -417,6 +432,38 @@ def sshtarget(sshtarget_generator):
     return sshtarget_generator()
 
 
+@pytest.fixture
+def failing_probes(monkeypatch):
+    """Fixture for making `SSHTarget.probe()` report every probe of the given
+    kinds (such as 'which' or 'writable') as failed.
+    """
+
+    def fail(*kinds):
+        original_probe = SSHTarget.probe
+
+        def probe(self, probes):
+            results = original_probe(self, probes)
+            return {p: False if p.kind in kinds else result for p, result in results.items()}
+
+        monkeypatch.setattr(SSHTarget, "probe", probe)
+
+    return fail
+
+
+@pytest.fixture
+def agent_cmd():
+    """Fixture for an exec list that runs a local yaesm agent from this source
+    tree, standing in for 'ssh ... yaesm agent'.
+    """
+    src = Path(bckp.__file__).parent.parent
+    return [
+        sys.executable,
+        "-c",
+        f"import sys; sys.path.insert(0, {str(src)!r}); import yaesm.agent;"
+        " yaesm.agent.serve(sys.stdin, sys.stdout)",
+    ]
+
+
 @pytest.fixture
 def random_timeframe_generator(
     random_timeframe_times_generator,
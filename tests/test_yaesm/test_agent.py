@@ -0,0 +1,102 @@
+"""tests/test_yaesm/test_agent.py."""
+
+import io
+import json
+import sys
+import time
+
+import pytest
+
+import yaesm.agent as agent
+
+AGENT_CMD = [
+    sys.executable,
+    "-c",
+    "import sys, yaesm.agent; yaesm.agent.serve(sys.stdin, sys.stdout)",
+]
+
+
+def _serve(*requests):
+    out = io.StringIO()
+    agent.serve(io.StringIO("".join(json.dumps(r) + "\n" for r in requests)), out)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_serve(path_generator):
+    d = path_generator("agent-dir", mkdir=True, cleanup=True)
+    d.joinpath("subdir").mkdir()
+    d.joinpath("file").touch()
+    responses = _serve(
+        {"op": "hello"},
+        {"op": "stat", "paths": [str(d), str(d / "file"), str(d / "missing")]},
+        {"op": "listdir", "path": str(d), "dirs_only": True},
+        {"op": "listdir", "path": str(d), "globs": ["f*", "x"]},
+        {"op": "which", "tools": ["sh", "no-such-tool-yaesm"]},
+        {"op": "rename", "src": str(d / "file"), "dst": str(d / "renamed")},
+        {"op": "run", "argv": ["sh", "-c", "cat; echo err >&2; exit 3"], "input": "hi"},
+        {"op": "run", "argv": ["no-such-tool-yaesm"]},
+    )
+    assert all(response["ok"] for response in responses)
+    results = [response["result"] for response in responses]
+    assert results[0] == {"version": agent.PROTOCOL_VERSION}
+    dir_stat, file_stat, missing = results[1]
+    assert dir_stat["is_dir"] and not dir_stat["is_file"]
+    assert file_stat["is_file"] and 0 <= file_stat["age"] < 60
+    assert missing is None
+    assert results[2] == ["subdir"]
+    assert results[3] == ["file"]
+    assert results[4] == [True, False]
+    assert d.joinpath("renamed").is_file()
+    assert results[6] == {"returncode": 3, "stdout": "hi", "stderr": "err\n"}
+    assert results[7]["returncode"] == 127
+
+
+def test_serve_errors():
+    out = io.StringIO()
+    agent.serve(io.StringIO('not json\n\n{"op": "nope"}\n[{"op": "hello"}, {"op": "stat"}]\n'), out)
+    responses = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(responses) == 3
+    assert not responses[0]["ok"]
+    assert not responses[1]["ok"]
+    assert [response["ok"] for response in responses[2]] == [True, False]
+
+
+def test_agent_session(agent_cmd, path_generator):
+    d = path_generator("agent-dir", mkdir=True, cleanup=True)
+    session = agent.AgentSession(agent_cmd)
+    try:
+        assert session.alive()
+        assert session.request("stat", paths=[str(d)])[0]["is_dir"]
+        assert session.batch(
+            [{"op": "which", "tools": ["sh"]}, {"op": "listdir", "path": str(d)}]
+        ) == [
+            [True],
+            [],
+        ]
+        with pytest.raises(agent.AgentRequestError):
+            session.request("listdir", path=str(d / "missing"))
+        with pytest.raises(agent.AgentRequestError):
+            session.batch([{"op": "hello"}, {"op": "listdir", "path": str(d / "missing")}])
+    finally:
+        session.close()
+    assert not session.alive()
+    with pytest.raises(agent.AgentError):
+        session.request("hello")
+
+
+def test_agent_session_timeout():
+    hello = json.dumps({"ok": True, "result": {"version": agent.PROTOCOL_VERSION}})
+    hung_agent = ["sh", "-c", f"read line; echo '{hello}'; sleep 60"]
+    session = agent.AgentSession(hung_agent, timeout=0.5)
+    start = time.monotonic()
+    with pytest.raises(agent.AgentError):
+        session.request("stat", paths=["/"])
+    assert time.monotonic() - start < 30
+    assert not session.alive()
+
+
+def test_agent_session_unavailable():
+    with pytest.raises(agent.AgentError):
+        agent.AgentSession(["sh", "-c", "exit 127"])
+    with pytest.raises(agent.AgentError):
+        agent.AgentSession(["no-such-tool-yaesm"])
@@ -5,9 +5,18 @@ every backend test script should have their own tests for the abstract methods i
 BackendBase class.
 """
 
+from pathlib import Path
+
+import pytest
+from freezegun import freeze_time
+
+import yaesm.backup as bckp
+import yaesm.prunequeue as prunequeue
 from yaesm.backend.backendbase import BackendBase, CheckResult, PathBackendBase
 from yaesm.backend.btrfsbackend import BtrfsBackend
 from yaesm.backend.rsyncbackend import RsyncBackend
+from yaesm.catalog import Catalog
+from yaesm.timeframe import DailyTimeframe, HourlyTimeframe
 
 
 def test_check_result_passed():
@@ -19,3 +28,164 @@ def test_path_backend_classes():
     assert issubclass(PathBackendBase, BackendBase)
     assert issubclass(BtrfsBackend, PathBackendBase)
     assert issubclass(RsyncBackend, PathBackendBase)
+
+
+class _DirBackend(PathBackendBase):
+    """A `PathBackendBase` whose artifacts are empty directories."""
+
+    fail_delete = False
+    unchanged = False
+
+    def __init__(self):
+        super().__init__()
+        self.deletes = []
+
+    def create_artifact(self, backup, timeframe, name):
+        path = backup.dst_dir.joinpath(name)
+        path.mkdir()
+        return bckp.BackupArtifact(name, timeframe.name, bckp.backup_to_datetime(name), str(path))
+
+    def delete_artifacts(self, backup, artifacts):
+        self.deletes.append([artifact.name for artifact in artifacts])
+        for artifact in artifacts:
+            Path(artifact.locator).rmdir()
+            if self.fail_delete:
+                raise OSError("delete failed")
+
+    def source_unchanged(self, backup, artifact):
+        return self.unchanged
+
+
+def test_path_backend_catalog(path_generator):
+    backend = _DirBackend()
+    src_dir = path_generator("catalog-src", mkdir=True, cleanup=True)
+    dst_dir = path_generator("catalog-dst", mkdir=True, cleanup=True)
+    timeframe = HourlyTimeframe(5, [0])
+    backup = bckp.Backup("foo", backend, src_dir, dst_dir, [timeframe])
+    assert backend.collect(backup) == []
+    names = [f"yaesm-foo-hourly.2026_08_20_{hour:02}:00" for hour in range(3)]
+    artifacts = [backend.create(backup, timeframe, name) for name in names]
+    assert backend.collect(backup) == artifacts[::-1]
+    backend.delete(backup, artifacts[:1])
+    assert backend.collect(backup) == artifacts[:0:-1]
+    backend.fail_delete = True
+    with pytest.raises(OSError):
+        backend.delete(backup, artifacts[1:])
+    # The failed delete removed one artifact, which the catalog must not hide.
+    assert backend.collect(backup) == artifacts[2:]
+
+
+def test_do_backup_defers_pruning(path_generator):
+    backend = _DirBackend()
+    backend.prune_deferred = True
+    src_dir = path_generator("defer-src", mkdir=True, cleanup=True)
+    dst_dir = path_generator("defer-dst", mkdir=True, cleanup=True)
+    hourly = HourlyTimeframe(1, [0])
+    backup = bckp.Backup("foo", backend, src_dir, dst_dir, [hourly])
+    for hour in range(3):
+        with freeze_time(f"2026-08-20 {hour:02}:00"):
+            backend.do_backup(backup, hourly)
+    assert backend.deletes == []
+    assert [artifact.name for artifact in backend.collect(backup)] == [
+        "yaesm-foo-hourly.2026_08_20_02:00"
+    ]
+    queued = ["yaesm-foo-hourly.2026_08_20_00:00", "yaesm-foo-hourly.2026_08_20_01:00"]
+    assert [artifact.name for artifact in backend.pending_deletions(backup)] == queued
+    assert [artifact.name for artifact in prunequeue.drain(backup)] == queued
+    assert backend.deletes == [queued]
+    assert backend.pending_deletions(backup) == []
+    assert not dst_dir.joinpath(queued[0]).exists()
+
+
+def test_do_backup_prunes_all_timeframes(path_generator):
+    backend = _DirBackend()
+    src_dir = path_generator("prune-src", mkdir=True, cleanup=True)
+    dst_dir = path_generator("prune-dst", mkdir=True, cleanup=True)
+    hourly = HourlyTimeframe(2, [0])
+    daily = DailyTimeframe(1, [(0, 0)])
+    backup = bckp.Backup("foo", backend, src_dir, dst_dir, [hourly, daily])
+    for hour in range(3):
+        with freeze_time(f"2026-08-20 {hour:02}:00"):
+            backend.create(backup, daily, bckp.backup_basename_now(backup, daily))
+    with freeze_time("2026-08-20 03:00"):
+        backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    with freeze_time("2026-08-20 04:00"):
+        plan = backend.prune(backup, dry_run=True)
+        assert [artifact.name for artifact in plan.delete] == [
+            "yaesm-foo-daily.2026_08_20_01:00",
+            "yaesm-foo-daily.2026_08_20_00:00",
+        ]
+        assert backend.deletes == []
+        backend.do_backup(backup, hourly)
+    assert backend.deletes == [[artifact.name for artifact in plan.delete]]
+    with freeze_time("2026-08-20 05:00"):
+        backend.do_backup(backup, hourly)
+    assert backend.deletes[1:] == [["yaesm-foo-hourly.2026_08_20_03:00"]]
+    assert [artifact.name for artifact in backend.collect(backup)] == [
+        "yaesm-foo-hourly.2026_08_20_05:00",
+        "yaesm-foo-hourly.2026_08_20_04:00",
+        "yaesm-foo-daily.2026_08_20_02:00",
+    ]
+
+
+def test_do_backup_collects_once(monkeypatch, path_generator):
+    backend = _DirBackend()
+    src_dir = path_generator("collect-src", mkdir=True, cleanup=True)
+    dst_dir = path_generator("collect-dst", mkdir=True, cleanup=True)
+    hourly = HourlyTimeframe(2, [0])
+    hourly.unchanged = "skip"
+    backup = bckp.Backup("foo", backend, src_dir, dst_dir, [hourly])
+    collects = []
+    original_collect = _DirBackend.collect
+    monkeypatch.setattr(
+        _DirBackend,
+        "collect",
+        lambda self, *args, **kwargs: (
+            collects.append(kwargs) or original_collect(self, *args, **kwargs)
+        ),
+    )
+    with freeze_time("2026-08-20 00:00"):
+        backend.do_backup(backup, hourly)
+        # The collect() of prune() is not one of do_backup().
+        assert collects == [{}, {}]
+        with pytest.raises(bckp.BackupError, match="backup already exists"):
+            backend.do_backup(backup, hourly)
+    assert len(collects) == 3
+
+
+def test_do_backup_unchanged(path_generator):
+    backend = _DirBackend()
+    src_dir = path_generator("unchanged-src", mkdir=True, cleanup=True)
+    dst_dir = path_generator("unchanged-dst", mkdir=True, cleanup=True)
+    hourly = HourlyTimeframe(2, [0])
+    hourly.unchanged = "alias"
+    daily = DailyTimeframe(1, [(0, 0)])
+    daily.unchanged = "skip"
+    backup = bckp.Backup("foo", backend, src_dir, dst_dir, [hourly, daily])
+    with freeze_time("2026-08-20 00:00"):
+        backend.do_backup(backup, hourly)
+    original = backend.collect(backup)[0]
+    backend.unchanged = True
+    with freeze_time("2026-08-21 00:00"):
+        backend.do_backup(backup, daily)
+    assert backend.collect(backup) == [original]
+    with freeze_time("2026-08-20 01:00"):
+        backend.do_backup(backup, hourly)
+    alias = backend.collect(backup)[0]
+    assert alias.name == "yaesm-foo-hourly.2026_08_20_01:00"
+    assert alias.locator == original.locator
+    assert alias.metadata["alias_of"] == original.name
+    assert sorted(path.name for path in dst_dir.iterdir() if path.is_dir()) == [original.name]
+    # The original is deleted from the catalog, but kept for the aliases of it.
+    with freeze_time("2026-08-20 02:00"):
+        backend.do_backup(backup, hourly)
+    assert backend.deletes == []
+    assert Path(original.locator).is_dir()
+    names = ["yaesm-foo-hourly.2026_08_20_02:00", alias.name]
+    assert [artifact.name for artifact in Catalog(backup).reconcile()] == names
+    backend.unchanged = False
+    for hour in [3, 4]:
+        with freeze_time(f"2026-08-20 {hour:02}:00"):
+            backend.do_backup(backup, hourly)
+    assert backend.deletes == [[names[0]]]
+    assert not Path(original.locator).exists()
@@ -1,5 +1,6 @@
 """tests/test_yaesm/test_backend/test_btrfsbackend.py."""
 
+import errno
 import os
 import shutil
 import subprocess
@@ -14,6 +15,7 @@ from freezegun import freeze_time
 import yaesm.backend.btrfsbackend as btrfs
 import yaesm.backup as bckp
 from yaesm.backup import Backup
+from yaesm.timeframe import DailyTimeframe, HourlyTimeframe
 
 
 @pytest.fixture(scope="session")
@@ -410,6 +412,394 @@ def test_btrfs_bootstrap_remote_to_local(
     assert bootstrap_snapshot.path.is_dir()
 
 
+# --- rolling parent ---
+
+
+def test_rolling_parent_snapshot(btrfs_backend, random_backup_generator):
+    for backup_type in ["local_to_local", "local_to_remote", "remote_to_local"]:
+        backup = random_backup_generator(backend_type="btrfs", backup_type=backup_type)
+        timeframe = backup.timeframes[0]
+        timeframe.keep = 5
+        src_dir = backup.src_dir.path if backup_type == "remote_to_local" else backup.src_dir
+        prefix = btrfs._btrfs_parent_snapshot_prefix(backup.name)
+        for hour in range(3):
+            with freeze_time(f"2020-01-01 {hour:02}:00"):
+                name = bckp.backup_basename_now(backup, timeframe)
+                btrfs_backend.do_backup(backup, timeframe)
+            parents = [path.name for path in src_dir.iterdir() if path.name.startswith(prefix)]
+            assert parents == [btrfs._btrfs_parent_snapshot_basename(name)]
+
+
+def test_rolling_parent_is_newest_common_snapshot(btrfs_backend, random_backup_generator):
+    backup = random_backup_generator(backend_type="btrfs", backup_type="local_to_local")
+    timeframe = backup.timeframes[0]
+    timeframe.keep = 5
+    for hour in range(2):
+        with freeze_time(f"2020-01-01 {hour:02}:00"):
+            name = bckp.backup_basename_now(backup, timeframe)
+            btrfs_backend.do_backup(backup, timeframe)
+    parent = btrfs._btrfs_incremental_parent_local_to_local(backup.src_dir, backup.dst_dir, backup)
+    assert parent == backup.src_dir.joinpath(btrfs._btrfs_parent_snapshot_basename(name))
+    # the received copy of the parent is gone, so fall back to the bootstrap snapshot
+    btrfs._btrfs_delete_subvolumes_local(backup.dst_dir.joinpath(name))
+    parent = btrfs._btrfs_incremental_parent_local_to_local(backup.src_dir, backup.dst_dir, backup)
+    assert parent == backup.src_dir.joinpath(btrfs._btrfs_bootstrap_snapshot_basename(backup.name))
+
+
+def test_rolling_parent_recovers_without_bootstrap(btrfs_backend, random_backup_generator):
+    for backup_type in ["local_to_local", "local_to_remote", "remote_to_local"]:
+        backup = random_backup_generator(backend_type="btrfs", backup_type=backup_type)
+        timeframe = backup.timeframes[0]
+        timeframe.keep = 5
+        with freeze_time("2020-01-01 00:00"):
+            btrfs_backend.do_backup(backup, timeframe)
+        src_dir = backup.src_dir.path if backup_type == "remote_to_local" else backup.src_dir
+        src_bootstrap = src_dir.joinpath(btrfs._btrfs_bootstrap_snapshot_basename(backup.name))
+        btrfs._btrfs_delete_subvolumes_local(src_bootstrap)
+        with freeze_time("2020-01-01 01:00"):
+            btrfs_backend.do_backup(backup, timeframe)
+        # recovered from the common rolling parent instead of re-bootstrapping
+        assert not src_bootstrap.is_dir()
+        assert len(bckp.backups_collect(backup, timeframes=[timeframe])) == 2
+
+
+def test_btrfs_find_common_parent():
+    backup = Backup("test", btrfs.BtrfsBackend(), Path("/src"), Path("/dst"), [])
+    bootstrap = btrfs._btrfs_bootstrap_snapshot_basename("test")
+    old_parent = btrfs._btrfs_parent_snapshot_basename("yaesm-test-hourly.2020_01_01_00:00")
+    new_parent = btrfs._btrfs_parent_snapshot_basename("yaesm-test-hourly.2020_01_01_01:00")
+    src_subvolumes = {
+        bootstrap: btrfs._BtrfsSubvolumeUUIDs("a", None),
+        old_parent: btrfs._BtrfsSubvolumeUUIDs("b", None),
+        new_parent: btrfs._BtrfsSubvolumeUUIDs("c", None),
+    }
+    dst_subvolumes = {
+        bootstrap: btrfs._BtrfsSubvolumeUUIDs("x", "a"),
+        "yaesm-test-hourly.2020_01_01_00:00": btrfs._BtrfsSubvolumeUUIDs("y", "b"),
+    }
+    assert btrfs._btrfs_find_common_parent(backup, src_subvolumes, dst_subvolumes) == old_parent
+    dst_subvolumes["yaesm-test-hourly.2020_01_01_01:00"] = btrfs._BtrfsSubvolumeUUIDs("z", "c")
+    assert btrfs._btrfs_find_common_parent(backup, src_subvolumes, dst_subvolumes) == new_parent
+    assert btrfs._btrfs_find_common_parent(backup, src_subvolumes, {}) is None
+
+
+def test_btrfs_parse_received_uuids():
+    output = (
+        "ID 256 gen 9 top level 5 received_uuid -                                    path a\n"
+        "ID 257 gen 12 top level 5 received_uuid 3d0a6ee3-0b9d-5143-9d39-2d7a5d5fdd26 path b\n"
+        "ID 258 gen 14 top level 5 received_uuid 00000000-0000-0000-0000-000000000000 path c\n"
+    )
+    assert btrfs._btrfs_parse_received_uuids(output) == {"3d0a6ee3-0b9d-5143-9d39-2d7a5d5fdd26"}
+
+
+def test_btrfs_parse_subvolume_list():
+    output = (
+        "ID 256 gen 9 top level 5 received_uuid - "
+        "uuid 7e1bd7c5-7b36-a54e-8b1e-b2a3c8d02c4d path a\n"
+        "ID 257 gen 12 top level 5 received_uuid 3d0a6ee3-0b9d-5143-9d39-2d7a5d5fdd26 "
+        "uuid 5b1c2e4f-10f0-c04a-9e42-93bb2ab0a1f1 path b/c\n"
+    )
+    assert btrfs._btrfs_parse_subvolume_list(output) == {
+        256: btrfs._BtrfsSubvolumeUUIDs("7e1bd7c5-7b36-a54e-8b1e-b2a3c8d02c4d", None),
+        257: btrfs._BtrfsSubvolumeUUIDs(
+            "5b1c2e4f-10f0-c04a-9e42-93bb2ab0a1f1", "3d0a6ee3-0b9d-5143-9d39-2d7a5d5fdd26"
+        ),
+    }
+
+
+def test_btrfs_subvolume_uuids_local_without_subvol_info(monkeypatch, path_generator):
+    directory = path_generator("subvolumes", mkdir=True, cleanup=True)
+    for name in ["a", "b", "not-a-subvolume"]:
+        directory.joinpath(name).mkdir()
+
+    def subvolume_info(path):
+        if path.name == "not-a-subvolume":
+            raise OSError(errno.EINVAL, "not a btrfs subvolume")
+        raise OSError(errno.ENOTTY, "old kernel")
+
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(
+            cmd,
+            0,
+            stdout=(
+                "ID 300 gen 9 top level 5 received_uuid - "
+                "uuid 7e1bd7c5-7b36-a54e-8b1e-b2a3c8d02c4d path subvolumes/a\n"
+                "ID 301 gen 9 top level 5 received_uuid - "
+                "uuid 5b1c2e4f-10f0-c04a-9e42-93bb2ab0a1f1 path subvolumes/b\n"
+                "ID 302 gen 9 top level 5 received_uuid - "
+                "uuid 3d0a6ee3-0b9d-5143-9d39-2d7a5d5fdd26 path elsewhere/a\n"
+            ),
+        )
+
+    monkeypatch.setattr(btrfs.btrfsioctl, "subvolume_info", subvolume_info)
+    monkeypatch.setattr(
+        btrfs.btrfsioctl, "subvolume_id", lambda path: {"a": 300, "b": 301}[path.name]
+    )
+    monkeypatch.setattr(btrfs.subprocess, "run", fake_run)
+    assert btrfs._btrfs_subvolume_uuids_local(directory, ["*"]) == {
+        "a": btrfs._BtrfsSubvolumeUUIDs("7e1bd7c5-7b36-a54e-8b1e-b2a3c8d02c4d", None),
+        "b": btrfs._BtrfsSubvolumeUUIDs("5b1c2e4f-10f0-c04a-9e42-93bb2ab0a1f1", None),
+    }
+    assert len(calls) == 1
+
+
+def test_btrfs_rotate_parent_snapshot_failure_is_not_fatal(caplog, path_generator):
+    backup = Backup("test", btrfs.BtrfsBackend(), Path("/src"), Path("/dst"), [])
+    snapshot = path_generator("missing-snapshot")
+    backup_basename = "yaesm-test-hourly.2020_01_01_00:00"
+    assert btrfs._btrfs_rotate_parent_snapshot_local(snapshot, backup, backup_basename) is None
+    assert "failed to keep parent snapshot" in caplog.text
+
+
+def test_create_artifact_locks_per_backup(monkeypatch):
+    backend = btrfs.BtrfsBackend()
+    backup = Backup("test", backend, Path("/src"), Path("/dst"), [])
+    hourly, daily = HourlyTimeframe(1, [0]), DailyTimeframe(1, [(0, 0)])
+    running = []
+    overlapped = threading.Event()
+
+    def fake_exec(backup, backup_basename, timeframe):
+        running.append(timeframe.name)
+        if len(running) > 1:
+            overlapped.set()
+        overlapped.wait(0.2)
+        running.remove(timeframe.name)
+        return Path("/dst", backup_basename)
+
+    monkeypatch.setattr(backend, "_exec_backup_local_to_local", fake_exec)
+    threads = [
+        threading.Thread(
+            target=backend.create_artifact,
+            args=(backup, timeframe, f"yaesm-test-{timeframe.name}.2020_01_01_00:00"),
+        )
+        for timeframe in [hourly, daily]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not overlapped.is_set()
+
+
+def test_btrfs_rotate_parent_snapshot_similar_backup_names(monkeypatch, path_generator):
+    src_dir = path_generator("btrfs-parents-src", mkdir=True, cleanup=True)
+    foo = Backup("foo", btrfs.BtrfsBackend(), src_dir, Path("/dst"), [])
+    foo_x = Backup("foo-x", btrfs.BtrfsBackend(), src_dir, Path("/dst"), [])
+    stale = src_dir.joinpath(".yaesm-btrfs-parent-snapshot-yaesm-foo-hourly.2020_01_01_00:00")
+    other = src_dir.joinpath(".yaesm-btrfs-parent-snapshot-yaesm-foo-x-hourly.2020_01_01_00:00")
+    snapshot = src_dir.joinpath(".yaesm-btrfs-staging")
+    for path in [stale, other, snapshot]:
+        path.mkdir()
+    deleted = []
+
+    def fake_delete(*subvolumes, check=True):
+        deleted.extend(subvolumes)
+        return 0, []
+
+    monkeypatch.setattr(btrfs, "_btrfs_delete_subvolumes_local", fake_delete)
+    parent = btrfs._btrfs_rotate_parent_snapshot_local(
+        snapshot, foo, "yaesm-foo-hourly.2020_01_01_01:00"
+    )
+    assert parent == src_dir.joinpath(
+        ".yaesm-btrfs-parent-snapshot-yaesm-foo-hourly.2020_01_01_01:00"
+    )
+    assert deleted == [stale]
+    subvolumes = {path.name: btrfs._BtrfsSubvolumeUUIDs(path.name, None) for path in [other]}
+    assert btrfs._btrfs_parent_candidates(foo, subvolumes) == []
+    assert btrfs._btrfs_parent_candidates(foo_x, subvolumes) == [other.name]
+
+
+def test_btrfs_parse_generation():
+    output = (
+        "home/.snapshots/yaesm-foo-hourly.2026_08_20_00:00\n"
+        "\tName: \t\t\tyaesm-foo-hourly.2026_08_20_00:00\n"
+        "\tGeneration: \t\t42\n"
+        "\tGen at creation: \t40\n"
+    )
+    assert btrfs._btrfs_parse_generation(output, "Generation") == 42
+    assert btrfs._btrfs_parse_generation(output, "Gen at creation") == 40
+    assert btrfs._btrfs_parse_generation(output, "Parent ID") is None
+
+
+def test_btrfs_select_clone_sources():
+    subvolumes = {
+        "c": btrfs._BtrfsSubvolumeUUIDs("3", None),
+        "a": btrfs._BtrfsSubvolumeUUIDs("1", None),
+        "b": btrfs._BtrfsSubvolumeUUIDs("2", None),
+    }
+    assert btrfs._btrfs_select_clone_sources(subvolumes, {"1", "3"}, set()) == ["a", "c"]
+    assert btrfs._btrfs_select_clone_sources(subvolumes, {"1", "3"}, {"a"}) == ["c"]
+    assert btrfs._btrfs_select_clone_sources(subvolumes, set(), set()) == []
+
+
+def test_clone_sources_local_to_local(monkeypatch, btrfs_fs_generator, random_timeframes_generator):
+    src_fs = btrfs_fs_generator()
+    dst_fs = btrfs_fs_generator()
+    src_dirs = []
+    for name in ["one", "two"]:
+        src_dirs.append(src_fs.joinpath(name))
+        subprocess.run(["btrfs", "subvolume", "create", src_dirs[-1]], check=True)
+        src_dirs[-1].joinpath("data").write_bytes(os.urandom(1 << 20))
+    backup_one = Backup(
+        "one",
+        btrfs.BtrfsBackend(),
+        src_dirs[0],
+        dst_fs.joinpath("one"),
+        random_timeframes_generator(1),
+    )
+    backup_two = Backup(
+        "two",
+        btrfs.BtrfsBackend(clone_sources=[src_dirs[0]]),
+        src_dirs[1],
+        dst_fs.joinpath("two"),
+        random_timeframes_generator(1),
+    )
+    backup_one.dst_dir.mkdir()
+    backup_two.dst_dir.mkdir()
+    send_receive = btrfs._btrfs_send_receive_local_to_local
+    clone_sources = []
+
+    def _spy(*args, **kwargs):
+        clone_sources.append(list(kwargs.get("clone_sources", [])))
+        return send_receive(*args, **kwargs)
+
+    monkeypatch.setattr(btrfs, "_btrfs_send_receive_local_to_local", _spy)
+    with freeze_time("2020-01-01 00:00"):
+        backup_one.backend.do_backup(backup_one, backup_one.timeframes[0])
+        backup_two.backend.do_backup(backup_two, backup_two.timeframes[0])
+    one_snapshots = {
+        path.name for path in src_dirs[0].iterdir() if path.name.startswith(".yaesm-btrfs-")
+    }
+    assert clone_sources[-1]
+    assert {path.name for path in clone_sources[-1]} <= one_snapshots
+    assert len(bckp.backups_collect(backup_two)) == 1
+
+
+@pytest.fixture
+def fake_findmnt(monkeypatch, path_generator):
+    """Fixture for a fake findmnt on PATH, for which paths containing 'fs1' or
+    'fs2' are on two btrfs filesystems, and other paths are on ext4. Remote
+    commands run locally.
+    """
+    bin_dir = path_generator("findmnt-bin", mkdir=True, cleanup=True)
+    fake = bin_dir.joinpath("findmnt")
+    fake.write_text(
+        "#!/bin/sh\n"
+        'case "$5" in\n'
+        "  *fs1*) echo 'btrfs 11111111-1111-1111-1111-111111111111' ;;\n"
+        "  *fs2*) echo 'btrfs 22222222-2222-2222-2222-222222222222' ;;\n"
+        "  *) echo 'ext4' ;;\n"
+        "esac\n"
+    )
+    fake.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    monkeypatch.setattr(
+        btrfs.SSHTarget, "openssh_cmd", lambda self, cmd, string=False: [str(a) for a in cmd]
+    )
+
+
+def test_btrfs_clone_sources_remote_other_filesystem(monkeypatch, fake_findmnt):
+    src_dir = btrfs.SSHTarget("ssh://localhost:/fs1/src", Path("/key"))
+    clone_dirs = [Path("/fs1/other"), Path("/fs2/other"), Path("/ext4/other")]
+    monkeypatch.setattr(
+        btrfs,
+        "_btrfs_subvolume_uuids_remote",
+        lambda directory, patterns: {"snapshot": btrfs._BtrfsSubvolumeUUIDs("1", None)},
+    )
+    clone_sources = btrfs._btrfs_clone_sources_remote(
+        [src_dir, *(src_dir.with_path(d) for d in clone_dirs)], {"1"}
+    )
+    assert [s.path for s in clone_sources] == [
+        Path("/fs1/src/snapshot"),
+        Path("/fs1/other/snapshot"),
+    ]
+    errors = btrfs.check_btrfs_same_filesystem_remote(src_dir, clone_dirs)
+    assert errors[Path("/fs1/other")] == []
+    assert errors[Path("/fs2/other")]
+    assert errors[Path("/ext4/other")]
+
+
+def test_btrfs_send_opts(monkeypatch):
+    features = {None: frozenset({"send", "receive"})}
+    monkeypatch.setattr(btrfs, "_btrfs_send_features", lambda sshtarget=None: features[sshtarget])
+    backend = btrfs.BtrfsBackend()
+    backup = Backup("test", backend, Path("/src"), Path("/dst"), [])
+    assert btrfs._btrfs_send_opts(backup) == []
+    backend.send_compressed_data = True
+    assert btrfs._btrfs_send_opts(backup) == ["--proto", "2", "--compressed-data"]
+    features[None] = frozenset({"receive"})
+    assert btrfs._btrfs_send_opts(backup) == []
+
+
+def test_btrfs_send_features_cached(monkeypatch):
+    monkeypatch.setattr(btrfs, "_send_features_cache", {})
+    features = btrfs._btrfs_send_features()
+    assert features <= {"send", "receive"}
+    monkeypatch.setattr(btrfs, "_SEND_FEATURES_SCRIPT", "echo send receive")
+    assert btrfs._btrfs_send_features() == features
+    btrfs._send_features_cache.clear()
+    assert btrfs._btrfs_send_features() == {"send", "receive"}
+
+
+def test_btrfs_spool_resumable():
+    manifest = btrfs.btrfsspool.SpoolManifest("backup", "a", "parent", "b", 10, ("--proto", "2"))
+    src_uuids = {
+        "snapshot": btrfs._BtrfsSubvolumeUUIDs("a", None),
+        "parent": btrfs._BtrfsSubvolumeUUIDs("b", None),
+    }
+    dst_uuids = {"received": btrfs._BtrfsSubvolumeUUIDs("c", "b")}
+    args = ("snapshot", src_uuids, dst_uuids)
+    assert btrfs._btrfs_spool_resumable(manifest, 10, ["--proto", "2"], *args)
+    assert not btrfs._btrfs_spool_resumable(manifest, 10, [], *args)
+    assert not btrfs._btrfs_spool_resumable(manifest, 20, ["--proto", "2"], *args)
+    assert not btrfs._btrfs_spool_resumable(
+        manifest, 10, ["--proto", "2"], "snapshot", src_uuids, {}
+    )
+
+
+def test_spool_resume_keeps_original_name(monkeypatch, path_generator):
+    dst_dir = path_generator("btrfs-spool-dst", mkdir=True, cleanup=True)
+    hourly = HourlyTimeframe(1, [0])
+    backend = btrfs.BtrfsBackend(spool=True)
+    src_dir = btrfs.SSHTarget("ssh://localhost:/src", Path("/key"))
+    backup = Backup("foo", backend, src_dir, dst_dir, [hourly])
+    snapshot_basename = btrfs.btrfsspool.spool_snapshot_basename("foo", "hourly")
+    spool = btrfs.btrfsspool.LocalSpool(
+        dst_dir.joinpath(btrfs.btrfsspool.spool_dir_basename("foo", "hourly"))
+    )
+    old = "yaesm-foo-hourly.2020_01_01_00:00"
+    spool.start(btrfs.btrfsspool.SpoolManifest(old, "a", None, None, 1 << 20))
+    parents = []
+    monkeypatch.setattr(
+        btrfs,
+        "_btrfs_subvolume_uuids_remote",
+        lambda directory, patterns: {snapshot_basename: btrfs._BtrfsSubvolumeUUIDs("a", None)},
+    )
+    monkeypatch.setattr(btrfs, "_btrfs_subvolume_uuids_local", lambda directory, patterns: {})
+    monkeypatch.setattr(btrfs, "_btrfs_spool_resumable", lambda *args: True)
+    monkeypatch.setattr(btrfs, "_btrfs_take_snapshot_remote", lambda *args: None)
+    monkeypatch.setattr(btrfs, "_btrfs_delete_subvolumes_remote", lambda *args, **kwargs: None)
+    monkeypatch.setattr(btrfs.btrfsspool, "fill_spool", lambda *args, **kwargs: None)
+    monkeypatch.setattr(
+        btrfs.btrfsspool,
+        "receive_spool",
+        lambda spool, directory: directory.joinpath(snapshot_basename).mkdir(),
+    )
+    monkeypatch.setattr(
+        btrfs,
+        "_btrfs_rotate_parent_snapshot_remote",
+        lambda snapshot, backup, backup_basename: parents.append(backup_basename),
+    )
+    new = "yaesm-foo-hourly.2020_01_01_12:00"
+    artifact = backend.create(backup, hourly, new)
+    assert artifact.name == new
+    assert parents == [old, new]
+    assert [artifact.name for artifact in backend.collect(backup)] == [new, old]
+
+
 # --- check: local_to_local ---
 
 
@@ -521,7 +911,12 @@ def test_check_local_to_remote_remote_dir_missing(
 
 
 def test_check_local_to_remote_remote_tool_missing(
-    monkeypatch, btrfs_backend, btrfs_fs_generator, sshtarget_generator, random_timeframes_generator
+    monkeypatch,
+    failing_probes,
+    btrfs_backend,
+    btrfs_fs_generator,
+    sshtarget_generator,
+    random_timeframes_generator,
 ):
     src_dir = btrfs_fs_generator()
     dst_dir_path = btrfs_fs_generator()
@@ -532,13 +927,12 @@ def test_check_local_to_remote_remote_tool_missing(
 
     def fake_run(cmd, **kwargs):
         command = " ".join(str(c) for c in cmd) if isinstance(cmd, list) else ""
-        if "command -v btrfs" in command:
-            return subprocess.CompletedProcess(cmd, returncode=1)
         if cmd[0] == "ssh" and "btrfs filesystem show" in command:
             return subprocess.CompletedProcess(cmd, returncode=127)
         return original_run(cmd, **kwargs)
 
     monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("which")
     errors = _errors(btrfs_backend.check(backup))
     assert any("not found on remote" in e and "btrfs" in e for e in errors)
     assert not any("not on a btrfs filesystem" in e for e in errors)
@@ -608,21 +1002,18 @@ def test_check_remote_to_local_remote_dir_missing(
 
 
 def test_check_remote_to_local_remote_tool_missing(
-    monkeypatch, btrfs_backend, btrfs_fs_generator, sshtarget_generator, random_timeframes_generator
+    failing_probes,
+    btrfs_backend,
+    btrfs_fs_generator,
+    sshtarget_generator,
+    random_timeframes_generator,
 ):
     src_dir_path = btrfs_fs_generator()
     dst_dir = btrfs_fs_generator()
     sshtarget = sshtarget_generator()
     src_dir = sshtarget.with_path(src_dir_path)
     backup = Backup("test", btrfs_backend, src_dir, dst_dir, random_timeframes_generator())
-    original_run = subprocess.run
-
-    def fake_run(cmd, **kwargs):
-        if isinstance(cmd, list) and "command -v btrfs" in " ".join(str(c) for c in cmd):
-            return subprocess.CompletedProcess(cmd, returncode=1)
-        return original_run(cmd, **kwargs)
-
-    monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("which")
     errors = _errors(btrfs_backend.check(backup))
     assert any("not found on remote" in e and "btrfs" in e for e in errors)
 
@@ -643,41 +1034,35 @@ def test_check_remote_to_local_remote_not_btrfs(
 
 
 def test_check_local_to_remote_remote_dst_not_writable(
-    monkeypatch, btrfs_backend, btrfs_fs_generator, sshtarget_generator, random_timeframes_generator
+    failing_probes,
+    btrfs_backend,
+    btrfs_fs_generator,
+    sshtarget_generator,
+    random_timeframes_generator,
 ):
     src_dir = btrfs_fs_generator()
     dst_dir_path = btrfs_fs_generator()
     sshtarget = sshtarget_generator()
     dst_dir = sshtarget.with_path(dst_dir_path)
     backup = Backup("test", btrfs_backend, src_dir, dst_dir, random_timeframes_generator())
-    original_run = subprocess.run
-
-    def fake_run(cmd, **kwargs):
-        if isinstance(cmd, list) and "test -w" in " ".join(str(c) for c in cmd):
-            return subprocess.CompletedProcess(cmd, returncode=1)
-        return original_run(cmd, **kwargs)
-
-    monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("writable")
     errors = _errors(btrfs_backend.check(backup))
     assert any("dst_dir" in e and "not writable" in e for e in errors)
 
 
 def test_check_remote_to_local_remote_src_not_readable(
-    monkeypatch, btrfs_backend, btrfs_fs_generator, sshtarget_generator, random_timeframes_generator
+    failing_probes,
+    btrfs_backend,
+    btrfs_fs_generator,
+    sshtarget_generator,
+    random_timeframes_generator,
 ):
     src_dir_path = btrfs_fs_generator()
     dst_dir = btrfs_fs_generator()
     sshtarget = sshtarget_generator()
     src_dir = sshtarget.with_path(src_dir_path)
     backup = Backup("test", btrfs_backend, src_dir, dst_dir, random_timeframes_generator())
-    original_run = subprocess.run
-
-    def fake_run(cmd, **kwargs):
-        if isinstance(cmd, list) and "test -r" in " ".join(str(c) for c in cmd):
-            return subprocess.CompletedProcess(cmd, returncode=1)
-        return original_run(cmd, **kwargs)
-
-    monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("readable")
     errors = _errors(btrfs_backend.check(backup))
     assert any("src_dir" in e and "not readable" in e for e in errors)
 
@@ -708,6 +1093,17 @@ def test_config_schema():
     # rejects float
     with pytest.raises(vlp.Invalid):
         schema({"btrfs_bootstrap_refresh": 1.5})
+    # clone source dirs are promoted to Paths
+    backend3 = btrfs.BtrfsBackend()
+    schema({"btrfs_clone_sources": ["/a", "/b"], "backend": backend3})
+    assert backend3.clone_sources == [Path("/a"), Path("/b")]
+    with pytest.raises(vlp.Invalid):
+        schema({"btrfs_clone_sources": "/a"})
+    backend4 = btrfs.BtrfsBackend()
+    schema({"btrfs_send_compressed_data": True, "backend": backend4})
+    assert backend4.send_compressed_data
+    with pytest.raises(vlp.Invalid):
+        schema({"btrfs_send_compressed_data": "yes"})
 
 
 # --- bootstrap refresh ---
@@ -748,15 +1144,21 @@ def test_btrfs_maybe_refresh_bootstrap(btrfs_fs_generator, random_timeframes_gen
     assert dst_bootstrap.is_dir()
     assert src_bootstrap.stat().st_mtime == original_mtime
 
-    # age bootstrap past threshold — should delete both
+    # age bootstrap past threshold — should replace both with a new pair
+    old_uuids = btrfs._btrfs_subvolume_uuids_local(src_dir, [basename])[basename]
     with freeze_time("2020-01-05 12:00"):
         _age_btrfs_snapshot(src_bootstrap, datetime(2020, 1, 1).timestamp())
         btrfs._btrfs_maybe_refresh_bootstrap(backup, 1)
-    assert not src_bootstrap.is_dir()
-    assert not dst_bootstrap.is_dir()
-
-    # recreate and test: src deleted but dst already gone — no error
-    btrfs._btrfs_bootstrap_local_to_local(src_dir, dst_dir, backup)
+    assert src_bootstrap.is_dir()
+    assert dst_bootstrap.is_dir()
+    new_uuids = btrfs._btrfs_subvolume_uuids_local(src_dir, [basename])[basename]
+    assert new_uuids.uuid != old_uuids.uuid
+    dst_uuids = btrfs._btrfs_subvolume_uuids_local(dst_dir, [basename])[basename]
+    assert dst_uuids.received_uuid == new_uuids.uuid
+    assert sorted(p.name for p in src_dir.iterdir() if p.name.startswith(".yaesm")) == [basename]
+    assert sorted(p.name for p in dst_dir.iterdir() if p.name.startswith(".yaesm")) == [basename]
+
+    # dst bootstrap gone and no common snapshot — should delete src bootstrap
     btrfs._btrfs_delete_subvolumes_local(dst_bootstrap)
     assert not dst_bootstrap.is_dir()
     with freeze_time("2020-01-05 12:00"):
@@ -0,0 +1,109 @@
+"""tests/test_yaesm/test_backend/test_btrfsioctl.py."""
+
+import subprocess
+import uuid
+
+import pytest
+
+import yaesm.backend.btrfsioctl as btrfsioctl
+
+
+def test_ioctl_numbers():
+    assert btrfsioctl.BTRFS_IOC_SNAP_CREATE_V2 == 0x50009417
+    assert btrfsioctl.BTRFS_IOC_SNAP_DESTROY == 0x5000940F
+    assert btrfsioctl.BTRFS_IOC_INO_LOOKUP == 0xD0009412
+    assert btrfsioctl.BTRFS_IOC_SNAP_DESTROY_V2 == 0x5000943F
+    assert btrfsioctl.BTRFS_IOC_GET_SUBVOL_INFO == 0x81F8943C
+    assert btrfsioctl.BTRFS_IOC_FS_INFO == 0x8400941F
+    assert btrfsioctl.BTRFS_IOC_START_SYNC == 0x80089418
+    assert btrfsioctl.BTRFS_IOC_WAIT_SYNC == 0x40089416
+
+
+def test_parse_subvolume_info():
+    subvol_uuid = uuid.uuid4()
+    received_uuid = uuid.uuid4()
+    buf = btrfsioctl._BTRFS_SUBVOL_INFO.pack(
+        257,
+        b"snap",
+        5,
+        256,
+        10,
+        btrfsioctl.BTRFS_SUBVOL_RDONLY,
+        subvol_uuid.bytes,
+        bytes(16),
+        received_uuid.bytes,
+        9,
+        8,
+        0,
+        0,
+        *(100, 500000000) * 4,
+    )
+    info = btrfsioctl._parse_subvolume_info(buf)
+    assert info.treeid == 257
+    assert info.name == "snap"
+    assert info.uuid == str(subvol_uuid)
+    assert info.parent_uuid is None
+    assert info.received_uuid == str(received_uuid)
+    assert info.ctransid == 9
+    assert info.ctime == 100.5
+    assert info.readonly
+
+
+def test_is_btrfs(btrfs_fs_generator, path_generator):
+    assert btrfsioctl.is_btrfs(btrfs_fs_generator())
+    assert not btrfsioctl.is_btrfs(path_generator("not-btrfs", mkdir=True))
+    with pytest.raises(OSError):
+        btrfsioctl.is_btrfs(path_generator("nonexistent"))
+
+
+def test_same_filesystem(btrfs_fs_generator, path_generator):
+    fs1 = btrfs_fs_generator()
+    fs2 = btrfs_fs_generator()
+    subvolume = fs1.joinpath("subvolume")
+    subprocess.run(["btrfs", "subvolume", "create", subvolume], check=True)
+    assert btrfsioctl.same_filesystem(fs1, fs1)
+    assert btrfsioctl.same_filesystem(fs1, subvolume)
+    assert not btrfsioctl.same_filesystem(fs1, fs2)
+    assert not btrfsioctl.same_filesystem(fs1, path_generator("not-btrfs", mkdir=True))
+
+
+def test_snapshot_subvolume_info_and_delete(btrfs_fs_generator):
+    fs = btrfs_fs_generator()
+    subvolume = fs.joinpath("subvolume")
+    subprocess.run(["btrfs", "subvolume", "create", subvolume], check=True)
+    snapshot = fs.joinpath("snapshot")
+    btrfsioctl.snapshot(subvolume, snapshot)
+    assert snapshot.is_dir()
+    info = btrfsioctl.subvolume_info(snapshot)
+    assert info.readonly
+    assert info.name == "snapshot"
+    assert info.parent_uuid == btrfsioctl.subvolume_info(subvolume).uuid
+    show = subprocess.run(
+        ["btrfs", "subvolume", "show", snapshot], check=True, capture_output=True, text=True
+    ).stdout
+    assert info.uuid in show
+    assert btrfsioctl.subvolume_id(snapshot) == info.treeid
+    with pytest.raises(OSError):
+        btrfsioctl.subvolume_id(fs.joinpath("subvolume", "."))
+    with pytest.raises(FileExistsError):
+        btrfsioctl.snapshot(subvolume, snapshot)
+    btrfsioctl.delete_subvolume(snapshot)
+    assert not snapshot.exists()
+    btrfsioctl.commit(fs)
+    with pytest.raises(OSError):
+        btrfsioctl.delete_subvolume(snapshot)
+
+
+def test_snapshot_across_filesystems_fails(btrfs_fs_generator):
+    fs1 = btrfs_fs_generator()
+    fs2 = btrfs_fs_generator()
+    with pytest.raises(OSError):
+        btrfsioctl.snapshot(fs1, fs2.joinpath("snapshot"))
+    assert not fs2.joinpath("snapshot").exists()
+
+
+def test_subvolume_info_not_a_subvolume(btrfs_fs_generator):
+    directory = btrfs_fs_generator().joinpath("dir")
+    directory.mkdir()
+    with pytest.raises(OSError):
+        btrfsioctl.subvolume_info(directory)
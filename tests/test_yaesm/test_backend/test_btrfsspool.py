@@ -0,0 +1,152 @@
+"""tests/test_yaesm/test_backend/test_btrfsspool.py."""
+
+import dataclasses
+import hashlib
+import os
+import subprocess
+
+import pytest
+
+import yaesm.backend.btrfsspool as btrfsspool
+
+
+@pytest.fixture
+def spool_stream(path_generator):
+    """A file holding 2500 random bytes, standing in for a send stream."""
+    stream = path_generator("spool-stream", touch=True, cleanup=True)
+    stream.write_bytes(os.urandom(2500))
+    return stream
+
+
+def _spool_contents(spool):
+    names = sorted(name for name in os.listdir(spool.path) if name[0].isdigit())
+    return b"".join(spool.path.joinpath(name).read_bytes() for name in names)
+
+
+def test_manifest_round_trip():
+    manifest = btrfsspool.SpoolManifest("backup@2000_01_01_00:00", "uuid", None, None, 1 << 20)
+    assert btrfsspool.SpoolManifest.loads(manifest.dumps()) == manifest
+    manifest = btrfsspool.SpoolManifest("backup", "uuid", "p", "p-uuid", 1, ("--proto", "2"))
+    assert btrfsspool.SpoolManifest.loads(manifest.dumps()) == manifest
+    assert btrfsspool.SpoolManifest.loads("not json") is None
+    assert btrfsspool.SpoolManifest.loads('{"backup_basename": "x"}') is None
+
+
+def test_parse_listing():
+    a, b = "a" * 64, "b" * 64
+    state = btrfsspool._parse_listing([f"00000000-{a}", f"00000002-{b}", "complete"], None)
+    assert state.manifest is None
+    assert state.checksums == [a]
+    assert not state.complete
+    state = btrfsspool._parse_listing(
+        [f"00000001-{b}", "manifest", f"00000000-{a}", "complete"], ""
+    )
+    assert state.checksums == [a, b]
+    assert state.complete
+
+
+def test_local_spool(path_generator):
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    assert spool.state() == btrfsspool.SpoolState(None, [], False)
+    manifest = btrfsspool.SpoolManifest("backup", "uuid", "parent", "parent-uuid", 3)
+    spool.start(manifest)
+    checksums = [hashlib.sha256(data).hexdigest() for data in (b"abc", b"def")]
+    spool.write_chunk(0, b"abc", checksums[0])
+    spool.write_chunk(1, b"def", checksums[1])
+    spool.mark_complete()
+    assert spool.state() == btrfsspool.SpoolState(manifest, checksums, True)
+    spool.truncate(1)
+    assert spool.state() == btrfsspool.SpoolState(manifest, checksums[:1], False)
+    spool.remove()
+    assert not spool.path.exists()
+
+
+def test_fill_spool(path_generator, spool_stream):
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    spool.start(btrfsspool.SpoolManifest("backup", "uuid", None, None, 1000))
+    btrfsspool.fill_spool(["cat", spool_stream], spool, 1000)
+    state = spool.state()
+    assert len(state.checksums) == 3
+    assert state.complete
+    assert _spool_contents(spool) == spool_stream.read_bytes()
+
+
+def test_fill_spool_failure_keeps_complete_chunks(path_generator, spool_stream):
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    spool.start(btrfsspool.SpoolManifest("backup", "uuid", None, None, 1000))
+    with pytest.raises(subprocess.CalledProcessError):
+        btrfsspool.fill_spool(
+            ["sh", "-c", 'head -c 2500 "$1"; exit 1', "sh", spool_stream], spool, 1000
+        )
+    state = spool.state()
+    assert len(state.checksums) == 2
+    assert not state.complete
+    assert _spool_contents(spool) == spool_stream.read_bytes()[:2000]
+
+
+def test_fill_spool_resume(path_generator, spool_stream):
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    spool.start(btrfsspool.SpoolManifest("backup", "uuid", None, None, 1000))
+    with pytest.raises(subprocess.CalledProcessError):
+        btrfsspool.fill_spool(
+            ["sh", "-c", 'head -c 1500 "$1"; exit 1', "sh", spool_stream], spool, 1000
+        )
+    chunk0 = next(spool.path.glob("00000000-*"))
+    mtime = chunk0.stat().st_mtime_ns
+    btrfsspool.fill_spool(["cat", spool_stream], spool, 1000, expected=spool.state().checksums)
+    assert chunk0.stat().st_mtime_ns == mtime
+    assert spool.state().complete
+    assert _spool_contents(spool) == spool_stream.read_bytes()
+
+
+def test_fill_spool_resume_mismatch(path_generator, spool_stream):
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    spool.start(btrfsspool.SpoolManifest("backup", "uuid", None, None, 1000))
+    btrfsspool.fill_spool(["head", "-c", "1000", "/dev/zero"], spool, 1000)
+    btrfsspool.fill_spool(["cat", spool_stream], spool, 1000, expected=spool.state().checksums)
+    state = spool.state()
+    assert len(state.checksums) == 3
+    assert state.complete
+    assert _spool_contents(spool) == spool_stream.read_bytes()
+
+
+def test_fill_spool_start_index(path_generator, spool_stream):
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    spool.start(btrfsspool.SpoolManifest("backup", "uuid", None, None, 1000))
+    btrfsspool.fill_spool(["head", "-c", "1000", spool_stream], spool, 1000)
+    spool.truncate(1)
+    btrfsspool.fill_spool(["tail", "-c", "+1001", spool_stream], spool, 1000, start_index=1)
+    assert spool.state().complete
+    assert _spool_contents(spool) == spool_stream.read_bytes()
+
+
+def test_local_spool_verify(path_generator, spool_stream):
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    spool.start(btrfsspool.SpoolManifest("backup", "uuid", None, None, 1000))
+    btrfsspool.fill_spool(["cat", spool_stream], spool, 1000)
+    state = spool.state()
+    assert spool.verify(state, 1000) == 3
+    assert spool.verify(dataclasses.replace(state, complete=False), 1000) == 2
+    chunk1 = next(spool.path.glob("00000001-*"))
+    chunk1.write_bytes(b"\0" * 1000)
+    assert spool.verify(state, 1000) == 1
+    chunk1.unlink()
+    assert spool.verify(state, 1000) == 1
+
+
+def test_receive_spool_fails_if_reading_fails(monkeypatch, path_generator, spool_stream):
+    bin_dir = path_generator("spool-bin", mkdir=True, cleanup=True)
+    dst_dir = path_generator("spool-dst", mkdir=True, cleanup=True)
+    fake_btrfs = bin_dir.joinpath("btrfs")
+    fake_btrfs.write_text('#!/bin/sh\ncat > "$2/received"\n')
+    fake_btrfs.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    spool = btrfsspool.LocalSpool(path_generator("spool", cleanup=True))
+    spool.start(btrfsspool.SpoolManifest("backup", "uuid", None, None, 1000))
+    btrfsspool.fill_spool(["cat", spool_stream], spool, 1000)
+    assert btrfsspool.receive_spool(spool, dst_dir) == 0
+    assert dst_dir.joinpath("received").read_bytes() == spool_stream.read_bytes()
+    chunk1 = next(spool.path.glob("00000001-*"))
+    chunk1.unlink()
+    chunk1.mkdir()
+    assert btrfsspool.receive_spool(spool, dst_dir, check=False) != 0
@@ -0,0 +1,164 @@
+"""tests/test_yaesm/test_backend/test_changejournal.py."""
+
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import yaesm.backend.changejournal as changejournal
+import yaesm.backend.rsyncbackend as rsync
+import yaesm.timeframe as tframe
+from yaesm.backup import Backup
+from yaesm.sshtarget import SSHTarget
+
+
+def _make_src(src):
+    for directory in ["a/deep", "b", "c"]:
+        src.joinpath(directory).mkdir(parents=True)
+    for path in ["top", "a/f", "a/deep/f", "b/f", "c/f"]:
+        src.joinpath(path).write_text(path)
+
+
+@pytest.fixture
+def journal(path_generator):
+    src = path_generator("changejournal_src", mkdir=True, cleanup=True)
+    _make_src(src)
+    journal = changejournal.ChangeJournal(src)
+    journal.start()
+    assert journal.wait_ready(10)
+    yield journal
+    journal.stop(timeout=10)
+    assert not journal.is_alive()
+
+
+def _wait_for(journal, since, until, predicate):
+    deadline = time.monotonic() + 10
+    while True:
+        changes = journal.changes(journal.session, since, until)
+        if changes is not None and predicate(changes) or time.monotonic() > deadline:
+            return changes
+        time.sleep(0.05)
+
+
+def test_journal_records_changes(journal):
+    src = journal.root
+    first = journal.checkpoint()
+    src.joinpath("a", "f").write_text("changed")
+    src.joinpath("b", "f").unlink()
+    src.joinpath("c").chmod(0o700)
+    src.joinpath("new", "sub").mkdir(parents=True)
+    src.joinpath("new", "sub", "f").touch()
+    second = journal.checkpoint()
+    expected = {".", "a", "b", "c", "new"}
+    changes = _wait_for(journal, first, second, lambda changes: expected <= changes.dirty)
+    assert changes.new_dirs == {"new", "new/sub"}
+    # Events read after a checkpoint count for the next one, so that changes
+    # may be recorded late, and more than once, but are never missed.
+    assert changes.dirty <= expected | {"new/sub"}
+    src.joinpath("new", "sub", "g").touch()
+    changes = _wait_for(
+        journal, second, journal.checkpoint(), lambda changes: "new/sub" in changes.dirty
+    )
+    assert "new/sub" in changes.dirty
+    assert "a" not in changes.dirty
+    assert expected <= journal.changes(journal.session, first, second).dirty
+
+
+def test_journal_gaps(journal):
+    # Changes before the tree was all watched, or of another session, are unknown.
+    assert journal.changes(journal.session, 0, journal.checkpoint()) is None
+    first = journal.checkpoint()
+    assert journal.changes("other", first, journal.checkpoint()) is None
+    assert (
+        journal.changes(journal.session, first, journal.checkpoint()) == changejournal.ChangeSet()
+    )
+    journal._rewatch()
+    assert journal.changes(journal.session, first, journal.checkpoint()) is None
+    journal.release(first)
+    assert min(journal._segments) == first
+
+
+def test_journal_released(journal):
+    first = journal.checkpoint()
+    journal.root.joinpath("a", "f").write_text("changed")
+    second = journal.checkpoint()
+    _wait_for(journal, first, second, lambda changes: "a" in changes.dirty)
+    # Another backup released the changes since `first`, which are now unknown.
+    journal.release(second)
+    assert journal.changes(journal.session, first) is None
+    assert journal.changes(journal.session, first, second) is None
+    assert journal.changes(journal.session, second) is not None
+    journal.release(first)
+    assert journal.changes(journal.session, first) is None
+
+
+def test_journal_cannot_watch(monkeypatch, path_generator, caplog):
+    src = path_generator("changejournal_src", mkdir=True, cleanup=True)
+    _make_src(src)
+    journal = changejournal.ChangeJournal(src)
+
+    def fail(fd, path):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(journal._libc, "inotify_add_watch", fail)
+    journal.start()
+    assert journal.wait_ready(10)
+    first = journal.checkpoint()
+    assert journal.changes(journal.session, first, journal.checkpoint()) is None
+    assert "cannot watch" in caplog.text
+    journal.stop(timeout=10)
+
+
+def test_start_and_stop_journals(monkeypatch, path_generator):
+    src = path_generator("changejournal_src", mkdir=True, cleanup=True)
+    dst = path_generator("changejournal_dst", mkdir=True, cleanup=True)
+    hourly = tframe.HourlyTimeframe(2, [0])
+    watched = Backup("foo", rsync.RsyncBackend(change_source="inotify"), src, dst, [hourly])
+    walked = Backup("bar", rsync.RsyncBackend(), src, dst, [hourly])
+    remote = Backup(
+        "baz",
+        rsync.RsyncBackend(change_source="inotify"),
+        SSHTarget(f"ssh://localhost:{src}", Path("/key")),
+        dst,
+        [hourly],
+    )
+    changejournal.start_journals([watched, walked, remote])
+    journal = changejournal.journal(watched)
+    assert journal is not None and journal.root == src
+    assert changejournal.journal(walked) is None
+    assert changejournal.journal(remote) is None
+    changejournal.stop_journals(timeout=10)
+    assert not journal.is_alive()
+    assert changejournal.journal(watched) is None
+
+
+def test_prefill(path_generator):
+    src = path_generator("changejournal_src", mkdir=True, cleanup=True)
+    base = path_generator("changejournal_base", mkdir=True, cleanup=True)
+    staging = path_generator("changejournal_staging", mkdir=True, cleanup=True)
+    for tree in [src, base]:
+        _make_src(tree)
+    base.joinpath("b", "gone").touch()
+    src.joinpath("b", "new").touch()
+    src.joinpath("b", "sub").mkdir()
+    src.joinpath("new", "sub").mkdir(parents=True)
+    src.joinpath("a", "deep").chmod(0o700)
+    base.joinpath("a", "deep").chmod(0o750)
+    os.utime(base.joinpath("c"), (1000000000, 1000000000))
+    changes = changejournal.ChangeSet(dirty={".", "b", "b/sub"}, new_dirs={"new", "b/sub"})
+    paths = changejournal.prefill(src, base, staging, changes)
+    assert paths == ["b/f", "b/new", "b/sub", "new", "top"]
+    assert sorted(str(path.relative_to(staging)) for path in staging.rglob("*")) == [
+        "a",
+        "a/deep",
+        "a/deep/f",
+        "a/f",
+        "b",
+        "c",
+        "c/f",
+    ]
+    assert staging.joinpath("a", "f").stat().st_ino == base.joinpath("a", "f").stat().st_ino
+    assert staging.joinpath("c").stat().st_mtime == 1000000000
+    changejournal.copy_dir_attrs(src, staging, ["a/deep", "gone"])
+    assert staging.joinpath("a", "deep").stat().st_mode & 0o777 == 0o700
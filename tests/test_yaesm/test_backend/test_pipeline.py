@@ -0,0 +1,70 @@
+"""tests/test_yaesm/test_backend/test_pipeline.py."""
+
+import subprocess
+import time
+
+import pytest
+
+import yaesm.backend.pipeline as pipeline
+
+
+def test_run_pipeline(path_generator):
+    src = path_generator("src", touch=True, cleanup=True)
+    dst = path_generator("dst", cleanup=True)
+    data = b"x" * (3 * (1 << 20) + 7)
+    src.write_bytes(data)
+    result = pipeline.run_pipeline(
+        ["cat", src], ["gzip", "-c"], ["sh", "-c", f"gzip -dc > '{dst}'"]
+    )
+    assert dst.read_bytes() == data
+    assert result.returncode == 0
+    assert result.failed_stage is None
+    assert result.bytes_transferred == len(data)
+    assert [stage.returncode for stage in result.stages] == [0, 0, 0]
+    assert result.stages[1].bytes_out is not None and result.stages[1].bytes_out > 0
+    assert result.stages[2].bytes_out is None
+
+
+def test_run_pipeline_first_stage_fails():
+    start = time.monotonic()
+    result = pipeline.run_pipeline(["sh", "-c", "exit 3"], ["sleep", "30"], check=False)
+    assert time.monotonic() - start < 10
+    assert result.failed_stage == 0
+    assert result.returncode == 3
+    assert result.stages[1].returncode != 0
+
+
+def test_run_pipeline_last_stage_fails():
+    result = pipeline.run_pipeline(
+        ["yes"], ["sh", "-c", "head -c 10 >/dev/null; exit 4"], check=False
+    )
+    assert result.failed_stage == 1
+    assert result.returncode == 4
+
+
+def test_run_pipeline_check():
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        pipeline.run_pipeline(["sh", "-c", "exit 5"], ["cat"])
+    assert excinfo.value.returncode == 5
+    assert excinfo.value.cmd == ["sh", "-c", "exit 5"]
+
+
+def test_relay_falls_back_to_read_write(monkeypatch, path_generator):
+    monkeypatch.delattr(pipeline.os, "splice")
+    dst = path_generator("dst", cleanup=True)
+    result = pipeline.run_pipeline(["echo", "hello"], ["sh", "-c", f"cat > '{dst}'"])
+    assert dst.read_text() == "hello\n"
+    assert result.bytes_transferred == 6
+
+
+def test_pipefail_sh():
+    def run(first, second):
+        return subprocess.run(pipeline.pipefail_sh(first, second), capture_output=True, text=True)
+
+    p = run(["sh", "-c", "echo hi; exit 3"], ["cat"])
+    assert p.returncode == 3
+    assert p.stdout == "hi\n"
+    assert run(["echo", "hi"], ["sh", "-c", "cat >/dev/null; exit 4"]).returncode == 4
+    p = run(["echo", "it's"], ["tr", "a-z", "A-Z"])
+    assert p.returncode == 0
+    assert p.stdout == "IT'S\n"
@@ -1,8 +1,11 @@
 """tests/test_yaesm/test_backend/test_rsyncbackend.py."""
 
+import dataclasses
 import filecmp
+import logging
 import shutil
 import subprocess
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -10,8 +13,11 @@ import pytest
 import voluptuous as vlp
 from freezegun import freeze_time
 
+import yaesm.backend.changejournal as changejournal
 import yaesm.backend.rsyncbackend as rsync
+import yaesm.backend.treedelete as treedelete
 import yaesm.backup as bckp
+import yaesm.timeframe as tframe
 from yaesm.backup import Backup
 from yaesm.sshtarget import SSHTarget
 
@@ -106,11 +112,11 @@ def test_failed_backup_is_not_collected(monkeypatch, rsync_backend, random_backu
     backup = random_backup_generator(backend_type="rsync", backup_type="local_to_local")
     timeframe = backup.timeframes[0]
 
-    def fail_after_creating_destination(command, **_kwargs):
-        Path(command[-1]).mkdir(parents=True)
+    def fail_after_writing_destination(command):
+        Path(command[-1]).joinpath("partial").touch()
         raise subprocess.CalledProcessError(returncode=23, cmd=command)
 
-    monkeypatch.setattr(rsync.subprocess, "run", fail_after_creating_destination)
+    monkeypatch.setattr(rsync, "_rsync_run", fail_after_writing_destination)
     with (
         freeze_time("2026-08-15 12:00"),
         pytest.raises(subprocess.CalledProcessError),
@@ -120,6 +126,174 @@ def test_failed_backup_is_not_collected(monkeypatch, rsync_backend, random_backu
     assert bckp.backups_collect(backup, [timeframe]) == []
 
 
+@pytest.mark.parametrize(
+    "exit_code, exit_policy, level",
+    [
+        (24, None, logging.WARNING),
+        (24, {24: "accept"}, logging.INFO),
+        (23, {23: "warn"}, logging.WARNING),
+    ],
+)
+def test_partial_backup_is_kept(monkeypatch, caplog, path_generator, exit_code, exit_policy, level):
+    src = path_generator("rsync_partial_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_partial_dst", mkdir=True, cleanup=True)
+    backend = rsync.RsyncBackend(exit_policy=exit_policy)
+    hourly = tframe.HourlyTimeframe(2, [0])
+    backup = Backup("foo", backend, src, dst, [hourly])
+
+    def partial_rsync(command):
+        Path(command[-1]).joinpath("file").touch()
+        raise rsync.RsyncError(exit_code, command, {"number_of_files_reg": 3})
+
+    monkeypatch.setattr(rsync, "_rsync_run", partial_rsync)
+    caplog.set_level(logging.INFO, logger=rsync.__name__)
+    with freeze_time("2026-08-20 00:00"):
+        artifact = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert Path(artifact.locator).joinpath("file").exists()
+    assert artifact.metadata["partial"] is True
+    assert artifact.metadata["rsync_exit_codes"] == [exit_code]
+    assert artifact.metadata["rsync_stats"]["files"] == 3
+    assert backend.collect(backup) == [artifact]
+    (record,) = [record for record in caplog.records if "is partial" in record.getMessage()]
+    assert record.levelno == level
+
+
+def test_failed_exit_code(monkeypatch, path_generator):
+    src = path_generator("rsync_partial_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_partial_dst", mkdir=True, cleanup=True)
+    src.joinpath("a").mkdir()
+    backend = rsync.RsyncBackend(shards="top_level", exit_policy={23: "fail", 24: "accept"})
+    hourly = tframe.HourlyTimeframe(2, [0])
+    backup = Backup("foo", backend, src, dst, [hourly])
+    exit_codes = [24, 23]
+
+    def failing_rsync(command):
+        raise rsync.RsyncError(exit_codes.pop(0), command, {})
+
+    monkeypatch.setattr(rsync, "_rsync_run", failing_rsync)
+    with freeze_time("2026-08-20 00:00"), pytest.raises(rsync.RsyncError) as exc_info:
+        backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert exc_info.value.returncode == 23
+    assert backend.collect(backup) == []
+
+
+def test_exit_policy_config():
+    backend = rsync.RsyncBackend()
+    assert backend.exit_policy == rsync.DEFAULT_EXIT_POLICY
+    schema = rsync.RsyncBackend.config_schema()
+    schema({"backend": backend, "rsync_exit_policy": {"23": "warn", 24: "fail"}})
+    assert backend.exit_policy == {23: "warn", 24: "fail"}
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_exit_policy": {23: "ignore"}})
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_exit_policy": {0: "warn"}})
+
+
+def test_failed_backup_is_resumed(monkeypatch, path_generator):
+    src = path_generator("rsync_resume_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_resume_dst", mkdir=True, cleanup=True)
+    backend = rsync.RsyncBackend()
+    hourly = tframe.HourlyTimeframe(2, [0])
+    backup = Backup("foo", backend, src, dst, [hourly])
+    # An older leftover, which is superseded by the newer one.
+    dst.joinpath(f"{rsync.STAGING_PREFIX}yaesm-foo-hourly.2026_08_19_00:00").mkdir()
+    destinations = []
+
+    def fake_rsync(command, fail):
+        destination = Path(command[-1])
+        destinations.append(destination)
+        destination.joinpath(f"file{len(destinations)}").touch()
+        if fail:
+            raise subprocess.CalledProcessError(returncode=23, cmd=command)
+        return {}
+
+    monkeypatch.setattr(rsync, "_rsync_run", lambda command: fake_rsync(command, True))
+    with freeze_time("2026-08-20 00:00"), pytest.raises(subprocess.CalledProcessError):
+        backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert destinations[0].name == f"{rsync.STAGING_PREFIX}yaesm-foo-hourly.2026_08_20_00:00"
+    assert destinations[0].joinpath("file1").exists()
+    assert backend.collect(backup) == []
+
+    monkeypatch.setattr(rsync, "_rsync_run", lambda command: fake_rsync(command, False))
+    with freeze_time("2026-08-20 01:00"):
+        artifact = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert destinations[1].name == f"{rsync.STAGING_PREFIX}{artifact.name}"
+    assert sorted(path.name for path in Path(artifact.locator).iterdir()) == ["file1", "file2"]
+    # rsync skipped file1 as it was in place already, not as it was hardlinked.
+    assert artifact.metadata["rsync_stats"]["hardlinked_files"] is None
+    assert backend.collect(backup) == [artifact]
+    assert not any(path.name.startswith(rsync.STAGING_PREFIX) for path in dst.iterdir())
+
+
+def test_live_staging_is_not_resumed(monkeypatch, path_generator):
+    src = path_generator("rsync_resume_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_resume_dst", mkdir=True, cleanup=True)
+    backend = rsync.RsyncBackend()
+    hourly = tframe.HourlyTimeframe(2, [0])
+    daily = tframe.DailyTimeframe(2, [(0, 0)])
+    backup = Backup("foo", backend, src, dst, [hourly, daily])
+    destinations = []
+
+    def fake_rsync(command):
+        destinations.append(command[-1])
+        return {}
+
+    monkeypatch.setattr(rsync, "_rsync_run", fake_rsync)
+    # The daily backup is still transferring into its staging directory.
+    daily_name = "yaesm-foo-daily.2026_08_20_00:00"
+    daily_staging, resumed = backend._staging(backup, daily_name)
+    assert not resumed
+    assert isinstance(daily_staging, Path)
+    daily_staging.joinpath("partial").touch()
+    with freeze_time("2026-08-20 00:00"):
+        artifact = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert destinations == [f"{dst}/{rsync.STAGING_PREFIX}{artifact.name}/"]
+    assert daily_staging.joinpath("partial").exists()
+    assert not Path(artifact.locator).joinpath("partial").exists()
+    # Once the daily backup failed, its staging directory is resumed from.
+    rsync._release_stagings(backup, [daily_staging.name])
+    with freeze_time("2026-08-20 01:00"):
+        artifact = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert Path(artifact.locator).joinpath("partial").exists()
+
+
+def test_failed_backup_is_resumed_remote(monkeypatch, path_generator):
+    monkeypatch.setattr(
+        SSHTarget, "openssh_cmd", lambda self, cmd, string=False: [str(arg) for arg in cmd]
+    )
+    src = path_generator("rsync_resume_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_resume_dst", mkdir=True, cleanup=True)
+    backend = rsync.RsyncBackend()
+    hourly = tframe.HourlyTimeframe(2, [0])
+    backup = Backup(
+        "foo", backend, src, SSHTarget(f"ssh://localhost:{dst}", Path("/key")), [hourly]
+    )
+    leftovers = [
+        dst.joinpath(f"{rsync.STAGING_PREFIX}yaesm-foo-hourly.2026_08_19_0{hour}:00")
+        for hour in range(3)
+    ]
+    for leftover in leftovers:
+        leftover.mkdir()
+    leftovers[2].joinpath("partial").touch()
+    # Leftovers of other backups are not touched.
+    other = dst.joinpath(f"{rsync.STAGING_PREFIX}yaesm-foo-bar-hourly.2026_08_19_03:00")
+    other.mkdir()
+    destinations = []
+
+    def fake_rsync(command):
+        destinations.append(command[-1])
+        return {}
+
+    monkeypatch.setattr(rsync, "_rsync_run", fake_rsync)
+    with freeze_time("2026-08-20 00:00"):
+        artifact = backend.create_artifact(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    staging = dst.joinpath(f"{rsync.STAGING_PREFIX}{artifact.name}")
+    assert destinations == [f"localhost:{staging}/"]
+    assert Path(artifact.locator).joinpath("partial").exists()
+    assert not any(leftover.exists() for leftover in leftovers)
+    assert other.is_dir()
+
+
 def test_delete_backups_local(rsync_backend, path_generator):
     dst_dir = path_generator("rsync_test_dst_dir", mkdir=True)
     backup_paths = []
@@ -133,8 +307,536 @@ def test_delete_backups_local(rsync_backend, path_generator):
         bckp.BackupArtifact(path.name, "5minute", datetime(1999, 5, 13), str(path))
         for path in backup_paths
     ]
+    # A backup left in the trash by an interrupted delete is deleted too.
+    leftover = dst_dir.joinpath(".yaesm-trash", "yaesm-test-backup-5minute.1999_05_12_00:00.0")
+    leftover.joinpath("subdir").mkdir(parents=True)
+    other = dst_dir.joinpath(".yaesm-trash", "yaesm-other-5minute.1999_05_12_00:00.0")
+    other.mkdir()
+    similar = dst_dir.joinpath(".yaesm-trash", "yaesm-test-backup-x-5minute.1999_05_12_00:00.0")
+    similar.mkdir()
     rsync_backend.delete(backup, artifacts)
     assert all(not path.is_dir() for path in backup_paths)
+    assert sorted(dst_dir.joinpath(".yaesm-trash").iterdir()) == sorted([other, similar])
+
+
+@pytest.mark.parametrize("strategy", ["rm", "rsync"])
+def test_delete_backups_batched_remote(monkeypatch, path_generator, strategy):
+    if strategy == "rsync" and shutil.which("rsync") is None:
+        pytest.skip("rsync is not installed")
+    # Run the remote command locally in place of over ssh.
+    monkeypatch.setattr(
+        SSHTarget, "openssh_cmd", lambda self, cmd, string=False: [str(arg) for arg in cmd]
+    )
+    runs = []
+    original_run = SSHTarget.run
+    monkeypatch.setattr(
+        SSHTarget,
+        "run",
+        lambda self, *args, **kwargs: runs.append(1) or original_run(self, *args, **kwargs),
+    )
+    dst_dir = path_generator("rsync-batched-delete", mkdir=True, cleanup=True)
+    backend = rsync.RsyncBackend(delete_workers=3, delete_strategy=strategy)
+    backup = Backup(
+        "foo", backend, dst_dir, SSHTarget(f"ssh://localhost:{dst_dir}", Path("/k")), []
+    )
+    artifacts = []
+    for hour in range(5):
+        name = f"yaesm-foo-hourly.2026_08_20_{hour:02}:00"
+        dst_dir.joinpath(name, "sub dir").mkdir(parents=True)
+        dst_dir.joinpath(name, "sub dir", "file").touch()
+        artifacts.append(
+            bckp.BackupArtifact(
+                name, "hourly", datetime(2026, 8, 20, hour), str(dst_dir.joinpath(name))
+            )
+        )
+    leftover = dst_dir.joinpath(".yaesm-trash", "yaesm-foo-hourly.2026_08_19_00:00.0")
+    leftover.mkdir(parents=True)
+    # a backup of another backup named 'foo-x' in the same dst_dir
+    other = dst_dir.joinpath(".yaesm-trash", "yaesm-foo-x-hourly.2026_08_19_00:00.0")
+    other.mkdir()
+    backend.delete_artifacts(backup, artifacts)
+    assert runs == [1]
+    assert not any(dst_dir.joinpath(artifact.name).exists() for artifact in artifacts)
+    assert list(dst_dir.joinpath(".yaesm-trash").iterdir()) == [other]
+
+
+def test_delete_backups_reports_failures(monkeypatch, path_generator, caplog):
+    monkeypatch.setattr(
+        SSHTarget, "openssh_cmd", lambda self, cmd, string=False: [str(arg) for arg in cmd]
+    )
+    caplog.set_level(logging.ERROR)
+    dst_dir = path_generator("rsync-delete-failures", mkdir=True, cleanup=True)
+    backend = rsync.RsyncBackend()
+    for dst in [dst_dir, SSHTarget(f"ssh://localhost:{dst_dir}", Path("/k"))]:
+        backup = Backup("foo", backend, dst_dir, dst, [])
+        present = dst_dir.joinpath("yaesm-foo-hourly.2026_08_20_01:00")
+        present.mkdir()
+        artifacts = [
+            bckp.BackupArtifact(path.name, "hourly", datetime(2026, 8, 20), str(path))
+            for path in [dst_dir.joinpath("yaesm-foo-hourly.2026_08_20_00:00"), present]
+        ]
+        caplog.clear()
+        with pytest.raises(bckp.BackupError, match="cannot delete 1 of 2 backups of 'foo'"):
+            backend.delete_artifacts(backup, artifacts)
+        assert f"cannot delete backup {artifacts[0].locator}" in caplog.text
+        assert artifacts[1].locator not in caplog.text
+        assert not present.exists()
+
+
+def test_delete_workers_config():
+    backend = rsync.RsyncBackend()
+    assert backend.delete_workers == treedelete.DEFAULT_WORKERS
+    schema = rsync.RsyncBackend.config_schema()
+    assert backend.delete_strategy == "rm"
+    schema({"backend": backend, "rsync_delete_workers": 2, "rsync_delete_strategy": "rsync"})
+    assert backend.delete_workers == 2
+    assert backend.delete_strategy == "rsync"
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_delete_workers": 0})
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_delete_strategy": "shred"})
+
+
+def _fake_sharded_rsync(command, fail_shard=None):
+    """Do what `command`, an rsync of one shard, would do, by copying what the
+    filter rules of its merge file select. Raises for the shard `fail_shard`.
+    """
+    (rules_file,) = [arg.split(" ", 1)[1] for arg in command if arg.startswith("--filter=merge ")]
+    if rules_file.endswith(f"shard{fail_shard}"):
+        raise subprocess.CalledProcessError(returncode=23, cmd=command)
+    rules = Path(rules_file).read_text().splitlines()
+    src, dst = Path(command[-2]), Path(command[-1])
+    count = 1
+    for entry in src.iterdir():
+        if "- /*" in rules:
+            selected = entry.is_dir() and f"+ /{entry.name}/" in rules
+        else:
+            selected = not (entry.is_dir() and f"- /{entry.name}/" in rules)
+        if not selected:
+            continue
+        if entry.is_dir():
+            shutil.copytree(entry, dst.joinpath(entry.name))
+            count += 1 + sum(1 for _ in dst.joinpath(entry.name).rglob("*"))
+        else:
+            shutil.copy2(entry, dst.joinpath(entry.name))
+            count += 1
+    return {"number_of_files": count, "number_of_files_reg": count - 1}
+
+
+@pytest.mark.parametrize("mode", ["top_level", "balanced"])
+def test_sharded_backup(monkeypatch, path_generator, mode):
+    src = path_generator("rsync_shard_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_shard_dst", mkdir=True, cleanup=True)
+    for name, files in [("a", 3), ("b", 1), ("c", 0)]:
+        src.joinpath(name).mkdir()
+        for i in range(files):
+            src.joinpath(name, f"f{i}").write_text(name)
+    src.joinpath("top").write_text("top")
+    backend = rsync.RsyncBackend(shards=mode, shard_workers=2)
+    hourly = tframe.HourlyTimeframe(2, [0])
+    backup = Backup("foo", backend, src, dst, [hourly])
+    commands = []
+
+    def fake_rsync(command):
+        commands.append(command)
+        return _fake_sharded_rsync(command)
+
+    monkeypatch.setattr(rsync, "_rsync_run", fake_rsync)
+    with freeze_time("2026-08-20 00:00"):
+        artifact = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert not filecmp.dircmp(src, artifact.locator).diff_files
+    assert not any(path.name.startswith(rsync.STAGING_PREFIX) for path in dst.iterdir())
+    staging = dst.joinpath(f"{rsync.STAGING_PREFIX}{artifact.name}")
+    assert all(command[-1] == f"{staging}/" for command in commands)
+    if mode == "top_level":
+        assert artifact.metadata["rsync_shards"] == 4
+    else:
+        assert artifact.metadata["rsync_shards"] == 3
+        assert artifact.metadata["rsync_shard_estimate"] == {"a": 4, "b": 2, "c": 1}
+    assert artifact.metadata["rsync_stats"]["files"] == 8
+    for path in [src.joinpath(name) for name in ["a", "b", "c", "top"]]:
+        copied = Path(artifact.locator).joinpath(path.name)
+        assert copied.is_dir() == path.is_dir() and copied.exists()
+
+    # The next backup reuses the cached estimate, measuring only new directories.
+    src.joinpath("d").mkdir()
+    measured = []
+    measure = rsync.rsyncshard.measure
+    monkeypatch.setattr(
+        rsync.rsyncshard,
+        "measure",
+        lambda src_dir, names: measured.append(names) or measure(src_dir, names),
+    )
+    with freeze_time("2026-08-20 01:00"):
+        artifact = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert Path(artifact.locator).joinpath("d").is_dir()
+    if mode == "balanced":
+        assert measured == [["d"]]
+        assert artifact.metadata["rsync_shard_estimate"] == {"a": 4, "b": 2, "c": 1, "d": 1}
+
+
+def test_sharded_backup_failure(monkeypatch, path_generator):
+    src = path_generator("rsync_shard_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_shard_dst", mkdir=True, cleanup=True)
+    for name in ["a", "b", "c"]:
+        src.joinpath(name).mkdir()
+    src.joinpath("top").touch()
+    backend = rsync.RsyncBackend(shards="top_level", shard_workers=1)
+    hourly = tframe.HourlyTimeframe(2, [0])
+    backup = Backup("foo", backend, src, dst, [hourly])
+    commands = []
+
+    def fake_rsync(command):
+        commands.append(command)
+        return _fake_sharded_rsync(command, fail_shard=1)
+
+    monkeypatch.setattr(rsync, "_rsync_run", fake_rsync)
+    with freeze_time("2026-08-20 00:00"), pytest.raises(subprocess.CalledProcessError):
+        backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    # No shard is started after one failed, and what was transferred is kept.
+    assert len(commands) == 2
+    staging = dst.joinpath(f"{rsync.STAGING_PREFIX}yaesm-foo-hourly.2026_08_20_00:00")
+    assert sorted(path.name for path in staging.iterdir()) == ["top"]
+    assert backend.collect(backup) == []
+
+
+def test_shards_config():
+    backend = rsync.RsyncBackend()
+    assert backend.shards == "none"
+    schema = rsync.RsyncBackend.config_schema()
+    schema({"backend": backend, "rsync_shards": "balanced", "rsync_shard_workers": 8})
+    assert backend.shards == "balanced"
+    assert backend.shard_workers == 8
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_shards": "random"})
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_shard_workers": 0})
+
+
+def _fake_journaled_rsync(command):
+    """Copy the --files-from paths, or else everything, as rsync would."""
+    src, dst = Path(command[-2]), Path(command[-1])
+    files_from = [arg.removeprefix("--files-from=") for arg in command if "--files-from" in arg]
+    if not files_from:
+        shutil.copytree(src, dst, symlinks=True, dirs_exist_ok=True)
+        return {}
+    for path in Path(files_from[0]).read_bytes().split(b"\0")[:-1]:
+        if src.joinpath(path.decode()).is_dir():
+            shutil.copytree(src / path.decode(), dst / path.decode(), symlinks=True)
+        else:
+            shutil.copy2(src / path.decode(), dst / path.decode())
+    return {}
+
+
+def test_journaled_backup(monkeypatch, caplog, path_generator):
+    caplog.set_level(logging.INFO)
+    src = path_generator("rsync_journal_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_journal_dst", mkdir=True, cleanup=True)
+    for directory in ["a", "b/deep", "c"]:
+        src.joinpath(directory).mkdir(parents=True)
+    for path in ["a/f", "b/deep/f", "c/f", "c/g"]:
+        src.joinpath(path).write_text(path)
+    backend = rsync.RsyncBackend(change_source="inotify")
+    hourly = tframe.HourlyTimeframe(5, [0])
+    backup = Backup("foo", backend, src, dst, [hourly])
+    commands = []
+
+    def fake_rsync(command):
+        commands.append(command)
+        return _fake_journaled_rsync(command)
+
+    monkeypatch.setattr(rsync, "_rsync_run", fake_rsync)
+    changejournal.start_journals([backup])
+    journal = changejournal.journal(backup)
+    assert journal is not None and journal.wait_ready(10)
+    try:
+        with freeze_time("2026-08-20 00:00"):
+            first = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+        assert "there is no earlier backup" in caplog.text
+        assert first.metadata["rsync_journal"]["session"] == journal.session
+        src.joinpath("a", "f").write_text("changed")
+        src.joinpath("c", "g").unlink()
+        src.joinpath("new").mkdir()
+        src.joinpath("new", "f").touch()
+        since = first.metadata["rsync_journal"]["checkpoint"]
+        for _ in range(200):
+            changes = journal.changes(journal.session, since, journal.checkpoint())
+            if changes is not None and {".", "a", "c"} <= changes.dirty:
+                break
+            time.sleep(0.05)
+        with freeze_time("2026-08-20 01:00"):
+            second = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    finally:
+        changejournal.stop_journals(timeout=10)
+
+    assert "--files-from" not in " ".join(commands[0])
+    assert any(arg.startswith("--files-from=") for arg in commands[1])
+    assert second.metadata["rsync_journal"]["changed_dirs"] >= 3
+    # rsync only saw the changed paths, the rest was hardlinked before it ran.
+    assert second.metadata["rsync_stats"]["hardlinked_files"] is None
+    assert "link_dest_hit_rate" not in second.metadata
+    assert not filecmp.dircmp(src, second.locator).diff_files
+    assert sorted(
+        str(path.relative_to(second.locator)) for path in Path(second.locator).rglob("*")
+    ) == [
+        "a",
+        "a/f",
+        "b",
+        "b/deep",
+        "b/deep/f",
+        "c",
+        "c/f",
+        "new",
+        "new/f",
+    ]
+    assert Path(second.locator, "a", "f").read_text() == "changed"
+    unchanged = Path(second.locator, "b", "deep", "f").stat()
+    assert unchanged.st_ino == Path(first.locator, "b", "deep", "f").stat().st_ino
+
+
+def test_journaled_backup_falls_back(monkeypatch, caplog, path_generator):
+    caplog.set_level(logging.INFO)
+    src = path_generator("rsync_journal_src", mkdir=True, cleanup=True)
+    dst = path_generator("rsync_journal_dst", mkdir=True, cleanup=True)
+    src.joinpath("f").touch()
+    backend = rsync.RsyncBackend(change_source="inotify")
+    hourly = tframe.HourlyTimeframe(5, [0])
+    backup = Backup("foo", backend, src, dst, [hourly])
+    monkeypatch.setattr(rsync, "_rsync_run", _fake_journaled_rsync)
+    # Without a journal, as outside of the 'run' subcommand, backups walk.
+    with freeze_time("2026-08-20 00:00"):
+        first = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+    assert "rsync_journal" not in first.metadata
+    changejournal.start_journals([backup])
+    journal = changejournal.journal(backup)
+    assert journal is not None and journal.wait_ready(10)
+    try:
+        with freeze_time("2026-08-20 01:00"):
+            second = backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+        assert f"backup {first.name} has no change journal checkpoint" in caplog.text
+        journal._rewatch()
+        with freeze_time("2026-08-20 02:00"):
+            backend.create(backup, hourly, bckp.backup_basename_now(backup, hourly))
+        assert f"changes since backup {second.name} may have been missed" in caplog.text
+    finally:
+        changejournal.stop_journals(timeout=10)
+
+
+def test_change_source_config():
+    backend = rsync.RsyncBackend()
+    assert backend.change_source == "walk"
+    schema = rsync.RsyncBackend.config_schema()
+    schema({"backend": backend, "rsync_change_source": "inotify"})
+    assert backend.change_source == "inotify"
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_change_source": "find-new"})
+
+
+def test_link_dests(artifact_generator):
+    backups = [
+        artifact_generator("hourly", 5),
+        artifact_generator("5minute", 4),
+        artifact_generator("hourly", 3),
+        artifact_generator("daily", 2),
+        artifact_generator("5minute", 1),
+    ]
+    hourly_timeframe = tframe.HourlyTimeframe(1, [0])
+    assert rsync._rsync_link_dests([], hourly_timeframe, "newest", None) == []
+    assert rsync._rsync_link_dests(backups, hourly_timeframe, "newest", None) == backups[:1]
+    assert rsync._rsync_link_dests(backups, hourly_timeframe, "newest", 3) == backups[:3]
+    assert rsync._rsync_link_dests(backups, hourly_timeframe, "per_timeframe", None) == [
+        backups[0],
+        backups[1],
+        backups[3],
+    ]
+    assert rsync._rsync_link_dests(backups, hourly_timeframe, "per_timeframe", 2) == backups[:2]
+    assert rsync._rsync_link_dests(backups, hourly_timeframe, "same_timeframe_first", None) == [
+        backups[0],
+        backups[2],
+        backups[1],
+        backups[3],
+        backups[4],
+    ]
+    many = [artifact_generator("hourly", hour) for hour in range(24)] * 2
+    assert len(rsync._rsync_link_dests(many, hourly_timeframe, "same_timeframe_first", None)) == 20
+    alias = bckp.BackupArtifact(
+        "yaesm-foo-hourly.2026_08_20_06:00",
+        "hourly",
+        datetime(2026, 8, 20, 6),
+        backups[0].locator,
+        metadata={"alias_of": backups[0].name},
+    )
+    assert rsync._rsync_link_dests([alias, *backups], hourly_timeframe, "newest", 2) == [alias]
+
+
+def test_source_unchanged(artifact_generator, monkeypatch, path_generator):
+    monkeypatch.setattr(rsync, "_CTIME_SLACK_NS", 0)
+    src_dir = path_generator("rsync_unchanged_src", mkdir=True, cleanup=True)
+    src_dir.joinpath("a", "b").mkdir(parents=True)
+    src_dir.joinpath("a", "b", "f").touch()
+    backend = rsync.RsyncBackend()
+    hourly = tframe.HourlyTimeframe(1, [0])
+    backup = Backup("foo", backend, src_dir, Path("/dst"), [hourly])
+    artifact = artifact_generator("hourly", 0)
+    assert not backend.source_unchanged(backup, artifact)
+    time.sleep(0.05)
+    artifact.metadata["src_watermark"] = time.time_ns()
+    assert backend.source_unchanged(backup, artifact)
+    partial = dataclasses.replace(artifact, metadata={**artifact.metadata, "partial": True})
+    assert not backend.source_unchanged(backup, partial)
+    remote = Backup(
+        "foo",
+        backend,
+        SSHTarget(f"ssh://localhost:{src_dir}", Path("/key")),
+        Path("/dst"),
+        [hourly],
+    )
+    assert not backend.source_unchanged(remote, artifact)
+    time.sleep(0.05)
+    src_dir.joinpath("a", "b", "f").write_text("changed")
+    assert not backend.source_unchanged(backup, artifact)
+    artifact.metadata["src_watermark"] = time.time_ns()
+    time.sleep(0.05)
+    src_dir.joinpath("a", "new").mkdir()
+    assert not backend.source_unchanged(backup, artifact)
+
+
+def test_source_unchanged_journal(artifact_generator, path_generator):
+    src_dir = path_generator("rsync_unchanged_src", mkdir=True, cleanup=True)
+    backend = rsync.RsyncBackend(change_source="inotify")
+    hourly = tframe.HourlyTimeframe(1, [0])
+    backup = Backup("foo", backend, src_dir, Path("/dst"), [hourly])
+    changejournal.start_journals([backup])
+    try:
+        journal = changejournal.journal(backup)
+        assert journal is not None and journal.wait_ready(10)
+        checkpoint = journal.checkpoint()
+        artifact = artifact_generator("hourly", 0)
+        artifact.metadata["rsync_journal"] = {"session": journal.session, "checkpoint": checkpoint}
+        assert backend.source_unchanged(backup, artifact)
+        # Once another backup released the checkpoint, its changes are unknown.
+        journal.release(journal.checkpoint())
+        assert not backend.source_unchanged(backup, artifact)
+    finally:
+        changejournal.stop_journals(timeout=10)
+
+
+def test_parse_stats():
+    output = """\
+sending incremental file list
+foo/bar
+
+Number of files: 1,234 (reg: 1,000, dir: 233, link: 1)
+Number of created files: 12 (reg: 10, dir: 2)
+Number of deleted files: 0
+Number of regular files transferred: 10
+Total file size: 12,345,678 bytes
+Total transferred file size: 2,048 bytes
+Literal data: 2,048 bytes
+Matched data: 0 bytes
+File list size: 0
+File list generation time: 0.001 seconds
+Total bytes sent: 40,123
+Total bytes received: 250
+
+sent 40,123 bytes  received 250 bytes  80,746.00 bytes/sec
+total size is 12,345,678  speedup is 305.79
+"""
+    assert rsync._rsync_parse_stats(output.splitlines()) == {
+        "number_of_files": 1234,
+        "number_of_files_reg": 1000,
+        "number_of_files_dir": 233,
+        "number_of_files_link": 1,
+        "number_of_created_files": 12,
+        "number_of_created_files_reg": 10,
+        "number_of_created_files_dir": 2,
+        "number_of_deleted_files": 0,
+        "number_of_regular_files_transferred": 10,
+        "total_file_size": 12345678,
+        "total_transferred_file_size": 2048,
+        "literal_data": 2048,
+        "matched_data": 0,
+        "file_list_size": 0,
+        "total_bytes_sent": 40123,
+        "total_bytes_received": 250,
+    }
+
+
+def test_rsync_stats():
+    counters = {
+        "number_of_files": 1234,
+        "number_of_files_reg": 1000,
+        "number_of_regular_files_transferred": 10,
+        "literal_data": 3 << 20,
+        "matched_data": 1 << 20,
+        "total_bytes_sent": 3 << 20,
+        "total_bytes_received": 1 << 20,
+    }
+    stats = rsync.RsyncStats.from_counters(counters, 2.0, link_dest=True)
+    assert stats.files == 1000
+    assert stats.files_transferred == 10
+    assert stats.hardlinked_files == 990
+    assert stats.rate == 2 << 20
+    assert stats.describe() == (
+        "10 of 1000 files transferred, 990 hardlinked, 3.0 MiB literal and 1.0 MiB matched,"
+        " in 2.0s (2.0 MiB/s)"
+    )
+    assert rsync.RsyncStats.from_counters(counters, 2.0, link_dest=False).hardlinked_files == 0
+    stats = rsync.RsyncStats.from_counters(counters, 2.0, link_dest=True, exact=False)
+    assert stats.hardlinked_files is None
+    assert stats.describe() == (
+        "10 of 1000 files transferred, 3.0 MiB literal and 1.0 MiB matched, in 2.0s (2.0 MiB/s)"
+    )
+    # rsync before 3.1 does not break the files down by type.
+    stats = rsync.RsyncStats.from_counters({"number_of_files": 5}, 0.0, link_dest=True)
+    assert stats.files == 5 and stats.hardlinked_files == 5 and stats.rate == 0.0
+
+
+def test_rsync_run_output(capsys):
+    script = (
+        "printf 'foo/bar\\n\\nNumber of files: 3 (reg: 2, dir: 1)\\n"
+        "Number of regular files transferred: 1\\nFile list generation time: 0.001 seconds\\n"
+        "sent 100 bytes  received 20 bytes  240.00 bytes/sec\\n"
+        "total size is 10  speedup is 0.08\\n'"
+    )
+    counters = rsync._rsync_run(["sh", "-c", script])
+    assert counters == {
+        "number_of_files": 3,
+        "number_of_files_reg": 2,
+        "number_of_files_dir": 1,
+        "number_of_regular_files_transferred": 1,
+    }
+    assert capsys.readouterr().out == "foo/bar\n"
+    script = (
+        "printf 'Total.txt\n\nsent/file\n\nNumber of files: 1\n\n"
+        "sent 100 bytes  received 20 bytes  240.00 bytes/sec\n'"
+    )
+    assert rsync._rsync_run(["sh", "-c", script]) == {"number_of_files": 1}
+    assert capsys.readouterr().out == "Total.txt\n\nsent/file\n"
+    with pytest.raises(rsync.RsyncError) as exc_info:
+        rsync._rsync_run(["sh", "-c", "printf 'Number of files: 2\\n'; exit 24"])
+    assert exc_info.value.returncode == 24
+    assert exc_info.value.counters == {"number_of_files": 2}
+
+
+def test_link_dest_config():
+    backend = rsync.RsyncBackend()
+    assert backend.link_dest_policy == "newest"
+    assert backend.link_dest_count is None
+    schema = rsync.RsyncBackend.config_schema()
+    schema(
+        {
+            "backend": backend,
+            "rsync_link_dest_policy": "per_timeframe",
+            "rsync_link_dest_count": 5,
+        }
+    )
+    assert backend.link_dest_policy == "per_timeframe"
+    assert backend.link_dest_count == 5
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_link_dest_policy": "oldest"})
+    with pytest.raises(vlp.Invalid):
+        schema({"backend": backend, "rsync_link_dest_count": 21})
 
 
 def test_delete_backups_remote(rsync_backend, sshtarget, path_generator):
@@ -257,21 +959,14 @@ def test_check_local_to_remote_checks_dst_when_src_missing(
 
 
 def test_check_local_to_remote_remote_tool_missing(
-    monkeypatch, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
+    failing_probes, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
 ):
     src_dir = path_generator("rsync-src", mkdir=True)
     dst_dir_path = path_generator("rsync-dst", mkdir=True)
     sshtarget = sshtarget_generator()
     dst_dir = sshtarget.with_path(dst_dir_path)
     backup = Backup("test", rsync_backend, src_dir, dst_dir, random_timeframes_generator())
-    original_run = subprocess.run
-
-    def fake_run(cmd, **kwargs):
-        if isinstance(cmd, list) and "command -v rsync" in " ".join(str(c) for c in cmd):
-            return subprocess.CompletedProcess(cmd, returncode=1)
-        return original_run(cmd, **kwargs)
-
-    monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("which")
     errors = _errors(rsync_backend.check(backup))
     assert any("not found on remote" in e and "rsync" in e for e in errors)
 
@@ -317,60 +1012,39 @@ def test_check_remote_to_local_remote_dir_missing(
 
 
 def test_check_remote_to_local_remote_tool_missing(
-    monkeypatch, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
+    failing_probes, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
 ):
     src_dir_path = path_generator("rsync-src", mkdir=True)
     dst_dir = path_generator("rsync-dst", mkdir=True)
     sshtarget = sshtarget_generator()
     src_dir = sshtarget.with_path(src_dir_path)
     backup = Backup("test", rsync_backend, src_dir, dst_dir, random_timeframes_generator())
-    original_run = subprocess.run
-
-    def fake_run(cmd, **kwargs):
-        if isinstance(cmd, list) and "command -v rsync" in " ".join(str(c) for c in cmd):
-            return subprocess.CompletedProcess(cmd, returncode=1)
-        return original_run(cmd, **kwargs)
-
-    monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("which")
     errors = _errors(rsync_backend.check(backup))
     assert any("not found on remote" in e and "rsync" in e for e in errors)
 
 
 def test_check_local_to_remote_remote_dst_not_writable(
-    monkeypatch, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
+    failing_probes, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
 ):
     src_dir = path_generator("rsync-src", mkdir=True)
     dst_dir_path = path_generator("rsync-dst", mkdir=True)
     sshtarget = sshtarget_generator()
     dst_dir = sshtarget.with_path(dst_dir_path)
     backup = Backup("test", rsync_backend, src_dir, dst_dir, random_timeframes_generator())
-    original_run = subprocess.run
-
-    def fake_run(cmd, **kwargs):
-        if isinstance(cmd, list) and "test -w" in " ".join(str(c) for c in cmd):
-            return subprocess.CompletedProcess(cmd, returncode=1)
-        return original_run(cmd, **kwargs)
-
-    monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("writable")
     errors = _errors(rsync_backend.check(backup))
     assert any("dst_dir" in e and "not writable" in e for e in errors)
 
 
 def test_check_remote_to_local_remote_src_not_readable(
-    monkeypatch, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
+    failing_probes, rsync_backend, path_generator, sshtarget_generator, random_timeframes_generator
 ):
     src_dir_path = path_generator("rsync-src", mkdir=True)
     dst_dir = path_generator("rsync-dst", mkdir=True)
     sshtarget = sshtarget_generator()
     src_dir = sshtarget.with_path(src_dir_path)
     backup = Backup("test", rsync_backend, src_dir, dst_dir, random_timeframes_generator())
-    original_run = subprocess.run
-
-    def fake_run(cmd, **kwargs):
-        if isinstance(cmd, list) and "test -r" in " ".join(str(c) for c in cmd):
-            return subprocess.CompletedProcess(cmd, returncode=1)
-        return original_run(cmd, **kwargs)
-
-    monkeypatch.setattr(subprocess, "run", fake_run)
+    failing_probes("readable")
     errors = _errors(rsync_backend.check(backup))
     assert any("src_dir" in e and "not readable" in e for e in errors)
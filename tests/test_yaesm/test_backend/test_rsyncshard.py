@@ -0,0 +1,62 @@
+"""tests/test_yaesm/test_backend/test_rsyncshard.py."""
+
+from pathlib import Path
+
+import yaesm.backend.rsyncshard as rsyncshard
+from yaesm.sshtarget import SSHTarget
+
+
+def _make_src(src):
+    src.joinpath("a", "deep").mkdir(parents=True)
+    for i in range(3):
+        src.joinpath("a", "deep", f"f{i}").touch()
+    src.joinpath("b").mkdir()
+    src.joinpath("b", "f").touch()
+    src.joinpath(".hidden").mkdir()
+    src.joinpath("file").touch()
+    src.joinpath("link").symlink_to("a")
+    src.joinpath("new\nline").mkdir()
+
+
+def test_top_level_dirs_and_measure(path_generator):
+    src = path_generator("rsyncshard_src", mkdir=True, cleanup=True)
+    _make_src(src)
+    names = rsyncshard.top_level_dirs(src)
+    assert names == [".hidden", "a", "b"]
+    assert rsyncshard.measure(src, names) == {".hidden": 1, "a": 5, "b": 2}
+    assert rsyncshard.measure(src, []) == {}
+
+
+def test_top_level_dirs_and_measure_remote(monkeypatch, path_generator):
+    monkeypatch.setattr(
+        SSHTarget, "openssh_cmd", lambda self, cmd, string=False: [str(arg) for arg in cmd]
+    )
+    src = path_generator("rsyncshard_src", mkdir=True, cleanup=True)
+    _make_src(src)
+    target = SSHTarget(f"ssh://localhost:{src}", Path("/key"))
+    names = rsyncshard.top_level_dirs(target)
+    assert names == [".hidden", "a", "b"]
+    assert rsyncshard.measure(target, names) == {".hidden": 1, "a": 5, "b": 2}
+
+
+def test_plan():
+    estimate = {"a": 100, "b": 60, "c": 50, "d": 10, "e": 1}
+    assert rsyncshard.plan(estimate, "top_level", 2) == [["a"], ["b"], ["c"], ["d"], ["e"]]
+    assert rsyncshard.plan(estimate, "balanced", 2) == [["a", "d", "e"], ["b", "c"]]
+    assert rsyncshard.plan(estimate, "balanced", 8) == [["a"], ["b"], ["c"], ["d"], ["e"]]
+    assert rsyncshard.plan({}, "balanced", 4) == []
+
+
+def test_filter_rules():
+    shards = [["a", "b"], ["c*"]]
+    assert rsyncshard.filter_rules(shards[0], shards) == ["+ /a/", "+ /b/", "- /*"]
+    assert rsyncshard.filter_rules(shards[1], shards) == ["+ /c\\*/", "- /*"]
+    assert rsyncshard.filter_rules(None, shards) == ["- /a/", "- /b/", "- /c\\*/"]
+    assert rsyncshard.filter_rules(["x\\[y]"], shards)[0] == "+ /x\\\\\\[y]/"
+    assert rsyncshard.filter_rules(["x\\y"], shards)[0] == "+ /x\\y/"
+
+
+def test_refine_estimate():
+    estimate = {"a": 10, "b": 30, "c": 5}
+    shards = [["a", "b"], ["c"]]
+    assert rsyncshard.refine_estimate(estimate, shards, [80, 0]) == {"a": 20, "b": 60, "c": 1}
@@ -0,0 +1,67 @@
+"""tests/test_yaesm/test_backend/test_treedelete.py."""
+
+import os
+
+import pytest
+
+import yaesm.backend.treedelete as treedelete
+
+
+def _make_tree(root, depth=3, width=3):
+    """Make a directory tree under `root` with files, hardlinks, symlinks, and
+    empty directories at every level. Returns the number of paths made.
+    """
+    root.mkdir()
+    count = 1
+    root.joinpath("file").write_text("data")
+    os.link(root.joinpath("file"), root.joinpath("hardlink"))
+    root.joinpath("symlink").symlink_to("file")
+    root.joinpath("empty").mkdir()
+    count += 4
+    if depth > 0:
+        for i in range(width):
+            count += _make_tree(root.joinpath(f"dir{i}"), depth - 1, width)
+    return count
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_delete_tree(path_generator, workers):
+    top = path_generator("treedelete", mkdir=True, cleanup=True)
+    tree = top.joinpath("tree")
+    _make_tree(tree)
+    outside = top.joinpath("outside")
+    outside.mkdir()
+    outside.joinpath("keep").touch()
+    # Symlinks out of the tree are deleted, not followed.
+    tree.joinpath("dir0", "outside").symlink_to(outside)
+    treedelete.delete_tree(tree, workers=workers)
+    assert not tree.exists()
+    assert outside.joinpath("keep").exists()
+
+
+def test_delete_tree_errors(path_generator):
+    top = path_generator("treedelete", mkdir=True, cleanup=True)
+    with pytest.raises(FileNotFoundError):
+        treedelete.delete_tree(top.joinpath("missing"))
+    target = top.joinpath("target")
+    target.mkdir()
+    link = top.joinpath("link")
+    link.symlink_to(target)
+    with pytest.raises(OSError):
+        treedelete.delete_tree(link)
+    assert target.is_dir()
+
+
+def test_move_to_trash(path_generator):
+    top = path_generator("treedelete", mkdir=True, cleanup=True)
+    assert treedelete.trash_contents(top, lambda name: True) == []
+    trashed = []
+    for name in ["yaesm-foo-hourly.2026_08_20_00:00", "yaesm-bar-hourly.2026_08_20_00:00"]:
+        _make_tree(top.joinpath(name), depth=1)
+        trashed.append(treedelete.move_to_trash(top.joinpath(name)))
+        assert not top.joinpath(name).exists()
+        assert trashed[-1].parent == top.joinpath(treedelete.TRASH_BASENAME)
+        assert trashed[-1].name.startswith(name + ".")
+    assert treedelete.trash_contents(top, lambda name: name.startswith("yaesm-foo-")) == [
+        trashed[0]
+    ]
@@ -1,6 +1,8 @@
 """tests/test_yaesm/test_backend.py."""
 
-from datetime import datetime
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
 
 from freezegun import freeze_time
 
@@ -192,6 +194,94 @@ def test_backups_collect(random_backup_generator):
     assert bckp.backups_collect(backup, timeframes=[]) == []
 
 
+def _table_backup(dst_dir="/backups"):
+    return bckp.Backup("home", None, Path(dst_dir), Path(dst_dir), [])
+
+
+def test_artifact_table_from_listing():
+    backup = _table_backup()
+    basenames = [
+        "yaesm-home-hourly.1999_05_13_11:30",
+        "yaesm-home-weekly.1999_05_13_13:30",
+        "yaesm-other-hourly.1999_05_13_14:30",
+        "yaesm-home-hourly.1999_13_13_12:30",
+        "yaesm-home-daily.1999_05_13_11:30",
+        "not-a-backup",
+    ]
+    table = bckp.ArtifactTable.from_listing(backup, basenames)
+    assert [artifact.name for artifact in table] == [
+        "yaesm-home-weekly.1999_05_13_13:30",
+        "yaesm-home-hourly.1999_05_13_11:30",
+        "yaesm-home-daily.1999_05_13_11:30",
+    ]
+    assert table[0] == bckp.BackupArtifact(
+        "yaesm-home-weekly.1999_05_13_13:30",
+        "weekly",
+        datetime(1999, 5, 13, 13, 30),
+        "/backups/yaesm-home-weekly.1999_05_13_13:30",
+    )
+    assert table[-1].timeframe == "daily"
+    assert table[1:] == list(table)[1:]
+    assert table.created_at(1) == datetime(1999, 5, 13, 11, 30)
+    weekly = tframe.WeeklyTimeframe(1, [(10, 30)], ["monday"])
+    assert [
+        artifact.name for artifact in bckp.ArtifactTable.from_listing(backup, basenames, [weekly])
+    ] == ["yaesm-home-weekly.1999_05_13_13:30"]
+    assert list(bckp.ArtifactTable.from_listing(backup, basenames, [])) == []
+
+
+def test_artifacts_queries():
+    rng = random.Random(1999)
+    start = datetime(1999, 5, 13)
+    artifacts = sorted(
+        (
+            bckp.BackupArtifact(
+                f"artifact-{i}",
+                rng.choice(["hourly", "daily"]),
+                start + timedelta(minutes=rng.randrange(0, 500, 5)),
+                f"/backups/artifact-{i}",
+            )
+            for i in range(200)
+        ),
+        key=lambda artifact: artifact.created_at,
+        reverse=True,
+    )
+    for minutes in [-10, 0, 1, 7.5, 100, 250, 495, 499, 600]:
+        dt = start + timedelta(minutes=minutes)
+        assert [artifacts[i] for i in bckp.artifacts_after(artifacts, dt)] == [
+            artifact for artifact in artifacts if artifact.created_at > dt
+        ]
+        assert [artifacts[i] for i in bckp.artifacts_before(artifacts, dt)] == [
+            artifact for artifact in artifacts if artifact.created_at < dt
+        ]
+        end = dt + timedelta(minutes=42)
+        assert [artifacts[i] for i in bckp.artifacts_between(artifacts, dt, end)] == [
+            artifact for artifact in artifacts if dt <= artifact.created_at <= end
+        ]
+        assert [artifacts[i] for i in bckp.artifacts_closest(artifacts, dt)] == [
+            min(artifacts, key=lambda artifact: abs(artifact.created_at - dt))
+        ]
+    assert bckp.artifacts_closest([], start) == range(0)
+
+
+def test_dst_dir_listing(path_generator):
+    d = path_generator("backup-listing", mkdir=True, cleanup=True)
+    for name in ["yaesm-home-hourly.x", "yaesm-home-daily.x", "yaesm-other-hourly.x"]:
+        d.joinpath(name).mkdir()
+    d.joinpath("yaesm-home-hourly.file").touch()
+    backup = _table_backup(d)
+    assert sorted(bckp.dst_dir_listing(d)) == [
+        "yaesm-home-daily.x",
+        "yaesm-home-hourly.x",
+        "yaesm-other-hourly.x",
+    ]
+    globs = bckp.backup_basename_globs(backup)
+    assert sorted(bckp.dst_dir_listing(d, globs)) == ["yaesm-home-daily.x", "yaesm-home-hourly.x"]
+    hourly = tframe.HourlyTimeframe(1, [30])
+    globs = bckp.backup_basename_globs(backup, [hourly])
+    assert bckp.dst_dir_listing(d, globs) == ["yaesm-home-hourly.x"]
+
+
 def test_backup_name_valid():
     assert bckp.backup_name_valid("f")
     assert bckp.backup_name_valid("F")
@@ -0,0 +1,264 @@
+"""tests/test_yaesm/test_catalog.py."""
+
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from freezegun import freeze_time
+
+import yaesm.backup as bckp
+import yaesm.catalog as catalog_module
+import yaesm.sshtarget as sshtarget_module
+from yaesm.backup import Backup, BackupArtifact
+from yaesm.catalog import Catalog, catalog_basename
+from yaesm.sshtarget import SSHTarget
+from yaesm.timeframe import HourlyTimeframe
+
+
+def _backup(path_generator, dst_dir=None):
+    src_dir = path_generator("catalog-src", mkdir=True, cleanup=True)
+    if dst_dir is None:
+        dst_dir = path_generator("catalog-dst", mkdir=True, cleanup=True)
+    return Backup("foo", None, src_dir, dst_dir, [])
+
+
+def _mkdir_artifact(backup, hour, timeframe="hourly"):
+    name = f"yaesm-foo-{timeframe}.2026_08_20_{hour:02}:00"
+    backup.dst_dir.joinpath(name).mkdir()
+    return BackupArtifact(
+        name, timeframe, datetime(2026, 8, 20, hour), str(backup.dst_dir.joinpath(name))
+    )
+
+
+def test_collect_trusts_catalog(path_generator):
+    backup = _backup(path_generator)
+    first = _mkdir_artifact(backup, 1)
+    catalog = Catalog(backup)
+    assert catalog.collect() == [first]
+    assert backup.dst_dir.joinpath(catalog_basename("foo")).is_file()
+    # Not recorded, so not seen until the catalog is reconciled.
+    second = _mkdir_artifact(backup, 2)
+    assert catalog.collect() == [first]
+    assert catalog.collect(rescan=True) == [second, first]
+
+
+def test_add_remove(path_generator):
+    backup = _backup(path_generator)
+    catalog = Catalog(backup)
+    assert catalog.collect() == []
+    hourly = _mkdir_artifact(backup, 1)
+    daily = _mkdir_artifact(backup, 2, timeframe="daily")
+    catalog.add(
+        BackupArtifact(
+            hourly.name, hourly.timeframe, hourly.created_at, hourly.locator, 42, {"k": "v"}
+        )
+    )
+    catalog.add(daily)
+    artifacts = catalog.collect()
+    assert artifacts == [daily, hourly]
+    assert artifacts[1].size == 42
+    assert artifacts[1].metadata == {"k": "v"}
+    assert catalog.collect(timeframes=[HourlyTimeframe(1, [0])]) == [hourly]
+    Path(daily.locator).rmdir()
+    catalog.remove([daily])
+    assert catalog.collect() == [hourly]
+    # Reconciling keeps what was recorded about artifacts that still exist.
+    assert catalog.collect(rescan=True)[0].size == 42
+
+
+def test_queue_removal(path_generator):
+    backup = _backup(path_generator)
+    catalog = Catalog(backup)
+    first, second, third = (_mkdir_artifact(backup, hour) for hour in (1, 2, 3))
+    assert catalog.collect() == [third, second, first]
+    catalog.queue_removal([second, first])
+    assert catalog.collect() == [third]
+    assert catalog.pending() == [first, second]
+    # The queue survives a restart, and reconciling.
+    catalog_module.clear_cache()
+    assert catalog.pending() == [first, second]
+    assert catalog.collect(rescan=True) == [third]
+    assert catalog.pending() == [first, second]
+    Path(first.locator).rmdir()
+    catalog.remove([first])
+    assert catalog.pending() == [second]
+    # A queued artifact deleted behind the catalogs back is dropped from the queue.
+    Path(second.locator).rmdir()
+    assert catalog.collect(rescan=True) == [third]
+    assert catalog.pending() == []
+    records = [json.loads(line) for line in catalog.path.read_text().splitlines()]
+    assert [record["op"] for record in records] == ["reconciled", "add"]
+
+
+def test_reconcile_when_untrusted(path_generator):
+    backup = _backup(path_generator)
+    catalog = Catalog(backup)
+    first = _mkdir_artifact(backup, 1)
+    assert catalog.collect() == [first]
+    second = _mkdir_artifact(backup, 2)
+    catalog.invalidate()
+    assert catalog.collect() == [second, first]
+    third = _mkdir_artifact(backup, 3)
+    with open(catalog.path, "a") as f:
+        f.write('{"op": "add", "na')
+    # Forget the listing of the dst_dir cached by the last reconciliation.
+    catalog_module.clear_cache()
+    assert catalog.collect() == [third, second, first]
+    fourth = _mkdir_artifact(backup, 4)
+    assert catalog.collect() == [third, second, first]
+    catalog_module.clear_cache()
+    with freeze_time(datetime.now() + timedelta(days=2)):
+        assert catalog.collect() == [fourth, third, second, first]
+
+
+def test_add_when_unreadable(monkeypatch, path_generator):
+    backup = _backup(path_generator)
+    catalog = Catalog(backup)
+    first = _mkdir_artifact(backup, 1)
+    assert catalog.collect() == [first]
+    catalog_module.clear_cache()
+
+    def fail_read(self):
+        raise subprocess.CalledProcessError(255, ["ssh"])
+
+    with monkeypatch.context() as m:
+        m.setattr(Catalog, "_read", fail_read)
+        # The artifact exists already, so recording it must not fail.
+        second = _mkdir_artifact(backup, 2)
+        catalog.add(second)
+    assert not catalog.path.exists()
+    assert catalog.collect() == [second, first]
+
+
+def test_cache(monkeypatch, path_generator):
+    backup = _backup(path_generator)
+    first = _mkdir_artifact(backup, 1)
+    assert Catalog(backup).collect() == [first]
+    reads = []
+    original_read = Catalog._read
+    monkeypatch.setattr(Catalog, "_read", lambda self: reads.append(1) or original_read(self))
+    assert Catalog(backup).collect() == [first]
+    second = _mkdir_artifact(backup, 2)
+    Catalog(backup).add(second)
+    assert Catalog(backup).collect() == [second, first]
+    assert reads == []
+    # Another process changed the catalog file.
+    with open(Catalog(backup).path, "a") as f:
+        f.write(json.dumps({"op": "remove", "name": second.name}) + "\n")
+    assert Catalog(backup).collect() == [first]
+    assert reads == [1]
+
+
+def test_listing_shared(monkeypatch, path_generator):
+    listings = []
+    original_listing = bckp.dst_dir_listing
+    monkeypatch.setattr(
+        bckp,
+        "dst_dir_listing",
+        lambda dst_dir, globs=None: listings.append(1) or original_listing(dst_dir, globs),
+    )
+    one = _backup(path_generator)
+    two = Backup("bar", None, one.src_dir, one.dst_dir, [])
+    artifact = _mkdir_artifact(one, 1)
+    assert Catalog(one).collect() == [artifact]
+    assert Catalog(two).collect() == []
+    assert listings == [1]
+    # A change to the dst_dir through a catalog drops its cached listing.
+    Catalog(one).add(_mkdir_artifact(one, 2))
+    Catalog(two).invalidate()
+    Catalog(two).collect()
+    assert listings == [1, 1]
+    Catalog(two).collect(rescan=True)
+    assert listings == [1, 1, 1]
+
+
+def test_concurrent_add(path_generator):
+    backup = _backup(path_generator)
+    Catalog(backup).collect()
+    artifacts = [_mkdir_artifact(backup, hour) for hour in range(24)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda artifact: Catalog(backup).add(artifact), artifacts))
+    assert Catalog(backup).collect() == artifacts[::-1]
+    catalog_module.clear_cache()
+    assert Catalog(backup).collect() == artifacts[::-1]
+
+
+def test_compaction(path_generator):
+    backup = _backup(path_generator)
+    catalog = Catalog(backup)
+    artifact = _mkdir_artifact(backup, 1)
+    catalog.collect()
+    for _ in range(100):
+        catalog.add(artifact)
+        catalog.remove([artifact])
+    catalog.add(artifact)
+    assert catalog.collect() == [artifact]
+    records = [json.loads(line) for line in catalog.path.read_text().splitlines()]
+    assert [record["op"] for record in records] == ["reconciled", "add"]
+
+
+def test_rewrite_keeps_appended_records(path_generator):
+    backup = _backup(path_generator)
+    catalog = Catalog(backup)
+    artifact = _mkdir_artifact(backup, 1)
+    assert catalog.collect() == [artifact]
+    with catalog._lock:
+        entry = catalog._entry()
+    # Another process queues the artifact for removal while the log is compacted.
+    with open(catalog.path, "a") as f:
+        f.write(json.dumps(catalog_module._artifact_record(artifact, "prune")) + "\n")
+    with catalog._lock:
+        catalog._write(entry.artifacts, time.time(), entry.pending, entry)
+    assert catalog.collect() == []
+    assert catalog.pending() == [artifact]
+    catalog_module.clear_cache()
+    assert catalog.pending() == [artifact]
+
+
+def test_remote_catalog(monkeypatch, agent_cmd, path_generator):
+    # Run the catalog commands through a local agent in place of ssh.
+    monkeypatch.setattr(SSHTarget, "openssh_cmd", lambda self, cmd, string=False: agent_cmd)
+    dst_dir = path_generator("catalog-dst", mkdir=True, cleanup=True)
+    backup = _backup(
+        path_generator, SSHTarget(f"ssh://agenthost:{dst_dir}", Path("/key"), agent=True)
+    )
+    try:
+        name = "yaesm-foo-hourly.2026_08_20_01:00"
+        dst_dir.joinpath(name).mkdir()
+        catalog = Catalog(backup)
+        artifact = BackupArtifact(
+            name, "hourly", datetime(2026, 8, 20, 1), str(dst_dir.joinpath(name))
+        )
+        assert catalog.collect() == [artifact]
+        catalog.remove([artifact])
+        assert catalog.collect() == []
+        catalog.add(artifact)
+        assert catalog.collect() == [artifact]
+        assert dst_dir.joinpath(catalog_basename("foo")).is_file()
+        # Another process queued the artifact for removal since the log was read.
+        with open(catalog.path, "a") as f:
+            f.write(json.dumps(catalog_module._artifact_record(artifact, "prune")) + "\n")
+        assert catalog.reconcile() == []
+        assert catalog.pending() == [artifact]
+        # Another process rewrote the log since it was read, which must not be
+        # clobbered by rewriting it from the old log.
+        with catalog._lock:
+            entry = catalog._entry()
+        catalog.path.write_text(
+            json.dumps({"op": "reconciled", "at": time.time() + 1})
+            + "\n"
+            + json.dumps(catalog_module._artifact_record(artifact))
+            + "\n"
+        )
+        with catalog._lock:
+            catalog._write(entry.artifacts, time.time(), entry.pending, entry)
+        assert catalog.collect() == [artifact]
+        assert catalog.pending() == []
+        assert sorted(path.name for path in dst_dir.iterdir()) == sorted(
+            [name, catalog_basename("foo"), catalog_basename("foo") + ".lock"]
+        )
+    finally:
+        sshtarget_module.close_agent_sessions()
@@ -313,6 +313,23 @@ def test_TimeframeSchema_schema(valid_raw_config):
                 ]
 
 
+def test_TimeframeSchema_unchanged():
+    schema = config.TimeframeSchema.schema()
+    spec = {
+        "timeframes": ["5minute", "hourly"],
+        "5minute_keep": 12,
+        "5minute_unchanged": "alias",
+        "hourly_keep": 24,
+        "hourly_minutes": [0],
+    }
+    fiveminute, hourly = schema(copy.deepcopy(spec))["timeframes"]
+    assert fiveminute.unchanged == "alias"
+    assert hourly.unchanged == "backup"
+    assert "daily_unchanged" in config.TimeframeSchema.valid_settings()
+    with pytest.raises(vlp.Invalid):
+        schema({**spec, "hourly_unchanged": "never"})
+
+
 def test_TimeframeSchema_rejects_immediate():
     schema = config.TimeframeSchema.schema()
     data = {"timeframes": ["immediate"]}
@@ -750,6 +767,62 @@ def test_btrfs_bootstrap_refresh_config(path_generator):
     assert backup2.backend.bootstrap_refresh_days is None
 
 
+def test_btrfs_spool_config(path_generator):
+    schema = config.BackupSchema.schema()
+    src_dir = path_generator("src", mkdir=True)
+    dst_dir = path_generator("dst", mkdir=True)
+    data = {
+        "mybackup": {
+            "backend": "btrfs",
+            "btrfs_spool": True,
+            "btrfs_spool_chunk_size": 16,
+            "src_dir": str(src_dir),
+            "dst_dir": str(dst_dir),
+            "timeframes": ["daily"],
+            "daily_keep": 7,
+            "daily_times": ["12:00"],
+        }
+    }
+    invalid = copy.deepcopy(data)
+    invalid["mybackup"]["btrfs_spool_chunk_size"] = 0
+    backup = schema(data)
+    assert backup.backend.spool
+    assert backup.backend.spool_chunk_size == 16
+
+    with pytest.raises(vlp.Invalid):
+        schema(invalid)
+
+
+def test_prune_config(path_generator):
+    schema = config.BackupSchema.schema()
+    src_dir = path_generator("src", mkdir=True)
+    dst_dir = path_generator("dst", mkdir=True)
+    data = {
+        "mybackup": {
+            "backend": "rsync",
+            "src_dir": str(src_dir),
+            "dst_dir": str(dst_dir),
+            "timeframes": ["daily"],
+            "daily_keep": 7,
+            "daily_times": ["12:00"],
+        }
+    }
+    backup = schema(copy.deepcopy(data))
+    assert not backup.backend.prune_deferred
+    assert backup.backend.prune_rate is None
+    data["mybackup"]["prune_deferred"] = True
+    data["mybackup"]["prune_rate"] = 2
+    backup = schema(copy.deepcopy(data))
+    assert backup.backend.prune_deferred
+    assert backup.backend.prune_rate == 2.0
+
+    for rate in [0, -1, "fast"]:
+        invalid = copy.deepcopy(data)
+        invalid["mybackup"]["prune_rate"] = rate
+        with pytest.raises(vlp.Invalid):
+            schema(invalid)
+
+
 def test_parse_config(path_generator, valid_config_file_generator):
     backups = config.parse_config(valid_config_file_generator())
     assert len(backups) == 3
@@ -800,3 +873,41 @@ def test_parse_config(path_generator, valid_config_file_generator):
         config.parse_config(config_file_copy)
     assert len(exc.value.errors) == 1
     assert isinstance(exc.value.errors[0][1], yaml.YAMLError)
+
+
+def test_ssh_transport_config(path_generator):
+    schema = config.BackupSchema.schema()
+    src_dir = path_generator("src", mkdir=True)
+    ssh_key = path_generator("key", touch=True)
+    data = {
+        "mybackup": {
+            "backend": "btrfs",
+            "src_dir": str(src_dir),
+            "dst_dir": "ssh://larry@localhost:/backups",
+            "ssh_key": str(ssh_key),
+            "ssh_cipher": "aes128-gcm@openssh.com",
+            "ssh_compression": "zstd",
+            "ssh_compression_level": 6,
+            "timeframes": ["daily"],
+            "daily_keep": 7,
+            "daily_times": ["12:00"],
+        }
+    }
+    backup = schema(copy.deepcopy(data))
+    assert backup.dst_dir.cipher == "aes128-gcm@openssh.com"
+    assert backup.dst_dir.compression == "zstd"
+    assert backup.dst_dir.compression_level == 6
+    assert not backup.dst_dir.agent
+
+    data["mybackup"]["ssh_agent"] = True
+    assert schema(copy.deepcopy(data)).dst_dir.agent
+
+    data["mybackup"]["ssh_compression"] = "gzip"
+    with pytest.raises(vlp.MultipleInvalid) as excinfo:
+        schema(copy.deepcopy(data))
+    assert config.SrcDirDstDirSchema.ErrMsg.SSH_COMPRESSION_INVALID in str(excinfo.value)
+
+    data["mybackup"]["ssh_compression"] = "auto"
+    data["mybackup"]["ssh_compression_level"] = 23
+    with pytest.raises(vlp.MultipleInvalid):
+        schema(copy.deepcopy(data))
@@ -1,5 +1,7 @@
 """tests/test_yaesm/test_main.py."""
 
+import io
+import json
 import os
 
 import yaesm.main
@@ -40,3 +42,10 @@ def test_unexpected_error_writes_traceback_to_log_file(
     log = logfile.read_text()
     assert "unexpected test error" in log
     assert "Traceback" in log
+
+
+def test_agent_does_not_need_config(monkeypatch, capsys, path_generator):
+    config = path_generator("missing-config.yml")
+    monkeypatch.setattr("sys.stdin", io.StringIO('{"op": "hello"}\n'))
+    assert yaesm.main.main(["--config", str(config), "agent"]) == 0
+    assert json.loads(capsys.readouterr().out)["ok"]
@@ -0,0 +1,113 @@
+"""tests/test_yaesm/test_prunequeue.py."""
+
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+import yaesm.prunequeue as prunequeue
+import yaesm.retention as retention
+from yaesm.backup import Backup, BackupArtifact
+
+
+def _make_backup(name, queued=0, rate=None):
+    """A backup whose backend has `queued` artifacts queued for deletion."""
+    pending = [
+        BackupArtifact(f"a{i}", "hourly", datetime(2026, 8, 20, i), f"/dst/a{i}")
+        for i in range(queued)
+    ]
+    backup = MagicMock(spec=Backup)
+    backup.name = name
+    backup.dst_dir = Path("/dst")
+    backup.backend = MagicMock()
+    backup.backend.prune_rate = rate
+    backup.backend.prune_deferred = True
+    backup.backend.pending_deletions.side_effect = lambda _backup: list(pending)
+    backup.backend.delete.side_effect = lambda _backup, artifacts: [
+        pending.remove(artifact) for artifact in artifacts
+    ]
+    return backup, pending
+
+
+def test_drain():
+    backup, pending = _make_backup("foo", queued=3)
+    expected = list(pending)
+    assert prunequeue.drain(backup) == expected
+    backup.backend.delete.assert_called_once_with(backup, expected)
+    backup.backend.commit_deletions.assert_called_once_with(backup)
+    assert prunequeue.drain(backup) == []
+
+
+def test_drain_does_not_block_pruning():
+    backup, pending = _make_backup("foo", queued=2)
+    locked = []
+    delete = backup.backend.delete.side_effect
+
+    def delete_and_check(_backup, artifacts):
+        # A backup pruning meanwhile can take the retention lock.
+        lock = retention.backup_lock(backup)
+        locked.append(lock.acquire(blocking=False))
+        lock.release()
+        delete(_backup, artifacts)
+
+    backup.backend.delete.side_effect = delete_and_check
+    assert len(prunequeue.drain(backup)) == 2
+    assert locked == [True]
+
+
+class _RecordingEvent(threading.Event):
+    """An event that records the timeouts it is waited for, without waiting."""
+
+    def __init__(self):
+        super().__init__()
+        self.waits = []
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return False
+
+
+def test_drain_rate():
+    backup, pending = _make_backup("foo", queued=5, rate=2.5)
+    expected = list(pending)
+    stop = _RecordingEvent()
+    assert prunequeue.drain(backup, stop) == expected
+    batches = [call.args[1] for call in backup.backend.delete.call_args_list]
+    assert batches == [expected[:2], expected[2:4], expected[4:]]
+    assert backup.backend.commit_deletions.call_count == 3
+    assert stop.waits == pytest.approx([0.8, 0.8, 0.4], abs=0.1)
+    backup, pending = _make_backup("foo", queued=4, rate=40)
+    start = time.monotonic()
+    assert len(prunequeue.drain(backup)) == 4
+    assert time.monotonic() - start >= 4 / 40
+
+
+def test_drain_stop():
+    backup, pending = _make_backup("foo", queued=3, rate=1)
+    stop = threading.Event()
+    backup.backend.commit_deletions.side_effect = lambda _backup: stop.set()
+    assert len(prunequeue.drain(backup, stop)) == 1
+    assert len(pending) == 2
+
+
+def test_worker():
+    one, one_pending = _make_backup("one", queued=2)
+    two, two_pending = _make_backup("two", queued=2)
+    two.backend.prune_deferred = False
+    worker = prunequeue.start_worker([one, two])
+    try:
+        prunequeue.notify(two)
+        deadline = time.monotonic() + 10
+        while (one_pending or two_pending) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert one_pending == [] and two_pending == []
+    finally:
+        prunequeue.stop_worker(timeout=10)
+    assert not worker.is_alive()
+    # Without a worker, queued deletions are left alone.
+    three, three_pending = _make_backup("three", queued=1)
+    prunequeue.notify(three)
+    three.backend.delete.assert_not_called()
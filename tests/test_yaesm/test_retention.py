@@ -0,0 +1,30 @@
+"""tests/test_yaesm/test_retention.py."""
+
+import yaesm.retention as retention
+from yaesm.timeframe import DailyTimeframe, HourlyTimeframe
+
+
+def test_plan(artifact_generator):
+    artifacts = [
+        artifact_generator("hourly", 9),
+        artifact_generator("daily", 8),
+        artifact_generator("hourly", 7),
+        artifact_generator("immediate", 6),
+        artifact_generator("hourly", 5),
+        artifact_generator("daily", 4),
+        artifact_generator("daily", 3),
+    ]
+    plan = retention.plan(artifacts, [HourlyTimeframe(2, [0]), DailyTimeframe(1, [(0, 0)])])
+    assert plan.delete == [
+        artifact_generator("hourly", 5),
+        artifact_generator("daily", 4),
+        artifact_generator("daily", 3),
+    ]
+    assert plan.keep == [
+        artifact_generator("hourly", 9),
+        artifact_generator("daily", 8),
+        artifact_generator("hourly", 7),
+        artifact_generator("immediate", 6),
+    ]
+    assert retention.plan(artifacts, []).delete == []
+    assert retention.plan([], [HourlyTimeframe(1, [0])]) == retention.RetentionPlan([], [])
@@ -1,5 +1,6 @@
 """tests/test_yaesm/test_sshtarget.py."""
 
+import hashlib
 import os
 import subprocess
 import time
@@ -7,7 +8,8 @@ from pathlib import Path
 
 import pytest
 
-from yaesm.sshtarget import SSHTarget
+import yaesm.sshtarget as sshtarget_module
+from yaesm.sshtarget import Probe, SSHTarget, SSHTargetException
 
 
 def test_sshtarget_constructor():
@@ -64,6 +66,18 @@ def test_openssh_opts(sshtarget):
     assert "ControlPath=~/.yaesm-ssh-controlmaster-%C" in opts
 
 
+def test_openssh_opts_cipher():
+    target = SSHTarget(
+        "ssh://larry@localhost:/a/random/path",
+        Path("/a/key"),
+        cipher="chacha20-poly1305@openssh.com",
+    )
+    opts = target.openssh_opts()
+    assert "Ciphers=chacha20-poly1305@openssh.com" in opts
+    cipher_hash = hashlib.sha256(b"chacha20-poly1305@openssh.com").hexdigest()[:8]
+    assert f"ControlPath=~/.yaesm-ssh-controlmaster-{cipher_hash}-%C" in opts
+
+
 def test_openssh_cmd(sshtarget):
     p = subprocess.run(
         sshtarget.openssh_cmd(["sh", "-c", "whoami && printf '%s\\n' foo 1>&2 && exit 73"]),
@@ -218,3 +232,161 @@ def test_is_older_than(sshtarget, path_generator):
     bad_path = path_generator("nonexistent")
     with pytest.raises(subprocess.CalledProcessError):
         sshtarget.is_older_than(1, path=bad_path)
+
+
+def test_agent(monkeypatch, capfd, agent_cmd, path_generator):
+    original_openssh_cmd = SSHTarget.openssh_cmd
+
+    def fake_openssh_cmd(self, cmd, string=False):
+        if cmd == ["yaesm", "agent"]:
+            return agent_cmd
+        return original_openssh_cmd(self, cmd, string=string)
+
+    monkeypatch.setattr(SSHTarget, "openssh_cmd", fake_openssh_cmd)
+    d = path_generator("sshtarget-agent", mkdir=True, cleanup=True)
+    target = SSHTarget(f"ssh://agenthost:{d}", Path("/key"), agent=True)
+    try:
+        session = target.agent_session()
+        assert session is not None
+        assert target.with_path(d / "x").agent_session() is session
+        assert target.is_dir()
+        assert not target.is_file()
+        assert not target.exists(d / "missing")
+        assert target.mkdir(d / "sub")
+        assert target.touch(d / "sub" / "file")
+        assert target.is_file(d / "sub" / "file")
+        assert not target.is_older_than(1, d / "sub")
+        with pytest.raises(subprocess.CalledProcessError):
+            target.is_older_than(1, d / "missing")
+        assert target.list_dirs() == ["sub"]
+        assert target.list_dirs(globs=["s*", "x"]) == ["sub"]
+        assert target.list_dirs(globs=["x*"]) == []
+        with pytest.raises(subprocess.CalledProcessError):
+            target.list_dirs(d / "missing")
+        target.rename(d / "sub", d / "renamed")
+        assert d.joinpath("renamed", "file").is_file()
+        with pytest.raises(subprocess.CalledProcessError):
+            target.rename(d / "missing", d / "other")
+        assert target.which("sh")
+        p = target.run(["sh", "-c", "echo out; exit 2"], capture_output=True, encoding="utf-8")
+        assert (p.returncode, p.stdout) == (2, "out\n")
+        with pytest.raises(subprocess.CalledProcessError):
+            target.run(["false"], check=True)
+        capfd.readouterr()
+        target.run(["sh", "-c", "echo out; echo err >&2"])
+        assert capfd.readouterr() == ("out\n", "err\n")
+    finally:
+        sshtarget_module.close_agent_sessions()
+
+
+def test_agent_unavailable(monkeypatch):
+    monkeypatch.setattr(SSHTarget, "openssh_cmd", lambda self, cmd, string=False: ["false"])
+    target = SSHTarget("ssh://agenthost:/", Path("/key"), agent=True)
+    try:
+        assert target.agent_session() is None
+        assert SSHTarget("ssh://agenthost:/", Path("/key")).agent_session() is None
+    finally:
+        sshtarget_module.close_agent_sessions()
+
+
+def test_probe_script(path_generator):
+    d = path_generator("sshtarget-probe", mkdir=True, cleanup=True)
+    d.joinpath("file").touch()
+    probes = [
+        Probe("is_dir", d),
+        Probe("is_file", d),
+        Probe("is_file", d / "file"),
+        Probe("exists", d / "missing"),
+        Probe("readable", d),
+        Probe("writable", d / "missing"),
+        Probe("which", "sh"),
+        Probe("which", "no-such-tool-yaesm"),
+        Probe("age", d / "file"),
+        Probe("age", d / "missing"),
+        *[Probe("exists", d / "file") for _ in range(3)],
+    ]
+    p = subprocess.run(
+        ["sh", "-c", sshtarget_module._probe_script(probes), "sh", *[p.arg for p in probes]],
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    )
+    lines = p.stdout.splitlines()
+    assert lines[:8] == ["1", "0", "1", "0", "1", "0", "1", "0"]
+    assert 0 <= int(lines[8]) < 60
+    assert lines[9:] == ["-", "1", "1", "1"]
+    with pytest.raises(ValueError):
+        Probe("nope", d)
+
+
+def test_probe(monkeypatch, agent_cmd, path_generator):
+    # Run the probes through a local agent in place of 'ssh ... yaesm agent'.
+    monkeypatch.setattr(SSHTarget, "openssh_cmd", lambda self, cmd, string=False: agent_cmd)
+    d = path_generator("sshtarget-probe", mkdir=True, cleanup=True)
+    target = SSHTarget(f"ssh://agenthost:{d}", Path("/key"), agent=True)
+    try:
+        probes = [Probe("is_dir", d), Probe("which", "sh"), Probe("age", d / "missing")]
+        results = target.probe([*probes, probes[0]])
+        assert list(results) == probes
+        assert results[probes[0]] is True
+        assert results[probes[1]] is True
+        assert results[probes[2]] is None
+        assert target.probe([]) == {}
+        monkeypatch.setattr(
+            SSHTarget, "run", lambda self, cmd, **kwargs: subprocess.run(["true"], **kwargs)
+        )
+        with pytest.raises(SSHTargetException):
+            target.probe(probes)
+    finally:
+        sshtarget_module.close_agent_sessions()
+
+
+def test_parse_dir_names():
+    data = b"a\x00b c\x00"
+    assert list(sshtarget_module._parse_dir_names([data])) == ["a", "b c"]
+    chunks = [data[i : i + 3] for i in range(0, len(data), 3)]
+    assert list(sshtarget_module._parse_dir_names(chunks)) == ["a", "b c"]
+    with pytest.raises(SSHTargetException):
+        list(sshtarget_module._parse_dir_names([data[:-1]]))
+
+
+def test_scan_dirs(monkeypatch, path_generator):
+    monkeypatch.setattr(
+        SSHTarget, "openssh_cmd", lambda self, cmd, string=False: [str(arg) for arg in cmd]
+    )
+    d = path_generator("sshtarget-scan", mkdir=True, cleanup=True)
+    for name in ["yaesm-a-hourly.x", "yaesm-a-we ird", "yaesm-b-hourly.x", ".yaesm-a-x"]:
+        d.joinpath(name).mkdir()
+    d.joinpath("yaesm-a-file").touch()
+    target = SSHTarget(f"ssh://localhost:{d}", Path("/key"))
+    assert sorted(target.list_dirs()) == sorted(
+        ["yaesm-a-hourly.x", "yaesm-a-we ird", "yaesm-b-hourly.x", ".yaesm-a-x"]
+    )
+    assert sorted(target.list_dirs(globs=["yaesm-a-*"])) == ["yaesm-a-hourly.x", "yaesm-a-we ird"]
+    assert target.list_dirs(globs=["yaesm-b-*", "nothing"]) == ["yaesm-b-hourly.x"]
+    assert target.list_dirs(globs=[]) == []
+    assert list(target.scan_dirs(globs=["yaesm-b-*"])) == ["yaesm-b-hourly.x"]
+    with pytest.raises(subprocess.CalledProcessError):
+        target.list_dirs(d / "missing")
+
+
+def test_scan_dirs_stderr_and_truncation(monkeypatch, path_generator):
+    monkeypatch.setattr(
+        SSHTarget, "openssh_cmd", lambda self, cmd, string=False: [str(arg) for arg in cmd]
+    )
+    d = path_generator("sshtarget-scan", mkdir=True, cleanup=True)
+    d.joinpath("yaesm-a-hourly.x").mkdir()
+    target = SSHTarget(f"ssh://localhost:{d}", Path("/key"))
+    script = sshtarget_module._scan_dirs_script
+    # more than a pipe buffer of stderr before the listing
+    monkeypatch.setattr(
+        sshtarget_module,
+        "_scan_dirs_script",
+        lambda globs_count: "head -c 1000000 /dev/zero >&2\n" + script(globs_count),
+    )
+    assert target.list_dirs() == ["yaesm-a-hourly.x"]
+    monkeypatch.setattr(
+        sshtarget_module, "_scan_dirs_script", lambda globs_count: "printf 'yaesm-a'"
+    )
+    with pytest.raises(subprocess.CalledProcessError):
+        target.list_dirs()
@@ -0,0 +1,89 @@
+"""tests/test_yaesm/test_subcommand/test_prunesubcommand.py."""
+
+import argparse
+import logging
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from yaesm.backup import Backup, BackupArtifact
+from yaesm.retention import RetentionPlan
+from yaesm.subcommand.prunesubcommand import PruneSubcommand
+
+
+def _artifacts(basenames):
+    return [
+        BackupArtifact(basename, "hourly", datetime(2026, 8, 20), f"/dst/{basename}")
+        for basename in basenames
+    ]
+
+
+def _make_backup(name, deleted=(), queued=()):
+    pending = _artifacts(queued)
+    backup = MagicMock(spec=Backup)
+    backup.name = name
+    backup.dst_dir = Path("/dst")
+    backup.backend = MagicMock()
+    backup.backend.prune_rate = None
+    backup.backend.prune.return_value = RetentionPlan([], _artifacts(deleted))
+    backup.backend.pending_deletions.side_effect = lambda _backup: list(pending)
+    backup.backend.delete.side_effect = lambda _backup, artifacts: [
+        pending.remove(artifact) for artifact in artifacts
+    ]
+    return backup
+
+
+def _parse(*args):
+    parser = argparse.ArgumentParser()
+    PruneSubcommand.add_argparser_arguments(parser)
+    return parser.parse_args(list(args))
+
+
+def test_add_argparser_arguments():
+    args = _parse()
+    assert args.backup_names is None
+    assert not args.dry_run
+    args = _parse("b,a,b", "--dry-run")
+    assert args.backup_names == ["b", "a"]
+    assert args.dry_run
+
+
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_prune_all_backups(capsys, dry_run):
+    backups = [_make_backup("a", ["x", "y"]), _make_backup("b", queued=["z"])]
+    args = _parse(*(["--dry-run"] if dry_run else []))
+    assert PruneSubcommand().main(backups, args) == 0
+    assert capsys.readouterr().out == "/dst/x\n/dst/y\n/dst/z\n"
+    for backup in backups:
+        backup.backend.prune.assert_called_once_with(backup, dry_run=dry_run, defer=False)
+    if dry_run:
+        backups[1].backend.delete.assert_not_called()
+    else:
+        backups[1].backend.delete.assert_called_once_with(backups[1], _artifacts(["z"]))
+
+
+def test_prune_specific_backups():
+    backups = [_make_backup("a"), _make_backup("b")]
+    assert PruneSubcommand().main(backups, _parse("b")) == 0
+    backups[0].backend.prune.assert_not_called()
+    backups[1].backend.prune.assert_called_once()
+
+
+def test_prune_failure_continues(caplog):
+    backups = [_make_backup("a"), _make_backup("b")]
+    backups[0].backend.prune.side_effect = OSError("boom")
+    caplog.set_level(logging.ERROR)
+    assert PruneSubcommand().main(backups, _parse()) == 1
+    assert "pruning backup 'a' failed" in caplog.text
+    backups[1].backend.prune.assert_called_once()
+
+
+def test_prune_unknown_backup_name(caplog):
+    backup = _make_backup("a")
+    caplog.set_level(logging.ERROR)
+    assert PruneSubcommand().main([backup], _parse("a,nonexistent")) == 2
+    assert "nonexistent" in caplog.text
+    backup.backend.prune.assert_not_called()
+    assert PruneSubcommand().main([backup], _parse(",")) == 2
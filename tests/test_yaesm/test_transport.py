@@ -0,0 +1,123 @@
+"""tests/test_yaesm/test_transport.py."""
+
+import threading
+from pathlib import Path
+
+import yaesm.transport as transport
+from yaesm.sshtarget import SSHTarget
+
+
+def _sshtarget(**kwargs):
+    return SSHTarget("ssh://larry@localhost:/backups", Path("/a/key"), **kwargs)
+
+
+def test_stream_compressor_cmds():
+    zstd = transport.StreamCompressor("zstd", 3)
+    assert zstd.compress_cmd() == ["zstd", "-q", "-c", "-3", "-T0"]
+    assert zstd.decompress_cmd() == ["zstd", "-q", "-d", "-c"]
+    assert zstd.rsync_opts() == ["--compress", "--compress-choice=zstd", "--compress-level=3"]
+    assert "--ultra" in transport.StreamCompressor("zstd", 22).compress_cmd()
+    lz4 = transport.StreamCompressor("lz4", 1)
+    assert lz4.compress_cmd() == ["lz4", "-q", "-c", "-1"]
+    assert lz4.rsync_opts() == ["--compress", "--compress-choice=lz4"]
+
+
+def _compressor(sshtarget, local_dir=None):
+    return transport.transfer_settings(sshtarget, local_dir=local_dir)[1]
+
+
+def test_transfer_settings():
+    sshtarget = _sshtarget()
+    assert transport.transfer_settings(sshtarget) == (sshtarget, None)
+    assert _compressor(_sshtarget(compression="none")) is None
+    assert _compressor(_sshtarget(compression="zstd")) == transport.StreamCompressor("zstd", 3)
+    assert _compressor(_sshtarget(compression="lz4", compression_level=9)) == (
+        transport.StreamCompressor("lz4", 9)
+    )
+
+
+def test_transfer_settings_auto_is_cached(monkeypatch, path_generator):
+    calls = []
+
+    def fake_benchmark(sshtarget, local_dir):
+        calls.append(local_dir)
+        return None, transport.StreamCompressor("lz4", 1)
+
+    monkeypatch.setattr(transport, "_benchmark", fake_benchmark)
+    monkeypatch.setattr(transport, "_benchmark_cache", {})
+    local_dir = path_generator("src", mkdir=True, cleanup=True)
+    sshtarget = _sshtarget(compression="auto")
+    for _ in range(3):
+        assert _compressor(sshtarget, local_dir=local_dir) == transport.StreamCompressor("lz4", 1)
+    assert calls == [local_dir]
+    _compressor(sshtarget)
+    assert calls == [local_dir, None]
+    _compressor(_sshtarget(compression="auto", cipher="aes128-ctr"))
+    assert len(calls) == 3
+
+
+def test_transfer_settings_auto_benchmark_failure(monkeypatch):
+    def failing_benchmark(sshtarget, local_dir):
+        raise OSError("ssh not found")
+
+    monkeypatch.setattr(transport, "_benchmark", failing_benchmark)
+    monkeypatch.setattr(transport, "_benchmark_cache", {})
+    assert _compressor(_sshtarget(compression="auto")) is None
+
+
+def test_transfer_settings_auto_locks_per_host(monkeypatch):
+    slow_started = threading.Event()
+    slow_release = threading.Event()
+
+    def fake_benchmark(sshtarget, local_dir):
+        if sshtarget.host == "slowhost":
+            slow_started.set()
+            slow_release.wait(10)
+        return None, transport.StreamCompressor("zstd", 3)
+
+    monkeypatch.setattr(transport, "_benchmark", fake_benchmark)
+    monkeypatch.setattr(transport, "_benchmark_cache", {})
+    slow = SSHTarget("ssh://slowhost:/backups", Path("/a/key"), compression="auto")
+    thread = threading.Thread(target=transport.transfer_settings, args=(slow,))
+    thread.start()
+    try:
+        assert slow_started.wait(10)
+        assert _compressor(_sshtarget(compression="auto")) == transport.StreamCompressor("zstd", 3)
+    finally:
+        slow_release.set()
+        thread.join()
+
+
+def test_transfer_settings_auto_picks_cipher(monkeypatch, path_generator):
+    links = {"aes128-gcm@openssh.com": 10.0, "chacha20-poly1305@openssh.com": 20.0}
+    measured = []
+
+    def fake_measure_link(sshtarget, local_dir, sample):
+        measured.append(sshtarget.cipher)
+        return b"x" * transport._BENCHMARK_MIN_SAMPLE_SIZE, links[sshtarget.cipher]
+
+    monkeypatch.setattr(transport, "_measure_link", fake_measure_link)
+    monkeypatch.setattr(transport.shutil, "which", lambda name: None)
+    monkeypatch.setattr(transport, "_benchmark_cache", {})
+    local_dir = path_generator("src", mkdir=True, cleanup=True)
+    sshtarget = _sshtarget(compression="auto", cipher=",".join(links))
+    target, compressor = transport.transfer_settings(sshtarget, local_dir=local_dir)
+    assert compressor is None
+    assert sorted(measured) == sorted(links)
+    assert target.cipher == "chacha20-poly1305@openssh.com,aes128-gcm@openssh.com"
+    assert target.host == sshtarget.host
+    # the configured target is shared by concurrent transfers, so it is unchanged
+    assert sshtarget.cipher == ",".join(links)
+    # the reordered cipher list still hits the cache
+    assert transport.transfer_settings(target, local_dir=local_dir)[0].cipher == target.cipher
+    assert len(measured) == 2
+
+
+def test_sample_local(path_generator):
+    directory = path_generator("src", mkdir=True, cleanup=True)
+    directory.joinpath("a").write_bytes(b"a" * 10)
+    directory.joinpath("sub").mkdir()
+    directory.joinpath("sub", "b").write_bytes(b"b" * 20)
+    directory.joinpath("link").symlink_to("/dev/zero")
+    sample = transport._sample_local(directory)
+    assert sorted(sample) == sorted(b"a" * 10 + b"b" * 20)